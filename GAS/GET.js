@@ -1,8 +1,13 @@
-function doGet(e) { return processData(e.parameter); }
+function doGet(e) {
+  if (e.parameter.mode === "export") return exportRows(e.parameter);
+  if (e.parameter.mode === "hashes") return rowHashes(e.parameter);
+  return processData(e.parameter);
+}
 function doPost(e) {
   var data = {};
   try { data = JSON.parse(e.postData.contents); } 
   catch (err) { data = e.parameter; }
+  if (data && Array.isArray(data.leads)) return processBatch(data.leads);
   return processData(data);
 }
 
@@ -16,6 +21,47 @@ function normalizePhone(value) {
     .replace(/^\+/, "");
 }
 
+// КАРТА ПОЛЕЙ
+var FIELD_MAP = {
+  "phone_number": ["phone", "phone_number", "mobile"],
+  "timestamp": ["timestamp"],
+  "brand": ["brand", "marka"],
+  "model": ["model"],
+  "year": ["year", "god"],
+  "city": ["city", "gorod", "location"],
+  "city_hub": ["city_hub", "hub"],
+  "budget": ["budget", "price"],
+  "manager": ["manager", "manager_consent", "consent", "soglasie"],
+  "client_name": ["client_name", "name"],
+  "tg_user_id": ["tg_user_id", "user_id"],
+  "tg_username": ["tg_username", "username"],
+  "tag": ["tag", "source", "utm"]
+};
+
+// ЗАГОЛОВКИ: недостающие колонки добавляются справа; возвращает заголовки и индексы колонок
+function ensureColumns(sheet, fieldMap) {
+  var headers = [];
+  if (sheet.getLastColumn() > 0) {
+    headers = sheet.getRange(1, 1, 1, sheet.getLastColumn()).getValues()[0];
+  }
+
+  var colIndexes = {};
+  for (var key in fieldMap) {
+    var colIndex = headers.indexOf(key);
+    if (colIndex === -1) {
+      colIndex = headers.length;
+      sheet.getRange(1, colIndex + 1).setValue(key);
+      headers.push(key);
+    }
+    colIndexes[key] = colIndex;
+    if (key === "phone_number") {
+      var rowsToFormat = Math.max(sheet.getMaxRows() - 1, 1);
+      sheet.getRange(2, colIndex + 1, rowsToFormat, 1).setNumberFormat("@");
+    }
+  }
+  return { headers: headers, colIndexes: colIndexes };
+}
+
 function processData(data) {
   var lock = LockService.getScriptLock();
   lock.tryLock(10000);
@@ -34,125 +80,9 @@ function processData(data) {
       return responseJSON({ "status": "error", "message": "Missing tg_user_id (required for user identification)" });
     }
 
-    // КАРТА ПОЛЕЙ
-    var fieldMap = {
-      "phone_number": ["phone", "phone_number", "mobile"],
-      "timestamp": ["timestamp"],
-      "brand": ["brand", "marka"],
-      "model": ["model"],
-      "year": ["year", "god"],
-      "city": ["city", "gorod", "location"],
-      "budget": ["budget", "price"],
-      "manager": ["manager", "manager_consent", "consent", "soglasie"],
-      "client_name": ["client_name", "name"],
-      "tg_user_id": ["tg_user_id", "user_id"],
-      "tg_username": ["tg_username", "username"],
-      "tag": ["tag", "source", "utm"]
-    };
-
-    var ss = SpreadsheetApp.getActiveSpreadsheet();
-    var sheet = ss.getActiveSheet();
-    var timestamp = new Date();
-
-    // ЗАГОЛОВКИ
-    var headers = [];
-    if (sheet.getLastColumn() > 0) {
-      headers = sheet.getRange(1, 1, 1, sheet.getLastColumn()).getValues()[0];
-    }
-
-    var colIndexes = {};
-    for (var key in fieldMap) {
-      var colIndex = headers.indexOf(key);
-      if (colIndex === -1) {
-        colIndex = headers.length;
-        sheet.getRange(1, colIndex + 1).setValue(key);
-        headers.push(key);
-      }
-      colIndexes[key] = colIndex;
-      if (key === "phone_number") {
-        var rowsToFormat = Math.max(sheet.getMaxRows() - 1, 1);
-        sheet.getRange(2, colIndex + 1, rowsToFormat, 1).setNumberFormat("@");
-      }
-    }
-
-    // ПОИСК: Priority 1 - by tg_user_id (always required), Priority 2 - by phone (as fallback)
-    var rowIndex = -1;
-    var phoneColIndex = colIndexes["phone_number"];
-    var tgUserIdColIndex = colIndexes["tg_user_id"];
-    var lastRow = sheet.getLastRow();
-
-    if (lastRow > 1) {
-      var allData = sheet.getRange(2, 1, lastRow - 1, headers.length).getValues();
-
-      for (var i = 0; i < allData.length; i++) {
-        // Priority 1: Search by tg_user_id (required identifier)
-        var cellTgId = String(allData[i][tgUserIdColIndex]);
-        if (cellTgId === String(tgUserId)) {
-          rowIndex = i + 2;
-          break;
-        }
-        // Priority 2: If not found by tg_user_id and phone is provided, try by phone
-        if (phone && rowIndex === -1) {
-          var cellValue = allData[i][phoneColIndex];
-          var normalizedCell = normalizePhone(cellValue);
-          if (normalizedCell === phone) {
-            rowIndex = i + 2;
-            break;
-          }
-        }
-      }
-    }
-    Logger.log("Search tg_user_id: " + tgUserId + ", phone: " + phone + ", found at row: " + rowIndex);
-
-    // ЗАПИСЬ
-    var action = "";
-    if (rowIndex !== -1) {
-      action = "updated";
-      for (var key in fieldMap) {
-        // Update phone_number if provided (allows transition from tg_user_id to phone)
-        if (key === "phone_number") {
-          if (phone) sheet.getRange(rowIndex, colIndexes[key] + 1).setValue(phone);
-          continue;
-        }
-        var val = null;
-        if (key === "timestamp") val = timestamp;
-        else {
-          var keys = fieldMap[key];
-          for (var k = 0; k < keys.length; k++) {
-            // Проверка: если ключ есть в данных
-            if (data[keys[k]] !== undefined) {
-              val = data[keys[k]];
-              break;
-            }
-          }
-        }
-        if (val !== null) sheet.getRange(rowIndex, colIndexes[key] + 1).setValue(val);
-      }
-    } else {
-      action = "created";
-      var newRow = new Array(headers.length).fill("");
-      for (var key in fieldMap) {
-        var val = "";
-        if (key === "phone_number") val = phone;
-        else if (key === "timestamp") val = timestamp;
-        else {
-          var keys = fieldMap[key];
-          for (var k = 0; k < keys.length; k++) {
-            if (data[keys[k]] !== undefined) {
-              val = data[keys[k]];
-              break;
-            }
-          }
-        }
-        newRow[colIndexes[key]] = val;
-      }
-      sheet.appendRow(newRow);
-      var appendedRow = sheet.getLastRow();
-      // Format phone column as text and set value (may be empty on first sync)
-      var phoneCell = sheet.getRange(appendedRow, colIndexes["phone_number"] + 1);
-      phoneCell.setNumberFormat("@");
-      if (phone) phoneCell.setValue(phone);
-    }
+    var written = shardingEnabled() ? writeSharded([data]) : writeActiveSheet(data, phone, tgUserId);
+    var action = written.actions[0];
+    var colIndexes = written.colIndexes;
 
     // Извлечь city и client_name для диагностики
     var extractedCity = null;
@@ -196,6 +126,775 @@ function processData(data) {
   }
 }
 
+// Один лист (без шардирования): поиск перебором строк, запись по ячейкам
+function writeActiveSheet(data, phone, tgUserId) {
+  var fieldMap = FIELD_MAP;
+  var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
+  var timestamp = new Date();
+  var columns = ensureColumns(sheet, fieldMap);
+  var headers = columns.headers;
+  var colIndexes = columns.colIndexes;
+
+  // ПОИСК: Priority 1 - by tg_user_id (always required), Priority 2 - by phone (as fallback)
+  var rowIndex = -1;
+  var phoneColIndex = colIndexes["phone_number"];
+  var tgUserIdColIndex = colIndexes["tg_user_id"];
+  var lastRow = sheet.getLastRow();
+
+  if (lastRow > 1) {
+    var allData = sheet.getRange(2, 1, lastRow - 1, headers.length).getValues();
+
+    for (var i = 0; i < allData.length; i++) {
+      // Priority 1: Search by tg_user_id (required identifier)
+      var cellTgId = String(allData[i][tgUserIdColIndex]);
+      if (cellTgId === String(tgUserId)) {
+        rowIndex = i + 2;
+        break;
+      }
+      // Priority 2: If not found by tg_user_id and phone is provided, try by phone
+      if (phone && rowIndex === -1) {
+        var cellValue = allData[i][phoneColIndex];
+        var normalizedCell = normalizePhone(cellValue);
+        if (normalizedCell === phone) {
+          rowIndex = i + 2;
+          break;
+        }
+      }
+    }
+  }
+  Logger.log("Search tg_user_id: " + tgUserId + ", phone: " + phone + ", found at row: " + rowIndex);
+
+  // ЗАПИСЬ
+  var action;
+  if (rowIndex !== -1) {
+    action = "updated";
+    for (var key in fieldMap) {
+      // Update phone_number if provided (allows transition from tg_user_id to phone)
+      if (key === "phone_number") {
+        if (phone) sheet.getRange(rowIndex, colIndexes[key] + 1).setValue(phone);
+        continue;
+      }
+      var val = null;
+      if (key === "timestamp") val = timestamp;
+      else {
+        var keys = fieldMap[key];
+        for (var k = 0; k < keys.length; k++) {
+          // Проверка: если ключ есть в данных
+          if (data[keys[k]] !== undefined) {
+            val = data[keys[k]];
+            break;
+          }
+        }
+      }
+      if (val !== null) sheet.getRange(rowIndex, colIndexes[key] + 1).setValue(val);
+    }
+  } else {
+    action = "created";
+    var newRow = new Array(headers.length).fill("");
+    for (var key in fieldMap) {
+      var val = "";
+      if (key === "phone_number") val = phone;
+      else if (key === "timestamp") val = timestamp;
+      else {
+        var keys = fieldMap[key];
+        for (var k = 0; k < keys.length; k++) {
+          if (data[keys[k]] !== undefined) {
+            val = data[keys[k]];
+            break;
+          }
+        }
+      }
+      newRow[colIndexes[key]] = val;
+    }
+    sheet.appendRow(newRow);
+    var appendedRow = sheet.getLastRow();
+    // Format phone column as text and set value (may be empty on first sync)
+    var phoneCell = sheet.getRange(appendedRow, colIndexes["phone_number"] + 1);
+    phoneCell.setNumberFormat("@");
+    if (phone) phoneCell.setValue(phone);
+  }
+  return { actions: [action], colIndexes: colIndexes };
+}
+
+// ЭКСПОРТ: строки, изменённые после курсора (или с момента since), по возрастанию timestamp.
+// ?mode=export&format=json|csv&since=<ISO или мс>&cursor=<next_cursor>&limit=<до 5000>
+// Курсор "мс:номер строки" (при шардировании "мс:шард:номер строки") - следующий запрос
+// продолжает ровно с места остановки.
+var EXPORT_DEFAULT_LIMIT = 500;
+var EXPORT_MAX_LIMIT = 5000;
+
+function parseExportTime(value) {
+  if (value === null || value === undefined || value === "") return 0;
+  if (value instanceof Date) return value.getTime();
+  if (/^\d+$/.test(String(value))) return Number(value);
+  var parsed = Date.parse(value);
+  return isNaN(parsed) ? 0 : parsed;
+}
+
+function exportCell(value) {
+  return value instanceof Date ? value.toISOString() : value;
+}
+
+function csvCell(value) {
+  var text = value === null || value === undefined ? "" : String(value);
+  return /[",\r\n]/.test(text) ? '"' + text.replace(/"/g, '""') + '"' : text;
+}
+
+function exportTokenValid(params) {
+  var token = PropertiesService.getScriptProperties().getProperty("EXPORT_TOKEN");
+  return !token || params.token === token;
+}
+
+function parseExportCursor(cursor) {
+  var parts = String(cursor).split(":");
+  if (parts.length > 2) return { time: Number(parts[0]) || 0, shard: parts[1], row: Number(parts[2]) || 0 };
+  return { time: Number(parts[0]) || 0, shard: "", row: Number(parts[1]) || 0 };
+}
+
+function exportCursor(item) {
+  return item.shard ? item.time + ":" + item.shard + ":" + item.row : item.time + ":" + item.row;
+}
+
+function compareExport(a, b) {
+  return a.time - b.time || (a.shard < b.shard ? -1 : a.shard > b.shard ? 1 : 0) || a.row - b.row;
+}
+
+function exportRows(params) {
+  if (!exportTokenValid(params)) {
+    return responseJSON({ "status": "error", "message": "Invalid export token" });
+  }
+
+  var limit = Math.min(Number(params.limit) || EXPORT_DEFAULT_LIMIT, EXPORT_MAX_LIMIT);
+  var after = params.cursor ? parseExportCursor(params.cursor) : { time: parseExportTime(params.since), shard: "", row: 0 };
+
+  // Одно чтение каждого рабочего листа вместо поиска по строкам; колонки шардов объединяются
+  var headers = [];
+  var changed = [];
+  workingSheets(SpreadsheetApp.getActiveSpreadsheet()).forEach(function (sheet) {
+    var shard = shardingEnabled() ? sheet.getName() : "";
+    var values = sheet.getDataRange().getValues();
+    var own = values.length ? values[0] : [];
+    var positions = own.map(function (name) {
+      if (headers.indexOf(name) === -1) headers.push(name);
+      return headers.indexOf(name);
+    });
+    var timestampCol = own.indexOf("timestamp");
+    for (var i = 1; i < values.length; i++) {
+      var item = { time: timestampCol === -1 ? 0 : parseExportTime(values[i][timestampCol]), shard: shard, row: i + 1 };
+      if (compareExport(item, after) > 0) {
+        item.cells = [];
+        for (var c = 0; c < positions.length; c++) item.cells[positions[c]] = values[i][c];
+        changed.push(item);
+      }
+    }
+  });
+  changed.sort(compareExport);
+
+  var page = changed.slice(0, limit).map(function (item) {
+    var cells = [];
+    for (var c = 0; c < headers.length; c++) cells.push(item.cells[c] === undefined ? "" : exportCell(item.cells[c]));
+    return { cursor: exportCursor(item), cells: cells };
+  });
+  var nextCursor = page.length ? page[page.length - 1].cursor : exportCursor(after);
+  var hasMore = changed.length > page.length;
+
+  if (params.format === "csv") {
+    // Курсор каждой строки в первой колонке: next_cursor - значение из последней строки
+    var lines = [["_cursor"].concat(headers).map(csvCell).join(",")];
+    page.forEach(function (item) {
+      lines.push([item.cursor].concat(item.cells).map(csvCell).join(","));
+    });
+    return ContentService.createTextOutput(lines.join("\r\n") + "\r\n").setMimeType(ContentService.MimeType.CSV);
+  }
+
+  return responseJSON({
+    "status": "success",
+    "columns": headers,
+    "rows": page.map(function (item) { return item.cells; }),
+    "next_cursor": nextCursor,
+    "has_more": hasMore
+  });
+}
+
+// СВЕРКА: хеш содержимого каждой строки по tg_user_id одним запросом.
+// ?mode=hashes - бот сравнивает их со своими и досылает только расходящиеся строки.
+// Порядок полей и приведение значений совпадают с reconcile.py.
+var HASH_FIELDS = ["phone_number", "brand", "model", "year", "city", "city_hub", "budget",
+                   "manager", "client_name", "tg_user_id", "tg_username", "tag"];
+
+function hashCell(key, value) {
+  if (value === null || value === undefined) return "";
+  if (key === "phone_number") return normalizePhone(value);
+  if (value instanceof Date) return value.toISOString();
+  return String(value);
+}
+
+function contentHash(text) {
+  var bytes = Utilities.computeDigest(Utilities.DigestAlgorithm.MD5, text, Utilities.Charset.UTF_8);
+  var hex = "";
+  for (var i = 0; i < 8; i++) {
+    var b = (bytes[i] + 256) % 256;
+    hex += (b < 16 ? "0" : "") + b.toString(16);
+  }
+  return hex;
+}
+
+function hashColumns(headers) {
+  return HASH_FIELDS.map(function (key) { return headers.indexOf(key); });
+}
+
+function rowContentHash(columns, cells) {
+  var parts = columns.map(function (col, k) { return col === -1 ? "" : hashCell(HASH_FIELDS[k], cells[col]); });
+  return contentHash(parts.join("\u001f"));
+}
+
+function rowHashes(params) {
+  if (!exportTokenValid(params)) {
+    return responseJSON({ "status": "error", "message": "Invalid export token" });
+  }
+  var ss = SpreadsheetApp.getActiveSpreadsheet();
+  var hashes = {};
+  var duplicates = 0;
+  workingSheets(ss).forEach(function (sheet) {
+    var values = sheet.getDataRange().getValues();
+    var headers = values.length ? values[0] : [];
+    var columns = hashColumns(headers);
+    var idCol = headers.indexOf("tg_user_id");
+    for (var i = 1; i < values.length && idCol !== -1; i++) {
+      var id = String(values[i][idCol]);
+      if (!id) continue;
+      // processData обновляет первую найденную строку, поэтому дубликаты не сравниваются
+      if (hashes.hasOwnProperty(id)) { duplicates++; continue; }
+      hashes[id] = rowContentHash(columns, values[i]);
+    }
+  });
+  if (shardingEnabled()) {
+    // Архивные шарды не читаются: их хеши записаны в индексе в момент последней записи
+    var directory = openDirectory(ss, true);
+    for (var id in directory.byId) {
+      var entry = directory.byId[id];
+      if (entry.archive && !hashes.hasOwnProperty(id)) hashes[id] = entry.hash;
+    }
+  }
+  return responseJSON({ "status": "success", "fields": HASH_FIELDS, "hashes": hashes, "duplicates": duplicates });
+}
+
+// Поля лида в строку по правилам processData: телефон - нормализованный, timestamp - время
+// записи, пустые значения (null) не затирают заполненные ячейки
+function applyLead(row, data, colIndexes, phone, timestamp) {
+  for (var key in FIELD_MAP) {
+    if (key === "phone_number") {
+      if (phone) row[colIndexes[key]] = phone;
+      continue;
+    }
+    if (key === "timestamp") { row[colIndexes[key]] = timestamp; continue; }
+    var keys = FIELD_MAP[key];
+    for (var k = 0; k < keys.length; k++) {
+      if (data[keys[k]] !== undefined) {
+        if (data[keys[k]] !== null) row[colIndexes[key]] = data[keys[k]];
+        break;
+      }
+    }
+  }
+}
+
+function ensureRows(sheet, rows) {
+  var missing = rows - sheet.getMaxRows();
+  if (missing > 0) sheet.insertRowsAfter(sheet.getMaxRows(), missing);
+}
+
+// ПАКЕТНАЯ ЗАПИСЬ: {"leads": [...]} - те же правила, что у processData, но лист читается
+// один раз, а изменённые и новые строки пишутся двумя вызовами setValues.
+function processBatch(leads) {
+  var lock = LockService.getScriptLock();
+  lock.tryLock(10000);
+
+  try {
+    if (shardingEnabled()) {
+      var written = writeSharded(leads);
+      return responseJSON({ "status": "success", "created": written.created, "updated": written.updated, "errors": written.errors });
+    }
+    var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
+    var timestamp = new Date();
+    var columns = ensureColumns(sheet, FIELD_MAP);
+    var colIndexes = columns.colIndexes;
+    var width = columns.headers.length;
+    var lastRow = sheet.getLastRow();
+    var rows = lastRow > 1 ? sheet.getRange(2, 1, lastRow - 1, width).getValues() : [];
+    var existing = rows.length;
+
+    // Индексы: первая строка с таким tg_user_id / телефоном
+    var byId = {}, byPhone = {};
+    for (var i = rows.length - 1; i >= 0; i--) {
+      byId[String(rows[i][colIndexes["tg_user_id"]])] = i;
+      var cellPhone = normalizePhone(rows[i][colIndexes["phone_number"]]);
+      if (cellPhone) byPhone[cellPhone] = i;
+    }
+
+    var firstDirty = -1, lastDirty = -1, created = 0, updated = 0, errors = 0;
+    leads.forEach(function (data) {
+      var tgUserId = data.tg_user_id || data.user_id;
+      if (!tgUserId) { errors++; return; }
+      var phone = normalizePhone(data.phone || data.phone_number || data.mobile);
+      var index = byId.hasOwnProperty(String(tgUserId)) ? byId[String(tgUserId)]
+                : (phone && byPhone.hasOwnProperty(phone) ? byPhone[phone] : -1);
+      var isNew = index === -1;
+      if (isNew) {
+        index = rows.length;
+        rows.push(new Array(width).fill(""));
+        created++;
+      } else {
+        updated++;
+      }
+      var row = rows[index];
+      applyLead(row, data, colIndexes, phone, timestamp);
+      byId[String(row[colIndexes["tg_user_id"]])] = index;
+      if (phone) byPhone[phone] = index;
+      if (!isNew && index < existing) {
+        firstDirty = firstDirty === -1 ? index : Math.min(firstDirty, index);
+        lastDirty = Math.max(lastDirty, index);
+      }
+    });
+
+    if (firstDirty !== -1) {
+      sheet.getRange(firstDirty + 2, 1, lastDirty - firstDirty + 1, width)
+        .setValues(rows.slice(firstDirty, lastDirty + 1));
+    }
+    if (rows.length > existing) {
+      var added = rows.length - existing;
+      ensureRows(sheet, lastRow + added);
+      sheet.getRange(lastRow + 1, colIndexes["phone_number"] + 1, added, 1).setNumberFormat("@");
+      sheet.getRange(lastRow + 1, 1, added, width).setValues(rows.slice(existing));
+    }
+    return responseJSON({ "status": "success", "created": created, "updated": updated, "errors": errors });
+  } catch (e) {
+    return responseJSON({ "status": "error", "message": e.toString() });
+  } finally {
+    lock.releaseLock();
+  }
+}
+
+// ШАРДИРОВАНИЕ (свойство скрипта SHARDING=on, включается один раз через setupSharding()).
+// Лиды пишутся не в один растущий лист, а во вкладки по месяцам "leads_2026_10"; заполненная
+// до SHARD_MAX_ROWS строк вкладка продолжается в "leads_2026_10_02". Скрытый лист "_directory" -
+// индекс tg_user_id -> вкладка и строка (плюс телефон и хеш строки): поиск не читает шарды.
+// rotateShards() 1-го числа переносит вкладки старше HOT_SHARD_MONTHS месяцев в архивные
+// таблицы (по одной на год), так что рабочий набор и время записи не растут вместе с базой.
+// Лид из архива при следующей записи переносится в текущий шард.
+var SHARD_PREFIX = "leads_";
+var SHARD_PATTERN = /^leads_(\d{4})_(\d{2})(?:_\d{2})?$/;
+var SHARD_MAX_ROWS = 20000;
+var HOT_SHARD_MONTHS = 3;
+var DIRECTORY_SHEET = "_directory";
+var DIRECTORY_HEADERS = ["tg_user_id", "phone_number", "shard", "row", "archive_id", "hash"];
+
+function scriptSetting(name, fallback) {
+  var value = PropertiesService.getScriptProperties().getProperty(name);
+  return value === null || value === "" ? fallback : value;
+}
+
+function shardingEnabled() {
+  return scriptSetting("SHARDING", "") === "on";
+}
+
+function shardMonth(date) {
+  return Utilities.formatDate(date, Session.getScriptTimeZone(), "yyyy_MM");
+}
+
+// Листы с лидами: шарды рабочей таблицы по порядку или один активный лист
+function workingSheets(ss) {
+  if (!shardingEnabled()) return [ss.getActiveSheet()];
+  return ss.getSheets()
+    .filter(function (sheet) { return SHARD_PATTERN.test(sheet.getName()); })
+    .sort(function (a, b) { return a.getName() < b.getName() ? -1 : 1; });
+}
+
+// Вкладка для новых строк: шард текущего месяца или его следующая часть, если он заполнен
+function currentShard(ss, now) {
+  var maxRows = Number(scriptSetting("SHARD_MAX_ROWS", SHARD_MAX_ROWS));
+  var base = SHARD_PREFIX + shardMonth(now);
+  var name = base;
+  for (var part = 2; ; part++) {
+    var sheet = ss.getSheetByName(name);
+    if (!sheet) {
+      sheet = ss.insertSheet(name);
+      ensureColumns(sheet, FIELD_MAP);
+      return sheet;
+    }
+    if (sheet.getLastRow() - 1 < maxRows) return sheet;
+    name = base + "_" + (part < 10 ? "0" : "") + part;
+  }
+}
+
+// ИНДЕКС. preload - прочитать весь индекс одним запросом (пакеты), иначе поиск TextFinder'ом
+function openDirectory(ss, preload) {
+  var sheet = ss.getSheetByName(DIRECTORY_SHEET);
+  if (!sheet) {
+    sheet = ss.insertSheet(DIRECTORY_SHEET);
+    sheet.getRange(1, 1, 1, DIRECTORY_HEADERS.length).setValues([DIRECTORY_HEADERS]);
+    sheet.getRange(1, 1, sheet.getMaxRows(), 2).setNumberFormat("@");
+    sheet.hideSheet();
+  }
+  var directory = { sheet: sheet, lastRow: sheet.getLastRow(), preloaded: !!preload,
+                    rows: {}, byId: {}, byPhone: {}, dirty: {}, added: [] };
+  if (preload && directory.lastRow > 1) {
+    var values = sheet.getRange(2, 1, directory.lastRow - 1, DIRECTORY_HEADERS.length).getValues();
+    // Снизу вверх: при повторах в индексе остаётся первая запись, как при поиске перебором
+    for (var i = values.length - 1; i >= 0; i--) rememberEntry(directory, i + 2, values[i]);
+  }
+  return directory;
+}
+
+function rememberEntry(directory, dirRow, values) {
+  var entry = { dirRow: dirRow, id: String(values[0]), phone: normalizePhone(values[1]), shard: String(values[2]),
+                row: values[3], archive: String(values[4] || ""), hash: String(values[5] || "") };
+  directory.rows[dirRow] = entry;
+  if (entry.id) directory.byId[entry.id] = entry;
+  if (entry.phone) directory.byPhone[entry.phone] = entry;
+  return entry;
+}
+
+// column: 1 - tg_user_id, 2 - телефон
+function findEntry(directory, column, value) {
+  if (!value) return null;
+  var known = column === 1 ? directory.byId : directory.byPhone;
+  if (known.hasOwnProperty(value)) return known[value];
+  if (directory.preloaded || directory.lastRow < 2) return null;
+  var cell = directory.sheet.getRange(2, column, directory.lastRow - 1, 1)
+    .createTextFinder(value).matchEntireCell(true).findNext();
+  if (!cell) return null;
+  var values = directory.sheet.getRange(cell.getRow(), 1, 1, DIRECTORY_HEADERS.length).getValues()[0];
+  return rememberEntry(directory, cell.getRow(), values);
+}
+
+function saveEntry(directory, entry, previousId) {
+  if (previousId && previousId !== entry.id && directory.byId[previousId] === entry) delete directory.byId[previousId];
+  if (!entry.dirRow) {
+    entry.dirRow = directory.lastRow + directory.added.length + 1;
+    directory.added.push(entry);
+  } else if (entry.dirRow <= directory.lastRow) {
+    directory.dirty[entry.dirRow] = true;
+  }
+  directory.rows[entry.dirRow] = entry;
+  directory.byId[entry.id] = entry;
+  if (entry.phone) directory.byPhone[entry.phone] = entry;
+}
+
+function entryValues(entry) {
+  return [entry.id, entry.phone, entry.shard, entry.row, entry.archive, entry.hash];
+}
+
+function flushDirectory(directory) {
+  var width = DIRECTORY_HEADERS.length;
+  var dirty = Object.keys(directory.dirty).map(Number).sort(function (a, b) { return a - b; });
+  if (dirty.length && directory.preloaded) {
+    // Весь индекс в памяти - изменённые записи одним setValues
+    var values = [];
+    for (var row = dirty[0]; row <= dirty[dirty.length - 1]; row++) values.push(entryValues(directory.rows[row]));
+    directory.sheet.getRange(dirty[0], 1, values.length, width).setValues(values);
+  } else {
+    dirty.forEach(function (row) {
+      directory.sheet.getRange(row, 1, 1, width).setValues([entryValues(directory.rows[row])]);
+    });
+  }
+  if (directory.added.length) {
+    var first = directory.lastRow + 1;
+    ensureRows(directory.sheet, directory.lastRow + directory.added.length);
+    directory.sheet.getRange(first, 1, directory.added.length, 2).setNumberFormat("@");
+    directory.sheet.getRange(first, 1, directory.added.length, width).setValues(directory.added.map(entryValues));
+  }
+}
+
+// ШАРДЫ: прочитанные строки, изменённые строки и новые строки каждой затронутой вкладки
+function openShard(ss, shards, name) {
+  if (!shards.hasOwnProperty(name)) {
+    var sheet = SHARD_PATTERN.test(name) ? ss.getSheetByName(name) : null;
+    var columns = sheet ? ensureColumns(sheet, FIELD_MAP) : null;
+    shards[name] = sheet ? { name: name, sheet: sheet, headers: columns.headers, colIndexes: columns.colIndexes,
+                             width: columns.headers.length, lastRow: sheet.getLastRow(), cells: {}, dirty: {}, added: [] }
+                         : null;
+  }
+  return shards[name];
+}
+
+// Нужные строки читаются одним диапазоном от первой до последней
+function loadShardRows(shard, rowNumbers) {
+  var wanted = rowNumbers.filter(function (row) { return row >= 2 && row <= shard.lastRow && !shard.cells[row]; });
+  if (!wanted.length) return;
+  var first = wanted.reduce(function (a, b) { return Math.min(a, b); });
+  var last = wanted.reduce(function (a, b) { return Math.max(a, b); });
+  var values = shard.sheet.getRange(first, 1, last - first + 1, shard.width).getValues();
+  values.forEach(function (cells, i) {
+    if (!shard.cells[first + i]) shard.cells[first + i] = cells;
+  });
+}
+
+function appendShardRow(shard, cells) {
+  var row = shard.lastRow + shard.added.length + 1;
+  shard.added.push(cells);
+  shard.cells[row] = cells;
+  return { shard: shard, row: row, cells: cells };
+}
+
+function rowsLoaded(shard, first, last) {
+  for (var row = first; row <= last; row++) if (!shard.cells[row]) return false;
+  return true;
+}
+
+function flushShard(shard) {
+  // Изменённые строки - отрезками без дыр (обычно один setValues), новые - одним setValues
+  var dirty = Object.keys(shard.dirty).map(Number).sort(function (a, b) { return a - b; });
+  var start = 0;
+  for (var i = 1; i <= dirty.length; i++) {
+    if (i < dirty.length && rowsLoaded(shard, dirty[i - 1], dirty[i])) continue;
+    var values = [];
+    for (var row = dirty[start]; row <= dirty[i - 1]; row++) values.push(shard.cells[row]);
+    shard.sheet.getRange(dirty[start], 1, values.length, shard.width).setValues(values);
+    start = i;
+  }
+  if (shard.added.length) {
+    ensureRows(shard.sheet, shard.lastRow + shard.added.length);
+    shard.sheet.getRange(shard.lastRow + 1, shard.colIndexes["phone_number"] + 1, shard.added.length, 1).setNumberFormat("@");
+    shard.sheet.getRange(shard.lastRow + 1, 1, shard.added.length, shard.width).setValues(shard.added);
+  }
+}
+
+function findInShard(shard, id) {
+  if (shard.lastRow < 2) return -1;
+  var cell = shard.sheet.getRange(2, shard.colIndexes["tg_user_id"] + 1, shard.lastRow - 1, 1)
+    .createTextFinder(id).matchEntireCell(true).findNext();
+  return cell ? cell.getRow() : -1;
+}
+
+// Строка лида из архивной таблицы как {колонка: значение}; null, если её там нет
+function readArchivedRow(entry) {
+  try {
+    var sheet = SpreadsheetApp.openById(entry.archive).getSheetByName(entry.shard);
+    if (!sheet) return null;
+    var width = sheet.getLastColumn();
+    var headers = sheet.getRange(1, 1, 1, width).getValues()[0];
+    var cells = sheet.getRange(Number(entry.row), 1, 1, width).getValues()[0];
+    if (String(cells[headers.indexOf("tg_user_id")]) !== entry.id) return null;
+    var record = {};
+    headers.forEach(function (name, i) { record[name] = cells[i]; });
+    return record;
+  } catch (e) {
+    Logger.log("Archive " + entry.archive + " unavailable: " + e);
+    return null;
+  }
+}
+
+// Строка лида в рабочей таблице; лид из архива переносится в текущий шард
+function locateRow(ss, shards, entry, current) {
+  if (entry.archive) {
+    var record = readArchivedRow(entry);
+    if (!record) return null;
+    var target = current();
+    var restored = new Array(target.width).fill("");
+    target.headers.forEach(function (name, i) {
+      if (record.hasOwnProperty(name)) restored[i] = record[name];
+    });
+    return appendShardRow(target, restored);
+  }
+  var shard = openShard(ss, shards, entry.shard);
+  if (!shard) return null;
+  var row = Number(entry.row);
+  loadShardRows(shard, [row]);
+  var cells = shard.cells[row];
+  if (!cells || String(cells[shard.colIndexes["tg_user_id"]]) !== entry.id) {
+    // Строки шарда сдвинули вручную - ищем лид в той же вкладке
+    row = findInShard(shard, entry.id);
+    if (row === -1) return null;
+    loadShardRows(shard, [row]);
+    cells = shard.cells[row];
+  }
+  return { shard: shard, row: row, cells: cells };
+}
+
+// Запись лидов через индекс: одно чтение индекса на пакет (или TextFinder для одного лида),
+// одно чтение диапазона строк на затронутый шард, запись изменённых и новых строк пачками
+function writeSharded(leads) {
+  var ss = SpreadsheetApp.getActiveSpreadsheet();
+  var now = new Date();
+  var directory = openDirectory(ss, leads.length > 1);
+  var shards = {};
+  var currentName = null;
+  var current = function () {
+    if (!currentName) currentName = currentShard(ss, now).getName();
+    return openShard(ss, shards, currentName);
+  };
+  var result = { created: 0, updated: 0, restored: 0, errors: 0, actions: [], colIndexes: null };
+
+  // Проход 1: строки уже известных лидов, по одному диапазону на шард
+  var needed = {};
+  leads.forEach(function (data) {
+    var entry = findEntry(directory, 1, String(data.tg_user_id || data.user_id || "")) ||
+                findEntry(directory, 2, normalizePhone(data.phone || data.phone_number || data.mobile));
+    if (entry && !entry.archive) (needed[entry.shard] = needed[entry.shard] || []).push(Number(entry.row));
+  });
+  for (var name in needed) {
+    var shard = openShard(ss, shards, name);
+    if (shard) loadShardRows(shard, needed[name]);
+  }
+
+  // Проход 2: лиды по порядку, как последовательные вызовы processData
+  leads.forEach(function (data) {
+    var tgUserId = data.tg_user_id || data.user_id;
+    if (!tgUserId) { result.errors++; result.actions.push("error"); return; }
+    var phone = normalizePhone(data.phone || data.phone_number || data.mobile);
+    var entry = findEntry(directory, 1, String(tgUserId)) || findEntry(directory, 2, phone);
+    var located = entry ? locateRow(ss, shards, entry, current) : null;
+    var action = located ? "updated" : "created";
+    if (!located) {
+      located = appendShardRow(current(), new Array(current().width).fill(""));
+    } else if (entry.archive) {
+      result.restored++;
+    } else if (located.row <= located.shard.lastRow) {
+      located.shard.dirty[located.row] = true;
+    }
+    result[action]++;
+    result.actions.push(action);
+
+    var colIndexes = located.shard.colIndexes;
+    applyLead(located.cells, data, colIndexes, phone, now);
+    var previousId = entry ? entry.id : null;
+    entry = entry || {};
+    entry.id = String(located.cells[colIndexes["tg_user_id"]]);
+    entry.phone = normalizePhone(located.cells[colIndexes["phone_number"]]);
+    entry.shard = located.shard.name;
+    entry.row = located.row;
+    entry.archive = "";
+    entry.hash = rowContentHash(hashColumns(located.shard.headers), located.cells);
+    saveEntry(directory, entry, previousId);
+    result.colIndexes = colIndexes;
+  });
+
+  // Сначала строки, потом индекс, который на них ссылается
+  for (var name in shards) {
+    if (shards[name]) flushShard(shards[name]);
+  }
+  flushDirectory(directory);
+  return result;
+}
+
+// Включение шардирования (запускается вручную один раз из редактора): активный лист
+// становится шардом текущего месяца, по нему строится индекс, ставится ежемесячная ротация
+function setupSharding() {
+  var lock = LockService.getScriptLock();
+  lock.waitLock(30000);
+  try {
+    if (shardingEnabled()) return;
+    var ss = SpreadsheetApp.getActiveSpreadsheet();
+    var sheet = ss.getActiveSheet();
+    if (!SHARD_PATTERN.test(sheet.getName())) sheet.setName(SHARD_PREFIX + shardMonth(new Date()));
+    var columns = ensureColumns(sheet, FIELD_MAP);
+    var colIndexes = columns.colIndexes;
+    var hashCols = hashColumns(columns.headers);
+    var lastRow = sheet.getLastRow();
+    var rows = lastRow > 1 ? sheet.getRange(2, 1, lastRow - 1, columns.headers.length).getValues() : [];
+    var directory = openDirectory(ss, true);
+    rows.forEach(function (cells, i) {
+      var id = String(cells[colIndexes["tg_user_id"]]);
+      if (!id || directory.byId.hasOwnProperty(id)) return;
+      saveEntry(directory, { id: id, phone: normalizePhone(cells[colIndexes["phone_number"]]), shard: sheet.getName(),
+                             row: i + 2, archive: "", hash: rowContentHash(hashCols, cells) });
+    });
+    flushDirectory(directory);
+    PropertiesService.getScriptProperties().setProperty("SHARDING", "on");
+    installRotationTrigger();
+  } finally {
+    lock.releaseLock();
+  }
+}
+
+function installRotationTrigger() {
+  ScriptApp.getProjectTriggers().forEach(function (trigger) {
+    if (trigger.getHandlerFunction() === "rotateShards") ScriptApp.deleteTrigger(trigger);
+  });
+  ScriptApp.newTrigger("rotateShards").timeBased().onMonthDay(1).atHour(3).create();
+}
+
+// Архивная таблица года (создаётся при первой ротации, id в свойстве ARCHIVE_<год>)
+function archiveSpreadsheet(year) {
+  var properties = PropertiesService.getScriptProperties();
+  var id = properties.getProperty("ARCHIVE_" + year);
+  if (id) return SpreadsheetApp.openById(id);
+  var archive = SpreadsheetApp.create(SpreadsheetApp.getActiveSpreadsheet().getName() + " - архив " + year);
+  properties.setProperty("ARCHIVE_" + year, archive.getId());
+  return archive;
+}
+
+// РОТАЦИЯ (триггер 1-го числа): шарды старше HOT_SHARD_MONTHS месяцев уезжают в архив
+function rotateShards() {
+  var lock = LockService.getScriptLock();
+  lock.waitLock(30000);
+  try {
+    var ss = SpreadsheetApp.getActiveSpreadsheet();
+    var now = new Date();
+    var hotMonths = Number(scriptSetting("HOT_SHARD_MONTHS", HOT_SHARD_MONTHS));
+    var oldestHot = shardMonth(new Date(now.getFullYear(), now.getMonth() - hotMonths + 1, 1));
+    var moved = {};
+    var stale = [];
+    ss.getSheets().forEach(function (sheet) {
+      var match = SHARD_PATTERN.exec(sheet.getName());
+      if (!match || match[1] + "_" + match[2] >= oldestHot) return;
+      var archive = archiveSpreadsheet(match[1]);
+      var leftover = archive.getSheetByName(sheet.getName());
+      if (leftover) archive.deleteSheet(leftover);  // копия из прерванной ротации
+      sheet.copyTo(archive).setName(sheet.getName());
+      moved[sheet.getName()] = archive.getId();
+      stale.push(sheet);
+    });
+    // Индекса нет - нет и шардирования; без устаревших вкладок остаётся только долечить индекс
+    if (!stale.length && !ss.getSheetByName(DIRECTORY_SHEET)) return moved;
+
+    // Последний видимый лист удалить нельзя: шард текущего месяца создаётся заранее, до первой записи
+    var keepsVisible = ss.getSheets().some(function (sheet) {
+      return !sheet.isSheetHidden() && !moved.hasOwnProperty(sheet.getName());
+    });
+    if (stale.length && !keepsVisible) currentShard(ss, now);
+
+    // Сначала удаление вкладок, потом индекс: индекс указывает на архив только после удаления.
+    // Если ротация прервалась между ними, следующий запуск найдёт удалённую вкладку в архиве года
+    stale.forEach(function (sheet) { ss.deleteSheet(sheet); });
+    var directory = openDirectory(ss, false);
+    var healed = 0;
+    if (directory.lastRow > 1) {
+      var range = directory.sheet.getRange(2, 3, directory.lastRow - 1, 3);
+      var values = range.getValues();
+      var archives = {};  // вкладка -> id архива с её копией ("" - вкладка на месте или копии нет)
+      values.forEach(function (cells) {
+        if (cells[2]) return;
+        var shard = String(cells[0]);
+        if (!archives.hasOwnProperty(shard)) {
+          archives[shard] = moved.hasOwnProperty(shard) ? moved[shard] : orphanedShardArchive(ss, shard);
+          if (archives[shard] && !moved.hasOwnProperty(shard)) healed++;
+        }
+        if (archives[shard]) cells[2] = archives[shard];
+      });
+      if (stale.length || healed) range.setValues(values);
+    }
+    Logger.log("Rotated shards to archive: " + JSON.stringify(moved) + (healed ? ", shards re-indexed: " + healed : ""));
+    return moved;
+  } finally {
+    lock.releaseLock();
+  }
+}
+
+// Архив, куда прерванная ротация уже скопировала удалённую вкладку; "" - вкладка на месте или копии нет
+function orphanedShardArchive(ss, name) {
+  var match = SHARD_PATTERN.exec(name);
+  if (!match || ss.getSheetByName(name)) return "";
+  var id = PropertiesService.getScriptProperties().getProperty("ARCHIVE_" + match[1]);
+  if (!id) return "";
+  try {
+    return SpreadsheetApp.openById(id).getSheetByName(name) ? id : "";
+  } catch (e) {
+    Logger.log("Archive " + id + " unavailable: " + e);
+    return "";
+  }
+}
+
 function responseJSON(content) {
   return ContentService.createTextOutput(JSON.stringify(content)).setMimeType(ContentService.MimeType.JSON);
 }
@@ -0,0 +1,95 @@
+"""
+Artifacts - precompiled catalogs and indexes for a fast cold start
+
+Building the fuzzy indexes and the nearest-hub grid from data/*.json/*.csv
+on every start costs time that grows with the catalogs. load_artifact()
+keeps the built object pickled in data/compiled/, keyed by a hash of its
+source files (data and the code that builds it), so a changed catalog or
+index format is rebuilt automatically and a stale pickle is never used.
+
+The Docker image precompiles everything at build time:
+
+    python artifacts.py            # build all artifacts (and Python bytecode)
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import time
+from typing import Callable, Iterable, TypeVar
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", os.path.join(ROOT, "data", "compiled"))
+# Bump when the pickled layout changes without a change in the source files
+ARTIFACT_FORMAT = 1
+
+T = TypeVar("T")
+
+
+def sources_digest(paths: Iterable[str]) -> str:
+    """Hash of the source files' contents, the format version and the Python version."""
+    digest = hashlib.sha256(f"{ARTIFACT_FORMAT}:{sys.version_info[:2]}".encode())
+    for path in paths:
+        with open(path, "rb") as handle:
+            digest.update(handle.read())
+    return digest.hexdigest()[:16]
+
+
+def load_artifact(name: str, sources: Iterable[str], build: Callable[[], T], directory: str = ARTIFACTS_DIR) -> T:
+    """
+    Return the precompiled object for `name`, building and storing it if missing or stale.
+
+    Args:
+        name: Artifact file prefix
+        sources: Files the object is built from (data and code)
+        build: Builds the object from the sources
+        directory: Where pickles are kept; an unwritable directory only disables caching
+    """
+    path = os.path.join(directory, f"{name}-{sources_digest(sources)}.pickle")
+    try:
+        with open(path, "rb") as handle:
+            return pickle.load(handle)
+    except FileNotFoundError:
+        pass
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as exc:
+        logging.warning("Artifact %s is unreadable, rebuilding: %s", path, exc)
+
+    started = time.perf_counter()
+    value = build()
+    logging.info("Artifact %s built in %.1f ms", name, (time.perf_counter() - started) * 1000)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for stale in os.listdir(directory):
+            if stale.startswith(f"{name}-") and stale.endswith(".pickle"):
+                os.remove(os.path.join(directory, stale))
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as handle:
+            pickle.dump(value, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except OSError as exc:
+        logging.warning("Artifact %s not saved: %s", path, exc)
+    return value
+
+
+def main() -> None:
+    # Imported here: both modules use load_artifact for their loaders
+    import compileall
+
+    import bot
+    from car_catalog import get_catalog
+    from city_gazetteer import get_gazetteer
+
+    logging.basicConfig(level=logging.INFO)
+    started = time.perf_counter()
+    get_catalog()
+    get_gazetteer(bot.CITY_HUBS)
+    print(f"Artifacts ready in {ARTIFACTS_DIR} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+    # PYTHONDONTWRITEBYTECODE keeps containers from writing .pyc at runtime, so ship them in the image
+    compileall.compile_dir(ROOT, quiet=1, legacy=False)
+    print("Bytecode compiled")
+
+
+if __name__ == "__main__":
+    main()
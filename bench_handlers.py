@@ -0,0 +1,282 @@
+"""
+Handler benchmark - drives the real ConversationHandler with synthetic updates
+
+The application is built by bot.build_application(), exactly as in main(),
+but Telegram HTTP calls go to an in-process stub and sheet syncs to a no-op,
+so only our handler code (and python-telegram-bot's dispatching) is measured.
+
+Usage:
+    python bench_handlers.py --users 2000 --concurrency 50 --json bench_output.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+from unittest import mock
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+import bot
+
+BOT_ID = 100000
+BENCH_TOKEN = f"{BOT_ID}:BENCHMARK"
+
+# Label of each funnel step, keyed by the conversation state the update arrives in
+STATE_NAMES = {None: "START", **bot.STATE_NAMES}
+
+
+def sheet_ok_response() -> mock.Mock:
+    """Stand-in for the Apps Script's answer to a successful sync."""
+    return mock.Mock(status_code=200, **{"json.return_value": {"status": "success"}})
+
+
+class StubTelegramRequest(BaseRequest):
+    """Answers Bot API calls in-process with minimal valid objects."""
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self._message_id = 0
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        return None
+
+    async def shutdown(self) -> None:
+        return None
+
+    async def do_request(self, url, method, request_data: Optional[RequestData] = None, **kwargs) -> Tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        params = request_data.parameters if request_data else {}
+
+        if endpoint == "getMe":
+            result = {"id": BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif endpoint.startswith(("send", "edit")):
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 0), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+
+class UpdateFactory:
+    """Builds Update objects the way Telegram would deliver them."""
+
+    def __init__(self, tg_bot):
+        self.bot = tg_bot
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next_ids(self) -> Tuple[int, int]:
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def _user(user_id: int, named: bool) -> Dict:
+        return {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"User{user_id}" if named else "",
+            "username": f"user{user_id}",
+        }
+
+    def message(self, user_id: int, named: bool, text: str = None, contact: Dict = None) -> Update:
+        update_id, message_id = self._next_ids()
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id, named),
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                command = text.split()[0]
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        if contact is not None:
+            message["contact"] = contact
+        return Update.de_json({"update_id": update_id, "message": message}, self.bot)
+
+    def callback(self, user_id: int, named: bool, data: str) -> Update:
+        update_id, message_id = self._next_ids()
+        query = {
+            "id": str(update_id),
+            "from": self._user(user_id, named),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Bench"},
+                "text": "Как только будете готовы, нажмите кнопку ниже.",
+            },
+        }
+        return Update.de_json({"update_id": update_id, "callback_query": query}, self.bot)
+
+
+def funnel_script(factory: UpdateFactory, number: int) -> List[Tuple[Optional[int], Update]]:
+    """
+    One user's complete funnel as (state before update, update) pairs.
+
+    Users alternate between contact/text phone, consent now/later and
+    having a profile name or not, so every state including CLIENT_NAME runs.
+    """
+    user_id = 1_000_000 + number
+    named = number % 3 != 0
+    phone = f"7999{number:07d}"[-11:]
+    steps: List[Tuple[Optional[int], Update]] = [
+        (None, factory.message(user_id, named, f"/start bench_tag_{number % 5}")),
+    ]
+    if number % 2:
+        contact = {"phone_number": f"+{phone}", "first_name": "Контакт" if named else "", "user_id": user_id}
+        steps.append((bot.PHONE, factory.message(user_id, named, contact=contact)))
+    else:
+        steps.append((bot.PHONE, factory.message(user_id, named, text=phone)))
+    steps += [
+        (bot.BRAND, factory.message(user_id, named, "хавал")),
+        (bot.MODEL, factory.message(user_id, named, "Jolion")),
+        (bot.CITY, factory.message(user_id, named, "мск")),
+        (bot.YEAR_TO, factory.message(user_id, named, "2022")),
+        (bot.BUDGET, factory.message(user_id, named, "2 000 000")),
+    ]
+    if number % 4 == 0:
+        steps.append((bot.MANAGER, factory.message(user_id, named, "Нет, пока не нужно")))
+        steps.append((bot.MANAGER, factory.callback(user_id, named, "pass_manager")))
+    else:
+        steps.append((bot.MANAGER, factory.message(user_id, named, "Да, передать менеджеру")))
+    if not named:
+        steps.append((bot.CLIENT_NAME, factory.message(user_id, named, f"Клиент {number}")))
+    return steps
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[position]
+
+
+async def run_benchmark(users: int, concurrency: int, alloc_users: int) -> Dict:
+    """Run all funnels and return latency/throughput/allocation statistics."""
+    # Every run starts with no known leads, so /start is not answered with a prefill offer
+    bot.close_lead_registry()
+    stub = StubTelegramRequest()
+    application = bot.build_application(BENCH_TOKEN, request=stub)
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    scripts = [funnel_script(factory, number) for number in range(users)]
+
+    samples: Dict[str, List[float]] = {name: [] for name in STATE_NAMES.values()}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def drive(script) -> None:
+        async with semaphore:
+            for state, update in script:
+                started = time.perf_counter()
+                await application.process_update(update)
+                samples[STATE_NAMES[state]].append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(script) for script in scripts))
+    elapsed = time.perf_counter() - started
+    total_updates = sum(len(values) for values in samples.values())
+
+    # Allocation pass: sequential, traced, on a separate sample of users
+    alloc_samples: Dict[str, List[int]] = {name: [] for name in STATE_NAMES.values()}
+    alloc_scripts = [funnel_script(factory, users + number) for number in range(alloc_users)]
+    tracemalloc.start()
+    for script in alloc_scripts:
+        for state, update in script:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            await application.process_update(update)
+            alloc_samples[STATE_NAMES[state]].append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    await application.shutdown()
+
+    states = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        allocs = alloc_samples[name]
+        states[name] = {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.50), 4),
+            "p95_ms": round(percentile(values, 0.95), 4),
+            "p99_ms": round(percentile(values, 0.99), 4),
+            "mean_ms": round(statistics.fmean(values), 4),
+            "peak_alloc_kib": round(statistics.fmean(allocs) / 1024, 2) if allocs else None,
+        }
+    return {
+        "users": users,
+        "concurrency": concurrency,
+        "updates": total_updates,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_sec": round(total_updates / elapsed, 1) if elapsed else 0.0,
+        "api_calls_per_update": round(sum(stub.calls.values()) / max(total_updates, 1), 2),
+        "states": states,
+        "samples_ms": {name: [round(value, 4) for value in values] for name, values in samples.items() if values},
+    }
+
+
+def print_report(result: Dict) -> None:
+    print("=" * 78)
+    print(f"HANDLER BENCHMARK: {result['users']} users, concurrency {result['concurrency']}")
+    print("=" * 78)
+    print(f"{'state':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}{'peak KiB':>11}")
+    for name, stats in result["states"].items():
+        peak = stats["peak_alloc_kib"]
+        print(
+            f"{name:<12}{stats['count']:>8}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}"
+            f"{stats['p99_ms']:>10.3f}{stats['mean_ms']:>10.3f}{(peak if peak is not None else 0):>11.1f}"
+        )
+    print("-" * 78)
+    print(f"Updates: {result['updates']} in {result['elapsed_s']} s -> {result['updates_per_sec']} updates/sec")
+    print(f"Bot API calls per update: {result['api_calls_per_update']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark conversation handlers in-process")
+    parser.add_argument("--users", type=int, default=1000, help="Simulated users (complete funnels)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Users progressing at the same time")
+    parser.add_argument("--alloc-users", type=int, default=100, help="Users in the traced allocation pass")
+    parser.add_argument("--json", help="Write full results (with raw samples) to this file")
+    parser.add_argument("--keep-logging", action="store_true", help="Measure with INFO logging enabled")
+    args = parser.parse_args()
+
+    if not args.keep_logging:
+        logging.getLogger().setLevel(logging.WARNING)
+    bot.AI_PROGRESS_STEP_SECONDS = 0
+    # Sheet I/O is stubbed: payloads are still built, the HTTP POST is not made
+    with mock.patch("requests.post", return_value=sheet_ok_response()):
+        result = asyncio.run(run_benchmark(args.users, args.concurrency, args.alloc_users))
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(result, handle, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
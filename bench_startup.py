@@ -0,0 +1,116 @@
+"""
+Startup Benchmark - import time and time-to-first-reply of a fresh bot process
+
+Every deploy restarts the container, and users who write during the restart
+wait for the new process. This measures, over several fresh interpreters:
+- import: `import bot` in a new Python process
+- first reply: from spawning `python bot.py` against the fake Bot API
+  (fake_telegram.py) with a /start already queued until the bot sends its
+  greeting - interpreter start, imports, getMe, first getUpdates and the
+  /start handler together
+
+Usage:
+    python bench_startup.py --repeats 5 [--json startup.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List
+
+from bench_handlers import percentile
+from fake_telegram import FakeTelegramServer
+from load_generator import spawn_bot
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+USER_ID = 424242
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import bot; print(time.perf_counter() - started)"
+
+
+def measure_import() -> float:
+    """Milliseconds `import bot` takes in a fresh interpreter."""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+        env=dict(os.environ, BOT_TOKEN=""),
+    ).stdout
+    return float(output.strip().splitlines()[-1]) * 1000
+
+
+def start_update() -> Dict:
+    return {
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": USER_ID, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Startup"},
+            "text": "/start startup",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        }
+    }
+
+
+def measure_first_reply(timeout: float = 60.0) -> float:
+    """Milliseconds from spawning bot.py to its reply to a queued /start."""
+    replied = threading.Event()
+    reply_time: List[float] = []
+
+    def on_call(call: Dict) -> None:
+        if call["method"] == "sendMessage" and int(call["params"].get("chat_id", 0)) == USER_ID and not replied.is_set():
+            reply_time.append(time.perf_counter())
+            replied.set()
+
+    server = FakeTelegramServer()
+    server.api.on_call = on_call
+    server.start()
+    server.api.push_update(start_update())
+    started = time.perf_counter()
+    process = spawn_bot(server.url, "")
+    try:
+        if not replied.wait(timeout):
+            raise RuntimeError(f"No reply to /start within {timeout:.0f} s")
+        return (reply_time[0] - started) * 1000
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        server.shutdown()
+        server.server_close()
+
+
+def run_startup_benchmark(repeats: int) -> Dict[str, List[float]]:
+    return {
+        "import_ms": [measure_import() for _ in range(repeats)],
+        "first_reply_ms": [measure_first_reply() for _ in range(repeats)],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import time and time-to-first-reply of bot.py")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="Write raw samples to this file")
+    args = parser.parse_args()
+
+    samples = run_startup_benchmark(args.repeats)
+    print("=" * 60)
+    print(f"STARTUP BENCHMARK ({args.repeats} fresh processes)")
+    print("=" * 60)
+    for name, values in samples.items():
+        print(f"{name:<16} p50 {percentile(values, 0.5):>8.1f} ms   max {max(values):>8.1f} ms")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(samples, handle, indent=2)
+        print(f"Samples saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
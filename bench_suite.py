@@ -0,0 +1,328 @@
+"""
+Benchmark Suite - versioned baselines and regression comparison
+
+Runs the hermetic benchmarks several times and stores their raw samples:
+- handler latency per conversation state and updates/sec (bench_handlers.py)
+- sheet sync throughput: sync_progress() replicated into the Apps Script stand-in
+- memory retained per finished session (user_data + conversation state)
+- cold start: `import bot` and time to the first reply of a fresh process (bench_startup.py)
+
+`compare` bootstraps 95% confidence intervals for the change of each
+metric's median, so a regression is reported only when the whole interval
+is worse than the threshold - not because one run was noisy. The baseline
+records hashes of bot.py and GAS/GET.js, so the report shows what changed.
+
+Usage:
+    python bench_suite.py run --output bench_current.json
+    python bench_suite.py run --output benchmarks/baseline.json      # refresh the baseline
+    python bench_suite.py compare benchmarks/baseline.json bench_current.json [--markdown]
+"""
+
+import argparse
+import asyncio
+import gc
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+from unittest import mock
+
+import numpy as np
+
+import bot
+from bench_handlers import (
+    BENCH_TOKEN,
+    StubTelegramRequest,
+    UpdateFactory,
+    funnel_script,
+    run_benchmark,
+    sheet_ok_response,
+)
+from bench_startup import measure_first_reply, measure_import
+from gas_standin import AppsScriptServer, AppsScriptStandIn
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+SCHEMA_VERSION = 1
+
+# Source files whose changes the baseline is meant to catch
+TRACKED_SOURCES = ("bot.py", "lead_registry.py", "GAS/GET.js", "gas_standin.py")
+
+# Samples kept per metric (evenly thinned) to keep baseline files small
+MAX_STORED_SAMPLES = 500
+
+DEFAULT_THRESHOLD = 0.10
+BOOTSTRAP_RESAMPLES = 2000
+CONFIDENCE = 0.95
+
+
+def _metric(unit: str, direction: str, samples: List[float]) -> Dict:
+    samples = [round(float(value), 4) for value in samples]
+    if len(samples) > MAX_STORED_SAMPLES:
+        step = len(samples) / MAX_STORED_SAMPLES
+        samples = [samples[int(i * step)] for i in range(MAX_STORED_SAMPLES)]
+    return {"unit": unit, "direction": direction, "samples": samples}
+
+
+def source_hashes() -> Dict[str, Optional[str]]:
+    hashes = {}
+    for name in TRACKED_SOURCES:
+        path = os.path.join(ROOT, name)
+        if os.path.exists(path):
+            with open(path, "rb") as handle:
+                hashes[name] = hashlib.sha256(handle.read()).hexdigest()[:12]
+        else:
+            hashes[name] = None
+    return hashes
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# ---- benchmarks ----
+
+
+def bench_sync_throughput(users: int, syncs_per_user: int = 3, timeout: float = 60.0) -> float:
+    """Syncs per second recorded by sync_progress() and replicated into the stand-in."""
+    server = AppsScriptServer(script=AppsScriptStandIn())
+    server.start()
+    try:
+        with mock.patch.object(bot, "SHEET_SYNC_URL", server.url):
+            bot.close_lead_registry()
+            started = time.perf_counter()
+            for user_id in range(1, users + 1):
+                user_data = {"tg_user_id": user_id, "tag": "bench"}
+                for step in range(syncs_per_user):
+                    user_data["budget"] = 1_000_000 + step
+                    bot.sync_progress(user_data)
+            if not bot.sheet_replicator.wait_idle(timeout):
+                raise RuntimeError("Sheet stand-in did not receive all syncs in time")
+            elapsed = time.perf_counter() - started
+            bot.close_lead_registry()
+    finally:
+        server.shutdown()
+        server.server_close()
+    # Changes of a lead queued together reach the sheet as one request
+    return users * syncs_per_user / elapsed
+
+
+async def _session_memory(users: int) -> float:
+    """Traced memory retained per completed funnel, KiB."""
+    application = bot.build_application(BENCH_TOKEN, request=StubTelegramRequest())
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    scripts = [funnel_script(factory, number) for number in range(users)]
+    # Warm-up funnel so lazy imports and caches are not counted as sessions
+    for _, update in funnel_script(factory, users + 1):
+        await application.process_update(update)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for script in scripts:
+        for _, update in script:
+            await application.process_update(update)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    await application.shutdown()
+    return retained / users / 1024
+
+
+def run_suite(users: int = 300, repeats: int = 5, sync_users: int = 100) -> Dict:
+    """Run every benchmark `repeats` times and collect samples per metric."""
+    metrics: Dict[str, Dict] = {}
+    latency: Dict[str, List[float]] = {}
+    updates_per_sec, sync_rates, session_kib, import_ms, first_reply_ms = [], [], [], [], []
+
+    bot.AI_PROGRESS_STEP_SECONDS = 0
+    for _ in range(repeats):
+        with mock.patch("requests.post", return_value=sheet_ok_response()):
+            result = asyncio.run(run_benchmark(users, concurrency=1, alloc_users=0))
+            session_kib.append(asyncio.run(_session_memory(max(users // 3, 10))))
+        for state, samples in result["samples_ms"].items():
+            latency.setdefault(state, []).extend(samples)
+        updates_per_sec.append(result["updates_per_sec"])
+        sync_rates.append(bench_sync_throughput(sync_users))
+        import_ms.append(measure_import())
+        first_reply_ms.append(measure_first_reply())
+
+    for state, samples in latency.items():
+        metrics[f"handler.{state}.latency_ms"] = _metric("ms", "lower", samples)
+    metrics["handler.updates_per_sec"] = _metric("updates/s", "higher", updates_per_sec)
+    metrics["sync.syncs_per_sec"] = _metric("syncs/s", "higher", sync_rates)
+    metrics["memory.session_kib"] = _metric("KiB", "lower", session_kib)
+    metrics["startup.import_ms"] = _metric("ms", "lower", import_ms)
+    metrics["startup.first_reply_ms"] = _metric("ms", "lower", first_reply_ms)
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "sources": source_hashes(),
+        "environment": {"python": platform.python_version(), "machine": platform.machine(), "platform": platform.system()},
+        "parameters": {"users": users, "repeats": repeats, "sync_users": sync_users},
+        "metrics": metrics,
+    }
+
+
+def save_results(result: Dict, path: str) -> None:
+    """Write results with one line per metric, so baseline diffs stay readable."""
+    metrics = result["metrics"]
+    header = json.dumps({key: value for key, value in result.items() if key != "metrics"}, ensure_ascii=False, indent=1)
+    lines = [f"  {json.dumps(name)}: {json.dumps(metrics[name])}" for name in sorted(metrics)]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write(header[:-2] + ',\n "metrics": {\n' + ",\n".join(lines) + "\n }\n}\n")
+
+
+# ---- comparison ----
+
+
+def bootstrap_change(baseline: List[float], current: List[float], seed: int = 0) -> Dict:
+    """
+    Relative change of the median with a bootstrap confidence interval.
+
+    Returns:
+        dict: baseline, current (medians), change, ci_low, ci_high (fractions, 0.1 = +10%)
+    """
+    base = np.asarray(baseline, dtype=np.float64)
+    cur = np.asarray(current, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    base_medians = np.median(base[rng.integers(0, len(base), (BOOTSTRAP_RESAMPLES, len(base)))], axis=1)
+    cur_medians = np.median(cur[rng.integers(0, len(cur), (BOOTSTRAP_RESAMPLES, len(cur)))], axis=1)
+    ratios = cur_medians / np.maximum(base_medians, 1e-12)
+    tail = (1 - CONFIDENCE) / 2 * 100
+    low, high = np.percentile(ratios, [tail, 100 - tail])
+    base_median, cur_median = float(np.median(base)), float(np.median(cur))
+    return {
+        "baseline": base_median,
+        "current": cur_median,
+        "change": cur_median / base_median - 1 if base_median else 0.0,
+        "ci_low": float(low) - 1,
+        "ci_high": float(high) - 1,
+    }
+
+
+def classify(change: Dict, direction: str, threshold: float) -> str:
+    """regression / improvement only when the whole interval is past the threshold."""
+    low, high = change["ci_low"], change["ci_high"]
+    if direction == "higher":
+        low, high = -high, -low
+    if low > threshold:
+        return "regression"
+    if high < -threshold:
+        return "improvement"
+    return "ok"
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    rows = []
+    names = sorted(set(baseline["metrics"]) | set(current["metrics"]))
+    for name in names:
+        base, cur = baseline["metrics"].get(name), current["metrics"].get(name)
+        if base is None or cur is None:
+            rows.append({"metric": name, "status": "new" if base is None else "missing"})
+            continue
+        change = bootstrap_change(base["samples"], cur["samples"])
+        rows.append(
+            {
+                "metric": name,
+                "unit": cur["unit"],
+                "direction": cur["direction"],
+                **change,
+                "status": classify(change, cur["direction"], threshold),
+            }
+        )
+    return rows
+
+
+def render_report(baseline: Dict, current: Dict, rows: List[Dict], threshold: float, markdown: bool = False) -> str:
+    changed_sources = [
+        name for name, digest in current.get("sources", {}).items() if baseline.get("sources", {}).get(name) != digest
+    ]
+    header = [
+        f"Baseline: {baseline.get('created_at')} commit {baseline.get('commit')}",
+        f"Current:  {current.get('created_at')} commit {current.get('commit')}",
+        f"Changed sources: {', '.join(changed_sources) or 'none'}",
+        f"Regression = whole {int(CONFIDENCE * 100)}% CI of the median change worse than {threshold:.0%}",
+        "",
+    ]
+    columns = ["metric", "baseline", "current", "change", f"{int(CONFIDENCE * 100)}% CI", "status"]
+    table = []
+    for row in rows:
+        if "change" not in row:
+            table.append([row["metric"], "-", "-", "-", "-", row["status"]])
+            continue
+        mark = {"regression": "REGRESSION", "improvement": "improved"}.get(row["status"], "ok")
+        table.append(
+            [
+                row["metric"],
+                f"{row['baseline']:.3f} {row['unit']}",
+                f"{row['current']:.3f} {row['unit']}",
+                f"{row['change']:+.1%}",
+                f"[{row['ci_low']:+.1%}, {row['ci_high']:+.1%}]",
+                mark,
+            ]
+        )
+
+    if markdown:
+        lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+        lines += ["| " + " | ".join(cells) + " |" for cells in table]
+    else:
+        widths = [max(len(str(cells[i])) for cells in [columns] + table) for i in range(len(columns))]
+        lines = ["  ".join(str(cell).ljust(width) for cell, width in zip(columns, widths))]
+        lines.append("  ".join("-" * width for width in widths))
+        lines += ["  ".join(str(cell).ljust(width) for cell, width in zip(cells, widths)) for cells in table]
+
+    regressions = sum(row["status"] == "regression" for row in rows)
+    footer = ["", f"{regressions} regression(s)" if regressions else "No significant regressions"]
+    return "\n".join(header + lines + footer) + "\n"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark baselines and regression comparison")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmark suite and write results")
+    run_parser.add_argument("--output", default=BASELINE_PATH)
+    run_parser.add_argument("--users", type=int, default=300)
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--sync-users", type=int, default=100)
+
+    compare_parser = commands.add_parser("compare", help="Compare results against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compare_parser.add_argument("--markdown", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        bot.logging.getLogger().setLevel(bot.logging.WARNING)
+        result = run_suite(args.users, args.repeats, args.sync_users)
+        save_results(result, args.output)
+        print(f"Results saved to {args.output} ({len(result['metrics'])} metrics)")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as handle:
+        baseline = json.load(handle)
+    with open(args.current, encoding="utf-8") as handle:
+        current = json.load(handle)
+    rows = compare(baseline, current, args.threshold)
+    print(render_report(baseline, current, rows, args.threshold, args.markdown), end="")
+    return 1 if any(row["status"] == "regression" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
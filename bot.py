@@ -1,12 +1,16 @@
 ﻿import asyncio
+import functools
+import html
 import json
 import logging
 import os
 import re
+import signal
+import sys
 import threading
+import time
 from typing import Dict, List, Optional
 
-import requests
 from dotenv import load_dotenv
 from telegram import (
     InlineKeyboardButton,
@@ -19,24 +23,51 @@ from telegram import (
 )
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CallbackQueryHandler,
     CommandHandler,
     ConversationHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
 )
+from telegram.request import BaseRequest, HTTPXRequest
+
+from car_catalog import get_catalog
+from catalogs import CatalogFile, Catalogs, model_keyboard, watch_catalogs
+from diagnostics import MemorySnapshots, SamplingProfiler
+from flood_control import StartThrottle
+from funnel_stats import FunnelCounters, snapshot_periodically
+from funnel_steps import STEP_CODES
+from health import HealthMonitor, InFlightCounter, LoopWatchdog
+from instrumentation import Instrumentation
+from reply_outbox import ReplyOutbox
+from sheet_export import SheetSnapshot, refresh_periodically
+from tenants import SharedRequest, Tenant, current_tenant, load_tenants
+from update_processor import PerUserUpdateProcessor
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
 # States
 PHONE, BRAND, MODEL, CITY, YEAR_TO, BUDGET, MANAGER, CLIENT_NAME = range(8)
+STATE_NAMES = {
+    PHONE: "PHONE",
+    BRAND: "BRAND",
+    MODEL: "MODEL",
+    CITY: "CITY",
+    YEAR_TO: "YEAR_TO",
+    BUDGET: "BUDGET",
+    MANAGER: "MANAGER",
+    CLIENT_NAME: "CLIENT_NAME",
+}
 
 PHONE_SHARE_BUTTON_TEXT = "Передать номер"
 PROCESS_INFO_BUTTON_TEXT = "Как мы работаем"
 
-# Popular options for 2025 market reality based on spreadsheet (2015-2025)
+# Popular options for 2025 market reality based on spreadsheet (2015-2025).
+# Built-in catalogs: CATALOGS_PATH overrides them without a restart, see catalogs.py
 CAR_BRANDS = [
     ["Lada", "Haval", "Chery"],
     ["Geely", "Changan"],
@@ -47,6 +78,9 @@ CITIES = [
     ["Екатеринбург", "Новосибирск", "Краснодар"],
 ]
 
+# Supported hubs: typed towns are mapped to the nearest of these
+CITY_HUBS = tuple(city for row in CITIES for city in row)
+
 POPULAR_MODELS = {
     "Lada": ["Granta", "Vesta", "Niva Travel"],
     "Haval": ["Jolion", "M6", "Dargo"],
@@ -71,8 +105,332 @@ SHEET_SYNC_URL = os.getenv(
     "https://script.google.com/macros/s/AKfycbxkA7StolIG29wpoe26bM2Q1ZOasmbvZbQqxHJhoTWaUNbYG5HlTekVlviTaCab4ce2/exec",
 )
 
+# Bot API server (empty = api.telegram.org); load tests point it at fake_telegram.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+
 LAST_SYNC_KEY = "_last_synced_payload"
 
+# Local lead database, the source of truth replicated to the sheet (empty = in memory only)
+LEADS_DB_PATH = os.getenv("LEADS_DB_PATH", "")
+# Concurrent requests replicating changed leads to the sheet
+SHEET_SYNC_WORKERS = int(os.getenv("SHEET_SYNC_WORKERS", "4"))
+# On SIGTERM/SIGINT, queued leads are replicated for at most this long before the bot exits;
+# the rest stays in LEADS_DB_PATH, or is saved to UNSENT_LEADS_PATH when leads are kept in memory
+# (restored on the next start; empty = dropped)
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "20"))
+UNSENT_LEADS_PATH = os.getenv("UNSENT_LEADS_PATH", "unsent_leads.sqlite3")
+
+# Local copy of the lead sheet for recognizing returning users, refreshed through the
+# script's export mode (0 = disabled); saved to SHEET_SNAPSHOT_PATH if set
+SHEET_SNAPSHOT_SECONDS = float(os.getenv("SHEET_SNAPSHOT_SECONDS", "600"))
+SHEET_SNAPSHOT_PATH = os.getenv("SHEET_SNAPSHOT_PATH", "")
+SHEET_EXPORT_TOKEN = os.getenv("SHEET_EXPORT_TOKEN", "")
+
+# JSON file of several bots hosted in this process (see tenants.py); BOT_TOKEN is then unused
+TENANTS_PATH = os.getenv("TENANTS_PATH", "")
+# JSON file with car_brands, cities, popular_models and default_model_suggestions (empty = the
+# constants above); checked every CATALOGS_CHECK_SECONDS and applied without a restart
+CATALOGS_PATH = os.getenv("CATALOGS_PATH", "")
+CATALOGS_CHECK_SECONDS = float(os.getenv("CATALOGS_CHECK_SECONDS", "5"))
+# bot_data keys of the Tenant an Application serves and of its /start throttle
+TENANT_KEY = "tenant"
+THROTTLE_KEY = "start_throttle"
+
+# Previous request offered to a returning user on /start, kept until they choose
+PREFILL_KEY = "_previous_request"
+PREFILL_CONTINUE = "prefill_continue"
+PREFILL_RESTART = "prefill_restart"
+# user_data key -> lead fields it is read from (registry payload, then sheet column)
+PREFILL_FIELDS = {
+    "phone": ("phone", "phone_number"),
+    "brand": ("brand",),
+    "model": ("model",),
+    "city": ("city",),
+    "city_hub": ("city_hub",),
+    "year_to": ("year",),
+    "budget": ("budget",),
+    "client_name": ("client_name",),
+}
+PREFILL_KEYBOARD = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("Продолжить с прошлой заявкой", callback_data=PREFILL_CONTINUE)],
+        [InlineKeyboardButton("Заполнить заново", callback_data=PREFILL_RESTART)],
+    ]
+)
+
+GREETING_TEXT = (
+    "Добро пожаловать в бота автоподбора!\n\n"
+    "Отправьте номер телефона РФ цифрами или нажмите кнопку \"Передать номер\". "
+    "Если хотите узнать, как мы работаем, нажмите \"Как мы работаем\". "
+    "Дальше зададим еще пару вопросов и передадим заявку.\n\n"
+    "Обычно процесс занимает 2-3 минуты\n"
+    "Нужен номер, чтобы связаться и вести заявку\n"
+    "Можно перезапустить диалог в любой момент командой /start"
+)
+
+# Pause between AI progress bar updates (benchmarks set it to 0)
+AI_PROGRESS_STEP_SECONDS = 1.0
+# Unrecognized model text we already asked the user to clarify once
+MODEL_CLARIFY_KEY = "_model_clarify_text"
+
+# Listings for the AI selection step (optional): memory-mapped repository
+# directory maintained by `python listings_store.py`, or a CSV/XLSX dump
+LISTINGS_PATH = os.getenv("LISTINGS_PATH", "")
+
+# Worker processes for listing scoring (0 = score inline, repository directory only)
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", "0"))
+SCORING_MAX_PENDING = int(os.getenv("SCORING_MAX_PENDING", "16"))
+
+# Updates handled at once per bot; one user's updates still run in order (1 = one update at a time)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics, health checks on
+# /health/live and /health/ready (0 = disabled)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Updates processed slower than this are logged with their state and handler
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", "1.0"))
+
+# Local funnel event log for drop-off analytics (`python funnel_events.py report`, empty = disabled)
+FUNNEL_EVENTS_DIR = os.getenv("FUNNEL_EVENTS_DIR", "")
+# Snapshot file of the live /stats counters, restored on startup (empty = counters are not persisted)
+FUNNEL_STATS_PATH = os.getenv("FUNNEL_STATS_PATH", "")
+FUNNEL_STATS_SNAPSHOT_SECONDS = float(os.getenv("FUNNEL_STATS_SNAPSHOT_SECONDS", "60"))
+# Funnel step the user was last moved to (kept in user_data, never synced)
+FUNNEL_STEP_KEY = "_funnel_step"
+
+# /start flood control: token buckets per user and per deeplink tag (burst, refill per minute; 0 = off).
+# Each /start clears the answers and a tagged one is synced at once, so floods are dropped before the handlers
+START_USER_BURST = int(os.getenv("START_USER_BURST", "5"))
+START_USER_PER_MINUTE = float(os.getenv("START_USER_PER_MINUTE", "6"))
+START_TAG_BURST = int(os.getenv("START_TAG_BURST", "300"))
+START_TAG_PER_MINUTE = float(os.getenv("START_TAG_PER_MINUTE", "0"))
+
+# Telegram user ids allowed to run /profile and /memsnap (comma-separated)
+ADMIN_USER_IDS = frozenset(int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip())
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 60
+
+profiler = SamplingProfiler()
+memory_snapshots = MemorySnapshots()
+instrumentation = Instrumentation(slow_update_seconds=SLOW_UPDATE_SECONDS, state_names=STATE_NAMES)
+sheet_syncs_in_flight = InFlightCounter()
+instrumentation.add_gauge(
+    "bot_sheet_sync_in_flight", "Sheet sync requests started and not finished", lambda: sheet_syncs_in_flight.value
+)
+instrumentation.add_gauge(
+    "bot_sheet_sync_pending",
+    "Leads changed locally and not yet replicated to the sheet",
+    lambda: sheet_sync_pending(),
+)
+loop_watchdog = LoopWatchdog(observe_lag=instrumentation.loop_lag_seconds.observe)
+funnel_counters = FunnelCounters()
+funnel_stats_task: Optional[asyncio.Task] = None
+sheet_snapshot = SheetSnapshot()
+sheet_snapshot_task: Optional[asyncio.Task] = None
+catalogs_task: Optional[asyncio.Task] = None
+
+
+# ---- lazily loaded subsystems ----
+# requests, NumPy (listings, gazetteer, event log) and the listings service cost
+# hundreds of milliseconds to import; they are loaded on first use, and warm_up()
+# preloads them in a background thread shortly after the bot starts polling.
+WARM_UP_DELAY_SECONDS = 1.0
+
+car_search_service = None  # GPTCarSearchService, see get_car_search_service()
+funnel_log = None  # FunnelEventLog when FUNNEL_EVENTS_DIR is set, see get_funnel_log()
+lead_registry = None  # LeadRegistry, see get_lead_registry()
+sheet_replicator = None  # SheetReplicator draining the outboxes of all registries
+hosted_tenants: List[Tenant] = []  # bots built by build_application(tenant=...)
+_lead_registry_lock = threading.Lock()
+
+
+def get_car_search_service():
+    """Listings search service, created on first use."""
+    global car_search_service
+    if car_search_service is None:
+        from gpt_service import GPTCarSearchService
+
+        car_search_service = GPTCarSearchService()
+    return car_search_service
+
+
+def get_funnel_log():
+    """Funnel event log, opened on first use; None when FUNNEL_EVENTS_DIR is empty."""
+    global funnel_log
+    if funnel_log is None and FUNNEL_EVENTS_DIR:
+        from funnel_events import FunnelEventLog
+
+        funnel_log = FunnelEventLog(FUNNEL_EVENTS_DIR)
+    return funnel_log
+
+
+def tenant_setting(name: str, default):
+    """Setting of the bot serving the current update: its tenant's value unless unset, else `default`."""
+    tenant = current_tenant.get()
+    value = None if tenant is None else getattr(tenant, name)
+    return default if value is None else value
+
+
+def prepare_catalogs(catalogs: Catalogs) -> None:
+    """Build what reloaded catalogs need before they are swapped in (CatalogFile worker thread)."""
+    hubs = {catalogs.city_hubs} | {tenant.catalogs(catalogs).city_hubs for tenant in hosted_tenants}
+    # Once gazetteers are in use (warm_up() loads the first), new cities get theirs here
+    # instead of stalling the first city answer
+    if "city_gazetteer" in sys.modules:
+        from city_gazetteer import get_gazetteer
+
+        for cities in hubs:
+            get_gazetteer(cities)
+
+
+catalog_file = CatalogFile(
+    CATALOGS_PATH,
+    Catalogs(CAR_BRANDS, CITIES, POPULAR_MODELS, DEFAULT_MODEL_SUGGESTIONS),
+    prepare=prepare_catalogs,
+    resolve_model=lambda brand, model: get_catalog().match_model(brand, model),
+)
+
+
+def current_catalogs() -> Catalogs:
+    """Catalogs of the bot serving the current update: the live defaults with its tenant's own."""
+    catalogs = catalog_file.current
+    tenant = current_tenant.get()
+    return catalogs if tenant is None else tenant.catalogs(catalogs)
+
+
+def get_lead_registry():
+    """Lead registry of the bot serving the current update, see open_lead_registry()."""
+    return open_lead_registry(current_tenant.get())
+
+
+def open_lead_registry(tenant: Optional[Tenant] = None):
+    """Lead registry of `tenant` (None = the BOT_TOKEN bot), opened on first use.
+
+    The first registry starts the sheet replication workers; later ones are
+    drained by the same workers.
+    """
+    global lead_registry, sheet_replicator
+    with _lead_registry_lock:
+        registry = lead_registry if tenant is None else tenant.lead_registry
+        if registry is not None:
+            return registry
+        from lead_registry import LeadRegistry, SheetReplicator
+
+        path = LEADS_DB_PATH if tenant is None else tenant.leads_db_path
+        if not path:
+            setting = "LEADS_DB_PATH" if tenant is None else f"{tenant.name}: leads_db_path"
+            logging.warning("%s is not set: leads are kept in memory only", setting)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        registry = LeadRegistry(path or ":memory:")
+        unsent = unsent_leads_path(tenant)
+        if not path and unsent and os.path.exists(unsent):
+            # Left by the previous run's shutdown; replicated by the workers started below
+            registry.load_copy(unsent)
+            os.remove(unsent)
+            logging.info("Restored %d unsent leads from %s", registry.pending(), unsent)
+        # The BOT_TOKEN bot reads SHEET_SYNC_URL at send time
+        send = send_to_sheet if tenant is None else functools.partial(send_to_sheet, url=tenant.sheet_sync_url)
+        if sheet_replicator is None:
+            sheet_replicator = SheetReplicator(registry, send, workers=SHEET_SYNC_WORKERS)
+            sheet_replicator.start()
+        else:
+            sheet_replicator.add_source(registry, send)
+        if tenant is None:
+            lead_registry = registry
+        else:
+            tenant.lead_registry = registry
+        return registry
+
+
+def open_registries() -> List:
+    """(tenant or None, registry) of the registries opened so far."""
+    owners = [(None, lead_registry)] + [(tenant, tenant.lead_registry) for tenant in hosted_tenants]
+    return [(tenant, registry) for tenant, registry in owners if registry is not None]
+
+
+def sheet_sync_pending() -> int:
+    """Leads of all registries waiting in their outboxes for the sheet."""
+    return sum(registry.pending() for _, registry in open_registries())
+
+
+def unsent_leads_path(tenant: Optional[Tenant] = None) -> str:
+    """File keeping an in-memory registry's unreplicated leads between runs ("" = not kept)."""
+    if not UNSENT_LEADS_PATH or tenant is None:
+        return UNSENT_LEADS_PATH
+    root, extension = os.path.splitext(UNSENT_LEADS_PATH)
+    return f"{root}.{tenant.name}{extension}"
+
+
+def drain_sheet_replication(seconds: float) -> bool:
+    """Shutdown: replicate queued leads for at most `seconds`; True if none are left."""
+    if sheet_replicator is None:
+        return True
+    started = time.monotonic()
+    drained = sheet_replicator.drain(seconds)
+    left = sheet_sync_pending()
+    if drained:
+        logging.info("Sheet replication drained in %.1f s", time.monotonic() - started)
+    else:
+        logging.warning("%d leads not replicated after %.1f s of draining", left, time.monotonic() - started)
+    return drained
+
+
+def close_lead_registry(keep_unsent: bool = False) -> None:
+    """Stop replication and close all registries; queued leads stay in their outboxes.
+
+    With `keep_unsent`, in-memory registries that still have queued leads are
+    saved to unsent_leads_path() first, so the next start replicates them.
+    """
+    global lead_registry, sheet_replicator
+    with _lead_registry_lock:
+        # A send still running after the timeout keeps using the connection, so it is left open
+        stopped = sheet_replicator is None or sheet_replicator.stop()
+        sheet_replicator = None
+        if stopped:
+            for tenant, registry in open_registries():
+                unsent = unsent_leads_path(tenant)
+                if keep_unsent and unsent and registry.path == ":memory:" and registry.pending():
+                    registry.save_copy(unsent)
+                    logging.warning("%d unsent leads saved to %s", registry.pending(), unsent)
+                registry.close()
+        lead_registry = None
+        for tenant in hosted_tenants:
+            tenant.lead_registry = None
+
+
+def city_gazetteer():
+    from city_gazetteer import get_gazetteer
+
+    return get_gazetteer(current_catalogs().city_hubs)
+
+
+def warm_up() -> None:
+    """Import heavy modules and load catalogs ahead of the first user (runs in a thread)."""
+    started = time.perf_counter()
+    import requests  # noqa: F401
+
+    get_car_search_service()
+    get_funnel_log()
+    get_catalog()
+    city_gazetteer()
+    logging.info("Warm-up finished in %.0f ms", (time.perf_counter() - started) * 1000)
+
+
+def last_update_delivery() -> Optional[float]:
+    """Monotonic time of the last successful getUpdates or processed update."""
+    seen = [instrumentation.last_api_success.get("getUpdates"), instrumentation.last_update_at]
+    seen = [moment for moment in seen if moment is not None]
+    return max(seen) if seen else None
+
+
+# The outbox, not the requests in flight (at most SHEET_SYNC_WORKERS), shows whether syncs keep up
+# Each hosted bot polls on its own: one stuck poller makes the process unhealthy
+health_monitor = HealthMonitor(
+    loop_watchdog, last_update_delivery, sheet_sync_pending, deliveries=lambda: dict(instrumentation.deliveries)
+)
+
 
 def get_progress_bar(current_step: int, total_steps: int = 7) -> str:
     """Генерирует текстовый прогресс-бар для отображения этапа заполнения анкеты."""
@@ -183,6 +541,7 @@ def _build_sync_payload(user_data: Dict) -> Dict:
         "brand": user_data.get("brand"),
         "model": user_data.get("model"),
         "city": user_data.get("city"),
+        "city_hub": user_data.get("city_hub"),
         "year": user_data.get("year_to"),
         "budget": user_data.get("budget"),
         "tg_user_id": tg_user_id,
@@ -200,19 +559,57 @@ def _build_sync_payload(user_data: Dict) -> Dict:
     return filtered
 
 
+def send_to_sheet(lead: Dict, url: Optional[str] = None) -> None:
+    """Send the current state of one lead to the Apps Script (SheetReplicator threads).
+
+    Args:
+        lead: Sync payload
+        url: Web app of a hosted tenant's sheet (None = SHEET_SYNC_URL)
+
+    Raises:
+        RuntimeError: the sheet URL is not set, or the script answered with an error
+        requests.RequestException: request failed or got an HTTP error status
+    """
+    import requests
+
+    url = SHEET_SYNC_URL if url is None else url
+    if not url:
+        raise RuntimeError("SHEET_SYNC_URL is not set")
+    sheet_syncs_in_flight.add(1)
+    started = time.perf_counter()
+    try:
+        # Отправляем POST запрос с JSON в теле для корректной передачи кириллицы
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+        response = requests.post(
+            url,
+            data=json.dumps(lead, ensure_ascii=False).encode('utf-8'),
+            headers=headers,
+            timeout=10
+        )
+    except requests.RequestException:
+        instrumentation.observe_sheet_sync(time.perf_counter() - started, "error")
+        raise
+    finally:
+        sheet_syncs_in_flight.add(-1)
+    instrumentation.observe_sheet_sync(time.perf_counter() - started, str(response.status_code))
+    response.raise_for_status()
+    # Apps Script answers 200 also when processData failed: only "success" means the row was written
+    answer = response.json()
+    if answer.get("status") != "success":
+        raise RuntimeError(f"Sheet sync failed: {answer.get('message', answer)}")
+    logging.info("Synced to sheet: %s", lead)
+
+
 def sync_progress(user_data: Dict) -> None:
-    """Send incremental updates to Google Sheet in background (non-blocking).
+    """Record incremental updates in the lead registry (non-blocking).
 
-    This function now runs synchronously in a background task to avoid blocking
-    the bot's responses to users. The actual request is made without awaiting.
+    The lead is deduplicated and merged locally; the change reaches the Google
+    Sheet asynchronously through the registry outbox (see lead_registry.py).
     """
-    logging.info(f"sync_progress called. SHEET_SYNC_URL={bool(SHEET_SYNC_URL)}, phone={user_data.get('phone')}, tg_user_id={user_data.get('tg_user_id')}")
+    sheet_url = tenant_setting("sheet_sync_url", SHEET_SYNC_URL)
+    logging.info(f"sync_progress called. SHEET_SYNC_URL={bool(sheet_url)}, phone={user_data.get('phone')}, tg_user_id={user_data.get('tg_user_id')}")
 
     # Require either phone or tg_user_id to identify the user
-    if not SHEET_SYNC_URL:
-        logging.warning("Sync skipped: missing SHEET_SYNC_URL")
-        return
-
     if not user_data.get("phone") and not user_data.get("tg_user_id"):
         logging.warning("Sync skipped: missing both phone and tg_user_id")
         return
@@ -231,28 +628,21 @@ def sync_progress(user_data: Dict) -> None:
     # Store a shallow copy so further modifications don't mutate cached payload
     user_data[LAST_SYNC_KEY] = payload.copy()
 
-    # Launch sync in background thread without blocking
-    def _do_request() -> None:
-        try:
-            # Отправляем POST запрос с JSON в теле для корректной передачи кириллицы
-            headers = {'Content-Type': 'application/json; charset=utf-8'}
-            response = requests.post(
-                SHEET_SYNC_URL,
-                data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
-                headers=headers,
-                timeout=10
-            )
-            logging.info("Synced to sheet: %s", payload)
-        except requests.RequestException as exc:
-            logging.warning("Failed to sync with sheet: %s", exc)
-
-    # Run in background thread without awaiting
-    thread = threading.Thread(target=_do_request, daemon=True)
-    thread.start()
+    try:
+        # Without a sheet the lead is still recorded, just not queued for replication
+        result = get_lead_registry().upsert(payload, replicate=bool(sheet_url))
+    except ValueError as exc:
+        logging.warning("Sync skipped: %s", exc)
+        return
+    if result is None:
+        logging.info("Sync skipped: lead unchanged")
+        return
+    if sheet_url and sheet_replicator is not None:
+        sheet_replicator.wake()
 
 
-async def send_summary_message(message, user_data: Dict) -> None:
-    """Send summary of collected data to the user."""
+def summary_text(user_data: Dict) -> str:
+    """Summary of collected data for the user."""
     phone = user_data.get("phone", "-")
     client_name = user_data.get("client_name", "-")
     login = user_data.get("client_login") or user_data.get("tg_username") or "-"
@@ -278,14 +668,45 @@ async def send_summary_message(message, user_data: Dict) -> None:
         f"- Бюджет: {budget_value}\n\n"
 
     )
-    await message.reply_text(summary)
+    return summary
+
+async def send_listing_matches(message, user_data: Dict) -> None:
+    """Send the best matching listings from the local store, if any."""
+    found = await get_car_search_service().search_cars(user_data)
+    if not found.get("results"):
+        return
+
+    lines = [f"🔎 Подходящих объявлений: {found['total_matches']}. Лучшие варианты:"]
+    for number, car in enumerate(found["results"], start=1):
+        lines.append(
+            f"{number}. {car['brand']} {car['model']} {car['year']}, "
+            f"{car['mileage']:,} км, {car['price']:,} ₽, {car['city']}"
+        )
+    await message.reply_text("\n".join(lines))
+
+
+def model_suggestions(brand: str, typed: Optional[str] = None) -> List[str]:
+    """Models to offer: closest catalog matches for typed text or the brand's popular models."""
+    catalog = get_catalog()
+    if typed:
+        return catalog.suggest_models(brand, typed, limit=4)
+    catalogs = current_catalogs()
+    return (
+        catalogs.popular_models.get(brand)
+        or catalog.suggest_models(brand, limit=4)
+        or catalogs.default_model_suggestions
+    )
 
-def build_model_keyboard(brand: str) -> ReplyKeyboardMarkup:
-    """Return keyboard with the most popular models for the selected brand."""
-    models: List[str] = POPULAR_MODELS.get(brand, DEFAULT_MODEL_SUGGESTIONS)
-    rows = [models[i : i + 2] for i in range(0, len(models), 2)]
-    rows.append(["Другая модель"])
-    return ReplyKeyboardMarkup(rows, resize_keyboard=True, one_time_keyboard=True)
+
+def build_model_keyboard(brand: str, typed: Optional[str] = None) -> ReplyKeyboardMarkup:
+    """Return keyboard with the most popular (or best matching) models for the selected brand."""
+    if not typed:
+        # Popular models of the catalogs have their keyboards built in advance
+        keyboard = current_catalogs().model_keyboards.get(brand)
+        if keyboard is not None:
+            return keyboard
+    models: List[str] = model_suggestions(brand, typed) if typed else []
+    return model_keyboard(models + model_suggestions(brand))
 
 
 async def prompt_brand_selection(message, phone: str) -> int:
@@ -300,22 +721,23 @@ async def prompt_brand_selection(message, phone: str) -> int:
     await message.reply_text(
         message_text,
         parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup(CAR_BRANDS, resize_keyboard=True, one_time_keyboard=True),
+        reply_markup=current_catalogs().brand_keyboard,
     )
     return BRAND
 
 
-async def finalize_manager_handoff(message, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Send final confirmation when manager takes over."""
+def finalize_manager_handoff(message, context: ContextTypes.DEFAULT_TYPE, outbox: ReplyOutbox) -> int:
+    """Queue the final confirmation and the summary (one message) when manager takes over."""
     maybe_set_client_name_from_profile(context.user_data)
     sync_progress(context.user_data)
 
     client_name = context.user_data.get("client_name") or context.user_data.get("tg_username") or "Коллега"
-    await message.reply_text(
+    outbox.reply(
+        message,
         f"{client_name}, передаю заявку менеджеру. Он свяжется в ближайшее время.",
         reply_markup=ReplyKeyboardRemove(),
     )
-    await send_summary_message(message, context.user_data)
+    outbox.reply(message, summary_text(context.user_data))
     return ConversationHandler.END
 
 
@@ -348,11 +770,11 @@ async def show_ai_selection_progress(message: Message, total_steps: int = 5) ->
         progress_message = await message.reply_text(f"{header}\n{build_loading_bar(0, total_steps)}")
     except Exception as exc:
         logging.warning("Failed to send AI progress message: %s", exc)
-        await asyncio.sleep(total_steps)
+        await asyncio.sleep(total_steps * AI_PROGRESS_STEP_SECONDS)
         return
 
     for step in range(1, total_steps + 1):
-        await asyncio.sleep(1)
+        await asyncio.sleep(AI_PROGRESS_STEP_SECONDS)
         bar = build_loading_bar(step, total_steps)
         try:
             await progress_message.edit_text(f"{header}\n{bar}")
@@ -370,6 +792,71 @@ async def show_ai_selection_progress(message: Message, total_steps: int = 5) ->
         logging.warning("Failed to finalize AI progress message: %s", exc)
 
 
+def find_previous_request(tg_user_id) -> Optional[Dict]:
+    """Answers of the user's last request (lead registry first, then the sheet snapshot).
+
+    Returns None unless at least the phone and the brand are known.
+    """
+    if not tg_user_id:
+        return None
+    snapshot = tenant_setting("sheet_snapshot", sheet_snapshot)
+    lead = get_lead_registry().get(tg_user_id=tg_user_id) or snapshot.get(tg_user_id)
+    if not lead:
+        return None
+
+    previous = {}
+    for key, fields in PREFILL_FIELDS.items():
+        value = next((lead[field] for field in fields if lead.get(field) not in (None, "")), None)
+        if value is None:
+            continue
+        if key == "phone":
+            value = normalize_phone_number(str(value))
+        elif key in ("year_to", "budget"):
+            # Sheet cells come back as numbers or strings
+            try:
+                value = int(float(value))
+            except (TypeError, ValueError):
+                continue
+        else:
+            value = str(value)
+        if value:
+            previous[key] = value
+    return previous if previous.get("phone") and previous.get("brand") else None
+
+
+def format_previous_request(previous: Dict) -> str:
+    """Offer to continue with the previous request."""
+    budget = previous.get("budget")
+    lines = [
+        f"- Телефон: {previous['phone']}",
+        f"- Марка: {previous['brand']}",
+        f"- Модель: {previous.get('model', '-')}",
+        f"- Город: {previous.get('city', '-')}",
+        f"- Максимальный год выпуска: {previous.get('year_to', '-')}",
+        f"- Бюджет: {f'{budget:,} ₽' if budget else '-'}",
+    ]
+    return (
+        "С возвращением! В прошлый раз вы оставили заявку:\n\n"
+        + "\n".join(lines)
+        + "\n\nПродолжим с ней или заполним заново?"
+    )
+
+
+async def resume_request(message, user_data: Dict) -> int:
+    """Ask the first question the prefilled request has no answer to."""
+    if not user_data.get("brand"):
+        return await prompt_brand_selection(message, user_data["phone"])
+    if not user_data.get("model"):
+        return await prompt_model_selection(message, user_data["brand"])
+    if not user_data.get("city"):
+        return await prompt_city_selection(message)
+    if not user_data.get("year_to"):
+        return await prompt_year_selection(message)
+    if not user_data.get("budget"):
+        return await prompt_budget(message)
+    return await present_selection(message, user_data)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start conversation. Tag is expected via deeplink parameter."""
     context.user_data.clear()
@@ -382,30 +869,55 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         if len(parts) > 1:
             raw_argument = parts[1]
 
+    # Looked up before the tag sync below creates a lead for a new user
+    previous = find_previous_request(context.user_data.get("tg_user_id"))
+
     # Save tag if present
     if raw_argument:
         context.user_data["tag"] = raw_argument
         # Write tag to Google Sheets immediately (incremental sync)
         sync_progress(context.user_data)
 
-    greeting = (
-        "Добро пожаловать в бота автоподбора!\n\n"
-        "Отправьте номер телефона РФ цифрами или нажмите кнопку \"Передать номер\". "
-        "Если хотите узнать, как мы работаем, нажмите \"Как мы работаем\". "
-        "Дальше зададим еще пару вопросов и передадим заявку.\n\n"
-        "Обычно процесс занимает 2-3 минуты\n"
-        "Нужен номер, чтобы связаться и вести заявку\n"
-        "Можно перезапустить диалог в любой момент командой /start"
-    )
+    if previous:
+        context.user_data[PREFILL_KEY] = previous
+        await update.message.reply_text(
+            format_previous_request(previous),
+            reply_markup=PREFILL_KEYBOARD,
+        )
+        return PHONE
 
     await update.message.reply_text(
-        greeting,
+        tenant_setting("greeting", GREETING_TEXT),
         parse_mode='HTML',
         reply_markup=build_phone_keyboard(include_process_info=True),
     )
     return PHONE
 
 
+async def handle_prefill_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Continue a returning user's previous request or start the questions over."""
+    query = update.callback_query
+    async with ReplyOutbox() as outbox:
+        # Overlap with the next question instead of delaying it
+        outbox.start(query.answer())
+        outbox.start(query.edit_message_reply_markup(reply_markup=None))
+
+        previous = context.user_data.pop(PREFILL_KEY, None)
+        if query.data == PREFILL_CONTINUE and previous:
+            context.user_data.update(previous)
+            # One sync for the whole request; nothing is sent if the lead is unchanged
+            sync_progress(context.user_data)
+            return await resume_request(query.message, context.user_data)
+
+        outbox.reply(
+            query.message,
+            tenant_setting("greeting", GREETING_TEXT),
+            parse_mode='HTML',
+            reply_markup=build_phone_keyboard(include_process_info=True),
+        )
+        return PHONE
+
+
 async def phone_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Process phone number from contact share."""
     contact = update.message.contact
@@ -481,7 +993,8 @@ async def manager_consent_received(update: Update, context: ContextTypes.DEFAULT
         context.user_data["manager"] = "true"
         maybe_set_client_name_from_profile(context.user_data)
         if context.user_data.get("client_name"):
-            return await finalize_manager_handoff(update.message, context)
+            async with ReplyOutbox() as outbox:
+                return finalize_manager_handoff(update.message, context, outbox)
         sync_progress(context.user_data)
         await update.message.reply_text(
             "Передаю контакт менеджеру - он скоро свяжется. Как к вам обращаться?",
@@ -492,15 +1005,15 @@ async def manager_consent_received(update: Update, context: ContextTypes.DEFAULT
     if normalized.startswith("нет") or "пока" in normalized:
         context.user_data["manager"] = "false"
         sync_progress(context.user_data)
-        await update.message.reply_text(
-            "Спасибо за обратную связь. Заявка остаётся активной — вы сможете передать её менеджеру в любой момент.",
-            reply_markup=ReplyKeyboardRemove(),
-        )
-        await update.message.reply_text(
-            "Как только будете готовы, нажмите кнопку ниже.",
-            reply_markup=MANAGER_FOLLOWUP_BUTTON,
-        )
-        await send_summary_message(update.message, context.user_data)
+        # Thanks and summary go as one message; the button comes last, right above the input
+        async with ReplyOutbox() as outbox:
+            outbox.reply(
+                update.message,
+                "Спасибо за обратную связь. Заявка остаётся активной — вы сможете передать её менеджеру в любой момент.",
+                reply_markup=ReplyKeyboardRemove(),
+            )
+            outbox.reply(update.message, summary_text(context.user_data))
+            outbox.reply(update.message, "Как только будете готовы, нажмите кнопку ниже.", reply_markup=MANAGER_FOLLOWUP_BUTTON)
         return MANAGER
 
     await update.message.reply_text(
@@ -520,35 +1033,46 @@ async def client_name_received(update: Update, context: ContextTypes.DEFAULT_TYP
         return CLIENT_NAME
 
     context.user_data["client_name"] = text
-    return await finalize_manager_handoff(update.message, context)
+    async with ReplyOutbox() as outbox:
+        return finalize_manager_handoff(update.message, context, outbox)
 
 
 async def handle_manager_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle inline button to pass request to manager later."""
     query = update.callback_query
-    await query.answer()
-    await query.edit_message_reply_markup(reply_markup=None)
+    async with ReplyOutbox() as outbox:
+        # Nothing below depends on these, so they overlap with the handoff
+        outbox.start(query.answer())
+        outbox.start(query.edit_message_reply_markup(reply_markup=None))
 
-    context.user_data["manager"] = "true"
-    maybe_set_client_name_from_profile(context.user_data)
-    if context.user_data.get("client_name"):
-        return await finalize_manager_handoff(query.message, context)
+        context.user_data["manager"] = "true"
+        maybe_set_client_name_from_profile(context.user_data)
+        if context.user_data.get("client_name"):
+            return finalize_manager_handoff(query.message, context, outbox)
 
-    sync_progress(context.user_data)
-    await query.message.reply_text(
-        "Передаю контакт менеджеру - он скоро свяжется. Как к вам обращаться?",
-        reply_markup=ReplyKeyboardRemove(),
-    )
-    return CLIENT_NAME
+        sync_progress(context.user_data)
+        outbox.reply(
+            query.message,
+            "Передаю контакт менеджеру - он скоро свяжется. Как к вам обращаться?",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        return CLIENT_NAME
 
 
 async def brand_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Process brand selection and move to model selection."""
-    brand = update.message.text.strip()
+    text = update.message.text.strip()
+    # "хавал джолион" -> Haval, with Jolion offered first on the model keyboard
+    brand, model_hint = get_catalog().parse_brand_model(text)
+    brand = brand or text
     context.user_data["brand"] = brand
-    popular_models = POPULAR_MODELS.get(brand, DEFAULT_MODEL_SUGGESTIONS)
     sync_progress(context.user_data)
+    return await prompt_model_selection(update.message, brand, model_hint)
 
+
+async def prompt_model_selection(message, brand: str, model_hint: Optional[str] = None) -> int:
+    """Ask for the model of the selected brand."""
+    popular_models = model_suggestions(brand)[:3]
     progress = get_progress_bar(3)
     message_text = (
         f"{progress}\n\n"
@@ -557,10 +1081,10 @@ async def brand_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         f"🔝 Самые популярные модели {brand}: {', '.join(popular_models)}"
     )
 
-    await update.message.reply_text(
+    await message.reply_text(
         message_text,
         parse_mode='HTML',
-        reply_markup=build_model_keyboard(brand),
+        reply_markup=build_model_keyboard(brand, model_hint),
     )
     return MODEL
 
@@ -576,9 +1100,30 @@ async def model_received(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("Напиши модель, которую рассматриваешь, вручную.")
         return MODEL
 
-    context.user_data["model"] = text
+    brand = context.user_data.get("brand", "")
+    model = get_catalog().match_model(brand, text)
+    if not model and text in model_suggestions(brand):
+        # A keyboard button is taken as is, also for a model the catalog does not know yet
+        model = text
+    if not model:
+        suggestions = model_suggestions(brand, text)
+        if suggestions and context.user_data.get(MODEL_CLARIFY_KEY) != text:
+            context.user_data[MODEL_CLARIFY_KEY] = text
+            await update.message.reply_text(
+                "Уточни модель: выбери вариант на клавиатуре или отправь название ещё раз, если его нет в списке.",
+                reply_markup=build_model_keyboard(brand, text),
+            )
+            return MODEL
+        model = text
+
+    context.user_data.pop(MODEL_CLARIFY_KEY, None)
+    context.user_data["model"] = model
     sync_progress(context.user_data)
+    return await prompt_city_selection(update.message)
+
 
+async def prompt_city_selection(message) -> int:
+    """Ask for the city."""
     progress = get_progress_bar(4)
     message_text = (
         f"{progress}\n\n"
@@ -587,21 +1132,32 @@ async def model_received(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         "Это поможет найти актуальные предложения в вашем регионе."
     )
 
-    await update.message.reply_text(
+    await message.reply_text(
         message_text,
         parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup(CITIES, resize_keyboard=True, one_time_keyboard=True),
+        reply_markup=current_catalogs().city_keyboard,
     )
     return CITY
 
 
 async def city_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Process city selection and move to year selection."""
-    city = update.message.text.strip()
+    text = update.message.text.strip()
+    # "мск", "Moscow" and "Москва" are stored as one city; towns get their nearest hub
+    locality = city_gazetteer().normalize(text)
+    city = locality["name"] if locality else text
     context.user_data["city"] = city
+    if locality and locality["hub"]:
+        context.user_data["city_hub"] = locality["hub"]
+    else:
+        context.user_data.pop("city_hub", None)
     logging.info(f"City selected: {city}, user_data now: {context.user_data}")
     sync_progress(context.user_data)
+    return await prompt_year_selection(update.message)
+
 
+async def prompt_year_selection(message) -> int:
+    """Ask for the newest acceptable model year."""
     progress = get_progress_bar(5)
     message_text = (
         f"{progress}\n\n"
@@ -610,7 +1166,7 @@ async def city_selected(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         "Например: 2020"
     )
 
-    await update.message.reply_text(
+    await message.reply_text(
         message_text,
         parse_mode='HTML',
         reply_markup=ReplyKeyboardRemove(),
@@ -632,7 +1188,11 @@ async def year_to_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     context.user_data["year_to"] = year_to
     sync_progress(context.user_data)
+    return await prompt_budget(update.message)
+
 
+async def prompt_budget(message) -> int:
+    """Ask for the budget."""
     progress = get_progress_bar(6)
     message_text = (
         f"{progress}\n\n"
@@ -641,7 +1201,7 @@ async def year_to_received(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         "Это позволит подобрать оптимальные варианты. Например: 1500000"
     )
 
-    await update.message.reply_text(
+    await message.reply_text(
         message_text,
         parse_mode='HTML'
     )
@@ -658,7 +1218,11 @@ async def budget_received(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     context.user_data["budget"] = budget
     sync_progress(context.user_data)
+    return await present_selection(update.message, context.user_data)
 
+
+async def present_selection(message, user_data: Dict) -> int:
+    """Show the AI selection progress and matches, then ask about the manager."""
     progress = get_progress_bar(7)
     waiting_message = (
         f"{progress}\n\n"
@@ -666,20 +1230,21 @@ async def budget_received(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         "Ожидайте, наш ИИ-менеджер формирует актуальный список моделей под ваш запрос."
     )
 
-    await update.message.reply_text(
+    await message.reply_text(
         waiting_message,
         parse_mode='HTML',
         reply_markup=ReplyKeyboardRemove(),
     )
 
-    await show_ai_selection_progress(update.message)
+    await show_ai_selection_progress(message)
+    await send_listing_matches(message, user_data)
 
     final_prompt = (
         "Есть актуальные предложения по вашему запросу. "
         "Передать контакт менеджеру, чтобы он связался и рассказал детали лично?"
     )
 
-    await update.message.reply_text(
+    await message.reply_text(
         final_prompt,
         reply_markup=ReplyKeyboardMarkup(MANAGER_DECISION_KEYBOARD, resize_keyboard=True, one_time_keyboard=True),
     )
@@ -695,28 +1260,108 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
-def main() -> None:
-    """Start the bot."""
-    token = os.getenv("BOT_TOKEN")
-    if not token:
-        print("Error: BOT_TOKEN not found in .env file")
+def is_admin(update: Update) -> bool:
+    user = update.effective_user
+    return bool(user and user.id in ADMIN_USER_IDS)
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin: sample all threads for a few seconds and send the hotspots as a file."""
+    if not is_admin(update):
+        return
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = PROFILE_DEFAULT_SECONDS
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    if profiler.running:
+        await update.message.reply_text("Профилирование уже идёт, дождитесь отчёта.")
         return
 
-    application = (
-        Application.builder()
-        .token(token)
-        .connect_timeout(30.0)
-        .read_timeout(30.0)
-        .write_timeout(30.0)
-        .pool_timeout(10.0)
-        .build()
+    await update.message.reply_text(f"Снимаю профиль {seconds} с, бот продолжает работать...")
+    try:
+        report = await asyncio.to_thread(profiler.run, seconds)
+    except RuntimeError:
+        await update.message.reply_text("Профилирование уже идёт, дождитесь отчёта.")
+        return
+    await update.message.reply_document(
+        document=report.encode("utf-8"), filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt"
     )
 
-    conv_handler = ConversationHandler(
+
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin: tracemalloc snapshot with growth since the previous one (`/memsnap stop` ends tracing)."""
+    if not is_admin(update):
+        return
+    if context.args and context.args[0].casefold() == "stop":
+        memory_snapshots.stop()
+        await update.message.reply_text("Трассировка памяти остановлена.")
+        return
+
+    report = await asyncio.to_thread(memory_snapshots.take)
+    await update.message.reply_document(
+        document=report.encode("utf-8"), filename=f"memory-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+    )
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes}:{seconds:02d}" if minutes < 60 else f"{minutes // 60}ч {minutes % 60:02d}м"
+
+
+def format_funnel_stats(report: Dict, tag: Optional[str] = None) -> str:
+    """Text of /stats: all tags in one table, or the steps of one tag."""
+    tags = report["tags"]
+    if tag is not None:
+        counters = tags.get(tag)
+        if counters is None:
+            return f"За {report['day']} по тегу «{html.escape(tag)}» ничего нет."
+        lines = [f"{'шаг':<12}{'вошли':>7}{'сейчас':>7}{'медиана':>9}"]
+        for step, row in counters["steps"].items():
+            lines.append(
+                f"{step:<12}{row['entered']:>7}{row['active']:>7}{format_duration(row['median_seconds']):>9}"
+            )
+        table = html.escape("\n".join(lines))
+        return (
+            f"📊 Тег «{html.escape(tag or '-')}» за {report['day']}\n"
+            f"Старты: {counters['started']}, активны: {counters['active']}, "
+            f"к менеджеру: {counters['conversions']}, отмены: {counters['cancelled']}\n"
+            f"<pre>{table}</pre>"
+        )
+
+    if not tags:
+        return f"За {report['day']} переходов по воронке ещё не было."
+    lines = [f"{'тег':<16}{'старты':>7}{'активны':>8}{'менеджер':>9}{'конв.':>7}"]
+    for name, counters in sorted(tags.items(), key=lambda item: -item[1]["started"]):
+        rate = counters["conversions"] / counters["started"] if counters["started"] else 0.0
+        lines.append(
+            f"{(name or '-')[:15]:<16}{counters['started']:>7}{counters['active']:>8}"
+            f"{counters['conversions']:>9}{rate:>7.0%}"
+        )
+    table = html.escape("\n".join(lines))
+    return f"📊 Воронка за {report['day']}\n<pre>{table}</pre>\nПодробно по шагам: /stats &lt;тег&gt;"
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Admin: today's live funnel counters, per tag or per step of one tag (`/stats <tag>`)."""
+    if not is_admin(update):
+        return
+    tag = context.args[0] if context.args else None
+    if tag == "-":
+        tag = ""
+    await update.message.reply_text(format_funnel_stats(funnel_counters.report(), tag), parse_mode="HTML")
+
+
+def build_conversation_handler() -> ConversationHandler:
+    """Conversation flow of the funnel: /start -> phone -> ... -> manager handoff."""
+    return ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             PHONE: [
                 MessageHandler(filters.CONTACT, phone_received),
+                CallbackQueryHandler(handle_prefill_choice, pattern=f"^({PREFILL_CONTINUE}|{PREFILL_RESTART})$"),
                 MessageHandler(filters.Regex(f"^{re.escape(PROCESS_INFO_BUTTON_TEXT)}$"), show_process_info),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, phone_received_text),
             ],
@@ -738,11 +1383,273 @@ def main() -> None:
         allow_reentry=True,
     )
 
+
+def record_funnel_transition(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, state: str, next_state: str, handler: str
+) -> None:
+    """Feed the user's funnel step change to live counters and the event log (retries in a step are skipped)."""
+    if update.effective_user is None:
+        return
+    user_data = context.user_data
+    # /start clears user_data, so a restart is logged as coming from START
+    previous = user_data.get(FUNNEL_STEP_KEY, "START")
+    step = "CANCEL" if handler == cancel.__name__ else next_state
+    if step == previous or step not in STEP_CODES:
+        return
+    user_data[FUNNEL_STEP_KEY] = step
+    funnel_counters.record(update.effective_user.id, user_data.get("tag"), previous, step)
+    log = get_funnel_log()
+    if log is not None:
+        log.append(update.effective_user.id, user_data.get("tag"), previous, step)
+
+
+instrumentation.add_transition_listener(record_funnel_transition)
+
+
+async def start_shared_services() -> None:
+    """Process-wide background work, started once however many bots are hosted."""
+    global funnel_stats_task, catalogs_task
+    loop_watchdog.start()
+    if CATALOGS_PATH:
+        await asyncio.to_thread(catalog_file.check)
+        catalogs_task = asyncio.get_running_loop().create_task(watch_catalogs(catalog_file, CATALOGS_CHECK_SECONDS))
+    # Started after the first getUpdates is under way: importing in parallel with
+    # startup competes for the GIL and delays the first reply
+    warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    asyncio.get_running_loop().call_later(WARM_UP_DELAY_SECONDS, warm_up_thread.start)
+    if FUNNEL_STATS_PATH:
+        if await asyncio.to_thread(funnel_counters.load, FUNNEL_STATS_PATH):
+            logging.info("Funnel stats restored from %s", FUNNEL_STATS_PATH)
+        funnel_stats_task = asyncio.get_running_loop().create_task(
+            snapshot_periodically(funnel_counters, FUNNEL_STATS_PATH, FUNNEL_STATS_SNAPSHOT_SECONDS)
+        )
+
+
+async def stop_shared_services() -> None:
+    global funnel_stats_task, catalogs_task
+    await loop_watchdog.stop()
+    if catalogs_task is not None:
+        catalogs_task.cancel()
+        catalogs_task = None
+    if funnel_stats_task is not None:
+        funnel_stats_task.cancel()
+        funnel_stats_task = None
+        await asyncio.to_thread(funnel_counters.save, FUNNEL_STATS_PATH)
+    if funnel_log is not None:
+        funnel_log.flush()
+
+
+async def start_sheet_snapshot(snapshot: SheetSnapshot, url: str, path: str, token: str) -> Optional[asyncio.Task]:
+    """Restore the sheet snapshot from `path` and start refreshing it; None when disabled."""
+    if not url or SHEET_SNAPSHOT_SECONDS <= 0:
+        return None
+    if path and await asyncio.to_thread(snapshot.load, path):
+        logging.info("Sheet snapshot restored from %s: %d leads", path, len(snapshot))
+    # First delta after startup for the same reason as the warm-up
+    return asyncio.get_running_loop().create_task(
+        refresh_periodically(snapshot, url, path, SHEET_SNAPSHOT_SECONDS, token, initial_delay=WARM_UP_DELAY_SECONDS)
+    )
+
+
+async def stop_sheet_snapshot(task: Optional[asyncio.Task], snapshot: SheetSnapshot, path: str) -> None:
+    if task is None:
+        return
+    task.cancel()
+    if path:
+        await asyncio.to_thread(snapshot.save, path)
+
+
+async def start_tenant_services(tenant: Tenant) -> None:
+    """Open a hosted bot's lead registry and start refreshing its sheet snapshot."""
+    await asyncio.to_thread(open_lead_registry, tenant)
+    tenant.sheet_snapshot_task = await start_sheet_snapshot(
+        tenant.sheet_snapshot, tenant.sheet_sync_url, tenant.sheet_snapshot_path, tenant.sheet_export_token
+    )
+
+
+async def stop_tenant_services(tenant: Tenant) -> None:
+    await stop_sheet_snapshot(tenant.sheet_snapshot_task, tenant.sheet_snapshot, tenant.sheet_snapshot_path)
+    tenant.sheet_snapshot_task = None
+
+
+async def on_startup(application: Application) -> None:
+    global sheet_snapshot_task
+    await start_shared_services()
+    # Opened now so leads left in the outbox by the previous run are replicated
+    await asyncio.to_thread(open_lead_registry)
+    sheet_snapshot_task = await start_sheet_snapshot(sheet_snapshot, SHEET_SYNC_URL, SHEET_SNAPSHOT_PATH, SHEET_EXPORT_TOKEN)
+
+
+async def drain_and_close_registries() -> None:
+    """Last shutdown step, after updates stopped: replicate what is queued, keep the rest."""
+    await asyncio.to_thread(drain_sheet_replication, SHUTDOWN_DRAIN_SECONDS)
+    await asyncio.to_thread(close_lead_registry, True)
+
+
+async def on_shutdown(application: Application) -> None:
+    # run_polling() has stopped polling and finished the updates in progress by now
+    global sheet_snapshot_task
+    await stop_sheet_snapshot(sheet_snapshot_task, sheet_snapshot, SHEET_SNAPSHOT_PATH)
+    sheet_snapshot_task = None
+    await drain_and_close_registries()
+    await stop_shared_services()
+
+
+async def throttle_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop a /start over its user's or tag's rate before the conversation (and the sheet) sees it."""
+    user = update.effective_user
+    throttle: StartThrottle = context.bot_data[THROTTLE_KEY]
+    reason = throttle.check(user.id if user else None, context.args[0] if context.args else None)
+    if reason is None:
+        return
+    instrumentation.dropped_updates.inc(f"start_{reason}")
+    raise ApplicationHandlerStop
+
+
+async def bind_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Make the tenant of the Application handling the update current for its handlers."""
+    current_tenant.set(context.bot_data.get(TENANT_KEY))
+
+
+def build_application(
+    token: str,
+    request: Optional[BaseRequest] = None,
+    tenant: Optional[Tenant] = None,
+    updates_request: Optional[BaseRequest] = None,
+) -> Application:
+    """Create application with all handlers registered and instrumented.
+
+    `request` replaces the HTTP layer (used by benchmarks to stub Telegram),
+    also for getUpdates unless `updates_request` is given. A hosted `tenant`'s
+    Application is started by run_tenants() instead of run_polling().
+    """
+    builder = Application.builder().token(token)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    updates_request = updates_request or request
+    if request is None:
+        request = HTTPXRequest(
+            connection_pool_size=256, connect_timeout=30.0, read_timeout=30.0, write_timeout=30.0, pool_timeout=10.0
+        )
+        updates_request = HTTPXRequest(connection_pool_size=1)
+    # Bot API calls are counted and timed; successful getUpdates feed the health checks
+    builder = builder.request(instrumentation.wrap_request(request))
+    poller = "default" if tenant is None else tenant.name
+    builder = builder.get_updates_request(instrumentation.wrap_request(updates_request, poller=poller))
+    if tenant is None:
+        builder = builder.post_init(on_startup).post_shutdown(on_shutdown)
+    if CONCURRENT_UPDATES > 1:
+        # A slow selection step of one user no longer holds up everyone else's replies
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    application = builder.build()
+    application.bot_data[TENANT_KEY] = tenant
+    application.bot_data[THROTTLE_KEY] = StartThrottle(
+        START_USER_BURST, START_USER_PER_MINUTE, START_TAG_BURST, START_TAG_PER_MINUTE
+    )
+    if tenant is not None and tenant not in hosted_tenants:
+        hosted_tenants.append(tenant)
+    # Flooded /start updates are dropped first, then the tenant is bound before the trace handlers in group -1
+    application.add_handler(CommandHandler("start", throttle_start), group=-3)
+    application.add_handler(TypeHandler(Update, bind_tenant), group=-2)
+
+    # Operator commands, checked before the funnel
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("memsnap", memory_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+
+    conv_handler = build_conversation_handler()
     application.add_handler(conv_handler)
+    instrumentation.install(application, conv_handler)
+    return application
+
 
-    print("Bot started successfully!")
+async def run_tenants(tenants: List[Tenant]) -> None:
+    """Poll every hosted bot in this event loop until SIGINT or SIGTERM."""
+    # One pool for Bot API calls of all bots; each getUpdates long poll keeps its own connection
+    shared_request = SharedRequest(
+        HTTPXRequest(
+            connection_pool_size=256, connect_timeout=30.0, read_timeout=30.0, write_timeout=30.0, pool_timeout=10.0
+        )
+    )
+    applications = [
+        build_application(
+            tenant.token, request=shared_request, tenant=tenant, updates_request=HTTPXRequest(connection_pool_size=1)
+        )
+        for tenant in tenants
+    ]
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    await start_shared_services()
+    started: List[Application] = []
+    try:
+        for tenant, application in zip(tenants, applications):
+            await application.initialize()
+            started.append(application)
+            await start_tenant_services(tenant)
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await application.start()
+            logging.info("Bot %s started as @%s", tenant.name, application.bot.username)
+        await stop.wait()
+    finally:
+        # Stop taking updates everywhere first, then finish the ones in progress
+        for application in started:
+            if application.updater.running:
+                await application.updater.stop()
+        for tenant, application in zip(tenants, started):
+            if application.running:
+                await application.stop()
+            await application.shutdown()
+            await stop_tenant_services(tenant)
+        await drain_and_close_registries()
+        await stop_shared_services()
+
+
+def main() -> None:
+    """Start the bot, or every bot listed in TENANTS_PATH."""
+    token = os.getenv("BOT_TOKEN")
+    try:
+        tenants = load_tenants(TENANTS_PATH) if TENANTS_PATH else []
+    except (OSError, ValueError) as exc:
+        print(f"Error: cannot load TENANTS_PATH: {exc}")
+        return
+    if not tenants and not token:
+        print("Error: BOT_TOKEN not found in .env file")
+        return
+
+    if LISTINGS_PATH:
+        from scoring_pool import ScoringPool
+
+        service = get_car_search_service()
+        count = service.load_listings(LISTINGS_PATH)
+        print(f"Listings loaded: {count}")
+        if SCORING_WORKERS > 0 and os.path.isdir(LISTINGS_PATH):
+            service.scoring_pool = ScoringPool(
+                LISTINGS_PATH, max_workers=SCORING_WORKERS, max_pending=SCORING_MAX_PENDING
+            )
+            service.scoring_pool.start()
+
+    application = None if tenants else build_application(token)
+    if METRICS_PORT:
+        instrumentation.add_route("/health/live", health_monitor.live)
+        instrumentation.add_route("/health/ready", health_monitor.ready)
+        instrumentation.start_http_server(METRICS_PORT, METRICS_HOST)
+
+    if tenants:
+        print(f"Bots started: {', '.join(tenant.name for tenant in tenants)}")
+    else:
+        print("Bot started successfully!")
     print("Press Ctrl+C to stop")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        if tenants:
+            asyncio.run(run_tenants(tenants))
+        else:
+            application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        if car_search_service is not None and car_search_service.scoring_pool is not None:
+            car_search_service.scoring_pool.close()
 
 
 if __name__ == "__main__":
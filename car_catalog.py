@@ -0,0 +1,109 @@
+"""
+Car Catalog - canonical brand and model names for free-text user input
+
+Brands and models are loaded from data/car_catalog.json (most popular first)
+into FuzzyIndex instances, so "хавал джолион", "HAVAL" or "tiggo7" resolve
+to the names used everywhere downstream (sheet, listings, keyboards).
+"""
+
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import fuzzy_index
+from artifacts import load_artifact
+from fuzzy_index import FuzzyIndex
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "car_catalog.json")
+
+# Brand-only matches must be confident: the rest of the text may be a model
+BRAND_MIN_SCORE = 0.7
+
+
+class CarCatalog:
+    """Brand and model indexes built from the catalog file."""
+
+    def __init__(self, brands: Dict[str, Dict]):
+        """
+        Args:
+            brands: {"Haval": {"aliases": [...], "models": {"Jolion": [aliases]}}}
+        """
+        self.brands = brands
+        self.brand_index = FuzzyIndex((brand, info.get("aliases", [])) for brand, info in brands.items())
+        self.model_indexes = {
+            brand: FuzzyIndex(info.get("models", {}).items()) for brand, info in brands.items()
+        }
+
+    @classmethod
+    def load(cls, path: str = CATALOG_PATH) -> "CarCatalog":
+        with open(path, encoding="utf-8") as handle:
+            return cls(json.load(handle))
+
+    def match_brand(self, text: str) -> Optional[str]:
+        """Canonical brand for text, or None."""
+        found = self.brand_index.lookup(text)
+        return found.value if found else None
+
+    def models(self, brand: str) -> List[str]:
+        """Models of a canonical brand, most popular first."""
+        return list(self.brands.get(brand, {}).get("models", {}))
+
+    def match_model(self, brand: Optional[str], text: str) -> Optional[str]:
+        """
+        Canonical model of `brand` for text, or None.
+
+        Text may repeat the brand ("Haval Jolion" or "хавал джолион").
+        """
+        parsed_brand, parsed_model = self.parse_brand_model(text)
+        if parsed_model and (brand is None or parsed_brand == brand):
+            return parsed_model
+        index = self.model_indexes.get(brand)
+        if index is None:
+            return None
+        found = index.lookup(text)
+        return found.value if found else None
+
+    def parse_brand_model(self, text: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Split free text like "хавал джолион" into (brand, model).
+
+        The longest leading run of words that is confidently a brand wins;
+        the remaining words are matched against that brand's models.
+        """
+        words = (text or "").split()
+        for size in range(len(words), 0, -1):
+            found = self.brand_index.lookup(" ".join(words[:size]), min_score=BRAND_MIN_SCORE)
+            if not found:
+                continue
+            rest = " ".join(words[size:])
+            model = None
+            if rest:
+                model_match = self.model_indexes[found.value].lookup(rest)
+                model = model_match.value if model_match else None
+            return found.value, model
+        return None, None
+
+    def suggest_models(self, brand: Optional[str], text: Optional[str] = None, limit: int = 6) -> List[str]:
+        """
+        Model suggestions for keyboards.
+
+        Without text these are the brand's most popular models; with text,
+        completions and closest matches of what the user typed.
+        """
+        index = self.model_indexes.get(brand)
+        if index is None:
+            return []
+        if not text:
+            return index.values[:limit]
+        suggestions = index.complete(text, limit)
+        for match in index.candidates(text, limit):
+            if match.value not in suggestions and match.score >= 0.4:
+                suggestions.append(match.value)
+        return suggestions[:limit]
+
+
+@lru_cache(maxsize=1)
+def get_catalog() -> CarCatalog:
+    """Catalog loaded once per process, from the precompiled artifact when it is fresh."""
+    return load_artifact("car_catalog", [CATALOG_PATH, __file__, fuzzy_index.__file__], CarCatalog.load)
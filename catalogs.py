@@ -0,0 +1,240 @@
+"""
+Catalogs - brand, city and model keyboards reloaded from a watched file
+
+The brands, cities and popular models offered as reply keyboards change
+with the market, but lived as constants in bot.py: updating a trending
+model meant a redeploy, dropping conversations and the warmed-up caches.
+
+With CATALOGS_PATH set, bot.py reads them from a JSON file instead:
+
+    {"car_brands": [["Lada", "Haval", "Chery"], ["Geely", "Changan"]],
+     "cities": [["Москва", "Санкт-Петербург"], ["Казань"]],
+     "popular_models": {"Lada": ["Granta", "Vesta", "Niva Travel"]},
+     "default_model_suggestions": ["Lada Granta", "Haval Jolion"]}
+
+Omitted keys keep the defaults from bot.py. CatalogFile checks the file's
+modification time every few seconds. A changed file is read, validated and
+turned into a new Catalogs - keyboard markups built in advance - in a
+worker thread; the new set replaces the old one in a single assignment, so
+a handler sees either the old or the new catalogs, never a mix, and the
+event loop never waits for the file. An invalid file is logged and the
+current catalogs stay in use until the file is fixed. Keyboard models the
+car catalog does not know are logged: the bot still accepts such a button
+as is, but a typo in the file would otherwise go unnoticed.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram import ReplyKeyboardMarkup
+
+OTHER_MODEL_BUTTON_TEXT = "Другая модель"
+MODEL_KEYBOARD_SIZE = 4
+CHECK_SECONDS = 5.0
+
+FIELDS = ("car_brands", "cities", "popular_models", "default_model_suggestions")
+
+# (brand, typed model) -> canonical model or None, e.g. CarCatalog.match_model
+ModelResolver = Callable[[str, str], Optional[str]]
+
+
+def reply_keyboard(rows: List[List[str]]) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True, one_time_keyboard=True)
+
+
+def model_keyboard(models: List[str]) -> ReplyKeyboardMarkup:
+    """Up to MODEL_KEYBOARD_SIZE models, two per row, and the "other model" button."""
+    models = list(dict.fromkeys(models))[:MODEL_KEYBOARD_SIZE]
+    rows = [models[i : i + 2] for i in range(0, len(models), 2)]
+    rows.append([OTHER_MODEL_BUTTON_TEXT])
+    return reply_keyboard(rows)
+
+
+class Catalogs:
+    """One consistent set of catalogs with their keyboards; never changed after it is built."""
+
+    def __init__(
+        self,
+        car_brands: List[List[str]],
+        cities: List[List[str]],
+        popular_models: Dict[str, List[str]],
+        default_model_suggestions: List[str],
+    ):
+        self.car_brands = car_brands
+        self.cities = cities
+        self.popular_models = popular_models
+        self.default_model_suggestions = default_model_suggestions
+        # Typed towns are mapped to the nearest of these
+        self.city_hubs = tuple(city for row in cities for city in row)
+        self.brand_keyboard = reply_keyboard(car_brands)
+        self.city_keyboard = reply_keyboard(cities)
+        self.model_keyboards = {brand: model_keyboard(models) for brand, models in popular_models.items()}
+        content = json.dumps([car_brands, cities, popular_models, default_model_suggestions], ensure_ascii=False)
+        self.version = hashlib.sha256(content.encode("utf-8")).hexdigest()[:8]
+
+    def overlay(
+        self,
+        car_brands: Optional[List[List[str]]] = None,
+        cities: Optional[List[List[str]]] = None,
+        popular_models: Optional[Dict[str, List[str]]] = None,
+    ) -> "Catalogs":
+        """These catalogs with some of them replaced (None keeps ours), e.g. by a hosted bot's own."""
+        if car_brands is None and cities is None and popular_models is None:
+            return self
+        return Catalogs(
+            self.car_brands if car_brands is None else car_brands,
+            self.cities if cities is None else cities,
+            self.popular_models if popular_models is None else popular_models,
+            self.default_model_suggestions,
+        )
+
+    def __repr__(self) -> str:
+        return f"Catalogs({self.version})"
+
+
+def _texts(value, field: str) -> List[str]:
+    if not isinstance(value, list) or not value or not all(isinstance(text, str) and text.strip() for text in value):
+        raise ValueError(f"{field} must be a non-empty list of non-empty strings")
+    return value
+
+
+def _keyboard(value, field: str) -> List[List[str]]:
+    if not isinstance(value, list) or not value:
+        raise ValueError(f"{field} must be a non-empty list of rows of button texts")
+    rows = [_texts(row, f"{field}[{number}]") for number, row in enumerate(value)]
+    buttons = [text for row in rows for text in row]
+    if len(set(buttons)) != len(buttons):
+        raise ValueError(f"{field} has the same button twice")
+    return rows
+
+
+def unknown_models(popular_models: Dict[str, List[str]], resolve_model: ModelResolver) -> List[str]:
+    """Keyboard models `resolve_model` cannot resolve, as "Brand Model"."""
+    return [
+        f"{brand} {model}"
+        for brand, models in popular_models.items()
+        for model in models
+        if not resolve_model(brand, model)
+    ]
+
+
+def parse_catalogs(data, defaults: Catalogs, resolve_model: Optional[ModelResolver] = None) -> Catalogs:
+    """
+    Validate the contents of a catalogs file and build its keyboards.
+
+    Args:
+        data: Parsed JSON object
+        defaults: Catalogs used for omitted keys
+        resolve_model: Checks the popular models; unknown ones are logged, not rejected
+
+    Raises:
+        ValueError: not an object, an unknown key, or a key of the wrong shape
+    """
+    if not isinstance(data, dict):
+        raise ValueError("catalogs must be a JSON object")
+    unknown = sorted(set(data) - set(FIELDS))
+    if unknown:
+        raise ValueError(f"unknown keys: {', '.join(unknown)}")
+    popular_models = data.get("popular_models", defaults.popular_models)
+    if not isinstance(popular_models, dict):
+        raise ValueError("popular_models must map brands to model lists")
+    popular_models = {brand: _texts(models, f"popular_models[{brand}]") for brand, models in popular_models.items()}
+    if resolve_model is not None and "popular_models" in data:
+        unknown = unknown_models(popular_models, resolve_model)
+        if unknown:
+            logging.warning("Popular models not in the car catalog (offered as typed): %s", ", ".join(unknown))
+    return Catalogs(
+        _keyboard(data.get("car_brands", defaults.car_brands), "car_brands"),
+        _keyboard(data.get("cities", defaults.cities), "cities"),
+        popular_models,
+        _texts(data.get("default_model_suggestions", defaults.default_model_suggestions), "default_model_suggestions"),
+    )
+
+
+def load_catalogs(path: str, defaults: Catalogs, resolve_model: Optional[ModelResolver] = None) -> Catalogs:
+    """
+    Read a catalogs file, see parse_catalogs().
+
+    Raises:
+        OSError: file cannot be read
+        ValueError: invalid JSON or catalogs
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return parse_catalogs(json.load(f), defaults, resolve_model)
+
+
+class CatalogFile:
+    """Catalogs of a watched file: `current` is replaced whenever the file changes to valid catalogs."""
+
+    def __init__(
+        self,
+        path: str,
+        defaults: Catalogs,
+        prepare: Optional[Callable[[Catalogs], None]] = None,
+        resolve_model: Optional[ModelResolver] = None,
+    ):
+        """
+        Args:
+            path: JSON file (empty = `defaults` forever)
+            defaults: Catalogs until the file is loaded, and for keys the file omits
+            prepare: Called with new catalogs before they are swapped in, e.g. to warm caches
+            resolve_model: Checks the popular models of the file, see parse_catalogs()
+        """
+        self.path = path
+        self.defaults = defaults
+        self.prepare = prepare
+        self.resolve_model = resolve_model
+        self.current = defaults
+        self.reloads = 0
+        self.rejected = 0
+        self._stamp: Optional[Tuple[int, int]] = None
+
+    def check(self) -> bool:
+        """
+        Load the file if it changed since the last check (blocking, call from a worker thread).
+
+        Returns:
+            bool: True if new catalogs were swapped in
+        """
+        if not self.path:
+            return False
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self._stamp is not None:
+                logging.warning("Catalogs file %s is gone, keeping catalogs %s", self.path, self.current.version)
+                self._stamp = None
+            return False
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        try:
+            catalogs = load_catalogs(self.path, self.defaults, self.resolve_model)
+        except (OSError, ValueError) as exc:
+            # Also a file caught halfway through writing: its next change is picked up again
+            self.rejected += 1
+            logging.error("Catalogs file %s rejected, keeping catalogs %s: %s", self.path, self.current.version, exc)
+            return False
+        if catalogs.version == self.current.version:
+            return False
+        if self.prepare is not None:
+            self.prepare(catalogs)
+        previous, self.current = self.current, catalogs
+        self.reloads += 1
+        logging.info("Catalogs %s loaded from %s (were %s)", catalogs.version, self.path, previous.version)
+        return True
+
+
+async def watch_catalogs(catalog_file: CatalogFile, interval: float = CHECK_SECONDS) -> None:
+    """Check the file every `interval` seconds until cancelled (file IO and parsing in a worker thread)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(catalog_file.check)
+        except Exception as exc:
+            logging.warning("Catalogs check failed: %s", exc)
@@ -0,0 +1,107 @@
+"""
+City Gazetteer - normalization of free-text city input
+
+Russian localities (data/ru_localities.csv) are indexed with FuzzyIndex, so
+"мск", "Moscow" and "Москва" all become "Москва" and typos like "Екатеренбург"
+still resolve. Each locality is also assigned the nearest supported hub (the
+cities offered on the keyboard) through a precomputed lat/lon grid, so listing
+queries for a small town fall back to its regional hub.
+"""
+
+import csv
+import hashlib
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+import fuzzy_index
+from artifacts import load_artifact
+from fuzzy_index import FuzzyIndex
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ru_localities.csv")
+
+# Grid covering Russia (longitudes east of 180 are stored as lon + 360)
+GRID_LAT_MIN, GRID_LAT_MAX = 40.0, 82.0
+GRID_LON_MIN, GRID_LON_MAX = 19.0, 191.0
+GRID_CELL_DEGREES = 0.5
+
+
+class CityGazetteer:
+    """Locality index with nearest-hub mapping."""
+
+    def __init__(self, localities: Iterable[Dict], hubs: Iterable[str]):
+        """
+        Args:
+            localities: Rows with name, region, lat, lon, population, aliases
+            hubs: Canonical names of supported hub cities (must be in localities)
+        """
+        self.localities: Dict[str, Dict] = {}
+        for row in sorted(localities, key=lambda item: -int(item.get("population") or 0)):
+            self.localities[row["name"]] = {
+                "name": row["name"],
+                "region": row.get("region", ""),
+                "lat": float(row["lat"]),
+                "lon": float(row["lon"]),
+                "aliases": [alias for alias in (row.get("aliases") or "").split("|") if alias],
+            }
+        # Bigger localities first: they win ties between similar names
+        self.index = FuzzyIndex((name, info["aliases"]) for name, info in self.localities.items())
+
+        self.hubs: List[str] = [hub for hub in hubs if hub in self.localities]
+        self._grid = self._build_grid()
+        for info in self.localities.values():
+            info["hub"] = self.nearest_hub(info["lat"], info["lon"])
+
+    @classmethod
+    def load(cls, hubs: Iterable[str], path: str = GAZETTEER_PATH) -> "CityGazetteer":
+        with open(path, newline="", encoding="utf-8") as handle:
+            return cls(list(csv.DictReader(handle)), hubs)
+
+    def _build_grid(self) -> np.ndarray:
+        """Hub number for the centre of every grid cell."""
+        lats = np.arange(GRID_LAT_MIN, GRID_LAT_MAX, GRID_CELL_DEGREES) + GRID_CELL_DEGREES / 2
+        lons = np.arange(GRID_LON_MIN, GRID_LON_MAX, GRID_CELL_DEGREES) + GRID_CELL_DEGREES / 2
+        if not self.hubs:
+            return np.zeros((len(lats), len(lons)), dtype=np.int8)
+
+        cell_lat = np.radians(lats)[:, None, None]
+        cell_lon = np.radians(lons)[None, :, None]
+        hub_lat = np.radians([self.localities[hub]["lat"] for hub in self.hubs])[None, None, :]
+        hub_lon = np.radians([self.localities[hub]["lon"] for hub in self.hubs])[None, None, :]
+        # Haversine distance from every cell centre to every hub
+        a = (
+            np.sin((hub_lat - cell_lat) / 2) ** 2
+            + np.cos(cell_lat) * np.cos(hub_lat) * np.sin((hub_lon - cell_lon) / 2) ** 2
+        )
+        return np.argmin(np.arcsin(np.sqrt(a)), axis=2).astype(np.int8)
+
+    def nearest_hub(self, lat: float, lon: float) -> Optional[str]:
+        """Supported hub closest to coordinates (O(1) grid lookup)."""
+        if not self.hubs:
+            return None
+        if lon < GRID_LON_MIN:
+            lon += 360.0
+        row = int((min(max(lat, GRID_LAT_MIN), GRID_LAT_MAX - 1e-9) - GRID_LAT_MIN) / GRID_CELL_DEGREES)
+        col = int((min(max(lon, GRID_LON_MIN), GRID_LON_MAX - 1e-9) - GRID_LON_MIN) / GRID_CELL_DEGREES)
+        return self.hubs[self._grid[row, col]]
+
+    def normalize(self, text: str) -> Optional[Dict]:
+        """
+        Locality for free-text city input.
+
+        Returns:
+            dict: name, region, lat, lon, hub - or None if nothing matches confidently
+        """
+        found = self.index.lookup(text)
+        if not found:
+            return None
+        return self.localities[found.value]
+
+
+@lru_cache(maxsize=4)
+def get_gazetteer(hubs: tuple) -> CityGazetteer:
+    """Gazetteer loaded once per set of hubs, from the precompiled artifact when it is fresh."""
+    name = "gazetteer-" + hashlib.sha256("|".join(hubs).encode()).hexdigest()[:8]
+    return load_artifact(name, [GAZETTEER_PATH, __file__, fuzzy_index.__file__], lambda: CityGazetteer.load(hubs))
@@ -0,0 +1,158 @@
+"""
+Diagnostics - on-demand sampling profiler and tracemalloc snapshots
+
+Used by the admin commands in bot.py to look inside a slow production
+process without restarting it:
+- SamplingProfiler samples the stacks of all threads (the event loop thread
+  and sync/scoring worker threads) at a fixed interval for a limited time
+  and reports the hottest frames plus collapsed stacks for flame graphs
+- MemorySnapshots starts tracemalloc on first use and reports the biggest
+  allocation sites and the growth since the previous snapshot
+Both are blocking and meant to run in a worker thread (asyncio.to_thread).
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+DEFAULT_INTERVAL_SECONDS = 0.005
+MAX_STACK_DEPTH = 64
+TRACEMALLOC_FRAMES = 25
+
+
+def _frame_label(code, lineno: Optional[int] = None) -> str:
+    location = f"{os.path.basename(code.co_filename)}:{lineno if lineno is not None else code.co_firstlineno}"
+    return f"{code.co_name} ({location})"
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler for all threads of the process."""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL_SECONDS):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float, top: int = 20) -> str:
+        """
+        Sample for `seconds` and return a text report.
+
+        Raises:
+            RuntimeError: if another profile is already running
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("Profile is already running")
+        try:
+            return self._sample(seconds, top)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, top: int) -> str:
+        own_thread = threading.get_ident()
+        leaf_counts: Counter = Counter()
+        function_counts: Counter = Counter()
+        stacks: Counter = Counter()
+        samples = 0
+
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                thread_name = names.get(thread_id, str(thread_id))
+                labels = []
+                while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                    labels.append((frame.f_code, frame.f_lineno))
+                    frame = frame.f_back
+                if not labels:
+                    continue
+                leaf_code, leaf_line = labels[0]
+                leaf_counts[(thread_name, _frame_label(leaf_code, leaf_line))] += 1
+                # A recursive function counts once per sample
+                for function in {_frame_label(code) for code, _ in labels}:
+                    function_counts[(thread_name, function)] += 1
+                stacks[";".join([thread_name] + [_frame_label(code) for code, _ in reversed(labels)])] += 1
+            samples += 1
+            time.sleep(self.interval)
+        elapsed = time.perf_counter() - started
+
+        lines = [
+            f"Sampling profile: {elapsed:.1f} s, {samples} samples every {self.interval * 1000:.0f} ms",
+            "Wall-clock samples: idle threads show up in select/wait frames.",
+            "",
+            f"Top {top} frames by self samples:",
+        ]
+        lines += self._table(leaf_counts, samples, top)
+        lines += ["", f"Top {top} functions by cumulative samples:"]
+        lines += self._table(function_counts, samples, top)
+        lines += ["", "Collapsed stacks (flamegraph.pl / speedscope):"]
+        lines += [f"{stack} {count}" for stack, count in stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _table(counts: Counter, samples: int, top: int):
+        rows = [f"{'samples':>8} {'%':>6}  thread / frame"]
+        for (thread_name, label), count in counts.most_common(top):
+            share = 100.0 * count / samples if samples else 0.0
+            rows.append(f"{count:>8} {share:>5.1f}%  {thread_name} / {label}")
+        return rows
+
+
+class MemorySnapshots:
+    """tracemalloc snapshots with a diff against the previous one."""
+
+    def __init__(self, frames: int = TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    def take(self, top: int = 20) -> str:
+        """Snapshot report; the first call starts tracing and records the baseline."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._previous = self._snapshot()
+                return "tracemalloc started, baseline recorded. Run the command again to see growth.\n"
+
+            snapshot = self._snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [
+                f"Traced memory: {current / 1024 / 1024:.1f} MiB (peak {peak / 1024 / 1024:.1f} MiB)",
+                "",
+                f"Top {top} allocation sites:",
+            ]
+            for stat in snapshot.statistics("lineno")[:top]:
+                lines.append(f"{stat.size / 1024:>10.1f} KiB {stat.count:>8} blocks  {stat.traceback[0]}")
+
+            if self._previous is not None:
+                lines += ["", f"Top {top} growth since previous snapshot:"]
+                for stat in snapshot.compare_to(self._previous, "lineno")[:top]:
+                    lines.append(
+                        f"{stat.size_diff / 1024:>+10.1f} KiB {stat.count_diff:>+8} blocks  {stat.traceback[0]}"
+                    )
+            self._previous = snapshot
+            return "\n".join(lines) + "\n"
+
+    def stop(self) -> None:
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ]
+        )
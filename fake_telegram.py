@@ -0,0 +1,273 @@
+"""
+Fake Telegram Bot API - local HTTP stand-in for load and end-to-end tests
+
+Serves the subset of the Bot API the bot uses: getMe, getUpdates (long
+polling), setWebhook/deleteWebhook (webhook delivery), send*/edit* methods,
+answerCallbackQuery. Outgoing bot calls are recorded with their arrival time,
+so a load generator can measure how quickly the bot replies. Any POST to a
+path outside /bot<token>/ (e.g. SHEET_SYNC_URL=http://host:port/sheet) is
+accepted as a no-op sheet sync.
+
+Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:8081.
+
+Usage:
+    python fake_telegram.py --port 8081
+    curl -d '{"message": {...}}' http://127.0.0.1:8081/_fake/updates
+    curl http://127.0.0.1:8081/_fake/calls
+"""
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_ID = 100000
+BOT_USERNAME = "fake_autopodbor_bot"
+
+# Kept for /_fake/calls; older calls are dropped
+MAX_RECORDED_CALLS = 10000
+
+
+def _decode_value(value: str):
+    """Bot API form values carry nested objects (reply_markup etc.) as JSON strings."""
+    if value[:1] in ("{", "["):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+class FakeBotAPI:
+    """Update queue and call log shared by the HTTP handler threads."""
+
+    def __init__(self, on_call: Optional[Callable[[Dict], None]] = None):
+        """
+        Args:
+            on_call: Called from a server thread with every recorded bot call
+                (getUpdates excluded): {"method", "params", "result", "time" (perf_counter)}
+        """
+        self.on_call = on_call
+        self.calls: List[Dict] = []
+        self.method_counts: Dict[str, int] = {}
+        self.sheet_posts = 0
+        self.webhook_url: Optional[str] = None
+        self.polling = threading.Event()
+        self._updates: List[Dict] = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._lock = threading.Lock()
+        self._has_updates = threading.Condition(self._lock)
+
+    # ---- incoming side (users -> bot) ----
+
+    def push_update(self, update: Dict) -> int:
+        """Queue an update (without update_id) for the bot; returns its update_id."""
+        with self._lock:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            update = dict(update, update_id=update_id)
+            webhook_url = self.webhook_url
+            if webhook_url is None:
+                self._updates.append(update)
+                self._has_updates.notify_all()
+        if webhook_url is not None:
+            threading.Thread(target=self._deliver_webhook, args=(webhook_url, update), daemon=True).start()
+        return update_id
+
+    def next_message_id(self) -> int:
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            return message_id
+
+    def get_updates(self, offset: int, limit: int, timeout: float) -> List[Dict]:
+        """Long polling: confirm updates below offset, wait up to timeout for new ones."""
+        self.polling.set()
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if offset:
+                self._updates = [update for update in self._updates if update["update_id"] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._has_updates.wait(remaining)
+            return self._updates[:limit]
+
+    def _deliver_webhook(self, url: str, update: Dict) -> None:
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(update, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            urllib.request.urlopen(request, timeout=30).read()
+        except OSError as exc:
+            logging.warning("Webhook delivery failed: %s", exc)
+
+    # ---- outgoing side (bot -> users) ----
+
+    def handle(self, method: str, params: Dict):
+        """Result of a Bot API call, recording it."""
+        received = time.perf_counter()
+        if method == "getUpdates":
+            return self.get_updates(
+                int(params.get("offset") or 0),
+                int(params.get("limit") or 100),
+                float(params.get("timeout") or 0),
+            )
+
+        result = self._result_for(method, params)
+        call = {"method": method, "params": params, "result": result, "time": received}
+        with self._lock:
+            self.method_counts[method] = self.method_counts.get(method, 0) + 1
+            self.calls.append(call)
+            if len(self.calls) > MAX_RECORDED_CALLS:
+                del self.calls[: len(self.calls) - MAX_RECORDED_CALLS]
+        if self.on_call is not None:
+            self.on_call(call)
+        return result
+
+    def _result_for(self, method: str, params: Dict):
+        if method == "getMe":
+            return {
+                "id": BOT_ID,
+                "is_bot": True,
+                "first_name": "Autopodbor",
+                "username": BOT_USERNAME,
+                "can_join_groups": False,
+                "can_read_all_group_messages": False,
+                "supports_inline_queries": False,
+            }
+        if method == "setWebhook":
+            self.webhook_url = params.get("url") or None
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method.startswith("send") or method.startswith("edit"):
+            message_id = params.get("message_id")
+            return {
+                "message_id": int(message_id) if message_id else self.next_message_id(),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id") or 0), "type": "private"},
+                "from": {"id": BOT_ID, "is_bot": True, "first_name": "Autopodbor"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def api(self) -> FakeBotAPI:
+        return self.server.api
+
+    def log_message(self, format, *args) -> None:
+        return None
+
+    def _read_params(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        query = urlsplit(self.path).query
+        params = {key: _decode_value(value) for key, value in parse_qsl(query)}
+        if not body:
+            return params
+        content_type = self.headers.get("Content-Type", "")
+        if "application/json" in content_type:
+            params.update(json.loads(body.decode("utf-8")))
+        else:
+            params.update({key: _decode_value(value) for key, value in parse_qsl(body.decode("utf-8"))})
+        return params
+
+    def _reply(self, payload, status: int = 200) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        self._dispatch()
+
+    def do_POST(self) -> None:
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        path = urlsplit(self.path).path
+        params = self._read_params()
+        parts = path.strip("/").split("/")
+
+        if len(parts) == 2 and parts[0].startswith("bot"):
+            self._reply({"ok": True, "result": self.api.handle(parts[1], params)})
+        elif path == "/_fake/updates" and self.command == "POST":
+            self._reply({"ok": True, "result": self.api.push_update(params)})
+        elif path == "/_fake/calls":
+            with self.api._lock:
+                calls = list(self.api.calls)
+            self._reply({"ok": True, "result": calls})
+        elif self.command == "POST":
+            # Stand-in for SHEET_SYNC_URL
+            with self.api._lock:
+                self.api.sheet_posts += 1
+            self._reply({"status": "success"})
+        else:
+            self._reply({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    """Threaded HTTP server around FakeBotAPI."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, api: Optional[FakeBotAPI] = None):
+        super().__init__((host, port), _Handler)
+        self.api = api or FakeBotAPI()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address) -> None:
+        # A bot shutting down drops its pending long poll; that is not an error
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self) -> threading.Thread:
+        """Serve in a background thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeTelegramServer(args.host, args.port)
+    server.api.on_call = lambda call: logging.info("%s %s", call["method"], call["params"].get("text", ""))
+    print(f"Fake Telegram Bot API on {server.url} (set TELEGRAM_API_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Flood control - token buckets shedding /start floods before the conversation
+
+/start is both the entry point and a fallback: every tap clears the user's
+answers, and a deeplink tag is synced to the lead registry and the sheet
+right away, so a user (or a script) hammering /start costs one Apps Script
+execution per tap.
+
+StartThrottle keeps a token bucket per user and per deeplink tag. A /start
+passes when its buckets have a token; otherwise the bot drops it before any
+handler runs: no Bot API call, no registry write, no sheet sync. A /start
+spends a token only when both of its buckets have one, so taps dropped by
+the tag limit do not use up the user's own allowance. Buckets
+refill continuously, are created on first use and forgotten in least
+recently used order beyond `max_keys`, so memory stays bounded however many
+user ids or tags a flood invents.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+MAX_TRACKED_KEYS = 100_000
+
+
+class TokenBuckets:
+    """Token bucket per key: up to `burst` tokens, refilled at `per_minute` tokens a minute."""
+
+    def __init__(
+        self,
+        burst: int,
+        per_minute: float,
+        max_keys: int = MAX_TRACKED_KEYS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.burst = burst
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self.clock = clock
+        # key -> (tokens, time of the last take), least recently used first
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        state = self._buckets.get(key)
+        if state is None:
+            return float(self.burst)
+        return min(float(self.burst), state[0] + (now - state[1]) * self.rate)
+
+    def available(self, key: Hashable) -> bool:
+        """True when take() would succeed; spends nothing."""
+        return self._tokens(key, self.clock()) >= 1.0
+
+    def take(self, key: Hashable) -> bool:
+        """Spend one token of the key's bucket; False when it is empty."""
+        now = self.clock()
+        tokens = self._tokens(key, now)
+        if key in self._buckets:
+            self._buckets.move_to_end(key)
+        allowed = tokens >= 1.0
+        if allowed:
+            tokens -= 1.0
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            # The least recently used bucket has had the longest time to refill
+            self._buckets.popitem(last=False)
+        return allowed
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class StartThrottle:
+    """Per-user and per-tag /start rate limits (a limit of 0 per minute is off)."""
+
+    def __init__(
+        self,
+        user_burst: int,
+        user_per_minute: float,
+        tag_burst: int = 0,
+        tag_per_minute: float = 0.0,
+        max_keys: int = MAX_TRACKED_KEYS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.users = TokenBuckets(user_burst, user_per_minute, max_keys, clock) if user_per_minute > 0 else None
+        self.tags = TokenBuckets(tag_burst, tag_per_minute, max_keys, clock) if tag_per_minute > 0 else None
+
+    def check(self, user_id: Optional[int], tag: Optional[str]) -> Optional[str]:
+        """
+        Take a token for one /start from each of its buckets, or from none.
+
+        Returns:
+            str: "user" or "tag" when the update should be dropped, None when it passes
+        """
+        users = self.users if user_id is not None else None
+        tags = self.tags if tag else None
+        if users is not None and not users.available(user_id):
+            return "user"
+        if tags is not None and not tags.available(tag):
+            return "tag"
+        if users is not None:
+            users.take(user_id)
+        if tags is not None:
+            tags.take(tag)
+        return None
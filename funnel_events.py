@@ -0,0 +1,337 @@
+"""
+Funnel Events - local append-only columnar log of conversation transitions
+
+Every funnel step change (START -> PHONE -> BRAND -> ... -> END) is appended
+with the user id, deeplink tag and timestamp, so drop-off analytics no longer
+need the Google Sheet.
+
+FunnelEventLog buffers events in memory and flushes them as immutable column
+chunks into one directory per UTC day; a chunk is written to a temporary
+name and renamed, so readers never see partial files:
+
+    <root>/day=2026-10-18/part-<unix ms>-<pid>-<seq>.npz
+        ts          float64   unix time, seconds
+        user_id     int64
+        from_step   int8      code in STEPS
+        to_step     int8      code in STEPS
+        tag         int32     code in tag_values
+        tag_values  str       tag vocabulary of this chunk ("" = no tag)
+
+read_events() prunes partitions by date, loads the chunks and remaps tag
+codes to one vocabulary; funnel_report() splits events into sessions (a
+session starts at /start) and counts reached steps and drop-offs per tag with
+sorts and bincounts over whole columns, so millions of events take seconds.
+
+Usage:
+    python funnel_events.py report data/funnel_events --since 2026-10-01 [--tag spring] [--json]
+    python funnel_events.py generate /tmp/funnel --sessions 500000
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from funnel_steps import FUNNEL_STEPS, STEP_CODES, STEPS
+
+START, END, CANCEL = STEP_CODES["START"], STEP_CODES["END"], STEP_CODES["CANCEL"]
+
+PARTITION_PREFIX = "day="
+COLUMNS = ("ts", "user_id", "from_step", "to_step", "tag")
+DEFAULT_FLUSH_ROWS = 1000
+DEFAULT_FLUSH_SECONDS = 60.0
+ALL_TAGS = "*"
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day.isoformat()}"
+
+
+class FunnelEventLog:
+    """Thread-safe buffered writer of funnel events."""
+
+    def __init__(self, root: str, flush_rows: int = DEFAULT_FLUSH_ROWS, flush_seconds: float = DEFAULT_FLUSH_SECONDS):
+        """
+        Args:
+            root: Directory with day partitions (created on first flush)
+            flush_rows: Buffered events that trigger a flush
+            flush_seconds: Age of the oldest buffered event that triggers a flush
+        """
+        self.root = root
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self._buffer: Dict[str, list] = {name: [] for name in COLUMNS}
+        self._buffer_started: Optional[float] = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer["ts"])
+
+    def append(self, user_id: int, tag: Optional[str], from_step: str, to_step: str, ts: Optional[float] = None) -> None:
+        """
+        Buffer one transition; flushes when the buffer is full or old enough.
+
+        Raises:
+            KeyError: if a step is not in STEPS
+        """
+        from_code, to_code = STEP_CODES[from_step], STEP_CODES[to_step]
+        with self._lock:
+            if self._buffer_started is None:
+                self._buffer_started = time.monotonic()
+            self._buffer["ts"].append(time.time() if ts is None else ts)
+            self._buffer["user_id"].append(user_id)
+            self._buffer["from_step"].append(from_code)
+            self._buffer["to_step"].append(to_code)
+            self._buffer["tag"].append(tag or "")
+            due = self.pending >= self.flush_rows or time.monotonic() - self._buffer_started >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write buffered events as one chunk per day; returns the number of events written."""
+        with self._lock:
+            buffer, self._buffer = self._buffer, {name: [] for name in COLUMNS}
+            self._buffer_started = None
+            if not buffer["ts"]:
+                return 0
+
+        tag_values, tag_codes = np.unique(np.asarray(buffer["tag"], dtype=str), return_inverse=True)
+        columns = {
+            "ts": np.asarray(buffer["ts"], dtype=np.float64),
+            "user_id": np.asarray(buffer["user_id"], dtype=np.int64),
+            "from_step": np.asarray(buffer["from_step"], dtype=np.int8),
+            "to_step": np.asarray(buffer["to_step"], dtype=np.int8),
+            "tag": tag_codes.astype(np.int32),
+        }
+        return self.write_columns(columns, tag_values)
+
+    def write_columns(self, columns: Dict[str, np.ndarray], tag_values: np.ndarray) -> int:
+        """Write ready event columns (bulk import), split into day partitions."""
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        days = (columns["ts"] // 86400).astype(np.int64)
+        for day in np.unique(days):
+            mask = days == day
+            chunk = {name: np.asarray(columns[name])[mask] for name in COLUMNS}
+            self._write_chunk(date(1970, 1, 1) + timedelta(days=int(day)), chunk, tag_values, sequence)
+        self.written += len(days)
+        return len(days)
+
+    def _write_chunk(self, day: date, columns: Dict[str, np.ndarray], tag_values: np.ndarray, sequence: int) -> None:
+        directory = os.path.join(self.root, partition_name(day))
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{int(time.time() * 1000)}-{os.getpid()}-{sequence:06d}.npz")
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as handle:
+            np.savez(handle, tag_values=tag_values, **columns)
+        os.replace(temporary, path)
+        logging.info("Funnel events flushed: %s rows to %s", len(columns["ts"]), path)
+
+
+def _partition_day(path: str) -> Optional[date]:
+    name = os.path.basename(path)
+    try:
+        return date.fromisoformat(name[len(PARTITION_PREFIX) :])
+    except ValueError:
+        return None
+
+
+def read_events(root: str, since: Optional[date] = None, until: Optional[date] = None) -> Dict[str, np.ndarray]:
+    """
+    Load events of days since..until (inclusive) into columns.
+
+    Returns:
+        dict: COLUMNS as arrays plus tag_values, the vocabulary of the tag codes
+    """
+    chunks = []
+    for directory in sorted(glob.glob(os.path.join(root, f"{PARTITION_PREFIX}*"))):
+        day = _partition_day(directory)
+        if day is None or (since and day < since) or (until and day > until):
+            continue
+        for path in sorted(glob.glob(os.path.join(directory, "*.npz"))):
+            with np.load(path) as data:
+                chunks.append({name: data[name] for name in (*COLUMNS, "tag_values")})
+
+    if not chunks:
+        empty = {name: np.empty(0, dtype=dtype) for name, dtype in zip(COLUMNS, (np.float64, np.int64, np.int8, np.int8, np.int32))}
+        return {**empty, "tag_values": np.empty(0, dtype=str)}
+
+    tag_values = np.unique(np.concatenate([chunk["tag_values"] for chunk in chunks]))
+    events = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in COLUMNS if name != "tag"}
+    events["tag"] = np.concatenate(
+        [np.searchsorted(tag_values, chunk["tag_values"]).astype(np.int32)[chunk["tag"]] for chunk in chunks]
+    )
+    events["tag_values"] = tag_values
+    return events
+
+
+def funnel_report(events: Dict[str, np.ndarray], tags: Optional[Sequence[str]] = None) -> List[Dict]:
+    """
+    Conversion and drop-off per step, for all sessions and per tag.
+
+    A session starts with a transition from START (/start) or with the first
+    event of a user; its tag is the tag of that first event. `reached` counts
+    sessions that were asked the step's question, `dropped` those whose last
+    step it was.
+
+    Args:
+        events: Columns from read_events()
+        tags: Only report these tags (all tags when None)
+
+    Returns:
+        list: One dict per tag ("*" = all) with sessions, cancelled and steps
+    """
+    total = len(events["ts"])
+    tag_values = list(events["tag_values"])
+    if total == 0:
+        return []
+
+    order = np.lexsort((events["ts"], events["user_id"]))
+    user_id = events["user_id"][order]
+    from_step = events["from_step"][order]
+    to_step = events["to_step"][order].astype(np.int64)
+    tag = events["tag"][order].astype(np.int64)
+
+    first = np.ones(total, dtype=bool)
+    first[1:] = (user_id[1:] != user_id[:-1]) | (from_step[1:] == START)
+    session = np.cumsum(first) - 1
+    sessions = int(session[-1]) + 1
+    last = np.ones(total, dtype=bool)
+    last[:-1] = first[1:]
+    session_tag = tag[first]
+    session_last_step = to_step[last]
+
+    step_count = len(STEPS)
+    reached = np.zeros((sessions, step_count), dtype=bool)
+    reached[session, to_step] = True
+    reached_rows, reached_steps = np.nonzero(reached)
+    group_count = len(tag_values)
+    by_tag_reached = np.bincount(
+        session_tag[reached_rows] * step_count + reached_steps, minlength=group_count * step_count
+    ).reshape(group_count, step_count)
+    by_tag_last = np.bincount(
+        session_tag * step_count + session_last_step, minlength=group_count * step_count
+    ).reshape(group_count, step_count)
+    by_tag_sessions = np.bincount(session_tag, minlength=group_count)
+
+    groups = [(ALL_TAGS, by_tag_reached.sum(axis=0), by_tag_last.sum(axis=0), sessions)]
+    for code in np.argsort(-by_tag_sessions, kind="stable"):
+        groups.append((tag_values[code], by_tag_reached[code], by_tag_last[code], int(by_tag_sessions[code])))
+
+    report = []
+    for name, reached_counts, last_counts, session_count in groups:
+        if tags is not None and name not in tags:
+            continue
+        steps = []
+        previous = session_count
+        for step in FUNNEL_STEPS:
+            code = STEP_CODES[step]
+            count = int(reached_counts[code])
+            steps.append(
+                {
+                    "step": step,
+                    "reached": count,
+                    "step_conversion": count / previous if previous else 0.0,
+                    "conversion": count / session_count if session_count else 0.0,
+                    "dropped": 0 if code == END else int(last_counts[code]),
+                }
+            )
+            previous = count
+        report.append(
+            {"tag": name, "sessions": session_count, "cancelled": int(last_counts[CANCEL]), "steps": steps}
+        )
+    return report
+
+
+def render_report(report: List[Dict]) -> str:
+    lines = []
+    for group in report:
+        title = "All tags" if group["tag"] == ALL_TAGS else f"Tag: {group['tag'] or '-'}"
+        lines.append(f"{title} - {group['sessions']} sessions, {group['cancelled']} cancelled")
+        lines.append(f"{'step':<12} {'reached':>9} {'from prev':>10} {'total':>8} {'dropped':>9}")
+        for step in group["steps"]:
+            lines.append(
+                f"{step['step']:<12} {step['reached']:>9} {step['step_conversion']:>10.1%} "
+                f"{step['conversion']:>8.1%} {step['dropped']:>9}"
+            )
+        lines.append("")
+    return "\n".join(lines)
+
+
+def synthetic_events(sessions: int, tags: Sequence[str] = ("", "spring", "avito", "vk"), seed: int = 0) -> Dict:
+    """
+    Random funnel sessions as event columns (for trying queries at scale).
+
+    Each session walks the funnel and stops at a random step; a few cancel.
+    """
+    rng = np.random.default_rng(seed)
+    path = np.array([STEP_CODES[step] for step in FUNNEL_STEPS], dtype=np.int8)
+    # Number of steps reached, at least PHONE
+    lengths = np.minimum(rng.geometric(0.18, sessions), len(path))
+    cancelled = (rng.random(sessions) < 0.05) & (lengths < len(path))
+    event_counts = lengths + cancelled
+    session = np.repeat(np.arange(sessions), event_counts)
+    offset = np.arange(len(session)) - np.repeat(np.cumsum(event_counts) - event_counts, event_counts)
+
+    to_step = path[np.minimum(offset, len(path) - 1)]
+    is_cancel = offset == np.repeat(lengths, event_counts)
+    to_step[is_cancel] = CANCEL
+    from_step = np.where(offset == 0, START, path[np.maximum(offset - 1, 0)]).astype(np.int8)
+    started = time.time() - rng.random(sessions) * 86400
+    return {
+        "ts": np.repeat(started, event_counts) + offset * 30.0,
+        "user_id": np.repeat(rng.integers(1, sessions * 2, sessions), event_counts),
+        "from_step": from_step,
+        "to_step": to_step,
+        "tag": np.repeat(rng.integers(0, len(tags), sessions).astype(np.int32), event_counts),
+        "tag_values": np.asarray(tags, dtype=str),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Funnel event log: conversion and drop-off reports")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = commands.add_parser("report", help="Conversion and drop-off per step and tag")
+    report_parser.add_argument("root")
+    report_parser.add_argument("--since", type=date.fromisoformat)
+    report_parser.add_argument("--until", type=date.fromisoformat)
+    report_parser.add_argument("--tag", action="append", help="Only these tags (repeatable, * = all)")
+    report_parser.add_argument("--json", action="store_true")
+
+    generate_parser = commands.add_parser("generate", help="Write synthetic sessions into a log directory")
+    generate_parser.add_argument("root")
+    generate_parser.add_argument("--sessions", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        events = synthetic_events(args.sessions)
+        written = FunnelEventLog(args.root).write_columns(events, events["tag_values"])
+        print(f"Written {written} events to {args.root}")
+        return
+
+    started = time.perf_counter()
+    events = read_events(args.root, args.since, args.until)
+    loaded = time.perf_counter()
+    report = funnel_report(events, args.tag)
+    elapsed = time.perf_counter() - loaded
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(render_report(report))
+    print(f"{len(events['ts'])} events: loaded in {loaded - started:.2f} s, aggregated in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Funnel Stats - live per-tag funnel counters for the admin /stats command
+
+Counters are updated incrementally on every funnel transition (the same
+listener that feeds funnel_events.py), so answering /stats never scans
+sessions or events:
+- per day and tag: sessions started, step entries, cancels, conversions to
+  the manager (manager=true: CLIENT_NAME or END reached), and a histogram of
+  time spent in each step, from which the median is read
+- per tag and step: sessions currently in that step; sessions idle longer
+  than `idle_seconds` stop counting as active (expired oldest-first from an
+  ordered dict, amortized O(1) per event)
+
+The counters are snapshotted to a JSON file periodically and restored on
+startup, so a restart does not reset today's numbers.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from funnel_steps import FUNNEL_STEPS
+
+# Upper bounds of time-in-step buckets, seconds
+STEP_TIME_BUCKETS = (2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600, 1200, 1800, 3600, 7200, 21600, 86400)
+SESSION_IDLE_SECONDS = 24 * 3600
+DAYS_KEPT = 7
+SNAPSHOT_SECONDS = 60.0
+SNAPSHOT_VERSION = 1
+
+# Reaching these steps means the user asked to be passed to a manager
+CONVERSION_STEPS = frozenset({"CLIENT_NAME", "END"})
+TERMINAL_STEPS = frozenset({"END", "CANCEL"})
+
+
+class StepTimes:
+    """Fixed-bucket histogram of time spent in a step."""
+
+    __slots__ = ("counts",)
+
+    def __init__(self, counts: Optional[List[int]] = None):
+        self.counts = counts or [0] * (len(STEP_TIME_BUCKETS) + 1)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(STEP_TIME_BUCKETS, seconds)] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts)
+
+    def median(self) -> Optional[float]:
+        """Median interpolated inside its bucket; None without observations."""
+        total = self.total
+        if not total:
+            return None
+        target = total / 2
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                low = STEP_TIME_BUCKETS[index - 1] if index else 0
+                high = STEP_TIME_BUCKETS[index] if index < len(STEP_TIME_BUCKETS) else low * 2
+                return low + (high - low) * (target - seen) / count
+            seen += count
+        return float(STEP_TIME_BUCKETS[-1])
+
+
+class TagDay:
+    """Counters of one tag for one day."""
+
+    __slots__ = ("started", "conversions", "cancelled", "entered", "step_times")
+
+    def __init__(self):
+        self.started = 0
+        self.conversions = 0
+        self.cancelled = 0
+        self.entered: Dict[str, int] = {}
+        self.step_times: Dict[str, StepTimes] = {}
+
+    def to_dict(self) -> Dict:
+        return {
+            "started": self.started,
+            "conversions": self.conversions,
+            "cancelled": self.cancelled,
+            "entered": self.entered,
+            "step_times": {step: times.counts for step, times in self.step_times.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "TagDay":
+        counters = cls()
+        counters.started = data["started"]
+        counters.conversions = data["conversions"]
+        counters.cancelled = data["cancelled"]
+        counters.entered = dict(data["entered"])
+        counters.step_times = {step: StepTimes(list(counts)) for step, counts in data["step_times"].items()}
+        return counters
+
+
+class FunnelCounters:
+    """Thread-safe live funnel counters."""
+
+    def __init__(
+        self,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+        days_kept: int = DAYS_KEPT,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            idle_seconds: Sessions without transitions for this long are no longer active
+            days_kept: Daily counters kept in memory and snapshots
+            clock: Source of unix time (tests pass a fake)
+        """
+        self.idle_seconds = idle_seconds
+        self.days_kept = days_kept
+        self.clock = clock
+        # user id -> [tag, step, entered_at, converted], least recently active first
+        self._sessions: "OrderedDict[int, list]" = OrderedDict()
+        self._active: Dict[str, Dict[str, int]] = {}
+        self._days: Dict[str, Dict[str, TagDay]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def day_key(timestamp: float) -> str:
+        return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+    def _tag_day(self, day: str, tag: str) -> TagDay:
+        tags = self._days.get(day)
+        if tags is None:
+            tags = self._days[day] = {}
+            for stale in sorted(self._days)[: -self.days_kept]:
+                del self._days[stale]
+        counters = tags.get(tag)
+        if counters is None:
+            counters = tags[tag] = TagDay()
+        return counters
+
+    def _set_active(self, tag: str, step: str, delta: int) -> None:
+        steps = self._active.setdefault(tag, {})
+        steps[step] = steps.get(step, 0) + delta
+
+    def _expire(self, now: float) -> None:
+        deadline = now - self.idle_seconds
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session[2] >= deadline:
+                break
+            del self._sessions[user_id]
+            self._set_active(session[0], session[1], -1)
+
+    def record(self, user_id: int, tag: Optional[str], from_step: str, to_step: str, ts: Optional[float] = None) -> None:
+        """Apply one funnel transition (same arguments as FunnelEventLog.append)."""
+        now = self.clock() if ts is None else ts
+        with self._lock:
+            self._expire(now)
+            day = self.day_key(now)
+            session = self._sessions.pop(user_id, None)
+            if session is not None:
+                self._set_active(session[0], session[1], -1)
+
+            if from_step == "START" or session is None:
+                tag, converted = tag or "", False
+                counters = self._tag_day(day, tag)
+                counters.started += 1
+            else:
+                tag, previous, entered_at, converted = session
+                counters = self._tag_day(day, tag)
+                counters.step_times.setdefault(previous, StepTimes()).observe(now - entered_at)
+
+            counters.entered[to_step] = counters.entered.get(to_step, 0) + 1
+            if to_step in CONVERSION_STEPS and not converted:
+                counters.conversions += 1
+                converted = True
+            if to_step == "CANCEL":
+                counters.cancelled += 1
+            if to_step not in TERMINAL_STEPS:
+                self._sessions[user_id] = [tag, to_step, now, converted]
+                self._set_active(tag, to_step, 1)
+
+    def report(self, day: Optional[str] = None) -> Dict:
+        """
+        Counters of a day (today by default) per tag; cost does not depend on traffic.
+
+        Returns:
+            dict: day and tags -> {started, active, conversions, cancelled, steps: {step: {entered, active, median_seconds}}}
+        """
+        with self._lock:
+            self._expire(self.clock())
+            day = day or self.day_key(self.clock())
+            day_tags = self._days.get(day, {})
+            tags = {}
+            for tag in sorted(set(day_tags) | {tag for tag, steps in self._active.items() if any(steps.values())}):
+                counters = day_tags.get(tag, TagDay())
+                active = self._active.get(tag, {})
+                steps = {}
+                for step in FUNNEL_STEPS:
+                    times = counters.step_times.get(step)
+                    steps[step] = {
+                        "entered": counters.entered.get(step, 0),
+                        "active": active.get(step, 0),
+                        "median_seconds": times.median() if times else None,
+                    }
+                tags[tag] = {
+                    "started": counters.started,
+                    "active": sum(active.values()),
+                    "conversions": counters.conversions,
+                    "cancelled": counters.cancelled,
+                    "steps": steps,
+                }
+            return {"day": day, "tags": tags}
+
+    # ---- snapshots ----
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "version": SNAPSHOT_VERSION,
+                "saved_at": self.clock(),
+                "sessions": [[user_id, *session] for user_id, session in self._sessions.items()],
+                "days": {
+                    day: {tag: counters.to_dict() for tag, counters in tags.items()} for day, tags in self._days.items()
+                },
+            }
+
+    def restore(self, data: Dict) -> None:
+        """Replace counters with a snapshot; active counts are rebuilt from its sessions."""
+        if data.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported funnel stats snapshot version: {data.get('version')}")
+        with self._lock:
+            self._days = {
+                day: {tag: TagDay.from_dict(counters) for tag, counters in tags.items()}
+                for day, tags in data["days"].items()
+            }
+            self._sessions = OrderedDict()
+            self._active = {}
+            for user_id, tag, step, entered_at, converted in sorted(data["sessions"], key=lambda row: row[3]):
+                self._sessions[user_id] = [tag, step, entered_at, converted]
+                self._set_active(tag, step, 1)
+            self._expire(self.clock())
+
+    def save(self, path: str) -> None:
+        """Write a snapshot atomically (temp file + rename)."""
+        data = self.snapshot()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(data, handle, ensure_ascii=False)
+        os.replace(temporary, path)
+
+    def load(self, path: str) -> bool:
+        """Restore from a snapshot file if it exists; a broken file is logged and ignored."""
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, encoding="utf-8") as handle:
+                self.restore(json.load(handle))
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            logging.warning("Funnel stats snapshot %s not loaded: %s", path, exc)
+            return False
+        return True
+
+
+async def snapshot_periodically(counters: FunnelCounters, path: str, interval: float = SNAPSHOT_SECONDS) -> None:
+    """Save counters every `interval` seconds until cancelled (file IO in a worker thread)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(counters.save, path)
+        except OSError as exc:
+            logging.warning("Funnel stats snapshot failed: %s", exc)
@@ -0,0 +1,13 @@
+"""
+Funnel Steps - step vocabulary shared by the event log and the live counters
+
+Kept free of NumPy and other heavy imports: bot.py needs it on every
+transition, while the columnar log (funnel_events.py) is loaded lazily.
+"""
+
+# Step vocabulary; codes are positions and must never be reordered
+STEPS = ("START", "PHONE", "BRAND", "MODEL", "CITY", "YEAR_TO", "BUDGET", "MANAGER", "CLIENT_NAME", "END", "CANCEL")
+STEP_CODES = {name: code for code, name in enumerate(STEPS)}
+
+# Report order: END is the handoff to a manager, CANCEL is reported separately
+FUNNEL_STEPS = ("PHONE", "BRAND", "MODEL", "CITY", "YEAR_TO", "BUDGET", "MANAGER", "CLIENT_NAME", "END")
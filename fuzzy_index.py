@@ -0,0 +1,161 @@
+"""
+Fuzzy Index - fast lookup of canonical names in free-text user input
+
+Every canonical value and alias is reduced to a Latin key (Cyrillic is
+transliterated, case, spaces and punctuation are dropped), so "Хавал",
+"HAVAL" and "haval" meet in one key space and "tiggo7" equals "Tiggo 7".
+Keys are indexed three ways:
+- exact dictionary for complete keys
+- prefix trie for partially typed names
+- character trigrams for typos
+A lookup touches only the posting lists of the query's trigrams, which keeps
+it well under a millisecond for catalogs of thousands of names.
+"""
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Digraphs first: "дж" is how "j" is written in brand names (Джолион -> Jolion)
+CYRILLIC_DIGRAPHS = (("дж", "j"), ("кс", "x"))
+
+CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e",
+    "ж": "zh", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "h", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "",
+    "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+}
+
+# Minimal score for a fuzzy match and the lead it needs over the runner-up
+MIN_SCORE = 0.5
+MIN_MARGIN = 0.05
+
+
+class Match(NamedTuple):
+    value: str
+    score: float
+
+
+def transliterate(text: str) -> str:
+    """Lowercase text with Cyrillic letters replaced by Latin ones."""
+    text = text.casefold()
+    for cyrillic, latin in CYRILLIC_DIGRAPHS:
+        text = text.replace(cyrillic, latin)
+    return "".join(CYRILLIC_TO_LATIN.get(ch, ch) for ch in text)
+
+
+def normalize_key(text: Optional[str]) -> str:
+    """Latin, lowercase, alphanumeric-only key for matching."""
+    if not text:
+        return ""
+    return "".join(ch for ch in transliterate(text) if ch.isalnum())
+
+
+def trigrams(key: str) -> List[str]:
+    padded = f"  {key} "
+    return [padded[i : i + 3] for i in range(len(padded) - 2)]
+
+
+class FuzzyIndex:
+    """Index of canonical values with aliases; values keep insertion order as priority."""
+
+    def __init__(self, entries: Iterable[Tuple[str, Iterable[str]]] = ()):
+        """
+        Args:
+            entries: (canonical value, aliases) pairs, most popular first
+        """
+        self.values: List[str] = []
+        self._value_ids: Dict[str, int] = {}
+        self._exact: Dict[str, int] = {}
+        self._keys: List[Tuple[str, int]] = []
+        self._gram_counts: List[int] = []
+        self._trigram_postings: Dict[str, List[int]] = {}
+        self._trie: Dict = {}
+        for value, aliases in entries:
+            self.add(value, aliases)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, value: str, aliases: Iterable[str] = ()) -> None:
+        """Add canonical value with alternative spellings."""
+        value_id = self._value_ids.get(value)
+        if value_id is None:
+            value_id = len(self.values)
+            self._value_ids[value] = value_id
+            self.values.append(value)
+
+        for name in (value, *aliases):
+            key = normalize_key(name)
+            if not key or key in self._exact:
+                continue
+            self._exact[key] = value_id
+            key_id = len(self._keys)
+            self._keys.append((key, value_id))
+            grams = set(trigrams(key))
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._trigram_postings.setdefault(gram, []).append(key_id)
+
+            # Every trie node lists the keys below it, so completion never scans the catalog
+            node = self._trie
+            for ch in key:
+                node = node.setdefault(ch, {})
+                node.setdefault("", []).append(key_id)
+
+    def _prefix_keys(self, key: str) -> List[int]:
+        node = self._trie
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                return []
+        return node.get("", [])
+
+    def complete(self, text: str, limit: int = 10) -> List[str]:
+        """Values having a name that starts with text, in priority order."""
+        value_ids = sorted({self._keys[key_id][1] for key_id in self._prefix_keys(normalize_key(text))})
+        return [self.values[value_id] for value_id in value_ids[:limit]]
+
+    def candidates(self, text: str, limit: int = 5) -> List[Match]:
+        """Best scoring values for text, best first."""
+        key = normalize_key(text)
+        if not key:
+            return []
+        scores: Dict[int, float] = {}
+        if key in self._exact:
+            scores[self._exact[key]] = 1.0
+
+        # Trigram similarity (Dice coefficient) over posting lists only
+        query_grams = set(trigrams(key))
+        common: Dict[int, int] = {}
+        for gram in query_grams:
+            for key_id in self._trigram_postings.get(gram, ()):
+                common[key_id] = common.get(key_id, 0) + 1
+        for key_id, shared in common.items():
+            value_id = self._keys[key_id][1]
+            score = 2.0 * shared / (len(query_grams) + self._gram_counts[key_id])
+            if score > scores.get(value_id, 0.0):
+                scores[value_id] = score
+
+        # Prefix completions: the more of the name is typed, the higher the score
+        for key_id in self._prefix_keys(key):
+            candidate_key, value_id = self._keys[key_id]
+            score = 0.5 + 0.5 * len(key) / len(candidate_key)
+            if score > scores.get(value_id, 0.0):
+                scores[value_id] = score
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [Match(self.values[value_id], round(score, 3)) for value_id, score in ranked[:limit]]
+
+    def lookup(self, text: str, min_score: float = MIN_SCORE) -> Optional[Match]:
+        """Best canonical match, or None when nothing is close or the result is ambiguous."""
+        found = self.candidates(text, limit=2)
+        if not found or found[0].score < min_score:
+            return None
+        if found[0].score < 1.0:
+            if len(found) > 1 and found[0].score - found[1].score < MIN_MARGIN:
+                return None
+            # "тигго" starts several models: let the user pick instead of guessing
+            completions = {self._keys[key_id][1] for key_id in self._prefix_keys(normalize_key(text))}
+            if len(completions) > 1:
+                return None
+        return found[0]
@@ -0,0 +1,849 @@
+"""
+Apps Script Stand-in - local replica of GAS/GET.js for hermetic sync tests
+
+Reproduces `processData` from GAS/GET.js over HTTP: the field map with its
+aliases, lookup by tg_user_id with phone fallback, create/update of rows,
+headers added on demand and the script lock (taken with tryLock(10000) and,
+exactly like the original, processing goes on even if the lock times out).
+The "sheet" lives in SQLite (":memory:" by default); every cell read/write is
+a separate statement, so without the lock concurrent requests interleave the
+same way Spreadsheet API calls do.
+
+Latency and failures of the real deployment can be injected per request.
+GET with mode=export pages through changed rows like exportRows() in GET.js,
+mode=hashes returns content hashes per tg_user_id (rowHashes), and a POST of
+{"leads": [...]} writes many leads at once (processBatch).
+
+setup_sharding() switches to the sharded layout of GET.js (SHARDING=on):
+monthly shard tabs with a row cap, the _directory index and rotate_shards()
+moving old tabs to yearly archives; the clock decides the current month.
+
+Usage:
+    python gas_standin.py --port 8090 --latency-ms 800 --error-rate 0.02
+    SHEET_SYNC_URL=http://127.0.0.1:8090/exec python bot.py
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from lead_registry import normalize_phone
+from reconcile import HASH_FIELDS, row_hash
+
+# Same order and aliases as fieldMap in GAS/GET.js
+FIELD_MAP = {
+    "phone_number": ["phone", "phone_number", "mobile"],
+    "timestamp": ["timestamp"],
+    "brand": ["brand", "marka"],
+    "model": ["model"],
+    "year": ["year", "god"],
+    "city": ["city", "gorod", "location"],
+    "city_hub": ["city_hub", "hub"],
+    "budget": ["budget", "price"],
+    "manager": ["manager", "manager_consent", "consent", "soglasie"],
+    "client_name": ["client_name", "name"],
+    "tg_user_id": ["tg_user_id", "user_id"],
+    "tg_username": ["tg_username", "username"],
+    "tag": ["tag", "source", "utm"],
+}
+
+LOCK_TIMEOUT_SECONDS = 10.0
+EXPORT_DEFAULT_LIMIT = 500
+EXPORT_MAX_LIMIT = 5000
+
+# Sharding settings and the directory layout of GET.js
+SHARD_PREFIX = "leads_"
+SHARD_PATTERN = re.compile(r"^leads_(\d{4})_(\d{2})(?:_\d{2})?$")
+SHARD_MAX_ROWS = 20000
+HOT_SHARD_MONTHS = 3
+DIRECTORY_HEADERS = ["tg_user_id", "phone_number", "shard", "row", "archive_id", "hash"]
+
+_MISSING = object()
+
+
+def js_string(value) -> str:
+    """String(value) as Apps Script sees a cell value."""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def parse_export_time(value) -> int:
+    """parseExportTime from GET.js: unix milliseconds of an ISO string or digits, 0 if unparsable."""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    text = str(value)
+    if text.isdigit():
+        return int(text)
+    try:
+        return int(datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp() * 1000)
+    except ValueError:
+        return 0
+
+
+def parse_export_cursor(cursor) -> Tuple[int, str, int]:
+    """parseExportCursor from GET.js: "ms:row" or, with sharding, "ms:shard:row"."""
+    parts = str(cursor).split(":")
+    number = lambda text: int(text) if text.isdigit() else 0
+    if len(parts) > 2:
+        return number(parts[0]), parts[1], number(parts[2])
+    return number(parts[0]), "", number(parts[1] if len(parts) > 1 else "")
+
+
+def export_cursor(key: Tuple[int, str, int]) -> str:
+    time_ms, shard, row_number = key
+    return f"{time_ms}:{shard}:{row_number}" if shard else f"{time_ms}:{row_number}"
+
+
+def shard_month(moment: datetime) -> str:
+    return moment.strftime("%Y_%m")
+
+
+def _first_present(data: Dict, keys: List[str]):
+    """Value of the first alias present in data (JS `!== undefined`), or _MISSING."""
+    for key in keys:
+        if key in data:
+            return data[key]
+    return _MISSING
+
+
+def apply_lead(row: List, data: Dict, columns: Dict[str, int], phone: str, timestamp: str) -> None:
+    """applyLead from GET.js: lead fields into the row; None never overwrites a cell."""
+    for key, aliases in FIELD_MAP.items():
+        if key == "phone_number":
+            if phone:
+                row[columns[key]] = phone
+            continue
+        value = timestamp if key == "timestamp" else _first_present(data, aliases)
+        if value is not _MISSING and value is not None:
+            row[columns[key]] = value
+
+
+class SheetStore:
+    """Sheet emulated in SQLite: a header row plus data rows numbered from 2."""
+
+    def __init__(self, path: str = ":memory:"):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS headers (position INTEGER PRIMARY KEY, name TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS rows (row_number INTEGER PRIMARY KEY, cells TEXT)")
+        self._db.commit()
+        # Serializes single statements only, like individual Spreadsheet API calls
+        self._mutex = threading.Lock()
+
+    def headers(self) -> List[str]:
+        with self._mutex:
+            return [name for (name,) in self._db.execute("SELECT name FROM headers ORDER BY position")]
+
+    def set_header(self, position: int, name: str) -> None:
+        with self._mutex:
+            self._db.execute("INSERT OR REPLACE INTO headers VALUES (?, ?)", (position, name))
+            self._db.commit()
+
+    def last_row(self) -> int:
+        with self._mutex:
+            (last,) = self._db.execute("SELECT MAX(row_number) FROM rows").fetchone()
+        return last or 1
+
+    def values(self) -> List[List]:
+        """All data rows (row 2 onwards)."""
+        with self._mutex:
+            return [json.loads(cells) for (cells,) in self._db.execute("SELECT cells FROM rows ORDER BY row_number")]
+
+    def row(self, row_number: int) -> Optional[List]:
+        """Cells of one row, or None past the last row."""
+        with self._mutex:
+            found = self._db.execute("SELECT cells FROM rows WHERE row_number = ?", (row_number,)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def set_value(self, row_number: int, position: int, value) -> None:
+        with self._mutex:
+            (cells,) = self._db.execute("SELECT cells FROM rows WHERE row_number = ?", (row_number,)).fetchone()
+            cells = json.loads(cells)
+            cells.extend([""] * (position + 1 - len(cells)))
+            cells[position] = value
+            self._db.execute("UPDATE rows SET cells = ? WHERE row_number = ?", (json.dumps(cells, ensure_ascii=False), row_number))
+            self._db.commit()
+
+    def append_row(self, cells: List) -> int:
+        with self._mutex:
+            cursor = self._db.execute(
+                "INSERT INTO rows (row_number, cells) VALUES ((SELECT COALESCE(MAX(row_number), 1) + 1 FROM rows), ?)",
+                (json.dumps(cells, ensure_ascii=False),),
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def set_rows(self, first_row: int, rows: List[List]) -> None:
+        """Write consecutive rows in one statement batch, like Range.setValues."""
+        with self._mutex:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO rows (row_number, cells) VALUES (?, ?)",
+                [(first_row + offset, json.dumps(cells, ensure_ascii=False)) for offset, cells in enumerate(rows)],
+            )
+            self._db.commit()
+
+    def records(self) -> List[Dict]:
+        """Rows as dicts keyed by header."""
+        headers = self.headers()
+        return [dict(zip(headers, row + [""] * (len(headers) - len(row)))) for row in self.values()]
+
+    def duplicate_users(self) -> Dict[str, int]:
+        """tg_user_id values present in more than one row (lost races)."""
+        counts = Counter(js_string(record.get("tg_user_id")) for record in self.records())
+        return {user_id: count for user_id, count in counts.items() if user_id and count > 1}
+
+
+def ensure_columns(store: SheetStore) -> Tuple[List[str], Dict[str, int]]:
+    """ensureColumns from GET.js: add missing field-map headers, return headers and indexes."""
+    headers = store.headers()
+    for key in FIELD_MAP:
+        if key not in headers:
+            store.set_header(len(headers), key)
+            headers.append(key)
+    return headers, {key: headers.index(key) for key in FIELD_MAP}
+
+
+class ShardedSheets:
+    """Shard tabs, the _directory index and yearly archives of GET.js with SHARDING=on."""
+
+    def __init__(self, max_rows: int = SHARD_MAX_ROWS, hot_months: int = HOT_SHARD_MONTHS):
+        self.max_rows = max_rows
+        self.hot_months = hot_months
+        self.tabs: Dict[str, SheetStore] = {}
+        self.archives: Dict[str, Dict[str, SheetStore]] = {}
+        self.directory = SheetStore()
+        for position, name in enumerate(DIRECTORY_HEADERS):
+            self.directory.set_header(position, name)
+        # Shard rows read per lookup: stays at one while the tabs grow
+        self.stats = Counter()
+
+    def working_tabs(self) -> List[Tuple[str, SheetStore]]:
+        """Shard tabs of the working spreadsheet in name order (workingSheets)."""
+        return sorted(self.tabs.items())
+
+    def current_shard(self, now: datetime) -> str:
+        """currentShard from GET.js: this month's tab, or its next part once full."""
+        base = SHARD_PREFIX + shard_month(now)
+        name, part = base, 2
+        while name in self.tabs and self.tabs[name].last_row() - 1 >= self.max_rows:
+            name = f"{base}_{part:02d}"
+            part += 1
+        if name not in self.tabs:
+            self.tabs[name] = SheetStore()
+            ensure_columns(self.tabs[name])
+        return name
+
+    def entries(self) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+        """Directory entries by tg_user_id and by phone; the first row wins on repeats."""
+        by_id, by_phone = {}, {}
+        rows = self.directory.values()
+        for offset in range(len(rows) - 1, -1, -1):
+            cells = rows[offset] + [""] * (len(DIRECTORY_HEADERS) - len(rows[offset]))
+            entry = dict(zip(DIRECTORY_HEADERS, cells), dir_row=offset + 2)
+            if entry["tg_user_id"]:
+                by_id[entry["tg_user_id"]] = entry
+            if entry["phone_number"]:
+                by_phone[entry["phone_number"]] = entry
+        return by_id, by_phone
+
+    def _save(self, entry: Dict) -> None:
+        cells = [entry[name] for name in DIRECTORY_HEADERS]
+        if entry.get("dir_row"):
+            self.directory.set_rows(entry["dir_row"], [cells])
+        else:
+            entry["dir_row"] = self.directory.append_row(cells)
+
+    def _locate(self, entry: Dict, now: datetime) -> Optional[Tuple[str, Optional[int], List]]:
+        """locateRow from GET.js: (shard, row or None for a new row, cells); archived leads move to the current shard."""
+        if entry["archive_id"]:
+            archived = self.archives.get(entry["archive_id"], {}).get(entry["shard"])
+            cells = archived.row(int(entry["row"])) if archived else None
+            if cells is None:
+                return None
+            record = dict(zip(archived.headers(), cells))
+            if js_string(record.get("tg_user_id")) != entry["tg_user_id"]:
+                return None
+            name = self.current_shard(now)
+            headers, _ = ensure_columns(self.tabs[name])
+            return name, None, [record.get(header, "") for header in headers]
+        store = self.tabs.get(entry["shard"])
+        if store is None:
+            return None
+        headers, columns = ensure_columns(store)
+        row_number = int(entry["row"] or 0)
+        cells = store.row(row_number)
+        self.stats["shard_rows_read"] += 1
+        if cells is None or js_string(cells[columns["tg_user_id"]]) != entry["tg_user_id"]:
+            # Rows were moved by hand: TextFinder over the same tab
+            values = store.values()
+            self.stats["shard_rows_read"] += len(values)
+            row_number = next(
+                (offset + 2 for offset, row in enumerate(values) if js_string(row[columns["tg_user_id"]]) == entry["tg_user_id"]),
+                None,
+            )
+            if row_number is None:
+                return None
+            cells = values[row_number - 2]
+        return entry["shard"], row_number, cells + [""] * (len(headers) - len(cells))
+
+    def write(self, leads: List[Dict], now: datetime) -> Dict:
+        """writeSharded from GET.js: leads in order, looked up through the directory."""
+        timestamp = now.isoformat(timespec="milliseconds")
+        by_id, by_phone = self.entries()
+        result = {"created": 0, "updated": 0, "restored": 0, "errors": 0, "actions": [], "columns": None}
+        for data in leads:
+            tg_user_id = data.get("tg_user_id") or data.get("user_id")
+            if not tg_user_id:
+                result["errors"] += 1
+                result["actions"].append("error")
+                continue
+            phone = normalize_phone(data.get("phone") or data.get("phone_number") or data.get("mobile"))
+            entry = by_id.get(js_string(tg_user_id)) or (by_phone.get(phone) if phone else None)
+            located = self._locate(entry, now) if entry else None
+            if located is None:
+                name = self.current_shard(now)
+                headers, _ = ensure_columns(self.tabs[name])
+                located = (name, None, [""] * len(headers))
+                action = "created"
+            else:
+                action = "updated"
+                if entry["archive_id"]:
+                    result["restored"] += 1
+            result[action] += 1
+            result["actions"].append(action)
+
+            name, row_number, cells = located
+            headers, columns = ensure_columns(self.tabs[name])
+            apply_lead(cells, data, columns, phone, timestamp)
+            if row_number is None:
+                row_number = self.tabs[name].append_row(cells)
+            else:
+                self.tabs[name].set_rows(row_number, [cells])
+
+            previous_id = entry["tg_user_id"] if entry else None
+            entry = entry or {}
+            entry.update(
+                tg_user_id=js_string(cells[columns["tg_user_id"]]),
+                phone_number=normalize_phone(cells[columns["phone_number"]]),
+                shard=name,
+                row=row_number,
+                archive_id="",
+                hash=row_hash(dict(zip(headers, cells))),
+            )
+            self._save(entry)
+            if previous_id and previous_id != entry["tg_user_id"] and by_id.get(previous_id) is entry:
+                del by_id[previous_id]
+            by_id[entry["tg_user_id"]] = entry
+            if entry["phone_number"]:
+                by_phone[entry["phone_number"]] = entry
+            result["columns"] = columns
+        return result
+
+    def adopt(self, store: SheetStore, now: datetime) -> str:
+        """setupSharding from GET.js: the existing sheet becomes this month's shard and is indexed."""
+        name = SHARD_PREFIX + shard_month(now)
+        self.tabs[name] = store
+        headers, columns = ensure_columns(store)
+        seen = set()
+        for offset, row in enumerate(store.values()):
+            row = row + [""] * (len(headers) - len(row))
+            user_id = js_string(row[columns["tg_user_id"]])
+            if not user_id or user_id in seen:
+                continue
+            seen.add(user_id)
+            self._save({
+                "tg_user_id": user_id,
+                "phone_number": normalize_phone(row[columns["phone_number"]]),
+                "shard": name,
+                "row": offset + 2,
+                "archive_id": "",
+                "hash": row_hash(dict(zip(headers, row))),
+            })
+        return name
+
+    def rotate(self, now: datetime) -> Dict[str, str]:
+        """rotateShards from GET.js: tabs older than hot_months move to the archive of their year."""
+        year, month = divmod(now.year * 12 + now.month - 1 - (self.hot_months - 1), 12)
+        oldest_hot = shard_month(datetime(year, month + 1, 1))
+        moved = {}
+        for name in list(self.tabs):
+            match = SHARD_PATTERN.match(name)
+            if not match or f"{match[1]}_{match[2]}" >= oldest_hot:
+                continue
+            archive_id = f"archive-{match[1]}"
+            self.archives.setdefault(archive_id, {})[name] = self.tabs[name]
+            moved[name] = archive_id
+        # The last visible sheet cannot be deleted: the current shard is created ahead of its first write
+        if moved and len(moved) == len(self.tabs):
+            self.current_shard(now)
+        # Tabs first, then the directory; an interrupted rotation is re-indexed by the next one
+        for name in moved:
+            del self.tabs[name]
+        rows = self.directory.values()
+        healed = set()
+        for cells in rows:
+            if cells[4]:
+                continue
+            archive_id = moved.get(cells[2]) or self.orphaned_archive(cells[2])
+            if archive_id:
+                if cells[2] not in moved:
+                    healed.add(cells[2])
+                cells[4] = archive_id
+        if rows and (moved or healed):
+            self.directory.set_rows(2, rows)
+        self.stats["reindexed_shards"] += len(healed)
+        return moved
+
+    def orphaned_archive(self, name: str) -> str:
+        """orphanedShardArchive from GET.js: archive holding a tab an interrupted rotation deleted."""
+        match = SHARD_PATTERN.match(name)
+        if not match or name in self.tabs:
+            return ""
+        archive_id = f"archive-{match[1]}"
+        return archive_id if name in self.archives.get(archive_id, {}) else ""
+
+
+class AppsScriptStandIn:
+    """processData from GAS/GET.js with injectable latency and failures."""
+
+    def __init__(
+        self,
+        store: Optional[SheetStore] = None,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        lock_timeout: float = LOCK_TIMEOUT_SECONDS,
+        seed: Optional[int] = None,
+        export_token: str = "",
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            store: Sheet storage (new in-memory sheet by default)
+            latency_ms: Spreadsheet work time per request, spent between lookup and write
+            jitter_ms: Uniform random addition to latency_ms
+            error_rate: Share of requests failing with HTTP 500 before processing
+            lock_timeout: tryLock timeout; processing continues without the lock after it
+            export_token: EXPORT_TOKEN script property required by the export mode (empty = open)
+            clock: Script time (timestamps and the month of the shard written to)
+        """
+        self.store = store or SheetStore()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.lock_timeout = lock_timeout
+        self.export_token = export_token
+        self.clock = clock
+        # SHARDING=on after setup_sharding(); None - one sheet (self.store), as before
+        self.sharding: Optional[ShardedSheets] = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = Counter()
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _now(self) -> datetime:
+        return datetime.fromtimestamp(self.clock())
+
+    def setup_sharding(self, max_rows: int = SHARD_MAX_ROWS, hot_months: int = HOT_SHARD_MONTHS) -> str:
+        """setupSharding from GET.js: the sheet becomes the current month's shard; returns its name."""
+        with self._lock:
+            self.sharding = ShardedSheets(max_rows, hot_months)
+            return self.sharding.adopt(self.store, self._now())
+
+    def rotate_shards(self) -> Dict[str, str]:
+        """rotateShards from GET.js: archived shard name -> archive id."""
+        with self._lock:
+            return self.sharding.rotate(self._now()) if self.sharding else {}
+
+    def working_sheets(self) -> List[Tuple[str, SheetStore]]:
+        """(shard name, sheet) holding leads; the name is empty without sharding."""
+        return self.sharding.working_tabs() if self.sharding else [("", self.store)]
+
+    def records(self) -> List[Dict]:
+        """Rows of every working sheet as dicts keyed by header."""
+        return [record for _, store in self.working_sheets() for record in store.records()]
+
+    def duplicate_users(self) -> Dict[str, int]:
+        """tg_user_id values present in more than one working row (lost races)."""
+        counts = Counter(js_string(record.get("tg_user_id")) for record in self.records())
+        return {user_id: count for user_id, count in counts.items() if user_id and count > 1}
+
+    def should_fail(self) -> bool:
+        """Injected platform failure (quota, timeout) for this request."""
+        with self._stats_lock:
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+        if failed:
+            self._count("injected_errors")
+        return failed
+
+    def process_data(self, data: Dict) -> Dict:
+        """Create or update the user's row; returns the JSON response of the script."""
+        self._count("requests")
+        locked = self._lock.acquire(timeout=self.lock_timeout)
+        if not locked:
+            self._count("lock_timeouts")
+        try:
+            return self._process_locked(data)
+        except Exception as exc:
+            self._count("errors")
+            return {"status": "error", "message": str(exc)}
+        finally:
+            if locked:
+                self._lock.release()
+
+    def _process_locked(self, data: Dict) -> Dict:
+        phone_raw = data.get("phone") or data.get("phone_number") or data.get("mobile")
+        phone = normalize_phone(phone_raw)
+        tg_user_id = data.get("tg_user_id") or data.get("user_id")
+        if not tg_user_id:
+            self._count("rejected")
+            return {"status": "error", "message": "Missing tg_user_id (required for user identification)"}
+
+        if self.sharding is not None:
+            self._spend_latency()
+            written = self.sharding.write([data], self._now())
+            action, columns = written["actions"][0], written["columns"]
+        else:
+            action, columns = self._write_active_sheet(data, phone, tg_user_id)
+        self._count(action)
+
+        city = _first_present(data, FIELD_MAP["city"])
+        name = _first_present(data, FIELD_MAP["client_name"])
+        return {
+            "status": "success",
+            "action": action,
+            "phone": phone,
+            "debug_received_data": data,
+            "debug_extracted": {
+                "city": None if city is _MISSING else city,
+                "client_name": None if name is _MISSING else name,
+            },
+            "debug_col_indexes": {"city": columns["city"], "client_name": columns["client_name"]},
+        }
+
+    def _spend_latency(self) -> None:
+        with self._stats_lock:
+            delay = self.latency_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay:
+            time.sleep(delay / 1000)
+
+    def _write_active_sheet(self, data: Dict, phone: str, tg_user_id) -> Tuple[str, Dict[str, int]]:
+        """writeActiveSheet from GET.js: row-by-row lookup and cell-by-cell writes."""
+        store = self.store
+        timestamp = self._now().isoformat(timespec="milliseconds")
+        headers, columns = ensure_columns(self.store)
+
+        # Priority 1: tg_user_id, priority 2: phone - checked row by row, first hit wins
+        row_number = -1
+        if store.last_row() > 1:
+            for offset, row in enumerate(store.values()):
+                row = row + [""] * (len(headers) - len(row))
+                if js_string(row[columns["tg_user_id"]]) == js_string(tg_user_id):
+                    row_number = offset + 2
+                    break
+                if phone and normalize_phone(row[columns["phone_number"]]) == phone:
+                    row_number = offset + 2
+                    break
+
+        # Spreadsheet round trips between the lookup and the write
+        self._spend_latency()
+
+        if row_number != -1:
+            action = "updated"
+            for key, aliases in FIELD_MAP.items():
+                if key == "phone_number":
+                    if phone:
+                        store.set_value(row_number, columns[key], phone)
+                    continue
+                value = timestamp if key == "timestamp" else _first_present(data, aliases)
+                if value is not _MISSING and value is not None:
+                    store.set_value(row_number, columns[key], value)
+        else:
+            action = "created"
+            cells = [""] * len(headers)
+            for key, aliases in FIELD_MAP.items():
+                if key == "phone_number":
+                    value = phone
+                elif key == "timestamp":
+                    value = timestamp
+                else:
+                    value = _first_present(data, aliases)
+                    value = "" if value is _MISSING or value is None else value
+                cells[columns[key]] = value
+            store.append_row(cells)
+        return action, columns
+
+    def process_batch(self, leads: List[Dict]) -> Dict:
+        """processBatch from GET.js: one read, changed and new rows written in two setValues."""
+        self._count("batches")
+        locked = self._lock.acquire(timeout=self.lock_timeout)
+        if not locked:
+            self._count("lock_timeouts")
+        try:
+            if self.sharding is not None:
+                written = self.sharding.write(leads, self._now())
+                for key in ("created", "updated", "restored"):
+                    self._count(key, written[key])
+                return {"status": "success", **{key: written[key] for key in ("created", "updated", "errors")}}
+            timestamp = self._now().isoformat(timespec="milliseconds")
+            headers, columns = ensure_columns(self.store)
+            width = len(headers)
+            rows = [row + [""] * (width - len(row)) for row in self.store.values()]
+            existing = len(rows)
+            by_id, by_phone = {}, {}
+            for index in range(len(rows) - 1, -1, -1):
+                by_id[js_string(rows[index][columns["tg_user_id"]])] = index
+                cell_phone = normalize_phone(rows[index][columns["phone_number"]])
+                if cell_phone:
+                    by_phone[cell_phone] = index
+
+            dirty = set()
+            counts = Counter()
+            for data in leads:
+                tg_user_id = data.get("tg_user_id") or data.get("user_id")
+                if not tg_user_id:
+                    counts["errors"] += 1
+                    continue
+                phone = normalize_phone(data.get("phone") or data.get("phone_number") or data.get("mobile"))
+                index = by_id.get(js_string(tg_user_id))
+                if index is None and phone:
+                    index = by_phone.get(phone)
+                if index is None:
+                    index = len(rows)
+                    rows.append([""] * width)
+                    counts["created"] += 1
+                else:
+                    counts["updated"] += 1
+                    if index < existing:
+                        dirty.add(index)
+                row = rows[index]
+                apply_lead(row, data, columns, phone, timestamp)
+                by_id[js_string(row[columns["tg_user_id"]])] = index
+                if phone:
+                    by_phone[phone] = index
+
+            if dirty:
+                first, last = min(dirty), max(dirty)
+                self.store.set_rows(first + 2, rows[first : last + 1])
+            if len(rows) > existing:
+                self.store.set_rows(existing + 2, rows[existing:])
+            self._count("created", counts["created"])
+            self._count("updated", counts["updated"])
+            return {"status": "success", **{key: counts[key] for key in ("created", "updated", "errors")}}
+        finally:
+            if locked:
+                self._lock.release()
+
+    def row_hashes(self, params: Dict) -> Dict:
+        """rowHashes from GET.js: content hash of the first row of every tg_user_id."""
+        self._count("hash_requests")
+        if self.export_token and params.get("token") != self.export_token:
+            return {"status": "error", "message": "Invalid export token"}
+        hashes = {}
+        duplicates = 0
+        for record in self.records():
+            user_id = js_string(record.get("tg_user_id"))
+            if not user_id:
+                continue
+            if user_id in hashes:
+                duplicates += 1
+                continue
+            hashes[user_id] = row_hash(record)
+        if self.sharding is not None:
+            # Archived shards are not read: their hashes come from the directory
+            by_id, _ = self.sharding.entries()
+            for user_id, entry in by_id.items():
+                if entry["archive_id"] and user_id not in hashes:
+                    hashes[user_id] = entry["hash"]
+        return {"status": "success", "fields": list(HASH_FIELDS), "hashes": hashes, "duplicates": duplicates}
+
+    def export_rows(self, params: Dict) -> Tuple[str, object]:
+        """
+        exportRows from GET.js: rows changed after the cursor (or since), oldest first.
+
+        Returns:
+            ("json", response dict) or ("csv", text with a leading _cursor column)
+        """
+        self._count("exports")
+        if self.export_token and params.get("token") != self.export_token:
+            return "json", {"status": "error", "message": "Invalid export token"}
+        try:
+            limit = int(params.get("limit") or 0)
+        except ValueError:
+            limit = 0
+        limit = min(limit or EXPORT_DEFAULT_LIMIT, EXPORT_MAX_LIMIT)
+        after = (parse_export_time(params.get("since")), "", 0)
+        if params.get("cursor"):
+            after = parse_export_cursor(params["cursor"])
+
+        # Columns of all working sheets, in order of first appearance
+        headers: List[str] = []
+        changed = []
+        for shard, store in self.working_sheets():
+            own = store.headers()
+            headers.extend(name for name in own if name not in headers)
+            positions = [headers.index(name) for name in own]
+            timestamp_column = own.index("timestamp") if "timestamp" in own else -1
+            for offset, row in enumerate(store.values()):
+                row = row + [""] * (len(own) - len(row))
+                key = (parse_export_time(row[timestamp_column]) if timestamp_column != -1 else 0, shard, offset + 2)
+                if key > after:
+                    changed.append((key, dict(zip(positions, row))))
+        changed.sort(key=lambda item: item[0])
+
+        page = [(key, [cells.get(position, "") for position in range(len(headers))]) for key, cells in changed[:limit]]
+        if params.get("format") == "csv":
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(["_cursor", *headers])
+            for key, row in page:
+                writer.writerow([export_cursor(key), *row])
+            return "csv", output.getvalue()
+        return "json", {
+            "status": "success",
+            "columns": headers,
+            "rows": [row for _, row in page],
+            "next_cursor": export_cursor(page[-1][0] if page else after),
+            "has_more": len(changed) > len(page),
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def script(self) -> AppsScriptStandIn:
+        return self.server.script
+
+    def log_message(self, format, *args) -> None:
+        return None
+
+    def _reply(self, payload, status: int = 200, content_type: str = "application/json") -> None:
+        if content_type == "application/json":
+            payload = json.dumps(payload, ensure_ascii=False)
+        body = payload.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        parts = urlsplit(self.path)
+        if parts.path == "/_stats":
+            stats = dict(self.script.stats)
+            stats["rows"] = len(self.script.records())
+            stats["duplicate_users"] = len(self.script.duplicate_users())
+            self._reply(stats)
+        elif parts.path == "/_rows":
+            self._reply(self.script.records())
+        elif self.script.should_fail():
+            self._reply({"error": "Service invoked too many times"}, status=500)
+        else:
+            params = dict(parse_qsl(parts.query))
+            if params.get("mode") == "export":
+                kind, payload = self.script.export_rows(params)
+                self._reply(payload, content_type="text/csv" if kind == "csv" else "application/json")
+                return
+            if params.get("mode") == "hashes":
+                self._reply(self.script.row_hashes(params))
+                return
+            # doGet(e): processData(e.parameter)
+            self._reply(self.script.process_data(params))
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.script.should_fail():
+            self._reply({"error": "Service invoked too many times"}, status=500)
+            return
+        # doPost(e): JSON body, falling back to e.parameter
+        try:
+            data = json.loads(body.decode("utf-8"))
+        except ValueError:
+            data = dict(parse_qsl(urlsplit(self.path).query))
+            data.update(parse_qsl(body.decode("utf-8", errors="replace")))
+        if not isinstance(data, dict):
+            data = {}
+        if isinstance(data.get("leads"), list):
+            self._reply(self.script.process_batch(data["leads"]))
+            return
+        self._reply(self.script.process_data(data))
+
+
+class AppsScriptServer(ThreadingHTTPServer):
+    """Threaded HTTP server exposing the stand-in at any path (e.g. /exec)."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, script: Optional[AppsScriptStandIn] = None):
+        super().__init__((host, port), _Handler)
+        self.script = script or AppsScriptStandIn()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/exec"
+
+    def start(self) -> threading.Thread:
+        """Serve in a background thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for the Google Apps Script sync endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--db", default=":memory:", help="SQLite file for the sheet (default: in memory)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Processing time per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra processing time")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 500")
+    parser.add_argument("--lock-timeout", type=float, default=LOCK_TIMEOUT_SECONDS, help="tryLock timeout, seconds")
+    parser.add_argument("--export-token", default="", help="Token required by mode=export (EXPORT_TOKEN)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    script = AppsScriptStandIn(
+        SheetStore(args.db),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        lock_timeout=args.lock_timeout,
+        export_token=args.export_token,
+    )
+    server = AppsScriptServer(args.host, args.port, script)
+    print(f"Apps Script stand-in on {server.url} (stats: /_stats, rows: /_rows)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,86 @@
 GPT Service - Architecture for AI-powered car search
 This module will handle GPT integration for intelligent car recommendations
 
+Candidate cars come from the local columnar listings store (listings_store.py):
+either a dump imported into memory or a memory-mapped repository directory
+that feed imports update in place. A swapped repository generation is
+re-mapped in a worker thread; searches use the previous one until then.
+With a ScoringPool attached, filtering and ranking run in worker processes
+instead of the bot's event loop.
+
 TODO: Add GPT API integration when ready
 """
 
+import asyncio
+import os
+from typing import Optional
+
+from listings_store import ListingsRepository, ListingsStore
+from scoring_pool import ScoringPool, ScoringPoolBusy
+
 
 class GPTCarSearchService:
     """Service for AI-powered car search using GPT."""
 
-    def __init__(self, api_key: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        listings: Optional[ListingsStore] = None,
+        scoring_pool: Optional[ScoringPool] = None,
+    ):
         """
         Initialize GPT service.
 
         Args:
             api_key: OpenAI API key (will be added later)
+            listings: Listings store used to find real candidate cars
+            scoring_pool: Process pool for searches over a listings repository
         """
         self.api_key = api_key
+        self.scoring_pool = scoring_pool
+        self._listings = listings if listings is not None else ListingsStore.empty()
+        self._repository: Optional[ListingsRepository] = None
+        self._refresh: Optional[asyncio.Future] = None
+
+    @property
+    def listings(self) -> ListingsStore:
+        """Live listings; of a repository, the generation mapped last (see refresh_listings())."""
+        if self._repository is not None:
+            return self._repository.mapped()
+        return self._listings
+
+    def refresh_listings(self) -> None:
+        """
+        Check the repository for a swapped generation in a worker thread (call on the event loop).
+
+        Re-mapping reads the manifest and every column file; searches keep using
+        the mapped generation until the new one replaces it in one assignment.
+        """
+        repository = self._repository
+        if repository is None or not repository.due():
+            return
+        if self._refresh is not None and not self._refresh.done():
+            return
+        self._refresh = asyncio.get_running_loop().run_in_executor(None, repository.current)
+
+    def load_listings(self, path: str) -> int:
+        """
+        Use listings for further searches.
+
+        Args:
+            path: Repository directory (memory-mapped, picks up feed deltas)
+                or a .csv/.xlsx dump imported into memory
+
+        Returns:
+            int: Number of available listings
+        """
+        if os.path.isdir(path):
+            self._repository = ListingsRepository(path)
+            self._repository.current()
+        else:
+            self._repository = None
+            self._listings = ListingsStore.from_file(path)
+        return len(self.listings)
 
     async def search_cars(self, user_preferences: dict) -> dict:
         """
@@ -26,13 +91,19 @@ class GPTCarSearchService:
             user_preferences: Dictionary containing:
                 - phone: str - User phone number
                 - brand: str - Preferred car brand
+                - model: str - Preferred model (optional)
                 - city: str - City for search
+                - city_hub: str - Nearest supported hub, used instead of city if set
                 - year_from: int - Minimum year
                 - year_to: int - Maximum year
                 - budget: int - Maximum budget in rubles
 
         Returns:
-            dict: Search results with car recommendations
+            dict: Search results with car recommendations:
+                - status: 'ok', 'no_data' when no listings are loaded
+                  or 'busy' when the scoring pool is saturated
+                - total_matches: int - Number of listings matching the filters
+                - results: list - Best listings, ranked
 
         Example:
             preferences = {
@@ -45,15 +116,46 @@ class GPTCarSearchService:
             }
             results = await gpt_service.search_cars(preferences)
         """
-        # TODO: Implement GPT API call
-        # 1. Format user preferences into GPT prompt
+        # TODO: Implement GPT API call on top of the matched listings
+        # 1. Format user preferences and candidates into GPT prompt
         # 2. Call GPT API with search parameters
         # 3. Parse GPT response
         # 4. Return structured car recommendations
 
+        criteria = {
+            'brand': user_preferences.get('brand'),
+            'model': user_preferences.get('model'),
+            'city': user_preferences.get('city_hub') or user_preferences.get('city'),
+            'year_to': user_preferences.get('year_to'),
+            'budget': user_preferences.get('budget'),
+        }
+
+        if self.scoring_pool is not None:
+            try:
+                found = await self.scoring_pool.search(**criteria)
+            except ScoringPoolBusy:
+                return {
+                    'status': 'busy',
+                    'total_matches': 0,
+                    'results': [],
+                    'user_preferences': user_preferences
+                }
+        else:
+            self.refresh_listings()
+            listings = self.listings
+            if not len(listings):
+                return {
+                    'status': 'no_data',
+                    'total_matches': 0,
+                    'results': [],
+                    'user_preferences': user_preferences
+                }
+            found = listings.search(**criteria)
+
         return {
-            'status': 'not_implemented',
-            'message': 'GPT search will be implemented later',
+            'status': 'ok',
+            'total_matches': found['total_matches'],
+            'results': found['results'],
             'user_preferences': user_preferences
         }
 
@@ -0,0 +1,213 @@
+"""
+Health - event-loop watchdog and liveness/readiness checks
+
+The process being up says nothing about the bot working: a blocking call in
+a handler or a wedged polling loop leaves the container "healthy" forever.
+
+- LoopWatchdog runs a task that wakes up every `interval` and measures how
+  late it was scheduled (event-loop lag); a monitor thread notices when the
+  task stops waking up altogether and logs the loop thread's stack, so the
+  blocking code is named in the logs
+- HealthMonitor combines loop responsiveness, sheet sync backlog and the
+  time since the last successful getUpdates (or delivered update) into
+  /health/live and /health/ready answers; with several bots polling in one
+  process, the bot that has gone longest without a getUpdates decides
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Optional, Tuple
+
+WATCHDOG_INTERVAL_SECONDS = 0.25
+STALL_SECONDS = 1.0
+
+
+class InFlightCounter:
+    """Thread-safe counter of started but unfinished jobs."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def add(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class LoopWatchdog:
+    """Measures event-loop lag and reports stacks of long blocking sections."""
+
+    def __init__(
+        self,
+        interval: float = WATCHDOG_INTERVAL_SECONDS,
+        stall_seconds: float = STALL_SECONDS,
+        observe_lag: Optional[Callable[[float], None]] = None,
+    ):
+        """
+        Args:
+            interval: How often the loop task wakes up
+            stall_seconds: Loop silence after which the blocking stack is logged
+            observe_lag: Called with every lag measurement (e.g. a histogram)
+        """
+        self.interval = interval
+        self.stall_seconds = stall_seconds
+        self.observe_lag = observe_lag
+        self.heartbeat = time.monotonic()
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall_stack: Optional[str] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """Start the lag task on the running loop and the stall monitor thread."""
+        self._loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        self._monitor = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._monitor.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def heartbeat_age(self) -> float:
+        return time.monotonic() - self.heartbeat
+
+    async def _tick(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.heartbeat = now
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            if self.observe_lag is not None:
+                self.observe_lag(lag)
+
+    def _watch(self) -> None:
+        reported_heartbeat = None
+        while not self._stop.wait(self.interval):
+            heartbeat = self.heartbeat
+            if time.monotonic() - heartbeat < self.stall_seconds or heartbeat == reported_heartbeat:
+                continue
+            # Report each stall once, while it is still happening
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<loop thread not found>"
+            self.stalls += 1
+            self.last_stall_stack = stack
+            logging.warning(
+                "Event loop blocked for more than %.1f s, loop thread stack:\n%s", self.stall_seconds, stack
+            )
+
+
+class HealthMonitor:
+    """Liveness and readiness answers for the orchestrator."""
+
+    def __init__(
+        self,
+        watchdog: LoopWatchdog,
+        last_delivery: Callable[[], Optional[float]],
+        sync_depth: Callable[[], int],
+        live_stall_seconds: float = 30.0,
+        stale_updates_seconds: float = 300.0,
+        ready_lag_seconds: float = 1.0,
+        max_sync_depth: int = 100,
+        deliveries: Optional[Callable[[], Dict[str, Optional[float]]]] = None,
+    ):
+        """
+        Args:
+            watchdog: Event-loop watchdog of the bot
+            last_delivery: time.monotonic() of the last successful getUpdates or update, or None
+            sync_depth: Leads waiting to be replicated to the sheet
+            live_stall_seconds: Loop silence that makes the process not alive
+            stale_updates_seconds: No getUpdates success/update for this long makes it not alive
+            ready_lag_seconds: Loop lag above which the bot is not ready
+            max_sync_depth: Sync backlog above which the bot is not ready
+            deliveries: Last successful getUpdates per polling bot (None = never); when not empty,
+                the stalest of them is used instead of `last_delivery`
+        """
+        self.watchdog = watchdog
+        self.last_delivery = last_delivery
+        self.sync_depth = sync_depth
+        self.live_stall_seconds = live_stall_seconds
+        self.stale_updates_seconds = stale_updates_seconds
+        self.ready_lag_seconds = ready_lag_seconds
+        self.max_sync_depth = max_sync_depth
+        self.deliveries = deliveries
+        self.started_at = time.monotonic()
+
+    def stalest_delivery(self) -> Tuple[Optional[str], Optional[float]]:
+        """(bot, last delivery) of the polling bot heard from longest ago; (None, last_delivery()) without them."""
+        deliveries = self.deliveries() if self.deliveries is not None else {}
+        if not deliveries:
+            return None, self.last_delivery()
+        bot = min(deliveries, key=lambda name: -1.0 if deliveries[name] is None else deliveries[name])
+        return bot, deliveries[bot]
+
+    def details(self) -> Dict:
+        now = time.monotonic()
+        stalest_bot, last_delivery = self.stalest_delivery()
+        return {
+            "loop_running": self.watchdog.running,
+            "loop_heartbeat_age_s": round(self.watchdog.heartbeat_age(), 3),
+            "loop_lag_s": round(self.watchdog.last_lag, 4),
+            "loop_max_lag_s": round(self.watchdog.max_lag, 4),
+            "loop_stalls": self.watchdog.stalls,
+            "sync_queue_depth": self.sync_depth(),
+            "since_last_delivery_s": None if last_delivery is None else round(now - last_delivery, 1),
+            "stalest_bot": stalest_bot,
+            "uptime_s": round(now - self.started_at, 1),
+        }
+
+    def live(self) -> Tuple[int, Dict]:
+        """Alive unless the loop is stuck or updates stopped arriving."""
+        details = self.details()
+        problems = []
+        if details["loop_heartbeat_age_s"] > self.live_stall_seconds:
+            problems.append("event loop is blocked")
+        last_seen = details["since_last_delivery_s"]
+        if last_seen is None:
+            last_seen = details["uptime_s"]
+        if last_seen > self.stale_updates_seconds:
+            problems.append("no successful getUpdates or update delivery")
+        return (503 if problems else 200), {"status": "fail" if problems else "ok", "problems": problems, **details}
+
+    def ready(self) -> Tuple[int, Dict]:
+        """Ready when polling works, the loop is responsive and syncs keep up."""
+        details = self.details()
+        problems = []
+        if not details["loop_running"]:
+            problems.append("watchdog not started")
+        heartbeat_late = details["loop_heartbeat_age_s"] > self.watchdog.interval + self.ready_lag_seconds
+        if heartbeat_late or details["loop_lag_s"] > self.ready_lag_seconds:
+            problems.append("event loop is lagging")
+        if details["since_last_delivery_s"] is None:
+            problems.append("no successful getUpdates yet")
+        if details["sync_queue_depth"] > self.max_sync_depth:
+            problems.append("sheet sync backlog")
+        return (503 if problems else 200), {"status": "fail" if problems else "ok", "problems": problems, **details}
@@ -0,0 +1,399 @@
+"""
+Instrumentation - per-update, per-handler and Bot API latency metrics
+
+Shows where the time of a slow reply goes: our handlers, Telegram API calls
+or sheet sync threads.
+
+- TypeHandlers in groups -1 and 1 (around the conversation handler in group 0)
+  open and close a trace for every update
+- conversation callbacks are wrapped to time each handler, keyed by the state
+  it is registered in, and the state transition it produces
+- the Bot API request object is wrapped to count and time outgoing calls,
+  attributed to the update being processed; a named getUpdates request
+  also records when its bot last polled successfully, per hosted bot
+- updates slower than a threshold are logged with their state and handler
+- transition listeners get every completed handler call with its states
+  (the funnel event log subscribes here)
+
+Metrics are exported in the Prometheus text format on /metrics of a small
+local HTTP server, which also serves JSON routes added by other components
+(health checks).
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from telegram import Update
+from telegram.ext import Application, ConversationHandler, TypeHandler
+from telegram.request import BaseRequest
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram with a fixed label set."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # [per-bucket counts..., +Inf count, sum]
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[position] += 1
+            series[-1] += value
+
+    def count(self, *label_values: str) -> int:
+        with self._lock:
+            series = self._series.get(label_values)
+            return sum(series[:-1]) if series else 0
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            base = _format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket{_format_labels(self.labels + ('le',), label_values + (le,))} {cumulative}"
+            yield f"{self.name}_sum{base} {series[-1]}"
+            yield f"{self.name}_count{base} {cumulative}"
+
+
+class Counter:
+    """Thread-safe Prometheus counter with a fixed label set."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            snapshot = dict(self._values)
+        for label_values, value in sorted(snapshot.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge:
+    """Prometheus gauge whose value is read from a callable at scrape time."""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {float(self.read())}"
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class UpdateTrace:
+    """What happened while one update was processed."""
+
+    __slots__ = ("kind", "started", "api_calls", "api_seconds", "handler", "state", "next_state")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.api_calls = 0
+        self.api_seconds = 0.0
+        self.handler: Optional[str] = None
+        self.state: Optional[str] = None
+        self.next_state: Optional[str] = None
+
+
+# Trace of the update being processed; each update task sees its own
+_current_trace: contextvars.ContextVar[Optional[UpdateTrace]] = contextvars.ContextVar("update_trace", default=None)
+
+
+def update_kind(update: Update) -> str:
+    if update.callback_query:
+        return "callback_query"
+    if update.message:
+        return "command" if (update.message.text or "").startswith("/") else "message"
+    return "other"
+
+
+class CountingRequest(BaseRequest):
+    """BaseRequest wrapper counting and timing Bot API calls."""
+
+    def __init__(self, inner: BaseRequest, instrumentation: "Instrumentation", poller: Optional[str] = None):
+        self.inner = inner
+        self.instrumentation = instrumentation
+        # Name of the bot whose getUpdates go through this request (None = not tracked per bot)
+        self.poller = poller
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.inner.read_timeout
+
+    async def initialize(self) -> None:
+        await self.inner.initialize()
+
+    async def shutdown(self) -> None:
+        if self.poller is not None:
+            # A bot that stopped polling on purpose is no longer expected to deliver
+            self.instrumentation.deliveries.pop(self.poller, None)
+        await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **timeouts) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        polling = self.poller is not None and api_method == "getUpdates"
+        if polling:
+            # Counted from its first poll: a bot stuck there shows up as never delivered
+            self.instrumentation.deliveries.setdefault(self.poller, None)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            code, payload = await self.inner.do_request(url, method, request_data, **timeouts)
+            status = str(code)
+            if polling and code == 200:
+                self.instrumentation.deliveries[self.poller] = time.monotonic()
+            return code, payload
+        finally:
+            self.instrumentation.observe_api_call(api_method, status, time.perf_counter() - started)
+
+
+class Instrumentation:
+    """Metric set and the hooks that feed it."""
+
+    def __init__(self, slow_update_seconds: float = 1.0, state_names: Optional[Dict[object, str]] = None):
+        """
+        Args:
+            slow_update_seconds: Updates taking longer are logged with their state and handler
+            state_names: Conversation state values -> readable names
+        """
+        self.slow_update_seconds = slow_update_seconds
+        self.state_names = {ConversationHandler.END: "END", **(state_names or {})}
+        self.update_seconds = Histogram("bot_update_seconds", "End-to-end update processing time", ["kind"])
+        self.handler_seconds = Histogram(
+            "bot_handler_seconds", "Conversation handler callback time", ["handler", "state"]
+        )
+        self.transition_seconds = Histogram(
+            "bot_state_transition_seconds", "Handler time by conversation state transition", ["from_state", "to_state"]
+        )
+        self.api_calls_per_update = Histogram(
+            "bot_api_calls_per_update", "Bot API calls made while processing one update", ["kind"], COUNT_BUCKETS
+        )
+        self.api_seconds = Histogram("bot_api_request_seconds", "Bot API request time", ["method", "status"])
+        self.sheet_sync_seconds = Histogram("bot_sheet_sync_seconds", "Google Sheet sync request time", ["result"])
+        self.loop_lag_seconds = Histogram("bot_event_loop_lag_seconds", "Event loop scheduling lag")
+        self.handler_errors = Counter("bot_handler_errors_total", "Handler callbacks that raised", ["handler"])
+        self.slow_updates = Counter("bot_slow_updates_total", "Updates slower than the slow-update threshold", ["state", "handler"])
+        self.dropped_updates = Counter("bot_dropped_updates_total", "Updates shed before any handler ran", ["reason"])
+        self.metrics = [
+            self.update_seconds,
+            self.handler_seconds,
+            self.transition_seconds,
+            self.api_calls_per_update,
+            self.api_seconds,
+            self.sheet_sync_seconds,
+            self.loop_lag_seconds,
+            self.handler_errors,
+            self.slow_updates,
+            self.dropped_updates,
+        ]
+        # time.monotonic() of the last successful call per Bot API method and of the last update
+        self.last_api_success: Dict[str, float] = {}
+        self.last_update_at: Optional[float] = None
+        # Bot name -> time.monotonic() of its last successful getUpdates (None = none yet), see CountingRequest
+        self.deliveries: Dict[str, Optional[float]] = {}
+        self.routes: Dict[str, Callable[[], Tuple[int, Dict]]] = {}
+        self.transition_listeners: List[Callable] = []
+        self._server: Optional["ThreadingHTTPServer"] = None
+
+    # ---- wiring ----
+
+    def install(self, application: Application, conversation: ConversationHandler) -> None:
+        """Register trace handlers around group 0 and wrap the conversation callbacks."""
+        application.add_handler(TypeHandler(Update, self._begin_update), group=-1)
+        application.add_handler(TypeHandler(Update, self._finish_update), group=1)
+        for handler in conversation.entry_points:
+            handler.callback = self.timed(handler.callback, "entry")
+        for state, handlers in conversation.states.items():
+            for handler in handlers:
+                handler.callback = self.timed(handler.callback, self.state_name(state))
+        for handler in conversation.fallbacks:
+            handler.callback = self.timed(handler.callback, "fallback")
+
+    def wrap_request(self, request: BaseRequest, poller: Optional[str] = None) -> CountingRequest:
+        """Count and time the calls of `request`; `poller` names the bot whose getUpdates it sends."""
+        return CountingRequest(request, self, poller)
+
+    def add_gauge(self, name: str, documentation: str, read: Callable[[], float]) -> None:
+        self.metrics.append(Gauge(name, documentation, read))
+
+    def add_route(self, path: str, handler: Callable[[], Tuple[int, Dict]]) -> None:
+        """Serve handler() -> (HTTP status, JSON payload) on path."""
+        self.routes[path] = handler
+
+    def add_transition_listener(self, listener: Callable) -> None:
+        """Call listener(update, context, state, next_state, handler) after each successful callback."""
+        self.transition_listeners.append(listener)
+
+    def state_name(self, state) -> str:
+        return self.state_names.get(state, str(state))
+
+    # ---- hooks ----
+
+    async def _begin_update(self, update: Update, context) -> None:
+        self.last_update_at = time.monotonic()
+        _current_trace.set(UpdateTrace(update_kind(update)))
+
+    async def _finish_update(self, update: Update, context) -> None:
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        _current_trace.set(None)
+        elapsed = time.perf_counter() - trace.started
+        self.update_seconds.observe(elapsed, trace.kind)
+        self.api_calls_per_update.observe(trace.api_calls, trace.kind)
+        if elapsed >= self.slow_update_seconds:
+            self.slow_updates.inc(trace.state or "-", trace.handler or "-")
+            logging.warning(
+                "Slow update: %.3f s in state %s, handler %s -> %s; %s API calls took %.3f s",
+                elapsed,
+                trace.state,
+                trace.handler,
+                trace.next_state,
+                trace.api_calls,
+                trace.api_seconds,
+            )
+
+    def timed(self, callback: Callable, state: str) -> Callable:
+        """Wrap a handler callback to record its time and the transition it returns."""
+        name = getattr(callback, "__name__", repr(callback))
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            next_state = None
+            try:
+                next_state = await callback(update, context)
+                to_state = state if next_state is None else self.state_name(next_state)
+                for listener in self.transition_listeners:
+                    try:
+                        listener(update, context, state, to_state, name)
+                    except Exception:
+                        logging.exception("Transition listener %r failed", listener)
+                return next_state
+            except Exception:
+                self.handler_errors.inc(name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                to_state = state if next_state is None else self.state_name(next_state)
+                self.handler_seconds.observe(elapsed, name, state)
+                self.transition_seconds.observe(elapsed, state, to_state)
+                trace = _current_trace.get()
+                if trace is not None:
+                    trace.handler, trace.state, trace.next_state = name, state, to_state
+
+        return wrapper
+
+    def observe_api_call(self, method: str, status: str, seconds: float) -> None:
+        self.api_seconds.observe(seconds, method, status)
+        if status == "200":
+            self.last_api_success[method] = time.monotonic()
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.api_calls += 1
+            trace.api_seconds += seconds
+
+    def observe_sheet_sync(self, seconds: float, result: str) -> None:
+        self.sheet_sync_seconds.observe(seconds, result)
+
+    # ---- export ----
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port: int, host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+        """Serve /metrics and added routes in a background thread."""
+        # Only with METRICS_PORT set: not part of the bot's import time
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        instrumentation = self
+
+        class _MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args) -> None:
+                return None
+
+            def do_GET(self) -> None:
+                path = self.path.split("?", 1)[0]
+                if path == "/metrics":
+                    status, content_type = 200, "text/plain; version=0.0.4; charset=utf-8"
+                    body = instrumentation.render().encode("utf-8")
+                elif path in instrumentation.routes:
+                    status, payload = instrumentation.routes[path]()
+                    content_type = "application/json"
+                    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logging.info("Metrics on http://%s:%s/metrics", host, self._server.server_address[1])
+        return self._server
+
+    def stop_http_server(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,424 @@
+"""
+Lead Registry - local lead database with asynchronous replication to the sheet
+
+The Google Sheet used to be the only lead store: every sync was a POST whose
+processData() scanned all rows to find the user. The registry keeps leads in
+an embedded SQLite database instead:
+- leads are looked up by indexed tg_user_id first, then by normalized phone
+  (same rules and normalization as processData in GAS/GET.js), and new
+  values are merged into the found lead
+- every change is written to lead_history with the old and new values
+- changed leads are queued in an outbox table, in the same transaction;
+  SheetReplicator threads send the lead's current state to the sheet, so
+  several quick changes of one lead become one request, and failed sends
+  are retried with exponential backoff - also after a restart, since the
+  outbox is on disk
+
+The bot only waits for the local write (WAL journal, no fsync per commit);
+sheet latency and quotas are off the request path.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+# Seconds before the first retry of a failed send; doubled per attempt up to RETRY_MAX_SECONDS
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 300.0
+REPLICATION_WORKERS = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY,
+    tg_user_id TEXT NOT NULL UNIQUE,
+    phone TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leads_phone ON leads (phone) WHERE phone != '';
+CREATE TABLE IF NOT EXISTS lead_history (
+    id INTEGER PRIMARY KEY,
+    lead_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    action TEXT NOT NULL,
+    changes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lead_history_lead ON lead_history (lead_id);
+CREATE TABLE IF NOT EXISTS outbox (
+    lead_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT NOT NULL DEFAULT ''
+);
+"""
+
+
+def normalize_phone(value) -> str:
+    """normalizePhone from GET.js: keep digits and "+", drop a leading "+"."""
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(int(round(value)))
+    cleaned = "".join(ch for ch in str(value) if ch.isdigit() or ch == "+")
+    return cleaned[1:] if cleaned.startswith("+") else cleaned
+
+
+class LeadRegistry:
+    """Thread-safe lead store with dedup, change history and a replication outbox."""
+
+    def __init__(self, path: str = ":memory:", clock: Callable[[], float] = time.time):
+        """
+        Args:
+            path: SQLite database file (":memory:" keeps leads only for the process lifetime)
+            clock: Source of unix time (tests pass a fake)
+        """
+        self.path = path
+        self.clock = clock
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # Outbox entries handed to a replicator and not yet acknowledged or retried
+        self._claimed = set()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def save_copy(self, path: str) -> None:
+        """Write the whole database to `path` (atomically replaced), e.g. to keep an in-memory registry."""
+        temporary = f"{path}.tmp"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        target = sqlite3.connect(temporary)
+        try:
+            with self._lock:
+                self._db.backup(target)
+        finally:
+            target.close()
+        os.replace(temporary, path)
+
+    def load_copy(self, path: str) -> None:
+        """Replace the database contents with a copy written by save_copy()."""
+        source = sqlite3.connect(path)
+        try:
+            with self._lock:
+                source.backup(self._db)
+                self._claimed.clear()
+        finally:
+            source.close()
+
+    # ---- leads ----
+
+    def _find(self, tg_user_id: str, phone: str) -> Optional[sqlite3.Row]:
+        row = self._db.execute("SELECT * FROM leads WHERE tg_user_id = ?", (tg_user_id,)).fetchone()
+        if row is None and phone:
+            row = self._db.execute("SELECT * FROM leads WHERE phone = ? ORDER BY id LIMIT 1", (phone,)).fetchone()
+        return row
+
+    def upsert(self, payload: Dict, replicate: bool = True) -> Optional[Tuple[str, Dict]]:
+        """
+        Create or update the lead of a sync payload (the fields sent to processData).
+
+        Args:
+            payload: Lead fields; tg_user_id is required, None values are ignored
+            replicate: Queue the change for the sheet (False when no sheet is configured)
+
+        Returns:
+            ("created" | "updated", lead) or None when the payload changed nothing
+
+        Raises:
+            ValueError: payload has no tg_user_id
+        """
+        tg_user_id = payload.get("tg_user_id")
+        if tg_user_id in (None, ""):
+            raise ValueError("Missing tg_user_id (required for user identification)")
+        tg_user_id = str(tg_user_id)
+        phone = normalize_phone(payload.get("phone"))
+        values = {key: value for key, value in payload.items() if value is not None and key != "phone"}
+        values["tg_user_id"] = tg_user_id
+        if phone:
+            values["phone"] = phone
+
+        now = self.clock()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._find(tg_user_id, phone)
+                if row is None:
+                    action, data = "created", values
+                    changes = {key: [None, value] for key, value in values.items()}
+                    lead_id = self._db.execute(
+                        "INSERT INTO leads (tg_user_id, phone, data, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                        (tg_user_id, phone, json.dumps(data, ensure_ascii=False), now, now),
+                    ).lastrowid
+                    version = 1
+                else:
+                    action, lead_id = "updated", row["id"]
+                    data = json.loads(row["data"])
+                    changes = {key: [data.get(key), value] for key, value in values.items() if data.get(key) != value}
+                    if not changes:
+                        self._db.execute("ROLLBACK")
+                        return None
+                    data.update(values)
+                    version = row["version"] + 1
+                    self._db.execute(
+                        "UPDATE leads SET tg_user_id = ?, phone = ?, data = ?, version = ?, updated_at = ? WHERE id = ?",
+                        (tg_user_id, data.get("phone", ""), json.dumps(data, ensure_ascii=False), version, now, lead_id),
+                    )
+                self._db.execute(
+                    "INSERT INTO lead_history (lead_id, ts, action, changes) VALUES (?, ?, ?, ?)",
+                    (lead_id, now, action, json.dumps(changes, ensure_ascii=False)),
+                )
+                if replicate:
+                    # A lead already waiting keeps its retry schedule and only gets the new version
+                    self._db.execute(
+                        "INSERT INTO outbox (lead_id, version, next_attempt_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT (lead_id) DO UPDATE SET version = excluded.version",
+                        (lead_id, version, now),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return action, dict(data, lead_id=lead_id)
+
+    def get(self, tg_user_id=None, phone=None) -> Optional[Dict]:
+        """Lead found by tg_user_id, then by phone (processData order), or None."""
+        with self._lock:
+            row = self._find("" if tg_user_id is None else str(tg_user_id), normalize_phone(phone))
+        return None if row is None else dict(json.loads(row["data"]), lead_id=row["id"])
+
+    def history(self, lead_id: int) -> List[Dict]:
+        """Changes of a lead, oldest first: {ts, action, changes: {field: [old, new]}}."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ts, action, changes FROM lead_history WHERE lead_id = ? ORDER BY id", (lead_id,)
+            ).fetchall()
+        return [{"ts": row["ts"], "action": row["action"], "changes": json.loads(row["changes"])} for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM leads").fetchone()[0]
+
+    def leads(self) -> List[Tuple[int, Dict]]:
+        """All leads as (lead_id, data), in creation order."""
+        with self._lock:
+            rows = self._db.execute("SELECT id, data FROM leads ORDER BY id").fetchall()
+        return [(row["id"], json.loads(row["data"])) for row in rows]
+
+    # ---- replication outbox ----
+
+    def pending(self) -> int:
+        """Leads whose latest change has not reached the sheet yet."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def queued_ids(self) -> Set[int]:
+        """Leads waiting in the outbox."""
+        with self._lock:
+            return {lead_id for (lead_id,) in self._db.execute("SELECT lead_id FROM outbox")}
+
+    def due(self, before: float) -> int:
+        """Outbox entries due at or before `before` (unix time), claimed ones included."""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox WHERE next_attempt_at <= ?", (before,)).fetchone()[0]
+
+    def expedite(self) -> None:
+        """Make entries waiting out a retry backoff due now."""
+        now = self.clock()
+        with self._lock:
+            self._db.execute("UPDATE outbox SET next_attempt_at = ? WHERE next_attempt_at > ?", (now, now))
+
+    def claim(self) -> Tuple[Optional[Tuple[int, int, Dict]], Optional[float]]:
+        """
+        Take the most overdue unclaimed outbox entry.
+
+        Returns:
+            ((lead_id, version, lead data) or None, unix time the next entry is due or None)
+        """
+        now = self.clock()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT o.lead_id, o.version, o.next_attempt_at, l.data FROM outbox o JOIN leads l ON l.id = o.lead_id "
+                "ORDER BY o.next_attempt_at"
+            )
+            next_due = None
+            for row in rows:
+                if row["lead_id"] in self._claimed:
+                    continue
+                if row["next_attempt_at"] > now:
+                    next_due = row["next_attempt_at"]
+                    break
+                self._claimed.add(row["lead_id"])
+                return (row["lead_id"], row["version"], json.loads(row["data"])), None
+            return None, next_due
+
+    def acknowledge(self, lead_id: int, version: int) -> None:
+        """Mark `version` of the lead replicated; a newer version stays queued."""
+        with self._lock:
+            self._claimed.discard(lead_id)
+            self._db.execute("DELETE FROM outbox WHERE lead_id = ? AND version = ?", (lead_id, version))
+
+    def retry(self, lead_id: int, error: str) -> float:
+        """Schedule the next attempt with exponential backoff; returns the delay in seconds."""
+        with self._lock:
+            self._claimed.discard(lead_id)
+            row = self._db.execute("SELECT attempts FROM outbox WHERE lead_id = ?", (lead_id,)).fetchone()
+            if row is None:
+                return 0.0
+            delay = min(RETRY_BASE_SECONDS * 2 ** row["attempts"], RETRY_MAX_SECONDS)
+            self._db.execute(
+                "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE lead_id = ?",
+                (self.clock() + delay, error, lead_id),
+            )
+            return delay
+
+
+class SheetReplicator:
+    """Worker threads sending changed leads from the outbox to the sheet."""
+
+    def __init__(
+        self,
+        registry: LeadRegistry,
+        send: Callable[[Dict], None],
+        workers: int = REPLICATION_WORKERS,
+        idle_seconds: float = 5.0,
+    ):
+        """
+        Args:
+            registry: Lead registry whose outbox is drained
+            send: Delivers one lead to the sheet; raises on failure (the lead is retried)
+            workers: Concurrent sends; the sheet script serializes them under its lock anyway
+            idle_seconds: Longest sleep of an idle worker between outbox checks
+        """
+        self.registry = registry
+        self.send = send
+        # (registry, send) pairs drained by the same workers, see add_source()
+        self._sources: List[Tuple[LeadRegistry, Callable[[Dict], None]]] = [(registry, send)]
+        self._next_source = 0
+        self.workers = workers
+        self.idle_seconds = idle_seconds
+        self._wakeup = threading.Condition()
+        self._stopping = False
+        self._threads: List[threading.Thread] = []
+        self._busy = 0
+
+    def start(self) -> None:
+        self._stopping = False
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"sheet-replicator-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def add_source(self, registry: LeadRegistry, send: Callable[[Dict], None]) -> None:
+        """Drain another registry's outbox with the same workers (one per hosted bot)."""
+        with self._wakeup:
+            self._sources.append((registry, send))
+            self._wakeup.notify_all()
+
+    def wake(self) -> None:
+        """Tell idle workers the outbox has a new entry."""
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def stop(self, timeout: float = 5.0) -> bool:
+        """
+        Stop workers after their current send; queued leads stay in the outbox.
+
+        Returns:
+            bool: False if a send was still running after `timeout`
+        """
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        stopped = not any(thread.is_alive() for thread in self._threads)
+        self._threads = []
+        return stopped
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Wait until nothing is queued and no send is running; False on timeout."""
+        deadline = time.monotonic() + timeout
+        while self._busy or any(registry.pending() for registry, _ in self._sources):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Send what is queued before shutdown. Leads waiting out a backoff are retried at once;
+        the drain ends when every lead was sent or has failed once more, or after `timeout`.
+
+        Returns:
+            bool: True if every outbox is empty
+        """
+        for registry, _ in self._sources:
+            registry.expedite()
+        started = self.registry.clock()
+        self.wake()
+        deadline = time.monotonic() + timeout
+        while any(registry.pending() for registry, _ in self._sources):
+            if time.monotonic() > deadline:
+                break
+            # Failed sends were rescheduled after `started`: nothing more to try without waiting
+            if not self._busy and not any(registry.due(started) for registry, _ in self._sources):
+                break
+            time.sleep(0.005)
+        # The last send may have been acknowledged since the loop condition was checked
+        return not any(registry.pending() for registry, _ in self._sources)
+
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                if self._stopping:
+                    return
+                source, entry, next_due = self._claim()
+                if entry is None:
+                    wait = self.idle_seconds if next_due is None else next_due - self.registry.clock()
+                    self._wakeup.wait(min(max(wait, 0.0), self.idle_seconds))
+                    continue
+                self._busy += 1
+            registry, send = source
+            lead_id, version, lead = entry
+            try:
+                send(lead)
+            except Exception as exc:
+                delay = registry.retry(lead_id, str(exc))
+                logging.warning("Lead %s not replicated, retry in %.0f s: %s", lead_id, delay, exc)
+            else:
+                registry.acknowledge(lead_id, version)
+            finally:
+                with self._wakeup:
+                    self._busy -= 1
+
+    def _claim(self):
+        """Due outbox entry of the next source in turn, so one busy bot does not starve the others.
+
+        Returns:
+            tuple: (registry, send) source, claimed entry or None, earliest retry time or None
+        """
+        next_due = None
+        count = len(self._sources)
+        for offset in range(count):
+            index = (self._next_source + offset) % count
+            entry, due = self._sources[index][0].claim()
+            if entry is not None:
+                self._next_source = index + 1
+                return self._sources[index], entry, None
+            if due is not None:
+                next_due = due if next_due is None else min(next_due, due)
+        return None, None, next_due
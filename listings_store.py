@@ -0,0 +1,617 @@
+"""
+Listings Store - local columnar storage of car listings for the AI selection step
+
+Listings are imported from a CSV/XLSX dump into NumPy columns:
+- brand, model and city are dictionary-encoded (int32 codes + vocabulary)
+- year, price, mileage and listing_id are plain integer columns
+
+Searches build boolean masks over whole columns, so filtering a million rows
+is a handful of vectorized comparisons instead of a Python loop.
+
+On disk the store is kept by ListingsRepository as memory-mapped .npy column
+files grouped into immutable segments. Feed deltas (appends/deletes) create a
+new generation that reuses existing segments, and the CURRENT pointer is
+swapped atomically, so the bot maps new data lazily without a full reload:
+
+    <root>/CURRENT                                  name of the live generation
+    <root>/segments/seg-000001/<column>.npy         immutable column files
+    <root>/generations/gen-000002/manifest.json     segments + vocabularies
+    <root>/generations/gen-000002/seg-000001.deleted.npy   tombstones
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+# Dictionary-encoded text columns and integer columns with their dtypes
+TEXT_COLUMNS = ("brand", "model", "city")
+INT_COLUMNS = {
+    "year": np.int16,
+    "price": np.int32,
+    "mileage": np.int32,
+    "listing_id": np.int64,
+}
+
+# Header aliases accepted in imported dumps (compared case-insensitively)
+HEADER_ALIASES = {
+    "brand": ["brand", "marka", "make", "марка"],
+    "model": ["model", "модель"],
+    "city": ["city", "gorod", "location", "город"],
+    "year": ["year", "god", "год", "год выпуска"],
+    "price": ["price", "budget", "цена", "стоимость"],
+    "mileage": ["mileage", "probeg", "km", "пробег"],
+    "listing_id": ["listing_id", "id", "ad_id", "объявление"],
+}
+
+# Code used for values that are not present in a vocabulary
+MISSING_CODE = -1
+
+# One model year is worth this many kilometres of mileage when ranking
+MILEAGE_PER_YEAR = 20000
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+def normalize_key(value: Optional[str]) -> str:
+    """Canonical form used for dictionary lookups (trimmed, casefolded)."""
+    if value is None:
+        return ""
+    return " ".join(str(value).split()).casefold()
+
+
+def parse_int(value) -> Optional[int]:
+    """Parse integers from dump cells like '1 500 000', '150000 км' or 2019.0."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = "".join(str(value).split())
+    try:
+        return int(float(text.replace(",", ".")))
+    except ValueError:
+        digits = "".join(ch for ch in text if ch.isdigit())
+        return int(digits) if digits else None
+
+
+class Segment:
+    """Immutable block of listing columns with an optional tombstone mask."""
+
+    def __init__(self, columns: Dict[str, np.ndarray], deleted: Optional[np.ndarray] = None):
+        self.columns = columns
+        self.deleted = deleted
+
+    def __len__(self) -> int:
+        return len(self.columns["year"])
+
+    def with_deleted(self, deleted: Optional[np.ndarray]) -> "Segment":
+        return Segment(self.columns, deleted)
+
+    def alive_count(self) -> int:
+        if self.deleted is None:
+            return len(self)
+        return len(self) - int(np.count_nonzero(self.deleted))
+
+
+class ListingsStore:
+    """Immutable columnar store of car listings (one generation)."""
+
+    def __init__(self, segments: List[Segment], vocabularies: Dict[str, List[str]]):
+        """
+        Initialize store from prepared segments.
+
+        Args:
+            segments: Column blocks; text columns hold vocabulary codes
+            vocabularies: Text column name -> list of original values by code
+        """
+        self.segments = segments
+        self.vocabularies = vocabularies
+        self._lookup = {
+            name: {normalize_key(value): code for code, value in enumerate(values)}
+            for name, values in vocabularies.items()
+        }
+        self._offsets = np.cumsum([0] + [len(segment) for segment in segments])
+
+    def __len__(self) -> int:
+        return sum(segment.alive_count() for segment in self.segments)
+
+    @classmethod
+    def empty(cls) -> "ListingsStore":
+        """Return store without listings."""
+        return cls([], {name: [] for name in TEXT_COLUMNS})
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray], vocabularies: Dict[str, List[str]]) -> "ListingsStore":
+        """Build single-segment store from ready columns (listing_id defaults to row number)."""
+        columns = dict(columns)
+        if "listing_id" not in columns:
+            columns["listing_id"] = np.arange(len(columns["year"]), dtype=np.int64)
+        return cls([Segment(columns)], vocabularies)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> "ListingsStore":
+        """
+        Build store from dictionaries with brand/model/city/year/price/mileage.
+
+        Rows without brand, year or price are skipped.
+        """
+        vocabularies: Dict[str, List[str]] = {name: [] for name in TEXT_COLUMNS}
+        segment = encode_records(records, vocabularies, first_listing_id=0)
+        return cls([segment], vocabularies)
+
+    @classmethod
+    def from_file(cls, path: str) -> "ListingsStore":
+        """Import listings dump (.csv or .xlsx) into a store."""
+        store = cls.from_records(read_dump(path))
+        logging.info("Listings imported from %s: %s rows", path, len(store))
+        return store
+
+    @classmethod
+    def open_generation(cls, root: str, generation: str) -> "ListingsStore":
+        """Map generation from disk; column data is paged in only when queried."""
+        generation_dir = os.path.join(root, "generations", generation)
+        with open(os.path.join(generation_dir, MANIFEST_FILE), encoding="utf-8") as handle:
+            manifest = json.load(handle)
+
+        segments = []
+        for name in manifest["segments"]:
+            segment_dir = os.path.join(root, "segments", name)
+            columns = {
+                column: np.load(os.path.join(segment_dir, f"{column}.npy"), mmap_mode="r")
+                for column in (*TEXT_COLUMNS, *INT_COLUMNS)
+            }
+            deleted_path = manifest.get("deleted", {}).get(name)
+            deleted = np.load(os.path.join(root, deleted_path), mmap_mode="r") if deleted_path else None
+            segments.append(Segment(columns, deleted))
+        return cls(segments, manifest["vocabularies"])
+
+    def code_for(self, column: str, value: Optional[str]) -> Optional[int]:
+        """
+        Return dictionary code for value.
+
+        None means "no filter" (empty value); MISSING_CODE means the value is
+        unknown to the store, so nothing can match.
+        """
+        key = normalize_key(value)
+        if not key:
+            return None
+        return self._lookup[column].get(key, MISSING_CODE)
+
+    def match_indices(
+        self,
+        brand: Optional[str] = None,
+        model: Optional[str] = None,
+        city: Optional[str] = None,
+        year_to: Optional[int] = None,
+        budget: Optional[int] = None,
+    ) -> np.ndarray:
+        """Global indices of live listings matching all provided criteria."""
+        codes = {}
+        for column, value in (("brand", brand), ("model", model), ("city", city)):
+            code = self.code_for(column, value)
+            if code == MISSING_CODE:
+                return np.empty(0, dtype=np.int64)
+            if code is not None:
+                codes[column] = code
+
+        found = []
+        for offset, segment in zip(self._offsets, self.segments):
+            mask = np.ones(len(segment), dtype=bool)
+            for column, code in codes.items():
+                mask &= segment.columns[column] == code
+            if year_to:
+                mask &= segment.columns["year"] <= year_to
+            if budget:
+                mask &= segment.columns["price"] <= budget
+            if segment.deleted is not None:
+                mask &= ~segment.deleted
+            found.append(np.flatnonzero(mask) + offset)
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def gather(self, column: str, indices: np.ndarray) -> np.ndarray:
+        """Read column values for global indices (touches only needed pages)."""
+        if len(self.segments) == 1:
+            return np.asarray(self.segments[0].columns[column][indices])
+        positions = np.searchsorted(self._offsets, indices, side="right") - 1
+        result = np.empty(len(indices), dtype=INT_COLUMNS.get(column, np.int32))
+        for number in np.unique(positions):
+            selected = positions == number
+            rows = indices[selected] - self._offsets[number]
+            result[selected] = self.segments[number].columns[column][rows]
+        return result
+
+    def rank(self, indices: np.ndarray, limit: int) -> np.ndarray:
+        """
+        Return up to `limit` of `indices` ordered best first.
+
+        Newer cars with less mileage win; price breaks ties in favour of cheaper ones.
+        """
+        if len(indices) == 0 or limit <= 0:
+            return indices[:0]
+        year = self.gather("year", indices).astype(np.float64)
+        mileage = self.gather("mileage", indices).astype(np.float64)
+        price = self.gather("price", indices).astype(np.float64)
+        score = year - mileage / MILEAGE_PER_YEAR - price / (price.max() + 1.0)
+
+        if len(indices) > limit:
+            top = np.argpartition(-score, limit - 1)[:limit]
+        else:
+            top = np.arange(len(indices))
+        return indices[top[np.argsort(-score[top], kind="stable")]]
+
+    def search(
+        self,
+        brand: Optional[str] = None,
+        model: Optional[str] = None,
+        city: Optional[str] = None,
+        year_to: Optional[int] = None,
+        budget: Optional[int] = None,
+        limit: int = 5,
+    ) -> Dict:
+        """
+        Filter and rank listings.
+
+        Returns:
+            dict: total number of matches and the best `limit` listings
+        """
+        indices = self.match_indices(brand, model, city, year_to, budget)
+        best = self.rank(indices, limit)
+        return {
+            "total_matches": int(len(indices)),
+            "results": [self.row(int(index)) for index in best],
+        }
+
+    def row(self, index: int) -> Dict:
+        """Decode a single listing into a plain dictionary."""
+        number = int(np.searchsorted(self._offsets, index, side="right")) - 1
+        columns = self.segments[number].columns
+        position = index - int(self._offsets[number])
+        result = {"id": int(columns["listing_id"][position])}
+        for name in TEXT_COLUMNS:
+            result[name] = self.vocabularies[name][columns[name][position]]
+        for name in ("year", "price", "mileage"):
+            result[name] = int(columns[name][position])
+        return result
+
+
+def encode_records(records: Iterable[Dict], vocabularies: Dict[str, List[str]], first_listing_id: int) -> Segment:
+    """
+    Encode records into a new segment, extending `vocabularies` in place.
+
+    Existing codes never change, so earlier segments stay valid.
+    """
+    vocab_codes = {
+        name: {normalize_key(value): code for code, value in enumerate(values)}
+        for name, values in vocabularies.items()
+    }
+    values: Dict[str, List[int]] = {name: [] for name in (*TEXT_COLUMNS, *INT_COLUMNS)}
+    next_listing_id = first_listing_id
+    skipped = 0
+
+    for record in records:
+        year = parse_int(record.get("year"))
+        price = parse_int(record.get("price"))
+        brand = (record.get("brand") or "").strip()
+        if not brand or year is None or price is None:
+            skipped += 1
+            continue
+
+        for name in TEXT_COLUMNS:
+            raw = " ".join(str(record.get(name) or "").split())
+            key = normalize_key(raw)
+            code = vocab_codes[name].get(key)
+            if code is None:
+                code = len(vocabularies[name])
+                vocab_codes[name][key] = code
+                vocabularies[name].append(raw)
+            values[name].append(code)
+
+        listing_id = parse_int(record.get("listing_id"))
+        if listing_id is None:
+            listing_id = next_listing_id
+        next_listing_id = max(next_listing_id, listing_id) + 1
+
+        values["year"].append(year)
+        values["price"].append(price)
+        values["mileage"].append(parse_int(record.get("mileage")) or 0)
+        values["listing_id"].append(listing_id)
+
+    if skipped:
+        logging.warning("Listings import: skipped %s rows without brand/year/price", skipped)
+
+    columns = {name: np.asarray(values[name], dtype=np.int32) for name in TEXT_COLUMNS}
+    columns.update({name: np.asarray(values[name], dtype=dtype) for name, dtype in INT_COLUMNS.items()})
+    return Segment(columns)
+
+
+class ListingsRepository:
+    """
+    Generations of memory-mapped listings on disk.
+
+    Writers (feed imports) publish new generations; readers (the bot) call
+    current(), which only re-maps files after the CURRENT pointer changes.
+    """
+
+    def __init__(self, root: str, check_interval: float = 5.0):
+        """
+        Args:
+            root: Directory with CURRENT, segments/ and generations/
+            check_interval: Seconds between checks of the CURRENT pointer
+        """
+        self.root = root
+        self.check_interval = check_interval
+        self._store: Optional[ListingsStore] = None
+        self._generation: Optional[str] = None
+        self._checked_at = 0.0
+
+    # --- reading -------------------------------------------------------
+
+    @property
+    def generation(self) -> Optional[str]:
+        """Generation returned by the last current() call."""
+        return self._generation
+
+    def current_generation(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE), encoding="utf-8") as handle:
+                return handle.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def mapped(self) -> ListingsStore:
+        """Generation mapped by the last current() call, without touching the disk."""
+        return self._store or ListingsStore.empty()
+
+    def due(self) -> bool:
+        """True when current() would check the CURRENT pointer again."""
+        return self._store is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    def current(self) -> ListingsStore:
+        """Return live generation, re-mapping it if the pointer was swapped."""
+        now = time.monotonic()
+        if self._store is not None and now - self._checked_at < self.check_interval:
+            return self._store
+        self._checked_at = now
+
+        generation = self.current_generation()
+        if generation is None:
+            return self._store or ListingsStore.empty()
+        if generation != self._generation:
+            try:
+                store = ListingsStore.open_generation(self.root, generation)
+            except (OSError, ValueError, KeyError) as exc:
+                logging.warning("Failed to map listings generation %s: %s", generation, exc)
+                return self._store or ListingsStore.empty()
+            # Single reference assignment: queries in flight keep the old mapping
+            self._store, self._generation = store, generation
+            logging.info("Listings generation %s mapped: %s rows", generation, len(store))
+        return self._store
+
+    # --- writing -------------------------------------------------------
+
+    def import_full(self, records: Iterable[Dict]) -> str:
+        """Replace all listings with a fresh dump."""
+        vocabularies: Dict[str, List[str]] = {name: [] for name in TEXT_COLUMNS}
+        segment = encode_records(records, vocabularies, first_listing_id=0)
+        name = self._write_segment(segment)
+        return self._publish({"segments": [name], "vocabularies": vocabularies, "deleted": {}})
+
+    def append(self, records: Iterable[Dict]) -> str:
+        """Add listings from a delta feed as a new segment."""
+        manifest = self._load_manifest()
+        store = self._open_current()
+        first_id = 0
+        if len(store.segments):
+            first_id = max(int(segment.columns["listing_id"].max(initial=-1)) for segment in store.segments) + 1
+        segment = encode_records(records, manifest["vocabularies"], first_listing_id=first_id)
+        if not len(segment):
+            return self.current_generation() or ""
+        manifest["segments"].append(self._write_segment(segment))
+        return self._publish(manifest)
+
+    def delete(self, listing_ids: Sequence[int]) -> str:
+        """Tombstone listings by listing_id; column files are left untouched."""
+        manifest = self._load_manifest()
+        store = self._open_current()
+        ids = np.asarray(list(listing_ids), dtype=np.int64)
+        generation = self._next_generation()
+        changed = False
+
+        for name, segment in zip(manifest["segments"], store.segments):
+            hits = np.isin(segment.columns["listing_id"], ids)
+            if not hits.any():
+                continue
+            deleted = hits if segment.deleted is None else (hits | segment.deleted)
+            if segment.deleted is not None and np.array_equal(deleted, segment.deleted):
+                continue
+            relative = os.path.join("generations", generation, f"{name}.deleted.npy")
+            os.makedirs(os.path.join(self.root, "generations", generation), exist_ok=True)
+            np.save(os.path.join(self.root, relative), deleted)
+            manifest.setdefault("deleted", {})[name] = relative
+            changed = True
+
+        if not changed:
+            return self.current_generation() or ""
+        return self._publish(manifest, generation)
+
+    def compact(self) -> str:
+        """Merge all segments into one and drop tombstoned rows."""
+        manifest = self._load_manifest()
+        store = self._open_current()
+        merged = {}
+        for column in (*TEXT_COLUMNS, *INT_COLUMNS):
+            parts = []
+            for segment in store.segments:
+                data = np.asarray(segment.columns[column])
+                parts.append(data if segment.deleted is None else data[~segment.deleted])
+            dtype = np.int32 if column in TEXT_COLUMNS else INT_COLUMNS[column]
+            merged[column] = np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+        name = self._write_segment(Segment(merged))
+        return self._publish({"segments": [name], "vocabularies": manifest["vocabularies"], "deleted": {}})
+
+    def collect_garbage(self, keep: int = 2) -> None:
+        """Remove old generations and segments no longer referenced by kept ones."""
+        generations_dir = os.path.join(self.root, "generations")
+        if not os.path.isdir(generations_dir):
+            return
+        generations = sorted(os.listdir(generations_dir))
+        current = self.current_generation()
+        kept = set(generations[-keep:]) | ({current} if current else set())
+
+        referenced = set()
+        for generation in kept:
+            path = os.path.join(generations_dir, generation, MANIFEST_FILE)
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as handle:
+                    manifest = json.load(handle)
+                referenced.update(manifest["segments"])
+                referenced.update(os.path.dirname(p) for p in manifest.get("deleted", {}).values())
+
+        for generation in generations:
+            if generation not in kept and os.path.join("generations", generation) not in referenced:
+                shutil.rmtree(os.path.join(generations_dir, generation), ignore_errors=True)
+        segments_dir = os.path.join(self.root, "segments")
+        for name in os.listdir(segments_dir) if os.path.isdir(segments_dir) else []:
+            if name not in referenced:
+                shutil.rmtree(os.path.join(segments_dir, name), ignore_errors=True)
+
+    def _open_current(self) -> ListingsStore:
+        generation = self.current_generation()
+        return ListingsStore.open_generation(self.root, generation) if generation else ListingsStore.empty()
+
+    def _load_manifest(self) -> Dict:
+        generation = self.current_generation()
+        if generation is None:
+            return {"segments": [], "vocabularies": {name: [] for name in TEXT_COLUMNS}, "deleted": {}}
+        path = os.path.join(self.root, "generations", generation, MANIFEST_FILE)
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)
+
+    def _next_number(self, subdir: str) -> int:
+        path = os.path.join(self.root, subdir)
+        names = os.listdir(path) if os.path.isdir(path) else []
+        numbers = [int(name.split("-")[1]) for name in names if "-" in name and name.split("-")[1].isdigit()]
+        return max(numbers, default=0) + 1
+
+    def _next_generation(self) -> str:
+        return f"gen-{self._next_number('generations'):06d}"
+
+    def _write_segment(self, segment: Segment) -> str:
+        name = f"seg-{self._next_number('segments'):06d}"
+        final_dir = os.path.join(self.root, "segments", name)
+        temp_dir = final_dir + ".tmp"
+        os.makedirs(temp_dir, exist_ok=True)
+        for column, data in segment.columns.items():
+            np.save(os.path.join(temp_dir, f"{column}.npy"), data)
+        os.replace(temp_dir, final_dir)
+        return name
+
+    def _publish(self, manifest: Dict, generation: Optional[str] = None) -> str:
+        generation = generation or self._next_generation()
+        generation_dir = os.path.join(self.root, "generations", generation)
+        os.makedirs(generation_dir, exist_ok=True)
+        _write_atomic(os.path.join(generation_dir, MANIFEST_FILE), json.dumps(manifest, ensure_ascii=False))
+        # The swap: readers see either the old or the new generation, never a mix
+        _write_atomic(os.path.join(self.root, CURRENT_FILE), generation)
+        logging.info("Listings generation %s published", generation)
+        return generation
+
+
+def _write_atomic(path: str, content: str) -> None:
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        handle.write(content)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temp_path, path)
+
+
+def read_dump(path: str) -> Iterable[Dict]:
+    """Yield records from a listings dump (.csv or .xlsx)."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return _read_csv_rows(path)
+    if extension in (".xlsx", ".xlsm"):
+        return _read_xlsx_rows(path)
+    raise ValueError(f"Unsupported listings format: {extension}")
+
+
+def _canonical_headers(headers: Sequence) -> List[Optional[str]]:
+    """Map raw dump headers to store column names (None for unknown columns)."""
+    aliases = {
+        normalize_key(alias): column
+        for column, names in HEADER_ALIASES.items()
+        for alias in names
+    }
+    return [aliases.get(normalize_key(header)) for header in headers]
+
+
+def _read_csv_rows(path: str) -> Iterable[Dict]:
+    with open(path, newline="", encoding="utf-8-sig") as handle:
+        sample = handle.read(4096)
+        handle.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(handle, dialect)
+        headers = _canonical_headers(next(reader, []))
+        for row in reader:
+            yield {name: value for name, value in zip(headers, row) if name}
+
+
+def _read_xlsx_rows(path: str) -> Iterable[Dict]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError as exc:
+        raise RuntimeError("XLSX import requires openpyxl: pip install -r requirements.txt") from exc
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = _canonical_headers(next(rows, ()))
+        for row in rows:
+            yield {name: value for name, value in zip(headers, row) if name}
+    finally:
+        workbook.close()
+
+
+def main() -> None:
+    """Feed import CLI: full import, deltas and maintenance of a listings repository."""
+    parser = argparse.ArgumentParser(description="Manage memory-mapped listings repository")
+    parser.add_argument("--root", required=True, help="Repository directory (LISTINGS_PATH)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("import", help="Replace listings with a full dump").add_argument("dump")
+    commands.add_parser("append", help="Append listings from a delta dump").add_argument("dump")
+    delete_parser = commands.add_parser("delete", help="Delete listings by id (one per line)")
+    delete_parser.add_argument("ids_file")
+    commands.add_parser("compact", help="Merge segments and drop deleted rows")
+    gc_parser = commands.add_parser("gc", help="Remove unreferenced generations and segments")
+    gc_parser.add_argument("--keep", type=int, default=2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    repository = ListingsRepository(args.root)
+    if args.command == "import":
+        print(repository.import_full(read_dump(args.dump)))
+    elif args.command == "append":
+        print(repository.append(read_dump(args.dump)))
+    elif args.command == "delete":
+        with open(args.ids_file, encoding="utf-8") as handle:
+            ids = [int(line) for line in handle if line.strip()]
+        print(repository.delete(ids))
+    elif args.command == "compact":
+        print(repository.compact())
+    elif args.command == "gc":
+        repository.collect_garbage(keep=args.keep)
+
+
+if __name__ == "__main__":
+    main()
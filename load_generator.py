@@ -0,0 +1,344 @@
+"""
+Load Generator - end-to-end latency vs throughput for the unmodified bot
+
+Starts fake_telegram.py in-process, launches `bot.py` as a subprocess pointed
+at it (TELEGRAM_API_URL, SHEET_SYNC_URL) and, for every arrival rate, lets
+synthetic users walk the whole funnel: /start <tag> deeplink, contact share or
+typed phone, brand/model/city/year/budget, manager consent now or via the
+inline "pass_manager" button later, and the name question. Users arrive as a
+Poisson process; each step waits for the bot's reply before the user "types"
+the next answer.
+
+Measured per rate:
+- reply latency: update queued -> first bot call for that chat
+- step latency: update queued -> the message that ends the step
+  (BUDGET includes the bot's progress bar pauses)
+
+Usage:
+    python load_generator.py --rates 1,5,10,20 --duration 20 --json load_report.json
+    python load_generator.py --no-spawn --port 8081   # bot already running against the fake API
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fake_telegram import BOT_ID, FakeTelegramServer
+from gas_standin import AppsScriptServer, AppsScriptStandIn
+
+BOT_TOKEN = f"{BOT_ID}:LOADTEST"
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+# Text that marks the last bot message of each step
+GREETING_MARK = "Добро пожаловать"
+SUMMARY_MARK = "- Бюджет:"
+ASK_NAME_MARK = "Как к вам обращаться"
+FOLLOWUP_BUTTON_MARK = "Как только будете готовы"
+
+
+class Step:
+    """One user action and the bot message that completes it."""
+
+    def __init__(self, state: str, expect: str, text: str = None, contact: Dict = None, callback: str = None):
+        self.state = state
+        self.expect = expect
+        self.text = text
+        self.contact = contact
+        self.callback = callback
+
+
+def funnel_steps(number: int) -> Tuple[bool, List[Step]]:
+    """
+    Scripted funnel for user `number`.
+
+    Returns:
+        tuple: (user has a profile name, steps)
+    """
+    named = number % 3 != 0
+    phone = f"7999{number:07d}"[-11:]
+    steps = [Step("START", GREETING_MARK, text=f"/start load_tag_{number % 5}")]
+    if number % 2:
+        contact = {"phone_number": f"+{phone}", "first_name": "Контакт" if named else ""}
+        steps.append(Step("PHONE", "Шаг 2", contact=contact))
+    else:
+        steps.append(Step("PHONE", "Шаг 2", text=phone))
+    steps += [
+        Step("BRAND", "Шаг 3", text="хавал"),
+        Step("MODEL", "Шаг 4", text="Jolion"),
+        Step("CITY", "Шаг 5", text="мск"),
+        Step("YEAR_TO", "Шаг 6", text="2022"),
+        Step("BUDGET", "Передать контакт менеджеру", text="2 000 000"),
+    ]
+    after_consent = SUMMARY_MARK if named else ASK_NAME_MARK
+    if number % 4 == 0:
+        steps.append(Step("MANAGER", FOLLOWUP_BUTTON_MARK, text="Нет, пока не нужно"))
+        steps.append(Step("MANAGER", after_consent, callback="pass_manager"))
+    else:
+        steps.append(Step("MANAGER", after_consent, text="Да, передать менеджеру"))
+    if not named:
+        steps.append(Step("CLIENT_NAME", SUMMARY_MARK, text=f"Клиент {number}"))
+    return named, steps
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[position]
+
+
+class LoadRun:
+    """Routes recorded bot calls to per-chat inboxes and drives users."""
+
+    def __init__(self, server: FakeTelegramServer, step_timeout: float, think_time: float):
+        self.server = server
+        self.step_timeout = step_timeout
+        self.think_time = think_time
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.inboxes: Dict[int, asyncio.Queue] = {}
+        self._message_id = 0
+
+    def on_call(self, call: Dict) -> None:
+        """Server thread callback: hand the call to the user's inbox."""
+        params = call["params"]
+        chat_id = params.get("chat_id")
+        if chat_id is None and params.get("callback_query_id"):
+            chat_id = str(params["callback_query_id"]).split(":", 1)[0]
+        if chat_id is None or self.loop is None:
+            return
+        inbox = self.inboxes.get(int(chat_id))
+        if inbox is not None:
+            self.loop.call_soon_threadsafe(inbox.put_nowait, call)
+
+    def _update_for(self, user_id: int, named: bool, step: Step, button_message_id: Optional[int]) -> Dict:
+        self._message_id += 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}" if named else "", "username": f"user{user_id}"}
+        if step.callback:
+            return {
+                "callback_query": {
+                    "id": f"{user_id}:{self._message_id}",
+                    "from": user,
+                    "chat_instance": str(user_id),
+                    "data": step.callback,
+                    "message": {
+                        "message_id": button_message_id,
+                        "date": int(time.time()),
+                        "chat": {"id": user_id, "type": "private"},
+                        "from": {"id": BOT_ID, "is_bot": True, "first_name": "Autopodbor"},
+                        "text": FOLLOWUP_BUTTON_MARK,
+                    },
+                }
+            }
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+        }
+        if step.contact is not None:
+            message["contact"] = dict(step.contact, user_id=user_id)
+        else:
+            message["text"] = step.text
+            if step.text.startswith("/"):
+                command = step.text.split()[0]
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"message": message}
+
+    async def run_user(self, user_id: int, number: int, stats: Dict) -> None:
+        named, steps = funnel_steps(number)
+        inbox = self.inboxes.setdefault(user_id, asyncio.Queue())
+        button_message_id = None
+        try:
+            for position, step in enumerate(steps):
+                if position:
+                    await asyncio.sleep(self.think_time)
+                sent = time.perf_counter()
+                self.server.api.push_update(self._update_for(user_id, named, step, button_message_id))
+                stats["updates"] += 1
+                first_reply = None
+                deadline = sent + self.step_timeout
+                while True:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    call = await asyncio.wait_for(inbox.get(), remaining)
+                    if first_reply is None:
+                        first_reply = call["time"] - sent
+                        stats["reply_ms"].append(first_reply * 1000)
+                    text = call["params"].get("text") or ""
+                    if not call["method"].startswith("send"):
+                        continue
+                    if FOLLOWUP_BUTTON_MARK in text:
+                        button_message_id = call["result"]["message_id"]
+                    if step.expect in text:
+                        stats["steps_ms"].setdefault(step.state, []).append((call["time"] - sent) * 1000)
+                        break
+            stats["completed"] += 1
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+        finally:
+            self.inboxes.pop(user_id, None)
+
+    async def run_rate(self, rate: float, duration: float, first_user: int, seed: int) -> Dict:
+        """Poisson arrivals at `rate` users/sec for `duration` seconds."""
+        self.loop = asyncio.get_running_loop()
+        rng = random.Random(seed)
+        stats = {"updates": 0, "completed": 0, "timeouts": 0, "reply_ms": [], "steps_ms": {}}
+        users = max(1, int(round(rate * duration)))
+
+        started = time.perf_counter()
+        tasks = []
+        for number in range(users):
+            tasks.append(asyncio.create_task(self.run_user(first_user + number, number, stats)))
+            await asyncio.sleep(rng.expovariate(rate))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        reply = stats["reply_ms"]
+        return {
+            "offered_users_per_sec": rate,
+            "users": users,
+            "completed": stats["completed"],
+            "timeouts": stats["timeouts"],
+            "updates": stats["updates"],
+            "elapsed_s": round(elapsed, 2),
+            "updates_per_sec": round(stats["updates"] / elapsed, 1) if elapsed else 0.0,
+            "reply_p50_ms": round(percentile(reply, 0.50), 1),
+            "reply_p95_ms": round(percentile(reply, 0.95), 1),
+            "reply_p99_ms": round(percentile(reply, 0.99), 1),
+            "steps_p95_ms": {state: round(percentile(values, 0.95), 1) for state, values in stats["steps_ms"].items()},
+        }
+
+
+def spawn_bot(api_url: str, sheet_url: str) -> subprocess.Popen:
+    """Run the unmodified bot.py against the fake API."""
+    env = dict(os.environ, BOT_TOKEN=BOT_TOKEN, TELEGRAM_API_URL=api_url, SHEET_SYNC_URL=sheet_url)
+    env.setdefault("PYTHONUNBUFFERED", "1")
+    return subprocess.Popen(
+        [sys.executable, BOT_SCRIPT],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        cwd=os.path.dirname(BOT_SCRIPT),
+    )
+
+
+def print_report(results: List[Dict]) -> None:
+    print("=" * 96)
+    print("LOAD TEST: latency vs throughput")
+    print("=" * 96)
+    print(
+        f"{'users/s':>8}{'users':>7}{'done':>7}{'t/o':>5}{'upd/s':>9}"
+        f"{'reply p50':>11}{'p95':>9}{'p99':>9}{'BUDGET p95':>12}{'other steps p95':>17}"
+    )
+    for row in results:
+        steps = dict(row["steps_p95_ms"])
+        budget = steps.pop("BUDGET", 0.0)
+        other = max(steps.values()) if steps else 0.0
+        print(
+            f"{row['offered_users_per_sec']:>8g}{row['users']:>7}{row['completed']:>7}{row['timeouts']:>5}"
+            f"{row['updates_per_sec']:>9}{row['reply_p50_ms']:>11.1f}{row['reply_p95_ms']:>9.1f}"
+            f"{row['reply_p99_ms']:>9.1f}{budget:>12.1f}{other:>17.1f}"
+        )
+    print("-" * 96)
+    print("Latencies in ms; reply = first bot call after the update, steps = until the step's final message")
+
+
+async def run(args) -> Tuple[List[Dict], Optional[Dict]]:
+    """Run all rates; returns per-rate results and stand-in sheet stats (if used)."""
+    server = FakeTelegramServer(args.host, args.port)
+    load = LoadRun(server, step_timeout=args.step_timeout, think_time=args.think)
+    server.api.on_call = load.on_call
+    server.start()
+
+    sheet_server = None
+    if args.sheet_standin:
+        script = AppsScriptStandIn(latency_ms=args.sheet_latency_ms, error_rate=args.sheet_error_rate)
+        sheet_server = AppsScriptServer(args.host, 0, script)
+        sheet_server.start()
+
+    bot_process = None
+    if not args.no_spawn:
+        sheet_url = sheet_server.url if sheet_server else args.sheet_url or f"{server.url}/sheet"
+        bot_process = spawn_bot(server.url, sheet_url)
+    try:
+        started = time.monotonic()
+        while not server.api.polling.is_set():
+            if bot_process is not None and bot_process.poll() is not None:
+                raise RuntimeError(f"bot.py exited with code {bot_process.returncode}")
+            if time.monotonic() - started > args.startup_timeout:
+                raise RuntimeError("Bot did not start polling the fake API in time")
+            await asyncio.sleep(0.1)
+
+        results = []
+        for index, rate in enumerate(args.rates):
+            print(f"Running {rate:g} users/sec for {args.duration:g} s...")
+            results.append(await load.run_rate(rate, args.duration, 1_000_000 * (index + 1), seed=index))
+            await asyncio.sleep(args.pause)
+
+        sheet = None
+        if sheet_server is not None:
+            sheet = dict(sheet_server.script.stats)
+            sheet["rows"] = len(sheet_server.script.store.values())
+            sheet["duplicate_users"] = len(sheet_server.script.store.duplicate_users())
+        return results, sheet
+    finally:
+        if bot_process is not None:
+            bot_process.terminate()
+            try:
+                bot_process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                bot_process.kill()
+        server.shutdown()
+        server.server_close()
+        if sheet_server is not None:
+            sheet_server.shutdown()
+            sheet_server.server_close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="End-to-end load test against a fake Telegram Bot API")
+    parser.add_argument("--rates", default="1,2,5,10", help="Comma-separated user arrival rates (users/sec)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Arrival window per rate, seconds")
+    parser.add_argument("--think", type=float, default=0.5, help="User think time between steps, seconds")
+    parser.add_argument("--step-timeout", type=float, default=30.0, help="Give up on a user after this wait")
+    parser.add_argument("--pause", type=float, default=2.0, help="Pause between rates, seconds")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="Fake API port (0 = any free port)")
+    parser.add_argument("--sheet-url", help="SHEET_SYNC_URL for the bot (default: no-op sink on the fake API)")
+    parser.add_argument("--sheet-standin", action="store_true", help="Sync into a local Apps Script stand-in")
+    parser.add_argument("--sheet-latency-ms", type=float, default=0.0, help="Stand-in processing time per sync")
+    parser.add_argument("--sheet-error-rate", type=float, default=0.0, help="Stand-in share of failed syncs")
+    parser.add_argument("--no-spawn", action="store_true", help="Do not start bot.py (it is already running)")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    args.rates = [float(rate) for rate in args.rates.split(",") if rate.strip()]
+    if args.no_spawn and not args.port:
+        parser.error("--no-spawn needs a fixed --port the running bot points to")
+
+    try:
+        results, sheet = asyncio.run(run(args))
+    except RuntimeError as exc:
+        print(f"Error: {exc}")
+        return 1
+
+    print_report(results)
+    if sheet is not None:
+        print(f"Sheet stand-in: {sheet}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump({"rates": results, "sheet": sheet}, handle, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+"""
+Reconcile - find and repair drift between the lead registry and the sheet
+
+Replication to the sheet is asynchronous, and the sheet can still drift
+(a lost request, a row edited or deleted by hand). Instead of comparing
+leads one by one, both sides hash each lead's content:
+- the sheet answers `?mode=hashes` with one hash per tg_user_id (GET.js)
+- the bot hashes its registry leads the same way (HASH_FIELDS, same
+  value formatting and MD5 prefix as rowHashes() in GET.js)
+
+Only leads whose hashes differ or that the sheet lacks are resent, in
+batches of BATCH_SIZE leads per POST (`{"leads": [...]}`, processBatch in
+GET.js). An audit of 50k leads is one hash request plus a few batches.
+Leads still waiting in the replication outbox are skipped.
+
+Usage:
+    python reconcile.py [--dry-run]      # LEADS_DB_PATH, SHEET_SYNC_URL from .env
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List
+
+from dotenv import load_dotenv
+
+from lead_registry import LeadRegistry, normalize_phone
+
+# Sheet columns compared, in hashing order (HASH_FIELDS in GET.js)
+HASH_FIELDS = (
+    "phone_number", "brand", "model", "year", "city", "city_hub", "budget",
+    "manager", "client_name", "tg_user_id", "tg_username", "tag",
+)
+BATCH_SIZE = 500
+
+
+def hash_cell(key: str, value) -> str:
+    """Cell value as hashCell() in GET.js formats it (String() of the cell)."""
+    if value is None:
+        return ""
+    if key == "phone_number":
+        return normalize_phone(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def row_hash(record: Dict) -> str:
+    """First 16 hex digits of the MD5 of the record's HASH_FIELDS joined by \\x1f."""
+    text = "\x1f".join(hash_cell(key, record.get(key)) for key in HASH_FIELDS)
+    return hashlib.md5(text.encode("utf-8")).hexdigest()[:16]
+
+
+def lead_record(lead: Dict) -> Dict:
+    """Registry lead (sync payload fields) as the sheet row it should produce."""
+    record = dict(lead)
+    record["phone_number"] = record.pop("phone", None)
+    return record
+
+
+def fetch_sheet_hashes(url: str, token: str = "", timeout: float = 120.0) -> Dict[str, str]:
+    """
+    Content hash of every sheet row by tg_user_id.
+
+    Raises:
+        requests.RequestException: request failed
+        RuntimeError: the script answered with an error
+    """
+    import requests
+
+    params = {"mode": "hashes"}
+    if token:
+        params["token"] = token
+    response = requests.get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    answer = response.json()
+    if answer.get("status") != "success":
+        raise RuntimeError(f"Hashes failed: {answer.get('message', answer)}")
+    if tuple(answer.get("fields", ())) != HASH_FIELDS:
+        raise RuntimeError(f"Sheet hashes fields differ from HASH_FIELDS: {answer.get('fields')}")
+    return answer["hashes"]
+
+
+def send_batch(url: str, leads: List[Dict], timeout: float = 120.0) -> Dict:
+    """Create or update many leads in one request (processBatch in GET.js)."""
+    import requests
+
+    response = requests.post(
+        url,
+        data=json.dumps({"leads": leads}, ensure_ascii=False).encode("utf-8"),
+        headers={"Content-Type": "application/json; charset=utf-8"},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+    answer = response.json()
+    if answer.get("status") != "success":
+        raise RuntimeError(f"Batch failed: {answer.get('message', answer)}")
+    return answer
+
+
+def reconcile(
+    registry: LeadRegistry, url: str, token: str = "", dry_run: bool = False, batch_size: int = BATCH_SIZE
+) -> Dict:
+    """
+    Compare registry leads with the sheet and resend the divergent ones.
+
+    Returns:
+        dict: leads, sheet_rows, in_sync, divergent, missing (not in the sheet),
+              queued (skipped, in the outbox), sheet_only, resent, requests, seconds
+    """
+    started = time.perf_counter()
+    sheet = fetch_sheet_hashes(url, token)
+    queued = registry.queued_ids()
+    report = {"leads": 0, "sheet_rows": len(sheet), "in_sync": 0, "divergent": 0, "missing": 0, "queued": 0}
+    resend = []
+    local_ids = set()
+    for lead_id, lead in registry.leads():
+        report["leads"] += 1
+        local_ids.add(lead["tg_user_id"])
+        if lead_id in queued:
+            report["queued"] += 1
+            continue
+        remote = sheet.get(lead["tg_user_id"])
+        if remote == row_hash(lead_record(lead)):
+            report["in_sync"] += 1
+            continue
+        report["missing" if remote is None else "divergent"] += 1
+        resend.append(lead)
+    report["sheet_only"] = len(set(sheet) - local_ids)
+
+    requests_made = 1
+    if not dry_run:
+        for offset in range(0, len(resend), batch_size):
+            send_batch(url, resend[offset : offset + batch_size])
+            requests_made += 1
+    report["resent"] = 0 if dry_run else len(resend)
+    report["requests"] = requests_made
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Resend leads whose sheet rows differ from the lead registry")
+    parser.add_argument("--db", default=os.getenv("LEADS_DB_PATH", ""), help="Lead registry (default: LEADS_DB_PATH)")
+    parser.add_argument("--url", default=os.getenv("SHEET_SYNC_URL", ""), help="Web app URL (default: SHEET_SYNC_URL)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the differences")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    if not args.db or not os.path.exists(args.db):
+        parser.error("--db or LEADS_DB_PATH must point to an existing lead registry")
+    if not args.url:
+        parser.error("--url or SHEET_SYNC_URL is required")
+
+    registry = LeadRegistry(args.db)
+    try:
+        report = reconcile(registry, args.url, os.getenv("SHEET_EXPORT_TOKEN", ""), args.dry_run, args.batch_size)
+    finally:
+        registry.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Reply outbox - fewer and overlapping Bot API calls per handler
+
+Handlers used to await every Bot API call in turn: a confirmation, then a
+summary, then a follow-up; answer() of a callback query and removing its
+buttons before doing any work. Each call is a round trip to Telegram, so
+the last message of a step arrived several round trips after the update.
+
+A ReplyOutbox collects the calls of one handler run:
+- reply() queues a text message; consecutive texts to the same chat are
+  merged into one message (blank line between them) when the layout
+  allows: same parse mode, at most one reply markup, no inline keyboard
+  followed by more text (the buttons would move below it), and within
+  Telegram's message length limit
+- start() begins an independent call (answer(), editing old buttons) right
+  away, so it runs concurrently with the handler's work and its messages
+
+Queued messages are sent when the `async with` block exits, in order, one
+chat at a time; the started calls are awaited together with them. Started
+calls are best effort: a callback query that is too old to answer or
+buttons that are already gone are logged, not raised, so the handler's
+next conversation state is not lost over them.
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, List, Optional
+
+from telegram import InlineKeyboardMarkup, Message
+from telegram.constants import MessageLimit
+
+
+class _Reply:
+    def __init__(self, message: Message, text: str, parse_mode: Optional[str], reply_markup):
+        self.message = message
+        self.text = text
+        self.parse_mode = parse_mode
+        self.reply_markup = reply_markup
+
+    def can_merge(self, other: "_Reply") -> bool:
+        return (
+            self.message.chat_id == other.message.chat_id
+            and self.parse_mode == other.parse_mode
+            and (self.reply_markup is None or other.reply_markup is None)
+            and not isinstance(self.reply_markup, InlineKeyboardMarkup)
+            and len(self.text) + 2 + len(other.text) <= MessageLimit.MAX_TEXT_LENGTH
+        )
+
+    def merge(self, other: "_Reply") -> None:
+        self.text = f"{self.text.rstrip()}\n\n{other.text.lstrip()}"
+        self.reply_markup = self.reply_markup or other.reply_markup
+
+
+class ReplyOutbox:
+    """Bot API calls of one handler run: texts merged, independent calls overlapped."""
+
+    def __init__(self):
+        self._replies: List[_Reply] = []
+        self._started: List[asyncio.Task] = []
+        self.sent = 0
+        self.merged = 0
+
+    def reply(self, message: Message, text: str, parse_mode: Optional[str] = None, reply_markup=None) -> None:
+        """Queue a text message to `message`'s chat (as message.reply_text would send it)."""
+        reply = _Reply(message, text, parse_mode, reply_markup)
+        if self._replies and self._replies[-1].can_merge(reply):
+            self._replies[-1].merge(reply)
+            self.merged += 1
+        else:
+            self._replies.append(reply)
+
+    def start(self, call: Awaitable) -> None:
+        """Run a call that nothing else waits for concurrently with the rest of the handler; failures are logged."""
+        self._started.append(asyncio.ensure_future(call))
+
+    async def flush(self) -> None:
+        """
+        Send the queued messages in order and wait for the started calls.
+
+        Raises:
+            telegram.error.TelegramError: a queued message failed, after the started calls finished
+        """
+        replies, self._replies = self._replies, []
+        started, self._started = self._started, []
+        error: Optional[BaseException] = None
+        try:
+            for reply in replies:
+                await reply.message.reply_text(reply.text, parse_mode=reply.parse_mode, reply_markup=reply.reply_markup)
+                self.sent += 1
+        except Exception as exc:
+            error = exc
+        for result in await asyncio.gather(*started, return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.warning("Best-effort Bot API call failed: %s", result)
+        if error is not None:
+            raise error
+
+    async def __aenter__(self) -> "ReplyOutbox":
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            await self.flush()
+            return
+        # The handler failed: queued messages are dropped, started calls still finish
+        self._replies = []
+        await asyncio.gather(*self._started, return_exceptions=True)
+        self._started = []
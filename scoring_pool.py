@@ -0,0 +1,185 @@
+"""
+Scoring Pool - CPU-heavy listing scoring outside of the bot's event loop
+
+Filtering and ranking thousands of candidate listings runs in a
+ProcessPoolExecutor whose workers are started ahead of time and keep the
+memory-mapped listings repository open (read-only, pages shared through the
+OS page cache). Ranked rows come back through shared memory instead of being
+pickled, and the number of queued requests is capped so a burst of heavy
+searches is shed instead of slowing everyone's replies.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from listings_store import TEXT_COLUMNS, ListingsRepository, ListingsStore
+
+# Layout of ranked rows passed back from workers
+RESULT_DTYPE = np.dtype(
+    [
+        ("listing_id", np.int64),
+        ("brand", np.int32),
+        ("model", np.int32),
+        ("city", np.int32),
+        ("year", np.int16),
+        ("price", np.int32),
+        ("mileage", np.int32),
+    ]
+)
+
+# Repository opened once per worker process by the initializer
+_worker_repository: Optional[ListingsRepository] = None
+
+
+class ScoringPoolBusy(Exception):
+    """Raised when the pool already has `max_pending` requests queued."""
+
+
+def _init_worker(root: str) -> None:
+    """Open the repository in the worker and map the live generation."""
+    global _worker_repository
+    _worker_repository = ListingsRepository(root, check_interval=1.0)
+    _worker_repository.current()
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+def _score_in_worker(criteria: Dict, limit: int) -> Tuple[Optional[str], int, Optional[str], int]:
+    """
+    Filter and rank listings in a worker process.
+
+    Returns:
+        tuple: (generation, total matches, shared memory name, ranked rows)
+    """
+    repository = _worker_repository
+    store = repository.current()
+    generation = repository.generation
+
+    indices = store.match_indices(**criteria)
+    best = store.rank(indices, limit)
+    if not len(best):
+        return generation, int(len(indices)), None, 0
+
+    block = shared_memory.SharedMemory(create=True, size=len(best) * RESULT_DTYPE.itemsize)
+    try:
+        rows = np.ndarray(len(best), dtype=RESULT_DTYPE, buffer=block.buf)
+        for column in RESULT_DTYPE.names:
+            rows[column] = store.gather(column, best)
+        del rows
+    finally:
+        block.close()
+    return generation, int(len(indices)), block.name, int(len(best))
+
+
+class ScoringPool:
+    """Pre-warmed process pool for listing searches over a repository."""
+
+    def __init__(self, listings_root: str, max_workers: int = 2, max_pending: int = 16):
+        """
+        Args:
+            listings_root: Memory-mapped listings repository directory
+            max_workers: Number of worker processes
+            max_pending: Queued + running requests above which new ones are rejected
+        """
+        if not os.path.isdir(listings_root):
+            raise ValueError(f"Scoring pool needs a listings repository directory: {listings_root}")
+        self.listings_root = listings_root
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._vocabularies: Dict[str, Dict] = {}
+
+    def start(self) -> None:
+        """Spawn workers and wait until each has mapped the listings."""
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.listings_root,),
+        )
+        pids = {future.result() for future in [self._executor.submit(_warm_up) for _ in range(self.max_workers)]}
+        logging.info("Scoring pool started: %s workers (%s)", self.max_workers, sorted(pids))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def search(self, limit: int = 5, **criteria) -> Dict:
+        """
+        Run ListingsStore.search in a worker.
+
+        Raises:
+            ScoringPoolBusy: when too many requests are already queued
+        """
+        if self._executor is None:
+            raise RuntimeError("Scoring pool is not started")
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ScoringPoolBusy(f"{self.pending} scoring requests pending")
+
+        self.pending += 1
+        future = self._executor.submit(_score_in_worker, criteria, limit)
+        try:
+            generation, total, block_name, count = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # A worker that already started still creates a result block: release it when done
+            future.add_done_callback(_discard_result)
+            raise
+        finally:
+            self.pending -= 1
+
+        rows = _take_shared_rows(block_name, count)
+        vocabularies = await self._vocabularies_for(generation)
+        results = []
+        for row in rows:
+            result = {"id": int(row["listing_id"])}
+            for name in TEXT_COLUMNS:
+                result[name] = vocabularies[name][row[name]]
+            for name in ("year", "price", "mileage"):
+                result[name] = int(row[name])
+            results.append(result)
+        return {"total_matches": total, "results": results}
+
+    async def _vocabularies_for(self, generation: Optional[str]) -> Dict:
+        if generation is None:
+            return {name: [] for name in TEXT_COLUMNS}
+        vocabularies = self._vocabularies.get(generation)
+        if vocabularies is None:
+            # Manifest, column files and lookup dicts: read in a thread like the scoring itself
+            store = await asyncio.to_thread(ListingsStore.open_generation, self.listings_root, generation)
+            vocabularies = store.vocabularies
+            # Only the latest generation is kept; workers move to it within a second
+            self._vocabularies = {generation: vocabularies}
+        return vocabularies
+
+
+def _discard_result(future: Future) -> None:
+    """Release the shared memory of a search nobody waits for any more."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    _, _, block_name, _ = future.result()
+    _take_shared_rows(block_name, 0)
+
+
+def _take_shared_rows(block_name: Optional[str], count: int) -> np.ndarray:
+    """Copy ranked rows out of shared memory and release the block."""
+    if block_name is None:
+        return np.empty(0, dtype=RESULT_DTYPE)
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        return np.ndarray(count, dtype=RESULT_DTYPE, buffer=block.buf).copy()
+    finally:
+        block.close()
+        block.unlink()
@@ -0,0 +1,228 @@
+"""
+Sheet Export - pull leads changed since a cursor from the Apps Script web app
+
+GET.js answers `?mode=export` with pages of rows ordered by their `timestamp`
+column (updated on every sync) and a `next_cursor`; passing the cursor back
+returns only rows changed after it. A client keeps the last cursor and
+fetches deltas instead of reading the sheet row by row.
+
+SheetSnapshot is such a client inside the bot: a local copy of the lead
+sheet indexed by tg_user_id, refreshed with deltas every few minutes and
+saved to disk, so returning users can be recognized without a sheet call.
+
+Usage:
+    python sheet_export.py --since 2026-10-01 --output leads.jsonl
+    python sheet_export.py --cursor-file export.cursor --format csv --output delta.csv
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+PAGE_SIZE = 500
+SNAPSHOT_REFRESH_SECONDS = 600.0
+SNAPSHOT_VERSION = 1
+
+
+def fetch_page(
+    url: str,
+    cursor: Optional[str] = None,
+    since: Optional[str] = None,
+    limit: int = PAGE_SIZE,
+    token: str = "",
+    timeout: float = 30.0,
+) -> Dict:
+    """
+    One export page as JSON.
+
+    Args:
+        url: Apps Script web app URL (SHEET_SYNC_URL)
+        cursor: next_cursor of the previous page; takes precedence over `since`
+        since: ISO date/time or unix milliseconds of the oldest change to return
+        limit: Rows per page (the script caps it at 5000)
+        token: EXPORT_TOKEN script property, if the script requires one
+
+    Returns:
+        dict: {status, columns, rows, next_cursor, has_more}
+
+    Raises:
+        requests.RequestException: request failed
+        RuntimeError: the script answered with an error
+    """
+    # Imported here: the bot loads this module at startup, requests is loaded lazily
+    import requests
+
+    params = {"mode": "export", "format": "json", "limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    elif since:
+        params["since"] = since
+    if token:
+        params["token"] = token
+    response = requests.get(url, params=params, timeout=timeout)
+    response.raise_for_status()
+    page = response.json()
+    if page.get("status") != "success":
+        raise RuntimeError(f"Export failed: {page.get('message', page)}")
+    return page
+
+
+def iter_changes(url: str, cursor: Optional[str] = None, since: Optional[str] = None, **kwargs) -> Iterator[Tuple[Dict, str]]:
+    """Rows changed after the cursor as (record keyed by column, cursor after this page), until the last page."""
+    while True:
+        page = fetch_page(url, cursor=cursor, since=since, **kwargs)
+        cursor = page["next_cursor"]
+        for row in page["rows"]:
+            yield dict(zip(page["columns"], row)), cursor
+        if not page["has_more"] or not page["rows"]:
+            return
+
+
+def user_key(value) -> str:
+    """tg_user_id cell as a lookup key (numeric cells come back as numbers)."""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return "" if value is None else str(value).strip()
+
+
+class SheetSnapshot:
+    """Local copy of the lead sheet indexed by tg_user_id, kept current with export deltas."""
+
+    def __init__(self):
+        self.cursor: Optional[str] = None
+        self._records: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, tg_user_id) -> Optional[Dict]:
+        """Latest sheet row of the user (columns as in the sheet), or None."""
+        return self._records.get(user_key(tg_user_id))
+
+    def refresh(self, url: str, token: str = "", limit: int = PAGE_SIZE) -> int:
+        """
+        Apply rows changed since the last refresh; returns how many arrived.
+
+        Raises:
+            requests.RequestException, RuntimeError: as fetch_page; rows of complete pages are kept
+        """
+        changed = 0
+        for record, cursor in iter_changes(url, cursor=self.cursor, limit=limit, token=token):
+            key = user_key(record.get("tg_user_id"))
+            with self._lock:
+                if key:
+                    self._records[key] = record
+                self.cursor = cursor
+            changed += 1
+        return changed
+
+    def save(self, path: str) -> None:
+        """Write the snapshot atomically (temp file + rename)."""
+        with self._lock:
+            data = {"version": SNAPSHOT_VERSION, "cursor": self.cursor, "records": list(self._records.values())}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(data, handle, ensure_ascii=False)
+        os.replace(temporary, path)
+
+    def load(self, path: str) -> bool:
+        """Restore from a saved snapshot if it exists; a broken file is logged and ignored."""
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, encoding="utf-8") as handle:
+                data = json.load(handle)
+            if data.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported sheet snapshot version: {data.get('version')}")
+            records = {user_key(record.get("tg_user_id")): record for record in data["records"]}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as exc:
+            logging.warning("Sheet snapshot %s not loaded: %s", path, exc)
+            return False
+        with self._lock:
+            self._records = records
+            self.cursor = data.get("cursor")
+        return True
+
+
+async def refresh_periodically(
+    snapshot: SheetSnapshot,
+    url: str,
+    path: str = "",
+    interval: float = SNAPSHOT_REFRESH_SECONDS,
+    token: str = "",
+    initial_delay: float = 0.0,
+) -> None:
+    """Refresh the snapshot after `initial_delay` and every `interval` seconds until cancelled (network in a worker thread)."""
+    await asyncio.sleep(initial_delay)
+    while True:
+        try:
+            changed = await asyncio.to_thread(snapshot.refresh, url, token)
+            if changed and path:
+                await asyncio.to_thread(snapshot.save, path)
+            logging.info("Sheet snapshot refreshed: %d changed rows, %d leads", changed, len(snapshot))
+        except Exception as exc:
+            logging.warning("Sheet snapshot refresh failed: %s", exc)
+        await asyncio.sleep(interval)
+
+
+def write_records(records: List[Dict], output, fmt: str) -> None:
+    if fmt == "csv":
+        import csv
+
+        columns = list(dict.fromkeys(column for record in records for column in record))
+        writer = csv.DictWriter(output, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        for record in records:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def main() -> None:
+    # Command line only: bot.py imports this module for SheetSnapshot
+    import argparse
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export leads changed since a cursor from the Apps Script")
+    parser.add_argument("--url", default=os.getenv("SHEET_SYNC_URL", ""), help="Web app URL (default: SHEET_SYNC_URL)")
+    parser.add_argument("--since", help="ISO date/time or unix ms; ignored when the cursor file has a cursor")
+    parser.add_argument("--cursor-file", help="Read the cursor from this file and store the new one after the export")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    parser.add_argument("--output", help="Output file (default: stdout)")
+    parser.add_argument("--limit", type=int, default=PAGE_SIZE, help="Rows per request")
+    args = parser.parse_args()
+    if not args.url:
+        parser.error("--url or SHEET_SYNC_URL is required")
+
+    cursor = None
+    if args.cursor_file and os.path.exists(args.cursor_file):
+        with open(args.cursor_file, encoding="utf-8") as handle:
+            cursor = handle.read().strip() or None
+
+    records = []
+    for record, cursor in iter_changes(
+        args.url, cursor=cursor, since=args.since, limit=args.limit, token=os.getenv("SHEET_EXPORT_TOKEN", "")
+    ):
+        records.append(record)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as handle:
+            write_records(records, handle, args.format)
+    else:
+        write_records(records, sys.stdout, args.format)
+    if args.cursor_file and cursor:
+        with open(args.cursor_file, "w", encoding="utf-8") as handle:
+            handle.write(cursor)
+    print(f"Exported {len(records)} changed rows, cursor {cursor}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Tenants - several regional bots hosted in one process
+
+Each regional brand used to run as its own container with one BOT_TOKEN,
+paying for a Python runtime, the imported libraries and HTTP pools per bot.
+With TENANTS_PATH set, bot.py reads the bots from a JSON file instead:
+
+    {"tenants": [
+        {"name": "kazan",
+         "token_env": "KAZAN_BOT_TOKEN",
+         "sheet_sync_url": "https://script.google.com/macros/s/.../exec",
+         "leads_db_path": "data/kazan/leads.sqlite3",
+         "car_brands": [["Lada", "Haval"], ["Chery"]],
+         "cities": [["Казань", "Набережные Челны"]],
+         "popular_models": {"Lada": ["Granta", "Vesta"]},
+         "greeting": "Добро пожаловать в бота автоподбора Казани!"}
+    ]}
+
+Each tenant gets its own Application: its token ("token", or the
+environment variable named by "token_env"), conversation state, lead
+registry, sheet and sheet snapshot ("sheet_snapshot_path",
+"sheet_export_token"). Omitted catalogs and the greeting fall back to the
+defaults in bot.py (CATALOGS_PATH, see catalogs.py, when it is set). The Applications share the event loop, one Bot API
+connection pool (SharedRequest), the sheet replication workers and the
+lazily loaded subsystems (car catalog, gazetteers, listings).
+
+Handlers find the bot they serve through `current_tenant`, set at the
+start of every update (None for the single bot run from BOT_TOKEN).
+"""
+
+import contextvars
+import json
+import os
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from telegram.request import BaseRequest
+
+from catalogs import Catalogs
+from sheet_export import SheetSnapshot
+
+current_tenant: contextvars.ContextVar[Optional["Tenant"]] = contextvars.ContextVar("tenant", default=None)
+
+
+class Tenant:
+    """Settings and per-bot state of one hosted bot."""
+
+    def __init__(
+        self,
+        name: str,
+        token: str,
+        sheet_sync_url: str = "",
+        leads_db_path: str = "",
+        car_brands: Optional[List[List[str]]] = None,
+        cities: Optional[List[List[str]]] = None,
+        popular_models: Optional[Dict[str, List[str]]] = None,
+        greeting: Optional[str] = None,
+        sheet_snapshot_path: str = "",
+        sheet_export_token: str = "",
+    ):
+        """
+        Args:
+            name: Short name used in logs
+            token: Bot API token
+            sheet_sync_url: Apps Script web app of the bot's lead sheet (empty = leads stay local)
+            leads_db_path: The bot's lead registry (empty = in memory only)
+            car_brands, cities: Reply keyboard rows (None = bot.py defaults)
+            popular_models: Models offered per brand (None = bot.py defaults)
+            greeting: /start text (None = bot.py default)
+            sheet_snapshot_path, sheet_export_token: As SHEET_SNAPSHOT_PATH and SHEET_EXPORT_TOKEN
+        """
+        self.name = name
+        self.token = token
+        self.sheet_sync_url = sheet_sync_url
+        self.leads_db_path = leads_db_path
+        self.car_brands = car_brands
+        self.cities = cities
+        # Typed towns are mapped to the nearest of the bot's own cities
+        self.city_hubs = tuple(city for row in cities for city in row) if cities else None
+        self.popular_models = popular_models
+        self.greeting = greeting
+        self.sheet_snapshot_path = sheet_snapshot_path
+        self.sheet_export_token = sheet_export_token
+        # Opened and started by bot.py
+        self.lead_registry = None
+        self.sheet_snapshot = SheetSnapshot()
+        self.sheet_snapshot_task = None
+        # (default catalogs, them with the tenant's own), rebuilt when the defaults are reloaded
+        self._catalogs: Optional[Tuple[Catalogs, Catalogs]] = None
+
+    def catalogs(self, defaults: Catalogs) -> Catalogs:
+        """`defaults` with the catalogs the tenant sets itself, built once per defaults."""
+        compiled = self._catalogs
+        if compiled is None or compiled[0] is not defaults:
+            compiled = (defaults, defaults.overlay(self.car_brands, self.cities, self.popular_models))
+            self._catalogs = compiled
+        return compiled[1]
+
+    def __repr__(self) -> str:
+        return f"Tenant({self.name!r})"
+
+
+def _keyboard(value, field: str, name: str) -> Optional[List[List[str]]]:
+    if value is None:
+        return None
+    if not value or not all(isinstance(row, list) and row and all(isinstance(b, str) for b in row) for row in value):
+        raise ValueError(f"Tenant {name}: {field} must be a non-empty list of rows of button texts")
+    return value
+
+
+def load_tenants(path: str, environ: Mapping[str, str] = os.environ) -> List[Tenant]:
+    """
+    Read the hosted bots from a JSON config file.
+
+    Raises:
+        OSError: file cannot be read
+        ValueError: invalid JSON, a missing token, or names, tokens or lead registries used twice
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    entries = config.get("tenants") if isinstance(config, dict) else None
+    if not entries:
+        raise ValueError(f"{path}: no tenants configured")
+
+    tenants: List[Tenant] = []
+    for number, entry in enumerate(entries, start=1):
+        name = str(entry.get("name") or f"tenant{number}")
+        token = entry.get("token") or environ.get(entry.get("token_env") or "", "")
+        if not token:
+            raise ValueError(f"Tenant {name}: token or token_env with a set variable is required")
+        export_token = entry.get("sheet_export_token") or environ.get(entry.get("sheet_export_token_env") or "", "")
+        popular_models = entry.get("popular_models")
+        if popular_models is not None and not isinstance(popular_models, dict):
+            raise ValueError(f"Tenant {name}: popular_models must map brands to model lists")
+        tenants.append(
+            Tenant(
+                name,
+                token,
+                sheet_sync_url=entry.get("sheet_sync_url", ""),
+                leads_db_path=entry.get("leads_db_path", ""),
+                car_brands=_keyboard(entry.get("car_brands"), "car_brands", name),
+                cities=_keyboard(entry.get("cities"), "cities", name),
+                popular_models=popular_models,
+                greeting=entry.get("greeting"),
+                sheet_snapshot_path=entry.get("sheet_snapshot_path", ""),
+                sheet_export_token=export_token,
+            )
+        )
+
+    # Two bots on one token would fight over getUpdates; on one registry they would merge leads
+    for field in ("name", "token", "leads_db_path", "sheet_snapshot_path"):
+        values = [getattr(tenant, field) for tenant in tenants if getattr(tenant, field)]
+        if field.endswith("_path"):
+            values = [os.path.abspath(value) for value in values]
+        if len(values) != len(set(values)):
+            raise ValueError(f"{path}: every tenant needs its own {field}")
+    return tenants
+
+
+class SharedRequest(BaseRequest):
+    """One Bot API connection pool used by several Applications.
+
+    Every Bot initializes and shuts down its request; the pool is opened by
+    the first initialize() and closed when the last user shuts down.
+    """
+
+    def __init__(self, inner: BaseRequest):
+        self.inner = inner
+        self._users = 0
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.inner.read_timeout
+
+    async def initialize(self) -> None:
+        self._users += 1
+        if self._users == 1:
+            await self.inner.initialize()
+
+    async def shutdown(self) -> None:
+        if self._users == 0:
+            return
+        self._users -= 1
+        if self._users == 0:
+            await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, **timeouts) -> Tuple[int, bytes]:
+        return await self.inner.do_request(url, method, request_data, **timeouts)
@@ -0,0 +1,111 @@
+"""Tests for benchmark baselines and the regression comparison."""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_suite
+
+
+def _results(metrics):
+    return {
+        "created_at": "test",
+        "commit": None,
+        "sources": bench_suite.source_hashes(),
+        "metrics": {
+            name: {"unit": "ms", "direction": direction, "samples": list(samples)}
+            for name, (direction, samples) in metrics.items()
+        },
+    }
+
+
+def test_doubled_latency_is_regression():
+    """Doubling a latency distribution is flagged; same-distribution noise is not"""
+    rng = np.random.default_rng(1)
+    base = rng.lognormal(0, 0.3, 300)
+    same = rng.lognormal(0, 0.3, 300)
+    doubled = rng.lognormal(0, 0.3, 300) * 2
+    baseline = _results({"handler.BUDGET.latency_ms": ("lower", base)})
+    rows_same = bench_suite.compare(baseline, _results({"handler.BUDGET.latency_ms": ("lower", same)}))
+    rows_doubled = bench_suite.compare(baseline, _results({"handler.BUDGET.latency_ms": ("lower", doubled)}))
+    print(f"Same: {rows_same[0]['change']:+.1%} {rows_same[0]['status']}")
+    print(f"Doubled: {rows_doubled[0]['change']:+.1%} {rows_doubled[0]['status']}")
+    assert rows_same[0]["status"] == "ok", "Noise within the threshold should not be a regression"
+    assert rows_doubled[0]["status"] == "regression", "Doubled latency should be a regression"
+    assert rows_doubled[0]["ci_low"] > 0.5, "CI should exclude small changes"
+    print("[PASS] Doubled latency is regression\n")
+
+
+def test_direction_and_missing_metrics():
+    """Lower throughput is a regression, faster handlers an improvement, renamed metrics are listed"""
+    baseline = _results(
+        {
+            "sync.requests_per_sec": ("higher", [100, 102, 98, 101, 99]),
+            "handler.START.latency_ms": ("lower", [1.0, 1.1, 0.9, 1.0, 1.05]),
+            "memory.session_kib": ("lower", [12, 12, 12]),
+        }
+    )
+    current = _results(
+        {
+            "sync.requests_per_sec": ("higher", [60, 61, 59, 62, 60]),
+            "handler.START.latency_ms": ("lower", [0.5, 0.55, 0.45, 0.5, 0.52]),
+            "memory.per_session_kib": ("lower", [12, 12, 12]),
+        }
+    )
+    statuses = {row["metric"]: row["status"] for row in bench_suite.compare(baseline, current)}
+    print(f"Statuses: {statuses}")
+    assert statuses["sync.requests_per_sec"] == "regression", "Throughput drop should be a regression"
+    assert statuses["handler.START.latency_ms"] == "improvement", "Lower latency should be an improvement"
+    assert statuses["memory.session_kib"] == "missing", "Metric absent from current run should be listed"
+    assert statuses["memory.per_session_kib"] == "new", "Metric absent from baseline should be listed"
+
+    report = bench_suite.render_report(baseline, current, bench_suite.compare(baseline, current), 0.1)
+    assert "REGRESSION" in report and "1 regression(s)" in report, "Report should flag the regression"
+    print("[PASS] Direction and missing metrics\n")
+
+
+def test_suite_run_structure():
+    """A tiny suite run produces every metric with samples"""
+    result = bench_suite.run_suite(users=10, repeats=2, sync_users=5)
+    metrics = result["metrics"]
+    print(f"Metrics: {sorted(metrics)}")
+    assert "handler.BUDGET.latency_ms" in metrics, "Per-state latency should be recorded"
+    assert len(metrics["handler.updates_per_sec"]["samples"]) == 2, "One throughput sample per repeat"
+    assert metrics["sync.syncs_per_sec"]["direction"] == "higher", "Throughput is higher-is-better"
+    assert metrics["memory.session_kib"]["samples"][0] > 0, "Sessions should retain memory"
+    assert metrics["startup.first_reply_ms"]["samples"][0] > 0, "Cold start should be measured"
+    assert result["sources"]["bot.py"], "bot.py hash should be recorded"
+    print("[PASS] Suite run structure\n")
+
+
+def test_committed_baseline_is_readable():
+    """benchmarks/baseline.json has the current schema"""
+    import json
+
+    with open(bench_suite.BASELINE_PATH, encoding="utf-8") as handle:
+        baseline = json.load(handle)
+    assert baseline["schema_version"] == bench_suite.SCHEMA_VERSION, "Baseline schema should be current"
+    assert "sync.syncs_per_sec" in baseline["metrics"], "Baseline should include sync throughput"
+    print("[PASS] Committed baseline is readable\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING BENCHMARK BASELINES")
+    print("=" * 60 + "\n")
+
+    try:
+        test_doubled_latency_is_regression()
+        test_direction_and_missing_metrics()
+        test_suite_run_structure()
+        test_committed_baseline_is_readable()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,127 @@
+"""Tests for fuzzy brand/model normalization (car_catalog + fuzzy_index)."""
+
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from car_catalog import get_catalog
+from fuzzy_index import FuzzyIndex, normalize_key
+
+
+def test_transliteration_keys():
+    """Cyrillic, Latin, case and spacing variants share one key"""
+    cases = {
+        "Хавал": "haval",
+        "HAVAL": "haval",
+        "Tiggo 7": "tiggo7",
+        "джолион": "jolion",
+        "тигго 7 про макс": "tiggo7promax",
+    }
+    for raw, expected in cases.items():
+        result = normalize_key(raw)
+        print(f"{raw!r} -> {result!r} (expected {expected!r})")
+        assert result == expected, f"Failed for {raw!r}"
+    print("[PASS] Transliteration keys\n")
+
+
+def test_brand_and_model_parsing():
+    """Free text with brand and model resolves to canonical names"""
+    catalog = get_catalog()
+    cases = {
+        "хавал джолион": ("Haval", "Jolion"),
+        "HAVAL": ("Haval", None),
+        "джили монжаро": ("Geely", "Monjaro"),
+        "Chery Tiggo 7 Pro Max": ("Chery", "Tiggo 7 Pro Max"),
+        "мерс": ("Mercedes-Benz", None),
+        "абракадабра": (None, None),
+    }
+    for raw, expected in cases.items():
+        result = catalog.parse_brand_model(raw)
+        print(f"{raw!r} -> {result}")
+        assert result == expected, f"Failed for {raw!r}"
+    print("[PASS] Brand and model parsing\n")
+
+
+def test_model_typos_and_ambiguity():
+    """Typos are corrected; prefixes of several models are left for the keyboard"""
+    catalog = get_catalog()
+    assert catalog.match_model("Haval", "джолиан") == "Jolion", "Typo should be corrected"
+    assert catalog.match_model("Chery", "тиго 7 про") == "Tiggo 7 Pro", "Typo should be corrected"
+    assert catalog.match_model("Chery", "tiggo7") is None, "Ambiguous prefix should not be guessed"
+    suggestions = catalog.suggest_models("Chery", "tiggo7")
+    print(f"Suggestions for 'tiggo7': {suggestions}")
+    assert suggestions[:2] == ["Tiggo 7 Pro Max", "Tiggo 7 Pro"], "Completions should come first"
+    assert catalog.match_model("Haval", "Camry") is None, "Other brand's model should not match"
+    print("[PASS] Model typos and ambiguity\n")
+
+
+def test_lookup_latency():
+    """Lookups stay well under a millisecond"""
+    catalog = get_catalog()
+    runs = 1000
+    started = time.perf_counter()
+    for _ in range(runs):
+        catalog.parse_brand_model("хавал джолион")
+    elapsed_ms = (time.perf_counter() - started) * 1000 / runs
+    print(f"parse_brand_model: {elapsed_ms:.3f} ms")
+    assert elapsed_ms < 1.0, "Lookup should take less than a millisecond"
+    print("[PASS] Lookup latency\n")
+
+
+def test_index_without_catalog():
+    """FuzzyIndex works standalone with aliases"""
+    index = FuzzyIndex([("Москва", ["мск", "moscow"]), ("Казань", ["kazan"])])
+    assert index.lookup("Moscow").value == "Москва", "Latin alias should match"
+    assert index.lookup("мск").value == "Москва", "Abbreviation should match"
+    assert index.lookup("казнь").value == "Казань", "Typo should match"
+    print("[PASS] Standalone index\n")
+
+
+async def _choose_model(brand: str, text: str):
+    message = SimpleNamespace(text=text, reply_text=mock.AsyncMock())
+    context = SimpleNamespace(user_data={"brand": brand})
+    state = await bot.model_received(SimpleNamespace(message=message), context)
+    return state, context.user_data.get("model")
+
+
+def test_popular_model_buttons_resolve():
+    """Every model button of the keyboard moves on to the city step with that model"""
+    for brand, models in bot.POPULAR_MODELS.items():
+        for model in models:
+            assert get_catalog().match_model(brand, model) == model, f"{brand} {model} is in the catalog"
+            state, chosen = asyncio.run(_choose_model(brand, model))
+            assert state == bot.CITY and chosen == model, f"{brand} {model} button is accepted"
+    # A reloaded keyboard may offer a model the catalog does not know yet
+    catalogs = bot.catalog_file.current.overlay(popular_models={"Chery": ["Tiggo 2 Pro"]})
+    with mock.patch.object(bot.catalog_file, "current", catalogs):
+        state, chosen = asyncio.run(_choose_model("Chery", "Tiggo 2 Pro"))
+    print(f"Buttons checked: {sum(map(len, bot.POPULAR_MODELS.values()))}, unknown button -> {chosen}")
+    assert state == bot.CITY and chosen == "Tiggo 2 Pro", "A button is taken as is without clarification"
+    print("[PASS] Popular model buttons resolve\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING CAR CATALOG")
+    print("=" * 60 + "\n")
+
+    try:
+        test_transliteration_keys()
+        test_brand_and_model_parsing()
+        test_model_typos_and_ambiguity()
+        test_lookup_latency()
+        test_index_without_catalog()
+        test_popular_model_buttons_resolve()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
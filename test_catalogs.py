@@ -0,0 +1,195 @@
+"""Tests for catalogs reloaded from a watched file"""
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BENCH_TOKEN, StubTelegramRequest, UpdateFactory, funnel_script
+from catalogs import OTHER_MODEL_BUTTON_TEXT, CatalogFile, Catalogs, parse_catalogs, unknown_models
+from tenants import Tenant
+
+DEFAULTS = Catalogs(bot.CAR_BRANDS, bot.CITIES, bot.POPULAR_MODELS, bot.DEFAULT_MODEL_SUGGESTIONS)
+
+
+class KeyboardRequest(StubTelegramRequest):
+    """Stub Bot API keeping the button texts of every reply keyboard sent."""
+
+    def __init__(self):
+        super().__init__()
+        self.keyboards = []
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        markup = request_data.parameters.get("reply_markup") if request_data else None
+        if isinstance(markup, dict) and "keyboard" in markup:
+            self.keyboards.append([[button["text"] for button in row] for row in markup["keyboard"]])
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+def _write(path: str, data) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(data if isinstance(data, str) else json.dumps(data, ensure_ascii=False))
+    # Two writes within the file system's timestamp resolution still count as a change
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_validation():
+    """Files are checked before use; omitted keys keep the defaults"""
+    catalogs = parse_catalogs({"popular_models": {"Tenet": ["T7", "T4", "T7"]}}, DEFAULTS)
+    rows = [[button.text for button in row] for row in catalogs.model_keyboards["Tenet"].keyboard]
+    print(f"Catalogs {catalogs.version}, Tenet keyboard: {rows}")
+    assert catalogs.car_brands == bot.CAR_BRANDS and catalogs.city_hubs == bot.CITY_HUBS, "Defaults kept"
+    assert rows == [["T7", "T4"], [OTHER_MODEL_BUTTON_TEXT]], "Model keyboards are built in advance"
+    assert catalogs.version != DEFAULTS.version, "Versions tell catalogs apart"
+
+    invalid = [
+        [["Lada"]],
+        {"car_brand": [["Lada"]]},
+        {"car_brands": []},
+        {"car_brands": [["Lada", ""]]},
+        {"cities": [["Казань"], ["Казань"]]},
+        {"popular_models": ["Granta"]},
+        {"popular_models": {"Lada": []}},
+        {"default_model_suggestions": "Lada Granta"},
+    ]
+    for data in invalid:
+        try:
+            parse_catalogs(data, DEFAULTS)
+        except ValueError as exc:
+            print(f"Rejected {json.dumps(data, ensure_ascii=False)}: {exc}")
+        else:
+            raise AssertionError(f"{data} should be rejected")
+    print("[PASS] Validation\n")
+
+
+def test_unknown_models_logged():
+    """Keyboard models the car catalog cannot resolve are logged, the file is still used"""
+    resolve_model = bot.catalog_file.resolve_model
+    assert not unknown_models(bot.POPULAR_MODELS, resolve_model), "Built-in keyboards are all in the catalog"
+    data = {"popular_models": {"Chery": ["Tiggo 5X", "Tigo 2 Pro Max"], "Haval": ["джолион"]}}
+    with mock.patch("catalogs.logging.warning") as warning:
+        catalogs = parse_catalogs(data, DEFAULTS, resolve_model)
+        parse_catalogs({"cities": [["Казань"]]}, DEFAULTS, resolve_model)
+    print(f"Unknown: {unknown_models(catalogs.popular_models, resolve_model)}, warnings: {warning.call_args_list}")
+    assert unknown_models(catalogs.popular_models, resolve_model) == ["Chery Tigo 2 Pro Max"], "Only the typo is unknown"
+    assert warning.call_count == 1 and "Chery Tigo 2 Pro Max" in warning.call_args[0], "Logged once, for the file with models"
+    assert catalogs.popular_models["Chery"] == ["Tiggo 5X", "Tigo 2 Pro Max"], "Not rejected"
+    print("[PASS] Unknown models logged\n")
+
+
+def test_tenant_overlay():
+    """A hosted bot keeps its own catalogs and takes the rest from the reloaded defaults"""
+    tenant = Tenant("kzn", "1:KZN", car_brands=[["Haval", "Tenet"]])
+    first = tenant.catalogs(DEFAULTS)
+    reloaded = parse_catalogs({"cities": [["Казань", "Самара"]]}, DEFAULTS)
+    second = tenant.catalogs(reloaded)
+    print(f"Tenant catalogs: {first} -> {second}, cities {second.cities}")
+    assert second is tenant.catalogs(reloaded), "Built once per defaults"
+    assert first.car_brands == second.car_brands == [["Haval", "Tenet"]], "Own brands stay"
+    assert second.cities == [["Казань", "Самара"]], "Reloaded cities apply"
+    assert Tenant("msk", "1:MSK").catalogs(reloaded) is reloaded, "No overrides: the defaults themselves"
+    print("[PASS] Tenant overlay\n")
+
+
+async def _funnel(request: KeyboardRequest, user_id: int):
+    application = bot.build_application(BENCH_TOKEN, request=request)
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    request.keyboards.clear()
+    for _, update in funnel_script(factory, user_id)[:3]:
+        await application.process_update(update)
+    await application.shutdown()
+    # Phone keyboard, then brands, then models
+    return request.keyboards[1], request.keyboards[2]
+
+
+def test_reload_changes_keyboards():
+    """An edited file changes the keyboards of the next step; an invalid edit is ignored"""
+    request = KeyboardRequest()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalogs.json")
+        catalog_file = CatalogFile(path, DEFAULTS, prepare=bot.prepare_catalogs)
+        with mock.patch.object(bot, "catalog_file", catalog_file), mock.patch.object(bot, "SHEET_SYNC_URL", ""):
+            bot.close_lead_registry()
+            before = asyncio.run(_funnel(request, 1))
+            brands = [["Haval", "Tenet"], ["Lada"]]
+            _write(path, {"car_brands": brands, "popular_models": {"Haval": ["H3", "Jolion"]}})
+            loaded = catalog_file.check()
+            after = asyncio.run(_funnel(request, 2))
+            _write(path, '{"car_brands": [["Haval"]')
+            rejected = not catalog_file.check()
+            kept = asyncio.run(_funnel(request, 3))
+            bot.close_lead_registry()
+    print(f"Before: {before[0]}, after: {after[0]} / {after[1]}, rejected edits: {catalog_file.rejected}")
+    assert before[0] == bot.CAR_BRANDS, "Built-in brands without a file"
+    assert loaded and after[0] == brands, "The reloaded brands are offered"
+    assert after[1] == [["H3", "Jolion"], [OTHER_MODEL_BUTTON_TEXT]], "And the reloaded models"
+    assert rejected and kept == after and catalog_file.rejected == 1, "An invalid file keeps the current catalogs"
+    print("[PASS] Reload changes keyboards\n")
+
+
+async def _reload_under_load(catalog_file: CatalogFile, path: str, variants):
+    lags = []
+
+    async def ticker():
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    task = asyncio.get_running_loop().create_task(ticker())
+    reloads = []
+    for data in variants:
+        await asyncio.to_thread(_write, path, data)
+        started = time.perf_counter()
+        await asyncio.to_thread(catalog_file.check)
+        reloads.append(time.perf_counter() - started)
+    task.cancel()
+    return lags, sum(reloads) / len(reloads)
+
+
+def test_reload_does_not_block_loop():
+    """Parsing and building a large catalog happens off the event loop"""
+    variants = [
+        {"popular_models": {f"Brand {n}": [f"Model {n}.{m}" for m in range(6)] for n in range(number, number + 1000)}}
+        for number in range(3)
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "catalogs.json")
+        catalog_file = CatalogFile(path, DEFAULTS)
+        lags, reload_seconds = asyncio.run(_reload_under_load(catalog_file, path, variants))
+    lag = statistics.median(lags)
+    print(f"Reload: {reload_seconds * 1000:.0f} ms, event loop ticks: {len(lags)}, median lag {lag * 1000:.1f} ms")
+    assert catalog_file.reloads == 3, "Every variant is swapped in"
+    assert "Brand 1001" in catalog_file.current.model_keyboards, "The last variant is current"
+    # A worker thread yields the GIL every few milliseconds; a reload on the loop would stall it throughout
+    assert len(lags) >= 3 * len(variants) and lag < 0.01, "The loop keeps running during a reload"
+    print("[PASS] Reload does not block the loop\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING CATALOGS RELOAD")
+    print("=" * 60 + "\n")
+
+    try:
+        test_validation()
+        test_unknown_models_logged()
+        test_tenant_overlay()
+        test_reload_changes_keyboards()
+        test_reload_does_not_block_loop()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
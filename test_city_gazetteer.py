@@ -0,0 +1,81 @@
+"""Tests for city normalization and nearest-hub mapping."""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from city_gazetteer import get_gazetteer
+
+HUBS = ("Москва", "Санкт-Петербург", "Казань", "Екатеринбург", "Новосибирск", "Краснодар")
+
+
+def test_spelling_variants():
+    """Abbreviations, Latin spelling and typos map to one canonical city"""
+    gazetteer = get_gazetteer(HUBS)
+    cases = {
+        "мск": "Москва",
+        "Moscow": "Москва",
+        " москва ": "Москва",
+        "питер": "Санкт-Петербург",
+        "Екатеренбург": "Екатеринбург",
+        "челны": "Набережные Челны",
+        "Kazan": "Казань",
+    }
+    for raw, expected in cases.items():
+        locality = gazetteer.normalize(raw)
+        print(f"{raw!r} -> {locality and locality['name']!r} (expected {expected!r})")
+        assert locality and locality["name"] == expected, f"Failed for {raw!r}"
+    assert gazetteer.normalize("абвгд") is None, "Unknown text should not match"
+    print("[PASS] Spelling variants\n")
+
+
+def test_nearest_hub():
+    """Small towns are assigned the nearest supported hub"""
+    gazetteer = get_gazetteer(HUBS)
+    cases = {
+        "Подольск": "Москва",
+        "Гатчина": "Санкт-Петербург",
+        "Сочи": "Краснодар",
+        "Нижний Тагил": "Екатеринбург",
+        "Бердск": "Новосибирск",
+        "Елабуга": "Казань",
+    }
+    for town, expected in cases.items():
+        hub = gazetteer.normalize(town)["hub"]
+        print(f"{town} -> {hub}")
+        assert hub == expected, f"Wrong hub for {town}"
+    assert gazetteer.nearest_hub(55.75, 37.62) == "Москва", "Coordinates lookup should work"
+    print("[PASS] Nearest hub\n")
+
+
+def test_lookup_latency():
+    """Normalization is cheap enough for every message"""
+    gazetteer = get_gazetteer(HUBS)
+    runs = 1000
+    started = time.perf_counter()
+    for _ in range(runs):
+        gazetteer.normalize("Екатеренбург")
+    elapsed_ms = (time.perf_counter() - started) * 1000 / runs
+    print(f"normalize: {elapsed_ms:.3f} ms")
+    assert elapsed_ms < 1.0, "Lookup should take less than a millisecond"
+    print("[PASS] Lookup latency\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING CITY GAZETTEER")
+    print("=" * 60 + "\n")
+
+    try:
+        test_spelling_variants()
+        test_nearest_hub()
+        test_lookup_latency()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
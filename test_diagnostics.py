@@ -0,0 +1,100 @@
+"""Tests for the sampling profiler, memory snapshots and admin-only commands."""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BENCH_TOKEN, StubTelegramRequest, UpdateFactory
+from diagnostics import MemorySnapshots, SamplingProfiler
+
+
+def _busy_loop(stop: threading.Event) -> None:
+    total = 0
+    while not stop.is_set():
+        total += sum(range(1000))
+
+
+def test_profiler_finds_hot_function():
+    """A CPU-bound worker thread shows up as the top self frame"""
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_loop, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        report = SamplingProfiler(interval=0.002).run(0.3, top=5)
+    finally:
+        stop.set()
+        worker.join()
+    hot_lines = [line for line in report.splitlines() if "busy-worker" in line and "_busy_loop" in line]
+    print(hot_lines[0] if hot_lines else report[:500])
+    assert hot_lines, "Busy thread and function should be reported"
+    assert "busy-worker;" in report, "Collapsed stacks should be included"
+    print("[PASS] Profiler finds hot function\n")
+
+
+def test_memory_snapshot_diff():
+    """Second snapshot reports the allocation growth site"""
+    snapshots = MemorySnapshots(frames=5)
+    try:
+        first = snapshots.take()
+        retained = [bytearray(1024) for _ in range(2000)]
+        second = snapshots.take(top=5)
+    finally:
+        snapshots.stop()
+    growth = second.split("growth since previous snapshot:", 1)[-1]
+    print(first.strip())
+    print(growth.strip().splitlines()[0])
+    assert "baseline recorded" in first, "First call should start tracing"
+    assert "test_diagnostics.py" in growth, "Growth should point at the allocating line"
+    assert not tracemalloc.is_tracing(), "stop() should end tracing"
+    del retained
+    print("[PASS] Memory snapshot diff\n")
+
+
+async def _send_commands(user_id: int, commands):
+    stub = StubTelegramRequest()
+    with mock.patch.object(bot, "ADMIN_USER_IDS", frozenset({42})):
+        application = bot.build_application(BENCH_TOKEN, request=stub)
+        await application.initialize()
+        factory = UpdateFactory(application.bot)
+        for command in commands:
+            await application.process_update(factory.message(user_id, True, command))
+        await application.shutdown()
+    return stub.calls
+
+
+def test_admin_commands():
+    """Only configured admins get reports, sent as documents"""
+    stranger = asyncio.run(_send_commands(7, ["/memsnap", "/profile 1"]))
+    started = time.perf_counter()
+    admin = asyncio.run(_send_commands(42, ["/memsnap", "/memsnap", "/profile 1", "/memsnap stop"]))
+    elapsed = time.perf_counter() - started
+    print(f"Stranger calls: {stranger}, admin calls: {admin}, {elapsed:.1f} s")
+    assert set(stranger) <= {"getMe"}, "Non-admins should get no reply"
+    assert admin.get("sendDocument") == 3, "Two snapshots and a profile should be sent as files"
+    assert not tracemalloc.is_tracing(), "/memsnap stop should end tracing"
+    print("[PASS] Admin commands\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING DIAGNOSTICS")
+    print("=" * 60 + "\n")
+
+    try:
+        test_profiler_finds_hot_function()
+        test_memory_snapshot_diff()
+        test_admin_commands()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,82 @@
+"""Tests for the local fake Telegram Bot API used by load tests."""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Bot, ReplyKeyboardMarkup
+
+from fake_telegram import BOT_ID, FakeTelegramServer
+
+
+def _run_with_server(scenario):
+    server = FakeTelegramServer()
+    server.start()
+    try:
+        bot = Bot(f"{BOT_ID}:TEST", base_url=f"{server.url}/bot")
+        return asyncio.run(scenario(server, bot)), server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_calls_are_recorded():
+    """python-telegram-bot talks to the fake API and every call is logged"""
+    recorded = []
+
+    async def scenario(server, bot):
+        server.api.on_call = recorded.append
+        async with bot:
+            keyboard = ReplyKeyboardMarkup([["Haval", "Chery"]])
+            sent = await bot.send_message(chat_id=42, text="Привет", reply_markup=keyboard)
+            await bot.edit_message_text(chat_id=42, message_id=sent.message_id, text="Готово")
+            return sent
+
+    sent, server = _run_with_server(scenario)
+    methods = [call["method"] for call in recorded]
+    print(f"Recorded: {methods}")
+    assert methods == ["getMe", "sendMessage", "editMessageText"], "All bot calls should be recorded"
+    params = recorded[1]["params"]
+    assert params["text"] == "Привет" and int(params["chat_id"]) == 42, "Parameters should be decoded"
+    assert params["reply_markup"]["keyboard"][0][0]["text"] == "Haval", "Nested JSON should be decoded"
+    assert int(recorded[2]["params"]["message_id"]) == sent.message_id, "Edits should target the sent message"
+    print("[PASS] Calls are recorded\n")
+
+
+def test_long_polling_delivers_updates():
+    """Pushed updates are returned by getUpdates and confirmed by offset"""
+
+    async def scenario(server, bot):
+        async with bot:
+            update_id = server.api.push_update(
+                {"message": {"message_id": 1, "date": 0, "chat": {"id": 7, "type": "private"}, "text": "/start tag"}}
+            )
+            first = await bot.get_updates(timeout=1)
+            confirmed = await bot.get_updates(offset=update_id + 1, timeout=0)
+            return update_id, first, confirmed
+
+    (update_id, first, confirmed), _ = _run_with_server(scenario)
+    print(f"First poll: {[update.update_id for update in first]}, after offset: {len(confirmed)}")
+    assert [update.update_id for update in first] == [update_id], "Pushed update should be delivered"
+    assert first[0].message.text == "/start tag", "Update content should survive the round trip"
+    assert confirmed == (), "Updates below offset should be dropped"
+    print("[PASS] Long polling delivers updates\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING FAKE TELEGRAM API")
+    print("=" * 60 + "\n")
+
+    try:
+        test_calls_are_recorded()
+        test_long_polling_delivers_updates()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,99 @@
+"""Tests for /start flood control"""
+
+import asyncio
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BENCH_TOKEN, StubTelegramRequest, UpdateFactory
+from flood_control import StartThrottle, TokenBuckets
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_buckets():
+    """Buckets allow a burst, refill over time and stay bounded"""
+    clock = FakeClock()
+    buckets = TokenBuckets(burst=3, per_minute=6, max_keys=100, clock=clock)
+    burst = [buckets.take("user") for _ in range(4)]
+    clock.now += 10  # one token back
+    refilled = [buckets.take("user") for _ in range(2)]
+    for user_id in range(1000):
+        buckets.take(user_id)
+    print(f"Burst: {burst}, after 10 s: {refilled}, tracked keys: {len(buckets)}")
+    assert burst == [True, True, True, False], "Burst of 3, then empty"
+    assert refilled == [True, False], "6 per minute refills one token in 10 s"
+    assert len(buckets) == 100, "Least recently used buckets are forgotten"
+    print("[PASS] Token buckets\n")
+
+
+def test_tag_limit_spares_user_tokens():
+    """A /start dropped by its tag does not spend the user's tokens"""
+    clock = FakeClock()
+    throttle = StartThrottle(user_burst=2, user_per_minute=1, tag_burst=1, tag_per_minute=1, clock=clock)
+    results = [throttle.check(7, "promo") for _ in range(4)] + [throttle.check(7, None), throttle.check(7, None)]
+    print(f"Checks: {results}")
+    assert results[:4] == [None, "tag", "tag", "tag"], "The tag allows one start"
+    assert results[4:] == [None, "user"], "The user still has the second token"
+    assert throttle.users.available(7) is False and len(throttle.users) == 1, "Checking spends nothing"
+    print("[PASS] Tag limit spares user tokens\n")
+
+
+async def _flood(throttle: StartThrottle, starts):
+    request = StubTelegramRequest()
+    application = bot.build_application(BENCH_TOKEN, request=request)
+    await application.initialize()
+    application.bot_data[bot.THROTTLE_KEY] = throttle
+    factory = UpdateFactory(application.bot)
+    for user_id, text in starts:
+        await application.process_update(factory.message(user_id, True, text))
+    registry = bot.get_lead_registry()
+    leads = len(list(registry.leads()))
+    await application.shutdown()
+    return request.calls.get("sendMessage", 0), leads
+
+
+def test_start_flood_is_shed():
+    """Flooded /start never reaches the conversation: no replies and no lead writes"""
+    dropped = bot.instrumentation.dropped_updates
+    before = dropped.value("start_user"), dropped.value("start_tag")
+    throttle = StartThrottle(user_burst=2, user_per_minute=1, tag_burst=3, tag_per_minute=1)
+    # One user taps /start 20 times, then 10 users arrive on one tag
+    starts = [(7, "/start promo") for _ in range(20)] + [(100 + n, "/start wave") for n in range(10)]
+    with mock.patch.object(bot, "SHEET_SYNC_URL", ""):
+        bot.close_lead_registry()
+        replies, leads = asyncio.run(_flood(throttle, starts))
+        bot.close_lead_registry()
+    shed = dropped.value("start_user") - before[0], dropped.value("start_tag") - before[1]
+    print(f"Replies: {replies}, leads: {leads}, dropped (user, tag): {shed}")
+    assert replies == 2 + 3, "Only starts within the buckets are answered"
+    assert leads == 1 + 3, "Dropped starts write nothing"
+    assert shed == (18, 7), "Every dropped update is counted by reason"
+    print("[PASS] Start flood is shed\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING /START FLOOD CONTROL")
+    print("=" * 60 + "\n")
+
+    try:
+        test_token_buckets()
+        test_tag_limit_spares_user_tokens()
+        test_start_flood_is_shed()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,144 @@
+"""Tests for the local funnel event log and drop-off queries."""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BENCH_TOKEN, StubTelegramRequest, UpdateFactory, funnel_script
+from funnel_events import FunnelEventLog, funnel_report, read_events, synthetic_events
+
+DAY = 86400.0
+# 2026-10-17 12:00 UTC
+NOON = 1792238400.0
+
+
+def _steps(report, tag="*"):
+    group = next(group for group in report if group["tag"] == tag)
+    return group, {step["step"]: step for step in group["steps"]}
+
+
+def test_partitions_and_tag_vocabulary():
+    """Events land in day partitions and chunks with different tags merge on read"""
+    with tempfile.TemporaryDirectory() as root:
+        log = FunnelEventLog(root, flush_rows=3)
+        log.append(1, "spring", "START", "PHONE", NOON)
+        log.append(1, "spring", "PHONE", "BRAND", NOON + 10)
+        log.append(2, None, "START", "PHONE", NOON + 11 * 3600)
+        log.append(3, "avito", "START", "PHONE", NOON + DAY)
+        assert log.pending == 1, "Third event should have flushed the buffer"
+        log.flush()
+        partitions = sorted(os.listdir(root))
+        print(f"Partitions: {partitions}")
+        assert partitions == ["day=2026-10-17", "day=2026-10-18"], "Events should be split by UTC day"
+
+        events = read_events(root)
+        tags = [str(events["tag_values"][code]) for code in events["tag"]]
+        print(f"Tags: {tags}")
+        assert sorted(tags) == ["", "avito", "spring", "spring"], "Tag codes should map to one vocabulary"
+        assert len(read_events(root, since=date(2026, 10, 18))["ts"]) == 1, "Partition pruning by date"
+    print("[PASS] Partitions and tag vocabulary\n")
+
+
+def test_conversion_and_drop_off():
+    """Sessions split on /start; reached and dropped counts per step and tag"""
+    with tempfile.TemporaryDirectory() as root:
+        log = FunnelEventLog(root)
+        # User 1 (spring): stops at BRAND, restarts and reaches the manager
+        for offset, (frm, to) in enumerate([("START", "PHONE"), ("PHONE", "BRAND")]):
+            log.append(1, "spring", frm, to, NOON + offset)
+        path = ["START", "PHONE", "BRAND", "MODEL", "CITY", "YEAR_TO", "BUDGET", "MANAGER", "END"]
+        for offset, (frm, to) in enumerate(zip(path, path[1:])):
+            log.append(1, "spring", frm, to, NOON + 100 + offset)
+        # User 2 (no tag): cancels at PHONE
+        log.append(2, None, "START", "PHONE", NOON)
+        log.append(2, None, "PHONE", "CANCEL", NOON + 5)
+        log.flush()
+        report = funnel_report(read_events(root))
+        filtered = funnel_report(read_events(root), tags=["spring"])
+
+    total, steps = _steps(report)
+    print(f"All: {total['sessions']} sessions, {total['cancelled']} cancelled")
+    assert total["sessions"] == 3, "A restart should open a new session"
+    assert total["cancelled"] == 1, "Cancel should be counted"
+    assert steps["PHONE"]["reached"] == 3 and steps["BRAND"]["reached"] == 2, "Reached counts"
+    assert steps["BRAND"]["dropped"] == 1 and steps["PHONE"]["dropped"] == 0, "Drop-off is the last step of a session"
+    assert steps["END"]["reached"] == 1 and abs(steps["END"]["conversion"] - 1 / 3) < 1e-9, "Handoff conversion"
+
+    spring, spring_steps = _steps(report, "spring")
+    assert spring["sessions"] == 2 and spring_steps["MODEL"]["step_conversion"] == 0.5, "Per-tag conversion"
+    assert [group["tag"] for group in filtered] == ["spring"], "Tag filter"
+    print("[PASS] Conversion and drop-off\n")
+
+
+def test_million_events_aggregation():
+    """Vectorized report over about a million events stays fast"""
+    events = synthetic_events(220_000)
+    started = time.perf_counter()
+    report = funnel_report(events)
+    elapsed = time.perf_counter() - started
+    total, steps = _steps(report)
+    print(f"{len(events['ts'])} events aggregated in {elapsed:.2f} s")
+    assert len(events["ts"]) > 900_000, "Synthetic set should be about a million events"
+    assert total["sessions"] <= 220_000, "Sessions cannot exceed generated ones"
+    assert steps["PHONE"]["reached"] == total["sessions"], "Every session is asked for the phone"
+    assert elapsed < 10, "Aggregation should be vectorized"
+    print("[PASS] Million events aggregation\n")
+
+
+async def _run_funnels(log: FunnelEventLog, users: int) -> None:
+    application = bot.build_application(BENCH_TOKEN, request=StubTelegramRequest())
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    with mock.patch.object(bot, "funnel_log", log), mock.patch.object(bot, "AI_PROGRESS_STEP_SECONDS", 0):
+        for number in range(users):
+            for _, update in funnel_script(factory, number):
+                await application.process_update(update)
+        await application.process_update(factory.message(1_000_000, True, "/start again"))
+        await application.process_update(factory.message(1_000_000, True, "/cancel"))
+        await application.post_shutdown(application)
+    await application.shutdown()
+
+
+def test_bot_records_transitions():
+    """The real conversation handler writes one event per step change"""
+    with tempfile.TemporaryDirectory() as root:
+        log = FunnelEventLog(root)
+        with mock.patch.object(bot, "SHEET_SYNC_URL", ""), mock.patch("logging.warning"):
+            asyncio.run(_run_funnels(log, 4))
+        assert log.pending == 0, "Shutdown should flush the buffer"
+        report = funnel_report(read_events(root))
+
+    total, steps = _steps(report)
+    print(f"Sessions: {total['sessions']}, END: {steps['END']['reached']}, cancelled: {total['cancelled']}")
+    assert total["sessions"] == 5, "Four funnels and one restart"
+    assert steps["END"]["reached"] == 4, "Every scripted funnel ends with the handoff"
+    assert steps["CLIENT_NAME"]["reached"] == 2, "Users without a profile name are asked for it"
+    assert total["cancelled"] == 1, "/cancel should be logged"
+    assert {group["tag"] for group in report} >= {"bench_tag_0", "bench_tag_3"}, "Deeplink tags should be kept"
+    print("[PASS] Bot records transitions\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING FUNNEL EVENTS")
+    print("=" * 60 + "\n")
+
+    try:
+        test_partitions_and_tag_vocabulary()
+        test_conversion_and_drop_off()
+        test_million_events_aggregation()
+        test_bot_records_transitions()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
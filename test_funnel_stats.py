@@ -0,0 +1,141 @@
+"""Tests for live funnel counters and the admin /stats command."""
+
+import asyncio
+import os
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BENCH_TOKEN, StubTelegramRequest, UpdateFactory, funnel_script
+from funnel_stats import FunnelCounters, StepTimes
+
+NOON = 1792238400.0
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_counters_active_conversions_and_medians():
+    """Active sessions move between steps, conversions count once, medians come from step times"""
+    clock = FakeClock(NOON)
+    counters = FunnelCounters(clock=clock)
+    for user_id, seconds in ((1, 10), (2, 30), (3, 50)):
+        counters.record(user_id, "spring", "START", "PHONE", NOON)
+        counters.record(user_id, "spring", "PHONE", "BRAND", NOON + seconds)
+    counters.record(1, "spring", "BRAND", "CLIENT_NAME", NOON + 60)
+    counters.record(1, "spring", "CLIENT_NAME", "END", NOON + 70)
+    counters.record(4, None, "START", "PHONE", NOON)
+    counters.record(4, None, "PHONE", "CANCEL", NOON + 5)
+
+    report = counters.report()
+    spring = report["tags"]["spring"]
+    print(f"spring: started {spring['started']}, active {spring['active']}, conversions {spring['conversions']}")
+    assert spring["started"] == 3 and spring["active"] == 2, "Two spring users are still in the funnel"
+    assert spring["steps"]["BRAND"]["active"] == 2 and spring["steps"]["PHONE"]["active"] == 0, "Active per step"
+    assert spring["conversions"] == 1, "CLIENT_NAME then END is one conversion"
+    median = spring["steps"]["PHONE"]["median_seconds"]
+    print(f"Median PHONE time: {median:.1f} s")
+    assert 20 <= median <= 30, "Median of 10/30/50 s should fall in the 20-30 s bucket"
+    assert report["tags"][""]["cancelled"] == 1 and report["tags"][""]["active"] == 0, "Cancel ends the session"
+
+    clock.now += 2 * 86400
+    assert counters.report()["tags"] == {}, "Idle sessions expire and a new day starts empty"
+    assert StepTimes().median() is None, "No observations, no median"
+    print("[PASS] Counters: active, conversions and medians\n")
+
+
+def test_snapshot_round_trip():
+    """Snapshots restore daily counters and active sessions"""
+    clock = FakeClock(NOON)
+    counters = FunnelCounters(clock=clock)
+    counters.record(1, "vk", "START", "PHONE", NOON)
+    counters.record(1, "vk", "PHONE", "BRAND", NOON + 20)
+    counters.record(2, "vk", "START", "PHONE", NOON)
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "stats.json")
+        counters.save(path)
+        restored = FunnelCounters(clock=clock)
+        assert restored.load(path), "Snapshot should load"
+        assert not FunnelCounters().load(os.path.join(root, "missing.json")), "Missing snapshot is not an error"
+
+    assert restored.report() == counters.report(), "Restored report should match"
+    restored.record(1, "vk", "BRAND", "MODEL", NOON + 50)
+    vk = restored.report()["tags"]["vk"]
+    print(f"After restore: {vk['steps']['BRAND']}")
+    assert vk["steps"]["BRAND"]["median_seconds"] is not None, "Restored session should keep its entry time"
+    assert vk["active"] == 2, "Active sessions survive the restore"
+    print("[PASS] Snapshot round trip\n")
+
+
+async def _funnels_and_stats(admin_id: int, users: int):
+    application = bot.build_application(BENCH_TOKEN, request=StubTelegramRequest())
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    for number in range(users):
+        for _, update in funnel_script(factory, number):
+            await application.process_update(update)
+    await application.process_update(factory.message(555, True, "/start spring"))
+    for text in ("/stats", "/stats spring"):
+        await application.process_update(factory.message(admin_id, True, text))
+    await application.shutdown()
+
+
+def test_stats_command():
+    """The bot feeds the counters and /stats answers admins only"""
+    counters = FunnelCounters()
+    format_calls = mock.Mock(wraps=bot.format_funnel_stats)
+    patches = (
+        mock.patch.object(bot, "funnel_counters", counters),
+        mock.patch.object(bot, "format_funnel_stats", format_calls),
+        mock.patch.object(bot, "ADMIN_USER_IDS", frozenset({42})),
+        mock.patch.object(bot, "AI_PROGRESS_STEP_SECONDS", 0),
+        mock.patch.object(bot, "SHEET_SYNC_URL", ""),
+        mock.patch("logging.warning"),
+    )
+    for patch in patches:
+        patch.start()
+    try:
+        asyncio.run(_funnels_and_stats(7, 2))
+        assert not format_calls.called, "Non-admins should get no stats"
+        asyncio.run(_funnels_and_stats(42, 0))
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+
+    overview = bot.format_funnel_stats(counters.report())
+    detail = bot.format_funnel_stats(counters.report(), "spring")
+    print(overview)
+    print(detail)
+    report = counters.report()["tags"]
+    assert report["bench_tag_0"]["conversions"] == 1 and report["bench_tag_1"]["conversions"] == 1, "Handoffs counted"
+    assert report["spring"]["steps"]["PHONE"]["active"] == 1, "Fresh /start is active at PHONE"
+    assert format_calls.call_count == 2, "Admin should get the overview and the tag detail"
+    assert "bench_tag_0" in overview and "<pre>" in overview, "Overview lists tags in a table"
+    assert "PHONE" in detail and "bench_tag_0" not in detail, "Detail lists steps of one tag"
+    print("[PASS] Stats command\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING FUNNEL STATS")
+    print("=" * 60 + "\n")
+
+    try:
+        test_counters_active_conversions_and_medians()
+        test_snapshot_round_trip()
+        test_stats_command()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,274 @@
+"""Tests for the local Apps Script stand-in and the sync path through it."""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from gas_standin import AppsScriptServer, AppsScriptStandIn, normalize_phone
+from sheet_export import iter_changes
+
+
+def test_create_and_update():
+    """Rows are created once per tg_user_id and updated by later syncs"""
+    script = AppsScriptStandIn()
+    first = script.process_data({"tg_user_id": 501, "tag": "promo", "phone": "+7 (999) 123-45-67"})
+    second = script.process_data({"tg_user_id": 501, "marka": "Haval", "gorod": "Москва", "name": "Иван", "model": None})
+    print(f"Actions: {first['action']}, {second['action']}")
+    assert first["action"] == "created" and second["action"] == "updated", "Second sync should update"
+
+    records = script.store.records()
+    assert len(records) == 1, "One user should have one row"
+    row = records[0]
+    print(f"Row: {row}")
+    assert row["phone_number"] == "79991234567", "Phone should be normalized like normalizePhone"
+    assert row["brand"] == "Haval" and row["city"] == "Москва", "Aliases should map to columns"
+    assert row["client_name"] == "Иван" and row["tag"] == "promo", "Earlier values should be kept"
+    assert row["model"] == "", "null values should not overwrite cells"
+    assert list(records[0])[:3] == ["phone_number", "timestamp", "brand"], "Headers follow the field map order"
+    print("[PASS] Create and update\n")
+
+
+def test_phone_fallback_and_validation():
+    """Phone finds the row when tg_user_id is new; tg_user_id is required"""
+    script = AppsScriptStandIn()
+    script.process_data({"tg_user_id": 1, "phone": "79990000001"})
+    found = script.process_data({"tg_user_id": 2, "phone": 79990000001, "brand": "Chery"})
+    rejected = script.process_data({"phone": "79990000001"})
+    print(f"Fallback: {found['action']}, without id: {rejected['status']}")
+    assert found["action"] == "updated", "Phone should be used when tg_user_id is not found"
+    assert script.store.records()[0]["brand"] == "Chery", "Matched row should be updated"
+    assert rejected["status"] == "error", "tg_user_id is mandatory"
+    assert normalize_phone("+7 999+1") == "7999+1", "Inner + is kept as in the regex"
+    print("[PASS] Phone fallback and validation\n")
+
+
+def _create_concurrently(script: AppsScriptStandIn, requests: int) -> None:
+    barrier = threading.Barrier(requests)
+
+    def worker(number: int) -> None:
+        barrier.wait()
+        script.process_data({"tg_user_id": 777, "budget": number})
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_lock_prevents_duplicate_rows():
+    """Concurrent first syncs create one row with the lock and duplicates without it"""
+    locked = AppsScriptStandIn(latency_ms=20)
+    _create_concurrently(locked, 6)
+    unlocked = AppsScriptStandIn(latency_ms=20, lock_timeout=0)
+    _create_concurrently(unlocked, 6)
+    print(f"With lock: {locked.store.duplicate_users()}, lock timed out: {unlocked.store.duplicate_users()}")
+    assert not locked.store.duplicate_users(), "Lock should serialize lookup and append"
+    assert unlocked.store.duplicate_users(), "Without the lock the race should be reproducible"
+    assert unlocked.stats["lock_timeouts"] == 5, "Lock timeouts should be counted"
+    print("[PASS] Lock prevents duplicate rows\n")
+
+
+def test_sync_progress_end_to_end():
+    """sync_progress from many users is replicated to the stand-in without duplicates"""
+    server = AppsScriptServer(script=AppsScriptStandIn(latency_ms=5, jitter_ms=5, seed=1))
+    server.start()
+    original_url = bot.SHEET_SYNC_URL
+    bot.SHEET_SYNC_URL = server.url
+    bot.close_lead_registry()
+    try:
+        users = 20
+        for user_id in range(1, users + 1):
+            user_data = {"tg_user_id": user_id, "tag": f"tag_{user_id}"}
+            bot.sync_progress(user_data)
+            user_data["phone"] = f"7999{user_id:07d}"
+            bot.sync_progress(user_data)
+
+        replicated = bot.sheet_replicator.wait_idle(10)
+    finally:
+        bot.close_lead_registry()
+        bot.SHEET_SYNC_URL = original_url
+        server.shutdown()
+        server.server_close()
+
+    stats = server.script.stats
+    records = server.script.store.records()
+    print(f"Requests: {stats['requests']}, rows: {len(records)}, duplicates: {server.script.store.duplicate_users()}")
+    assert replicated, "Outbox should drain"
+    # Changes of a lead still waiting in the outbox are sent as one request
+    assert users <= stats["requests"] <= users * 2, "Every lead should reach the stand-in"
+    assert len(records) == users, "One row per user"
+    assert not server.script.store.duplicate_users(), "No duplicate rows"
+    assert all(record["tag"] for record in records), "Tag from the first sync should be stored"
+    assert all(record["phone_number"] for record in records), "Latest state of each lead should be stored"
+    print("[PASS] sync_progress end to end\n")
+
+
+def test_script_error_is_retried():
+    """A 200 answer with status "error" keeps the lead in the outbox until a retry writes it"""
+    script = AppsScriptStandIn(seed=1)
+    server = AppsScriptServer(script=script)
+    server.start()
+    original_url = bot.SHEET_SYNC_URL
+    bot.SHEET_SYNC_URL = server.url
+    bot.close_lead_registry()
+    process_locked = script._process_locked
+    failures = [RuntimeError("Service Spreadsheets timed out")]
+
+    def flaky(data):
+        if failures:
+            raise failures.pop()
+        return process_locked(data)
+
+    try:
+        with mock.patch.object(script, "_process_locked", side_effect=flaky):
+            bot.sync_progress({"tg_user_id": 501, "phone": "79990000501"})
+            registry = bot.get_lead_registry()
+            deadline = time.monotonic() + 5
+            while not script.stats["errors"] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # Let the failed send be rescheduled before looking at the outbox
+            bot.sheet_replicator.wait_idle(0.2)
+            pending_after_error = registry.pending()
+            written_after_error = len(script.records())
+            registry.expedite()
+            bot.sheet_replicator.wake()
+            replicated = bot.sheet_replicator.wait_idle(5)
+    finally:
+        bot.close_lead_registry()
+        bot.SHEET_SYNC_URL = original_url
+        server.shutdown()
+        server.server_close()
+
+    print(f"Errors: {script.stats['errors']}, pending after the error: {pending_after_error}, rows: {len(script.records())}")
+    assert script.stats["errors"] == 1 and written_after_error == 0, "The first request failed inside the script"
+    assert pending_after_error == 1, "The lead is not acknowledged by an error answer"
+    assert replicated and len(script.records()) == 1, "The retry writes the row"
+    print("[PASS] Script error is retried\n")
+
+
+def test_export_pages_and_deltas():
+    """mode=export pages by cursor and then returns only rows changed after it"""
+    server = AppsScriptServer(script=AppsScriptStandIn(export_token="secret"))
+    server.start()
+    try:
+        script = server.script
+        for user_id in range(1, 6):
+            script.process_data({"tg_user_id": user_id, "city": "Москва, центр"})
+        rows = list(iter_changes(server.url, limit=2, token="secret"))
+        print(f"Full export: {[record['tg_user_id'] for record, _ in rows]}, exports: {script.stats['exports']}")
+        assert [record["tg_user_id"] for record, _ in rows] == [1, 2, 3, 4, 5], "All rows in timestamp order"
+        assert script.stats["exports"] == 3, "Five rows in pages of two"
+        cursor = rows[-1][1]
+
+        time.sleep(0.01)
+        script.process_data({"tg_user_id": 2, "brand": "Haval"})
+        delta = list(iter_changes(server.url, cursor=cursor, token="secret"))
+        print(f"Delta after {cursor}: {[record for record, _ in delta]}")
+        assert [record["brand"] for record, _ in delta] == ["Haval"], "Only the updated row is returned"
+        assert not list(iter_changes(server.url, cursor=delta[-1][1], token="secret")), "Nothing after the last cursor"
+
+        kind, text = script.export_rows({"mode": "export", "format": "csv", "token": "secret", "limit": "1"})
+        assert kind == "csv" and text.splitlines()[0].startswith("_cursor,phone_number"), "CSV has a header row"
+        assert '"Москва, центр"' in text, "CSV cells are quoted"
+        denied = script.export_rows({"mode": "export"})[1]
+        assert denied["status"] == "error", "Export token is required when set"
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("[PASS] Export pages and deltas\n")
+
+
+def test_sharded_writes_and_rotation():
+    """With sharding, leads go to monthly tabs found through the directory; old tabs are archived"""
+    now = [datetime(2026, 7, 15).timestamp()]
+    script = AppsScriptStandIn(clock=lambda: now[0])
+    for user_id in (1, 2, 3):
+        script.process_data({"tg_user_id": user_id, "brand": "Lada", "phone": f"7999000000{user_id}"})
+    assert script.setup_sharding(max_rows=3, hot_months=2) == "leads_2026_07", "Sheet becomes this month's shard"
+
+    script.process_data({"tg_user_id": 4, "brand": "Chery"})
+    now[0] = datetime(2026, 8, 3).timestamp()
+    script.process_data({"tg_user_id": 5, "brand": "Haval"})
+    script.process_data({"tg_user_id": 1, "city": "Казань"})
+    sharding = script.sharding
+    layout = {name: [record["tg_user_id"] for record in store.records()] for name, store in script.working_sheets()}
+    print(f"Shards: {layout}")
+    assert layout == {"leads_2026_07": [1, 2, 3], "leads_2026_07_02": [4], "leads_2026_08": [5]}, "Full shard continues"
+    assert sharding.stats["shard_rows_read"] == 1, "Update reads one row found through the directory"
+    hashes_before = script.row_hashes({})["hashes"]
+
+    now[0] = datetime(2026, 10, 1).timestamp()
+    moved = script.rotate_shards()
+    print(f"Archived: {moved}")
+    assert sorted(moved) == ["leads_2026_07", "leads_2026_07_02", "leads_2026_08"], "Shards older than two months"
+    working = [(name, store.records()) for name, store in script.working_sheets()]
+    assert working == [("leads_2026_10", [])], "The current shard stays as the visible sheet"
+    assert script.row_hashes({})["hashes"] == hashes_before, "Archived hashes from the directory"
+
+    written = script.process_batch([{"tg_user_id": 2, "model": "Vesta"}, {"tg_user_id": 6, "brand": "Geely"}])
+    assert written["created"] == 1 and written["updated"] == 1 and script.stats["restored"] == 1, "Archived lead is restored"
+    restored = script.records()[0]
+    assert (restored["brand"], restored["model"], restored["phone_number"]) == ("Lada", "Vesta", "79990000002"), "Old fields kept"
+    assert script.process_data({"tg_user_id": 7, "phone": "79990000001"})["action"] == "updated", "Phone lookup in the archive"
+
+    kind, page = script.export_rows({"mode": "export", "limit": "2"})
+    print(f"Export after rotation: {page['rows']}, cursor {page['next_cursor']}")
+    assert page["next_cursor"].split(":")[1] == "leads_2026_10", "Cursor names the shard"
+    rest = script.export_rows({"mode": "export", "cursor": page["next_cursor"]})[1]
+    assert len(page["rows"]) + len(rest["rows"]) == 3 and not rest["has_more"], "Hot rows exported once"
+    print("[PASS] Sharded writes and rotation\n")
+
+
+def test_interrupted_rotation_is_reindexed():
+    """A rotation stopped after deleting tabs is completed in the directory by the next one"""
+    now = [datetime(2026, 7, 15).timestamp()]
+    script = AppsScriptStandIn(clock=lambda: now[0])
+    script.process_data({"tg_user_id": 1, "brand": "Lada"})
+    script.setup_sharding(hot_months=1)
+    script.process_data({"tg_user_id": 2, "brand": "Chery"})
+    now[0] = datetime(2026, 8, 3).timestamp()
+    sharding = script.sharding
+    # The tab was copied and deleted, then the run ended before the directory was written
+    with mock.patch.object(sharding.directory, "set_rows", side_effect=RuntimeError("Exceeded maximum execution time")):
+        try:
+            script.rotate_shards()
+        except RuntimeError:
+            pass
+    broken = {entry: fields["archive_id"] for entry, fields in sharding.entries()[0].items()}
+    assert script.rotate_shards() == {}, "Nothing left to move"
+    healed = {entry: fields["archive_id"] for entry, fields in sharding.entries()[0].items()}
+    print(f"Archive ids after the interrupted run: {broken}, after the next: {healed}")
+    assert broken == {"1": "", "2": ""}, "Interrupted before the directory was updated"
+    assert healed == {"1": "archive-2026", "2": "archive-2026"} and sharding.stats["reindexed_shards"] == 1
+    assert script.process_data({"tg_user_id": 2, "model": "Tiggo 4"})["action"] == "updated", "Found in the archive"
+    print("[PASS] Interrupted rotation is reindexed\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING APPS SCRIPT STAND-IN")
+    print("=" * 60 + "\n")
+
+    try:
+        test_create_and_update()
+        test_phone_fallback_and_validation()
+        test_lock_prevents_duplicate_rows()
+        test_sync_progress_end_to_end()
+        test_script_error_is_retried()
+        test_export_pages_and_deltas()
+        test_sharded_writes_and_rotation()
+        test_interrupted_rotation_is_reindexed()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
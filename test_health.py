@@ -0,0 +1,219 @@
+"""Tests for the event-loop watchdog and liveness/readiness checks."""
+
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram.error import TimedOut
+
+import bot
+from bench_handlers import StubTelegramRequest
+from fake_telegram import BOT_ID, FakeTelegramServer
+from health import HealthMonitor, LoopWatchdog
+from tenants import Tenant
+
+
+def _blocking_section(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+def test_watchdog_reports_blocking_stack():
+    """A blocking call on the loop is measured as lag and its stack is captured"""
+    lags = []
+
+    async def scenario():
+        watchdog = LoopWatchdog(interval=0.05, stall_seconds=0.2, observe_lag=lags.append)
+        watchdog.start()
+        await asyncio.sleep(0.15)
+        _blocking_section(0.6)
+        await asyncio.sleep(0.15)
+        await watchdog.stop()
+        return watchdog
+
+    with mock.patch("logging.warning"):
+        watchdog = asyncio.run(scenario())
+    print(f"Stalls: {watchdog.stalls}, max lag: {watchdog.max_lag:.2f} s, samples: {len(lags)}")
+    assert watchdog.stalls == 1, "One blocking section should be reported once"
+    assert "_blocking_section" in watchdog.last_stall_stack, "Stack should name the blocking function"
+    assert watchdog.max_lag >= 0.5, "Lag should cover the blocked time"
+    assert not watchdog.running, "Watchdog should stop"
+    print("[PASS] Watchdog reports blocking stack\n")
+
+
+def test_live_and_ready_rules():
+    """Readiness needs a delivery and a short sync backlog; liveness fails on stale polling"""
+    watchdog = LoopWatchdog()
+    watchdog._task = mock.Mock(done=mock.Mock(return_value=False))
+    state = {"delivery": None, "depth": 0}
+    monitor = HealthMonitor(
+        watchdog,
+        lambda: state["delivery"],
+        lambda: state["depth"],
+        stale_updates_seconds=60,
+        max_sync_depth=10,
+    )
+
+    not_ready, payload = monitor.ready()
+    print(f"Before first getUpdates: {not_ready} {payload['problems']}")
+    assert not_ready == 503, "Not ready before the first successful getUpdates"
+
+    state["delivery"] = time.monotonic()
+    assert monitor.ready()[0] == 200 and monitor.live()[0] == 200, "Fresh delivery should be healthy"
+
+    state["depth"] = 11
+    assert monitor.ready()[0] == 503, "Sync backlog should make the bot not ready"
+    assert monitor.live()[0] == 200, "Sync backlog alone is no reason to restart"
+
+    state["delivery"] = time.monotonic() - 120
+    status, payload = monitor.live()
+    print(f"Stale polling: {status} {payload['problems']}")
+    assert status == 503, "Stale getUpdates should fail liveness"
+    print("[PASS] Live and ready rules\n")
+
+
+def test_ready_fails_with_outbox_backlog():
+    """Leads piling up in the outbox make the bot not ready, however few sends are in flight"""
+    with mock.patch.object(bot, "SHEET_SYNC_URL", ""):
+        bot.close_lead_registry()
+        registry = bot.open_lead_registry()
+        # The sheet is unreachable: nothing leaves the outbox
+        bot.sheet_replicator.stop()
+        for user_id in range(1, 151):
+            registry.upsert({"tg_user_id": user_id, "phone": f"7999{user_id:07d}"})
+        with mock.patch.object(bot.health_monitor, "last_delivery", time.monotonic):
+            status, payload = bot.health_monitor.ready()
+        bot.close_lead_registry()
+    print(f"Ready: {status}, depth {payload['sync_queue_depth']}, in flight {bot.sheet_syncs_in_flight.value}")
+    assert payload["sync_queue_depth"] == 150, "Depth is the outbox of the registries"
+    assert status == 503 and "sheet sync backlog" in payload["problems"], "A large backlog fails readiness"
+    print("[PASS] Ready fails with outbox backlog\n")
+
+
+class IdlePollRequest(StubTelegramRequest):
+    """Stub Bot API answering getUpdates with no updates."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith("/getUpdates"):
+            return 200, json.dumps({"ok": True, "result": []}).encode()
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+class StuckPollRequest(StubTelegramRequest):
+    """Stub Bot API whose getUpdates never succeeds (a poller wedged on a dead connection)."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith("/getUpdates"):
+            raise TimedOut()
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+async def _poll_once(tenants, requests):
+    applications = [
+        bot.build_application(tenant.token, tenant=tenant, request=StubTelegramRequest(), updates_request=request)
+        for tenant, request in zip(tenants, requests)
+    ]
+    for application in applications:
+        await application.initialize()
+        try:
+            await application.bot.get_updates(timeout=0)
+        except TimedOut:
+            pass
+    deliveries = dict(bot.instrumentation.deliveries)
+    monitor = HealthMonitor(
+        bot.loop_watchdog,
+        bot.last_update_delivery,
+        lambda: 0,
+        stale_updates_seconds=60,
+        deliveries=lambda: dict(bot.instrumentation.deliveries),
+    )
+    # As if the bots had been running for two minutes
+    monitor.started_at -= 120
+    live = monitor.live()
+    for application in applications:
+        await application.shutdown()
+    return deliveries, live, dict(bot.instrumentation.deliveries)
+
+
+def test_stuck_tenant_fails_liveness():
+    """One hosted bot polling fine does not hide another whose getUpdates is stuck"""
+    tenants = [Tenant("msk", f"{BOT_ID}:MSK"), Tenant("kzn", f"{BOT_ID}:KZN")]
+    try:
+        deliveries, (status, payload), after = asyncio.run(
+            _poll_once(tenants, [IdlePollRequest(), StuckPollRequest()])
+        )
+    finally:
+        bot.hosted_tenants.clear()
+    print(f"Deliveries: {deliveries}, live: {status} {payload['problems']}, stalest: {payload['stalest_bot']}")
+    assert deliveries["msk"] is not None and deliveries["kzn"] is None, "Tracked per bot"
+    assert status == 503 and payload["stalest_bot"] == "kzn", "The stuck bot makes the process not alive"
+    assert not after, "Bots that shut down are no longer expected to poll"
+    print("[PASS] Stuck tenant fails liveness\n")
+
+
+async def _poll_fake_api(server: FakeTelegramServer) -> None:
+    application = bot.build_application(f"{BOT_ID}:HEALTH")
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(timeout=1)
+    await application.start()
+    try:
+        deadline = time.monotonic() + 10
+        while not bot.instrumentation.deliveries.get("default") and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.3)
+        url = f"http://127.0.0.1:{bot.instrumentation._server.server_address[1]}/health/ready"
+        body = await asyncio.to_thread(lambda: urllib.request.urlopen(url, timeout=5).read())
+        return json.loads(body)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+
+
+def test_ready_endpoint_with_polling_bot():
+    """The bot polling a (fake) Bot API answers /health/ready with 200"""
+    server = FakeTelegramServer()
+    server.start()
+    bot.instrumentation.add_route("/health/ready", bot.health_monitor.ready)
+    bot.instrumentation.start_http_server(0)
+    try:
+        with mock.patch.object(bot, "TELEGRAM_API_URL", server.url):
+            payload = asyncio.run(_poll_fake_api(server))
+    except urllib.error.HTTPError as error:
+        payload = json.loads(error.read())
+    finally:
+        bot.instrumentation.stop_http_server()
+        server.shutdown()
+        server.server_close()
+    print(f"Ready: {payload}")
+    assert payload["status"] == "ok", f"Polling bot should be ready: {payload['problems']}"
+    assert payload["loop_running"], "Watchdog should be started by post_init"
+    print("[PASS] Ready endpoint with polling bot\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING HEALTH CHECKS")
+    print("=" * 60 + "\n")
+
+    try:
+        test_watchdog_reports_blocking_stack()
+        test_live_and_ready_rules()
+        test_ready_fails_with_outbox_backlog()
+        test_stuck_tenant_fails_liveness()
+        test_ready_endpoint_with_polling_bot()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,86 @@
+"""Tests for per-update / per-handler instrumentation and the metrics endpoint."""
+
+import asyncio
+import os
+import sys
+import urllib.request
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BENCH_TOKEN, StubTelegramRequest, UpdateFactory
+from instrumentation import Instrumentation
+
+
+async def _run_updates(slow_update_seconds: float) -> Instrumentation:
+    metrics = Instrumentation(slow_update_seconds=slow_update_seconds, state_names=bot.STATE_NAMES)
+    with mock.patch.object(bot, "instrumentation", metrics), mock.patch.object(bot, "SHEET_SYNC_URL", ""):
+        application = bot.build_application(BENCH_TOKEN, request=StubTelegramRequest())
+        await application.initialize()
+        factory = UpdateFactory(application.bot)
+        await application.process_update(factory.message(2001, True, "/start promo"))
+        await application.process_update(factory.message(2001, True, "79991234567"))
+        await application.shutdown()
+    return metrics
+
+
+def test_update_and_handler_metrics():
+    """Every update, handler call, transition and API call is recorded"""
+    metrics = asyncio.run(_run_updates(slow_update_seconds=60))
+    print(f"Updates: command={metrics.update_seconds.count('command')}, message={metrics.update_seconds.count('message')}")
+    assert metrics.update_seconds.count("command") == 1, "/start should be timed end to end"
+    assert metrics.update_seconds.count("message") == 1, "Phone message should be timed end to end"
+    assert metrics.handler_seconds.count("start", "entry") == 1, "Entry handler should be timed"
+    assert metrics.handler_seconds.count("phone_received_text", "PHONE") == 1, "State handler should be timed"
+    assert metrics.transition_seconds.count("entry", "PHONE") == 1, "Transition into PHONE should be recorded"
+    assert metrics.transition_seconds.count("PHONE", "BRAND") == 1, "Transition PHONE -> BRAND should be recorded"
+    assert metrics.api_seconds.count("sendMessage", "200") == 2, "Each reply should be counted as an API call"
+    assert metrics.api_calls_per_update.count("message") == 1, "API calls per update should be observed"
+    assert metrics.slow_updates.value("PHONE", "phone_received_text") == 0, "Fast updates are not slow"
+    print("[PASS] Update and handler metrics\n")
+
+
+def test_slow_update_log():
+    """Updates over the threshold are counted with their state and handler"""
+    with mock.patch("logging.warning") as warning:
+        metrics = asyncio.run(_run_updates(slow_update_seconds=0))
+    slow_logs = [call for call in warning.call_args_list if call.args[0].startswith("Slow update")]
+    print(f"Slow update warnings: {len(slow_logs)}")
+    assert metrics.slow_updates.value("PHONE", "phone_received_text") == 1, "Slow update should name the handler"
+    assert len(slow_logs) == 2, "Each slow update should be logged"
+    print("[PASS] Slow update log\n")
+
+
+def test_metrics_endpoint():
+    """Metrics are served in the Prometheus text format"""
+    metrics = asyncio.run(_run_updates(slow_update_seconds=60))
+    server = metrics.start_http_server(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        body = urllib.request.urlopen(url, timeout=5).read().decode("utf-8")
+    finally:
+        metrics.stop_http_server()
+    print("\n".join(line for line in body.splitlines() if "PHONE" in line and "_count" in line))
+    assert "# TYPE bot_update_seconds histogram" in body, "Histogram type should be declared"
+    assert 'bot_handler_seconds_count{handler="phone_received_text",state="PHONE"} 1' in body, "Series missing"
+    assert 'bot_update_seconds_bucket{kind="message",le="+Inf"} 1' in body, "+Inf bucket should hold all samples"
+    print("[PASS] Metrics endpoint\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING INSTRUMENTATION")
+    print("=" * 60 + "\n")
+
+    try:
+        test_update_and_handler_metrics()
+        test_slow_update_log()
+        test_metrics_endpoint()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,114 @@
+"""Tests for the local lead registry and its sheet replication outbox"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lead_registry import LeadRegistry, SheetReplicator
+
+
+def test_dedup_and_merge():
+    """Leads are found by tg_user_id first, then by phone, and merged"""
+    registry = LeadRegistry()
+    action, lead = registry.upsert({"tg_user_id": 1, "tag": "vk"})
+    assert action == "created", "First sync creates the lead"
+    action, lead = registry.upsert({"tg_user_id": 1, "phone": "+7 (999) 123-45-67", "brand": "Haval"})
+    print(f"Merged lead: {lead}")
+    assert action == "updated", "Same tg_user_id updates the lead"
+    assert lead["tag"] == "vk" and lead["brand"] == "Haval", "Earlier fields are kept"
+    assert lead["phone"] == "79991234567", "Phone is normalized like GET.js"
+
+    action, moved = registry.upsert({"tg_user_id": 2, "phone": "79991234567", "city": "Казань"})
+    assert action == "updated" and moved["lead_id"] == lead["lead_id"], "Unknown user with a known phone is deduplicated"
+    assert moved["tg_user_id"] == "2", "Lead takes the new tg_user_id, as processData does"
+    assert registry.upsert({"tg_user_id": 2, "city": "Казань"}) is None, "Unchanged payload is a no-op"
+    assert registry.count() == 1, "One lead"
+
+    history = registry.history(lead["lead_id"])
+    assert [entry["action"] for entry in history] == ["created", "updated", "updated"], "Every change is recorded"
+    assert history[-1]["changes"]["tg_user_id"] == ["1", "2"], "History keeps old and new values"
+    try:
+        registry.upsert({"phone": "79990000000"})
+        raise AssertionError("Payload without tg_user_id should be rejected")
+    except ValueError:
+        pass
+    print("[PASS] Dedup and merge\n")
+
+
+def test_outbox_coalesces_and_retries():
+    """Queued changes of a lead are sent once; failures are retried with backoff"""
+    now = [1000.0]
+    registry = LeadRegistry(clock=lambda: now[0])
+    registry.upsert({"tg_user_id": 1, "tag": "vk"})
+    registry.upsert({"tg_user_id": 1, "brand": "Lada"})
+    registry.upsert({"tg_user_id": 3, "tag": "local"}, replicate=False)
+    assert registry.pending() == 1, "Two changes of one lead are one outbox entry"
+
+    (lead_id, version, lead), _ = registry.claim()
+    assert lead["brand"] == "Lada" and lead["tag"] == "vk", "Latest state is sent"
+    assert registry.claim() == (None, None), "A claimed entry is not handed out twice"
+    delay = registry.retry(lead_id, "HTTP 500")
+    assert delay == 1.0, "First retry after the base delay"
+    entry, next_due = registry.claim()
+    assert entry is None and next_due == 1001.0, "Entry waits for its retry time"
+
+    now[0] = 1001.0
+    (lead_id, version, _), _ = registry.claim()
+    registry.upsert({"tg_user_id": 1, "budget": 1500000})
+    registry.acknowledge(lead_id, version)
+    assert registry.pending() == 1, "A change made during the send stays queued"
+    (lead_id, version, lead), _ = registry.claim()
+    registry.acknowledge(lead_id, version)
+    assert registry.pending() == 0 and lead["budget"] == 1500000, "Newer version replicated"
+    print("[PASS] Outbox coalesces and retries\n")
+
+
+def test_replicator_survives_restart():
+    """Leads left in the outbox on disk are replicated by the next process"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "leads.sqlite3")
+        registry = LeadRegistry(path)
+        for user_id in range(1, 6):
+            registry.upsert({"tg_user_id": user_id, "phone": f"7999000000{user_id}"})
+        registry.close()
+
+        sent = []
+        lock = threading.Lock()
+
+        def send(lead):
+            with lock:
+                sent.append(lead["tg_user_id"])
+
+        registry = LeadRegistry(path)
+        replicator = SheetReplicator(registry, send, workers=2)
+        replicator.start()
+        started = time.perf_counter()
+        assert replicator.wait_idle(5), "Outbox should drain"
+        print(f"Replicated {sorted(sent)} in {(time.perf_counter() - started) * 1000:.1f} ms")
+        assert replicator.stop(), "Workers should stop"
+        assert sorted(sent) == ["1", "2", "3", "4", "5"], "Every lead replicated exactly once"
+        assert registry.get(phone="+7 999 000 00 03")["tg_user_id"] == "3", "Lookup by phone"
+        registry.close()
+    print("[PASS] Replicator survives restart\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING LEAD REGISTRY")
+    print("=" * 60 + "\n")
+
+    try:
+        test_dedup_and_merge()
+        test_outbox_coalesces_and_retries()
+        test_replicator_survives_restart()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,181 @@
+"""Tests for the columnar listings store used by the AI selection step."""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from gpt_service import GPTCarSearchService
+from listings_store import ListingsRepository, ListingsStore, parse_int
+
+RECORDS = [
+    {"brand": "Haval", "model": "Jolion", "city": "Москва", "year": 2022, "price": 2100000, "mileage": 30000},
+    {"brand": "Haval", "model": "Jolion", "city": "Москва", "year": 2019, "price": 1500000, "mileage": 90000},
+    {"brand": "Haval", "model": "Jolion", "city": "Казань", "year": 2021, "price": 1900000, "mileage": 40000},
+    {"brand": "Lada", "model": "Vesta", "city": "Москва", "year": 2020, "price": 1100000, "mileage": 60000},
+    {"brand": "haval", "model": "JOLION", "city": "москва", "year": 2020, "price": 1700000, "mileage": 10000},
+]
+
+
+def test_dictionary_encoding():
+    """Text columns are stored as int codes with case-insensitive vocabularies"""
+    store = ListingsStore.from_records(RECORDS)
+    print(f"Vocabularies: {store.vocabularies}")
+    assert store.vocabularies["brand"] == ["Haval", "Lada"], "Brands should be deduplicated"
+    columns = store.segments[0].columns
+    assert columns["brand"].dtype == np.int32, "Brand column should hold int codes"
+    assert columns["year"].dtype == np.int16, "Year should be int16"
+    print("[PASS] Dictionary encoding\n")
+
+
+def test_search_filters_and_ranking():
+    """Search applies brand/model/city/year_to/budget filters and ranks best first"""
+    store = ListingsStore.from_records(RECORDS)
+    found = store.search(brand="HAVAL", model="jolion", city="Москва", year_to=2021, budget=2000000)
+    print(f"Found: {found}")
+    assert found["total_matches"] == 2, "Only Moscow Jolions up to 2021 within budget"
+    assert [car["year"] for car in found["results"]] == [2020, 2019], "Newer car should come first"
+
+    missing = store.search(brand="Toyota")
+    assert missing["total_matches"] == 0, "Unknown brand should match nothing"
+    print("[PASS] Search filters and ranking\n")
+
+
+def test_csv_import_with_aliases():
+    """CSV dumps with Russian headers and formatted numbers are imported"""
+    content = (
+        "Марка;Модель;Город;Год;Цена;Пробег\n"
+        "Chery;Tiggo 7 Pro Max;Казань;2023;2 450 000;15 000 км\n"
+        "Chery;Arrizo 8;Казань;;1 900 000;5000\n"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "dump.csv")
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(content)
+        store = ListingsStore.from_file(path)
+
+    print(f"Imported rows: {len(store)}")
+    assert len(store) == 1, "Row without year should be skipped"
+    assert store.row(0)["price"] == 2450000, "Spaces in price should be ignored"
+    assert store.row(0)["mileage"] == 15000, "Units in mileage should be ignored"
+    assert parse_int("1500000,50") == 1500000, "Decimal comma should be accepted"
+    print("[PASS] CSV import\n")
+
+
+def test_repository_deltas_and_generation_swap():
+    """Appends and deletes publish new memory-mapped generations picked up by readers"""
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = ListingsRepository(tmp)
+        reader = ListingsRepository(tmp, check_interval=0)
+        writer.import_full(RECORDS)
+
+        store = reader.current()
+        assert isinstance(store.segments[0].columns["price"], np.memmap), "Columns should be memory-mapped"
+        assert len(store) == 5, "Full import should expose all rows"
+
+        writer.append([{"brand": "Geely", "model": "Monjaro", "city": "Казань", "year": 2024, "price": 3500000}])
+        writer.delete([0])
+        swapped = reader.current()
+        print(f"Generation: {reader.current_generation()}, segments: {len(swapped.segments)}")
+        assert swapped is not store, "Reader should map the new generation"
+        assert len(swapped) == 5, "One row appended, one deleted"
+        assert swapped.search(brand="Geely")["results"][0]["id"] == 5, "Appended row gets next listing_id"
+        assert swapped.search(brand="Haval", year_to=2022, budget=2100000)["total_matches"] == 3, "Deleted row is hidden"
+        assert len(store) == 5 and store.search(brand="Geely")["total_matches"] == 0, "Old generation stays usable"
+
+        writer.compact()
+        writer.collect_garbage(keep=1)
+        compacted = reader.current()
+        assert len(compacted.segments) == 1 and len(compacted) == 5, "Compaction drops tombstoned rows"
+        assert len(os.listdir(os.path.join(tmp, "segments"))) == 1, "Unreferenced segments are removed"
+    print("[PASS] Repository deltas and generation swap\n")
+
+
+async def _search_during_swap(service: GPTCarSearchService):
+    preferences = {"brand": "Geely"}
+    started = time.perf_counter()
+    during = await service.search_cars(preferences)
+    elapsed = time.perf_counter() - started
+    await service._refresh
+    after = await service.search_cars(preferences)
+    return during, elapsed, after, threading.get_ident()
+
+
+def test_service_remaps_generation_off_loop():
+    """A swapped generation is mapped in a worker thread; searches use the old one meanwhile"""
+    open_generation = ListingsStore.open_generation
+    mapped_in = []
+
+    def slow_open(root, generation):
+        mapped_in.append(threading.get_ident())
+        time.sleep(0.2)
+        return open_generation(root, generation)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = ListingsRepository(tmp)
+        writer.import_full(RECORDS)
+        service = GPTCarSearchService()
+        service.load_listings(tmp)
+        service._repository.check_interval = 0
+        writer.append([{"brand": "Geely", "model": "Monjaro", "city": "Казань", "year": 2024, "price": 3500000}])
+        with mock.patch.object(ListingsStore, "open_generation", side_effect=slow_open):
+            during, elapsed, after, loop_thread = asyncio.run(_search_during_swap(service))
+
+    print(f"During swap: {during['total_matches']} in {elapsed * 1000:.1f} ms, after: {after['total_matches']}")
+    assert during["status"] == "ok" and during["total_matches"] == 0, "The old generation answers meanwhile"
+    assert elapsed < 0.1, "The search does not wait for the re-map"
+    assert after["total_matches"] == 1, "The new generation is used once mapped"
+    assert mapped_in and loop_thread not in mapped_in, "Mapping runs outside the event loop thread"
+    print("[PASS] Service re-maps generation off the loop\n")
+
+
+def benchmark_million_rows():
+    """Print query latency over a synthetic million-row store"""
+    rng = np.random.default_rng(0)
+    size = 1_000_000
+    brands = ["Lada", "Haval", "Chery", "Geely", "Changan"]
+    cities = ["Москва", "Санкт-Петербург", "Казань", "Екатеринбург", "Новосибирск", "Краснодар"]
+    columns = {
+        "brand": rng.integers(0, len(brands), size).astype(np.int32),
+        "model": rng.integers(0, 3, size).astype(np.int32),
+        "city": rng.integers(0, len(cities), size).astype(np.int32),
+        "year": rng.integers(2005, 2026, size).astype(np.int16),
+        "price": rng.integers(300_000, 6_000_000, size).astype(np.int32),
+        "mileage": rng.integers(0, 300_000, size).astype(np.int32),
+    }
+    store = ListingsStore.from_columns(columns, {"brand": brands, "model": ["A", "B", "C"], "city": cities})
+
+    started = time.perf_counter()
+    runs = 50
+    for _ in range(runs):
+        store.search(brand="Haval", city="Казань", year_to=2022, budget=2_000_000)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / runs
+    print(f"1M listings: {elapsed_ms:.2f} ms per query")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING LISTINGS STORE")
+    print("=" * 60 + "\n")
+
+    try:
+        test_dictionary_encoding()
+        test_search_filters_and_ranking()
+        test_csv_import_with_aliases()
+        test_repository_deltas_and_generation_swap()
+        test_service_remaps_generation_off_loop()
+        benchmark_million_rows()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,121 @@
+"""Tests for returning-user prefill from the lead registry and the sheet snapshot"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BENCH_TOKEN, StubTelegramRequest, UpdateFactory, funnel_script
+from gas_standin import AppsScriptServer, AppsScriptStandIn
+from sheet_export import SheetSnapshot
+
+
+class RecordingRequest(StubTelegramRequest):
+    """Stub Bot API that keeps the texts of sent messages."""
+
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith("/sendMessage") and request_data:
+            self.texts.append(request_data.parameters.get("text", ""))
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+async def _returning_user(choice: str):
+    request = RecordingRequest()
+    application = bot.build_application(BENCH_TOKEN, request=request)
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    for _, update in funnel_script(factory, 1):
+        await application.process_update(update)
+    lead = bot.get_lead_registry().get(tg_user_id=1_000_001)
+    history_before = len(bot.get_lead_registry().history(lead["lead_id"]))
+
+    request.texts.clear()
+    await application.process_update(factory.message(1_000_001, True, "/start bench_tag_1"))
+    offer = request.texts[-1]
+    await application.process_update(factory.callback(1_000_001, True, choice))
+    history_after = len(bot.get_lead_registry().history(lead["lead_id"]))
+    await application.shutdown()
+    return offer, request.texts[-1], history_after - history_before
+
+
+def test_continue_previous_request():
+    """A returning user continues with one tap and lands on the manager question"""
+    with mock.patch.object(bot, "SHEET_SYNC_URL", ""), mock.patch.object(bot, "AI_PROGRESS_STEP_SECONDS", 0):
+        bot.close_lead_registry()
+        offer, last, changes = asyncio.run(_returning_user(bot.PREFILL_CONTINUE))
+        bot.close_lead_registry()
+    print(f"Offer: {offer!r}\nLast message: {last!r}, lead changes: {changes}")
+    assert offer.startswith("С возвращением") and "Haval" in offer, "Previous request should be offered"
+    assert "Передать контакт менеджеру" in last, "All answers are known, so the manager question follows"
+    assert changes == 0, "Unchanged request should not create a new sync"
+    print("[PASS] Continue previous request\n")
+
+
+def test_restart_previous_request():
+    """Choosing to start over asks for the phone again"""
+    with mock.patch.object(bot, "SHEET_SYNC_URL", ""), mock.patch.object(bot, "AI_PROGRESS_STEP_SECONDS", 0):
+        bot.close_lead_registry()
+        _, last, _ = asyncio.run(_returning_user(bot.PREFILL_RESTART))
+        bot.close_lead_registry()
+    assert last == bot.GREETING_TEXT, "Restart should show the usual greeting"
+    print("[PASS] Restart previous request\n")
+
+
+def test_snapshot_from_sheet():
+    """Leads known only to the sheet are prefilled from the delta-refreshed snapshot"""
+    server = AppsScriptServer(script=AppsScriptStandIn())
+    server.start()
+    try:
+        script = server.script
+        script.process_data({"tg_user_id": 42, "phone": "+7 999 000-00-42", "brand": "Chery", "budget": 1500000.0})
+        snapshot = SheetSnapshot()
+        assert snapshot.refresh(server.url) == 1, "First refresh loads the sheet"
+        script.process_data({"tg_user_id": 42, "city": "Казань"})
+        script.process_data({"tg_user_id": 43, "phone": "79990000043"})
+        assert snapshot.refresh(server.url) == 2, "Second refresh only pulls changed rows"
+        assert snapshot.refresh(server.url) == 0, "Nothing changed since the last cursor"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "snapshot.json")
+        snapshot.save(path)
+        restored = SheetSnapshot()
+        assert restored.load(path) and restored.cursor == snapshot.cursor, "Snapshot survives a restart"
+
+    with mock.patch.object(bot, "sheet_snapshot", restored), mock.patch.object(bot, "SHEET_SYNC_URL", ""):
+        bot.close_lead_registry()
+        previous = bot.find_previous_request(42)
+        without_brand = bot.find_previous_request(43)
+        bot.close_lead_registry()
+    print(f"Prefill from sheet: {previous}")
+    assert previous == {"phone": "79990000042", "brand": "Chery", "city": "Казань", "budget": 1500000}, "Sheet row mapped"
+    assert without_brand is None, "Leads without a brand are not offered"
+    print("[PASS] Snapshot from sheet\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING RETURNING-USER PREFILL")
+    print("=" * 60 + "\n")
+
+    try:
+        test_continue_previous_request()
+        test_restart_previous_request()
+        test_snapshot_from_sheet()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
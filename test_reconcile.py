@@ -0,0 +1,138 @@
+"""Tests for hash-based reconciliation between the lead registry and the sheet"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gas_standin import AppsScriptServer, AppsScriptStandIn
+from lead_registry import LeadRegistry
+from reconcile import BATCH_SIZE, reconcile, row_hash
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Runs rowHashes() from GAS/GET.js with the Apps Script services stubbed
+NODE_HARNESS = r"""
+const fs = require("fs");
+const crypto = require("crypto");
+const values = JSON.parse(fs.readFileSync(0, "utf8"));
+globalThis.Utilities = {
+  DigestAlgorithm: { MD5: "md5" },
+  Charset: { UTF_8: "utf8" },
+  computeDigest: (algorithm, text) =>
+    Array.from(crypto.createHash("md5").update(text, "utf8").digest()).map((b) => (b > 127 ? b - 256 : b)),
+};
+globalThis.SpreadsheetApp = {
+  getActiveSpreadsheet: () => ({ getActiveSheet: () => ({ getDataRange: () => ({ getValues: () => values }) }) }),
+};
+globalThis.PropertiesService = { getScriptProperties: () => ({ getProperty: () => null }) };
+globalThis.ContentService = { MimeType: { JSON: "json" }, createTextOutput: (text) => ({ setMimeType: () => text }) };
+const rowHashes = new Function(fs.readFileSync(process.argv[1], "utf8") + "; return rowHashes;")();
+process.stdout.write(rowHashes({}));
+"""
+
+
+def _lead(user_id: int) -> dict:
+    return {
+        "tg_user_id": user_id,
+        "phone": f"7999{user_id:07d}",
+        "brand": "Haval",
+        "model": "Jolion",
+        "city": "Москва",
+        "year": 2022,
+        "budget": 2_000_000,
+        "tag": f"tag_{user_id % 7}",
+    }
+
+
+def test_hashes_match_get_js():
+    """rowHashes() in GET.js and row_hash() agree on the same cells"""
+    node = shutil.which("node")
+    if node is None:
+        print("[SKIP] node is not installed\n")
+        return
+    record = {
+        "phone_number": "79991234567", "timestamp": "", "brand": "Chery", "model": "Tiggo 7 Pro Max",
+        "year": 2021, "city": "Санкт-Петербург", "city_hub": "", "budget": 1500000.0, "manager": True,
+        "client_name": "Иван", "tg_user_id": 501, "tg_username": "@ivan", "tag": "vk",
+    }
+    values = [list(record), list(record.values())]
+    output = subprocess.run(
+        [node, "-e", NODE_HARNESS, os.path.join(ROOT, "GAS", "GET.js")],
+        input=json.dumps(values, ensure_ascii=False),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    hashes = json.loads(output)["hashes"]
+    print(f"GET.js: {hashes}, Python: {row_hash(record)}")
+    assert hashes == {"501": row_hash(record)}, "Both sides must hash a row identically"
+    print("[PASS] Hashes match GET.js\n")
+
+
+def test_drift_is_repaired_in_batches():
+    """Only divergent and missing leads are resent, in a few batch requests"""
+    leads = 5000
+    registry = LeadRegistry()
+    for user_id in range(1, leads + 1):
+        registry.upsert(_lead(user_id), replicate=False)
+    server = AppsScriptServer(script=AppsScriptStandIn())
+    server.start()
+    try:
+        script = server.script
+        # The sheet got every lead except the last 40; 150 rows lost their budget
+        script.process_batch([lead for _, lead in registry.leads()][:-40])
+        store = script.store
+        budget_column = store.headers().index("budget")
+        for row_number in range(2, 2 + 150):
+            store.set_value(row_number, budget_column, "")
+        registry.upsert({"tg_user_id": 7, "city": "Казань"})  # queued for replication, skipped
+
+        first = reconcile(registry, server.url)
+        second = reconcile(registry, server.url, dry_run=True)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(f"First pass: {first}\nSecond pass: {second}")
+    assert first["missing"] == 40 and first["divergent"] == 149, "Drift should be found by hash"
+    assert first["queued"] == 1, "Leads in the outbox are left to replication"
+    assert first["requests"] == 2 and first["resent"] == 189 <= BATCH_SIZE, "One hash request and one batch"
+    assert second["in_sync"] == leads - 1 and second["resent"] == 0, "Everything but the queued lead is in sync"
+    assert len(store.records()) == leads, "Missing leads were appended once"
+    print("[PASS] Drift is repaired in batches\n")
+
+
+def test_batch_matches_process_data():
+    """processBatch produces the same rows as one processData per lead"""
+    one_by_one = AppsScriptStandIn()
+    batched = AppsScriptStandIn()
+    leads = [_lead(1), {"tg_user_id": 2, "phone": "+7 999 000-00-01", "brand": "Lada"}, _lead(3), {"tg_user_id": 3, "budget": None, "model": "M6"}]
+    for lead in leads:
+        one_by_one.process_data(lead)
+    answer = batched.process_batch(leads)
+    strip = lambda records: [{key: value for key, value in record.items() if key != "timestamp"} for record in records]
+    print(f"Batch answer: {answer}")
+    assert answer["created"] == 2 and answer["updated"] == 2, "Phone fallback and repeated ids update rows"
+    assert strip(batched.store.records()) == strip(one_by_one.store.records()), "Same rows either way"
+    print("[PASS] Batch matches processData\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING RECONCILIATION")
+    print("=" * 60 + "\n")
+
+    try:
+        test_hashes_match_get_js()
+        test_drift_is_repaired_in_batches()
+        test_batch_matches_process_data()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,159 @@
+"""Tests for merging and overlapping Bot API calls of one handler"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BENCH_TOKEN, StubTelegramRequest, UpdateFactory, funnel_script
+from reply_outbox import ReplyOutbox
+
+LATENCY = 0.05
+
+
+class SlowRequest(StubTelegramRequest):
+    """Stub Bot API with a fixed round trip that logs (method, text) of every call."""
+
+    def __init__(self):
+        super().__init__()
+        self.log = []
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if not url.endswith("/getMe"):
+            await asyncio.sleep(LATENCY)
+            text = request_data.parameters.get("text") if request_data else None
+            self.log.append((url.rsplit("/", 1)[-1], text))
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+class StaleQueryRequest(StubTelegramRequest):
+    """Stub Bot API refusing to answer callback queries or edit their buttons."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith(("/answerCallbackQuery", "/editMessageReplyMarkup")):
+            error = {"ok": False, "error_code": 400, "description": "Bad Request: query is too old"}
+            return 400, json.dumps(error).encode()
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+async def _outbox_layouts():
+    request = SlowRequest()
+    application = bot.build_application(BENCH_TOKEN, request=request)
+    await application.initialize()
+    message = UpdateFactory(application.bot).message(5, True, "x").message
+    async with ReplyOutbox() as outbox:
+        outbox.reply(message, "Спасибо", reply_markup=bot.ReplyKeyboardRemove())
+        outbox.reply(message, "Сводка")
+        outbox.reply(message, "Нажмите кнопку", reply_markup=bot.MANAGER_FOLLOWUP_BUTTON)
+        outbox.reply(message, "После кнопки")
+        outbox.reply(message, "<b>HTML</b>", parse_mode="HTML")
+        outbox.reply(message, "x" * 4095)
+    await application.shutdown()
+    return [text for _, text in request.log], outbox
+
+
+def test_merge_rules():
+    """Texts merge unless it would move buttons, mix parse modes or exceed the length limit"""
+    texts, outbox = asyncio.run(_outbox_layouts())
+    print(f"Sent: {[text[:40] for text in texts]}")
+    assert texts[0] == "Спасибо\n\nСводка", "Plain text joins the message with the keyboard removal"
+    assert texts[1] == "Нажмите кнопку", "A message carries one reply markup"
+    assert texts[2:4] == ["После кнопки", "<b>HTML</b>"], "Inline buttons and parse mode changes split messages"
+    assert len(texts) == 5 and outbox.merged == 1, "A merge over the length limit is skipped"
+    print("[PASS] Merge rules\n")
+
+
+async def _manager_button():
+    request = SlowRequest()
+    application = bot.build_application(BENCH_TOKEN, request=request)
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    # User 4 declines the manager first and presses the follow-up button afterwards
+    script = funnel_script(factory, 4)
+    for _, update in script[:-2]:
+        await application.process_update(update)
+    request.log.clear()
+    started = time.perf_counter()
+    await application.process_update(script[-2][1])
+    decline = (time.perf_counter() - started, list(request.log))
+    request.log.clear()
+    started = time.perf_counter()
+    await application.process_update(script[-1][1])
+    button = (time.perf_counter() - started, list(request.log))
+    await application.shutdown()
+    return decline, button
+
+
+def test_manager_steps_need_fewer_round_trips():
+    """Declining takes two messages; the follow-up button costs one round trip instead of four"""
+    with mock.patch.object(bot, "SHEET_SYNC_URL", ""), mock.patch.object(bot, "AI_PROGRESS_STEP_SECONDS", 0):
+        bot.close_lead_registry()
+        (decline_seconds, decline), (button_seconds, button) = asyncio.run(_manager_button())
+        bot.close_lead_registry()
+    print(f"Decline: {decline_seconds * 1000:.0f} ms, {[method for method, _ in decline]}")
+    print(f"Button: {button_seconds * 1000:.0f} ms, {[method for method, _ in button]}")
+    assert len(decline) == 2 and "- Бюджет:" in decline[0][1], "Thanks and summary are one message"
+    assert "нажмите кнопку ниже" in decline[1][1], "The follow-up button comes last"
+    assert sorted(method for method, _ in button) == ["answerCallbackQuery", "editMessageReplyMarkup", "sendMessage"]
+    handoff = next(text for method, text in button if method == "sendMessage")
+    assert "передаю заявку менеджеру" in handoff and "- Бюджет:" in handoff, "Confirmation and summary merged"
+    assert button_seconds < 2 * LATENCY, "Calls overlap: about one round trip for the whole step"
+    print("[PASS] Manager steps need fewer round trips\n")
+
+
+async def _stale_manager_button():
+    request = StaleQueryRequest()
+    application = bot.build_application(BENCH_TOKEN, request=request)
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    script = funnel_script(factory, 4)
+    for _, update in script[:-2]:
+        await application.process_update(update)
+    conversation = next(
+        handler for handler in application.handlers[0] if isinstance(handler, bot.ConversationHandler)
+    )
+    key = conversation._get_key(script[-1][1])
+    before = conversation._conversations.get(key)
+    sent = request.calls.get("sendMessage", 0)
+    await application.process_update(script[-1][1])
+    after = conversation._conversations.get(key)
+    await application.shutdown()
+    return before, after, request.calls.get("sendMessage", 0) - sent
+
+
+def test_failed_started_calls_keep_state():
+    """A stale callback query fails answer() and the button edit; the step still moves on"""
+    with mock.patch.object(bot, "SHEET_SYNC_URL", ""), mock.patch.object(bot, "AI_PROGRESS_STEP_SECONDS", 0):
+        bot.close_lead_registry()
+        with mock.patch("logging.warning") as warning:
+            before, after, sent = asyncio.run(_stale_manager_button())
+        bot.close_lead_registry()
+    failed = [call for call in warning.call_args_list if "Best-effort" in call[0][0]]
+    print(f"State: {before} -> {after}, messages: {sent}, logged failures: {len(failed)}")
+    assert before == bot.MANAGER, "Waiting for the follow-up button"
+    assert after != bot.MANAGER and sent == 1, "The handoff is sent and the conversation moves on"
+    assert len(failed) == 2, "Both failed calls are logged"
+    print("[PASS] Failed started calls keep state\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING REPLY OUTBOX")
+    print("=" * 60 + "\n")
+
+    try:
+        test_merge_rules()
+        test_manager_steps_need_fewer_round_trips()
+        test_failed_started_calls_keep_state()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
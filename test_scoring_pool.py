@@ -0,0 +1,152 @@
+"""Tests for listing searches in the pre-warmed scoring process pool"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from listings_store import ListingsRepository
+from scoring_pool import ScoringPool, ScoringPoolBusy
+
+SHM_DIR = "/dev/shm"
+
+RECORDS = [
+    {"brand": "Haval", "model": "Jolion", "city": "Москва", "year": 2022, "price": 2100000, "mileage": 30000},
+    {"brand": "Haval", "model": "Jolion", "city": "Москва", "year": 2019, "price": 1500000, "mileage": 90000},
+    {"brand": "Haval", "model": "Jolion", "city": "Казань", "year": 2021, "price": 1900000, "mileage": 40000},
+    {"brand": "Haval", "model": "Dargo", "city": "Москва", "year": 2023, "price": 2900000, "mileage": 5000},
+    {"brand": "Lada", "model": "Vesta", "city": "Москва", "year": 2020, "price": 1100000, "mileage": 60000},
+]
+
+
+def _shared_blocks() -> set:
+    return {name for name in os.listdir(SHM_DIR) if name.startswith("psm_")} if os.path.isdir(SHM_DIR) else set()
+
+
+def _started_pool(root: str, max_pending: int = 16) -> ScoringPool:
+    pool = ScoringPool(root, max_workers=1, max_pending=max_pending)
+    pool.start()
+    return pool
+
+
+async def _gather(*searches):
+    return await asyncio.gather(*searches)
+
+
+def test_worker_search_matches_store():
+    """Ranked rows from the worker equal ListingsStore.search on the same generation"""
+    with tempfile.TemporaryDirectory() as tmp:
+        repository = ListingsRepository(tmp)
+        repository.import_full(RECORDS)
+        expected = [
+            repository.current().search(brand="Haval", limit=3),
+            repository.current().search(brand="Haval", city="Москва", year_to=2022, budget=2000000),
+            repository.current().search(brand="Toyota"),
+        ]
+        pool = _started_pool(tmp)
+        try:
+            found = asyncio.run(
+                _gather(
+                    pool.search(brand="Haval", limit=3),
+                    pool.search(brand="Haval", city="Москва", year_to=2022, budget=2000000),
+                    pool.search(brand="Toyota"),
+                )
+            )
+        finally:
+            pool.close()
+    print(f"Pool: {found[1]}")
+    assert list(found) == expected, "Worker results match the in-process search"
+    print("[PASS] Worker search matches store\n")
+
+
+async def _burst(pool: ScoringPool, size: int):
+    return await asyncio.gather(*(pool.search(brand="Haval") for _ in range(size)), return_exceptions=True)
+
+
+def test_busy_at_max_pending():
+    """Requests beyond max_pending are rejected instead of queued"""
+    with tempfile.TemporaryDirectory() as tmp:
+        ListingsRepository(tmp).import_full(RECORDS)
+        pool = _started_pool(tmp, max_pending=2)
+        try:
+            results = asyncio.run(_burst(pool, 5))
+        finally:
+            pool.close()
+    busy = [result for result in results if isinstance(result, ScoringPoolBusy)]
+    print(f"Answered: {len(results) - len(busy)}, busy: {len(busy)}, rejected: {pool.rejected}")
+    assert len(busy) == 3 and pool.rejected == 3, "Only max_pending searches are accepted"
+    assert pool.pending == 0, "Pending count returns to zero"
+    print("[PASS] Busy at max_pending\n")
+
+
+def test_new_generation_after_append():
+    """Workers pick up a generation published by ListingsRepository.append"""
+    with tempfile.TemporaryDirectory() as tmp:
+        repository = ListingsRepository(tmp)
+        repository.import_full(RECORDS)
+        pool = _started_pool(tmp)
+        try:
+            before = asyncio.run(pool.search(brand="Geely"))
+            repository.append([{"brand": "Geely", "model": "Monjaro", "city": "Казань", "year": 2024, "price": 3500000}])
+            # Workers check the CURRENT pointer once a second
+            time.sleep(1.2)
+            after = asyncio.run(pool.search(brand="Geely"))
+        finally:
+            pool.close()
+    print(f"Before: {before['total_matches']}, after: {after}")
+    assert before["total_matches"] == 0, "Nothing before the append"
+    assert after["total_matches"] == 1 and after["results"][0]["model"] == "Monjaro", "Appended listing is found"
+    print("[PASS] New generation after append\n")
+
+
+async def _cancel_after_worker_finished(pool: ScoringPool):
+    task = asyncio.get_running_loop().create_task(pool.search(brand="Haval"))
+    await asyncio.sleep(0)  # submitted, waiting for the worker
+    # The worker creates its result block while the loop is busy; then the caller goes away
+    time.sleep(0.5)
+    created = _shared_blocks()
+    cancelled = task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return cancelled, created
+
+
+def test_shared_memory_released():
+    """Result blocks are unlinked after searches, also when the caller was cancelled"""
+    before = _shared_blocks()
+    with tempfile.TemporaryDirectory() as tmp:
+        ListingsRepository(tmp).import_full(RECORDS)
+        pool = _started_pool(tmp)
+        try:
+            asyncio.run(_burst(pool, 5))
+            after_searches = _shared_blocks() - before
+            cancelled, created = asyncio.run(_cancel_after_worker_finished(pool))
+        finally:
+            pool.close()
+    leaked = _shared_blocks() - before
+    print(f"Blocks after searches: {len(after_searches)}, while cancelling: {len(created - before)}, leaked: {len(leaked)}")
+    assert not after_searches, "Blocks of answered searches are unlinked"
+    assert cancelled and created - before, "The search was cancelled after its worker created a block"
+    assert not leaked, "The cancelled search's block is unlinked too"
+    print("[PASS] Shared memory released\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING SCORING POOL")
+    print("=" * 60 + "\n")
+
+    try:
+        test_worker_search_matches_store()
+        test_busy_at_max_pending()
+        test_new_generation_after_append()
+        test_shared_memory_released()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
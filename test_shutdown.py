@@ -0,0 +1,129 @@
+"""Tests for draining sheet replication on shutdown"""
+
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from gas_standin import AppsScriptServer, AppsScriptStandIn
+from lead_registry import LeadRegistry, SheetReplicator
+
+
+def _wait(condition, seconds: float = 5.0) -> None:
+    deadline = time.monotonic() + seconds
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting"
+        time.sleep(0.01)
+
+
+def test_drain_retries_backed_off_leads():
+    """Leads waiting out a retry backoff are sent at once by drain()"""
+    registry = LeadRegistry()
+    attempts = {}
+    sent = []
+
+    def send(lead):
+        attempts[lead["tg_user_id"]] = attempts.get(lead["tg_user_id"], 0) + 1
+        if attempts[lead["tg_user_id"]] == 1:
+            raise RuntimeError("HTTP 500")
+        sent.append(lead["tg_user_id"])
+
+    replicator = SheetReplicator(registry, send, workers=2)
+    replicator.start()
+    try:
+        for user_id in range(3):
+            registry.upsert({"tg_user_id": user_id, "tag": "vk"})
+        replicator.wake()
+        _wait(lambda: len(attempts) == 3 and not replicator._busy)
+        started = time.monotonic()
+        drained = replicator.drain(10)
+        elapsed = time.monotonic() - started
+    finally:
+        replicator.stop()
+        registry.close()
+    print(f"Drained: {drained} in {elapsed * 1000:.0f} ms, sent: {sorted(sent)}")
+    assert drained and sorted(sent) == ["0", "1", "2"], "Every lead is sent"
+    assert elapsed < 0.5, "No waiting for the 1 s backoff"
+    print("[PASS] Drain retries backed-off leads\n")
+
+
+def test_drain_gives_up_on_failing_sheet():
+    """A sheet that keeps failing ends the drain after one more try, not at the deadline"""
+    registry = LeadRegistry()
+
+    def send(lead):
+        raise RuntimeError("HTTP 500")
+
+    replicator = SheetReplicator(registry, send, workers=2)
+    replicator.start()
+    try:
+        registry.upsert({"tg_user_id": 1, "tag": "vk"})
+        started = time.monotonic()
+        drained = replicator.drain(10)
+        elapsed = time.monotonic() - started
+        pending = registry.pending()
+    finally:
+        replicator.stop()
+        registry.close()
+    print(f"Drained: {drained} in {elapsed * 1000:.0f} ms, pending: {pending}")
+    assert not drained and pending == 1, "The lead stays queued"
+    assert elapsed < 1.0, "Drain returns without waiting for the deadline"
+    print("[PASS] Drain gives up on failing sheet\n")
+
+
+def test_unsent_leads_survive_restart():
+    """In-memory leads the sheet did not take are saved on shutdown and sent on the next start"""
+    with tempfile.TemporaryDirectory() as directory:
+        unsent = os.path.join(directory, "unsent.sqlite3")
+        with mock.patch.object(bot, "LEADS_DB_PATH", ""), mock.patch.object(bot, "UNSENT_LEADS_PATH", unsent):
+            bot.close_lead_registry()
+            # First run: the sheet is not reachable
+            with mock.patch.object(bot, "SHEET_SYNC_URL", ""):
+                registry = bot.get_lead_registry()
+                for user_id in range(5):
+                    registry.upsert({"tg_user_id": user_id, "tag": "vk", "brand": "Haval"})
+                drained = bot.drain_sheet_replication(2)
+                bot.close_lead_registry(keep_unsent=True)
+            saved = os.path.exists(unsent)
+
+            server = AppsScriptServer(script=AppsScriptStandIn())
+            server.start()
+            try:
+                with mock.patch.object(bot, "SHEET_SYNC_URL", server.url):
+                    restored = bot.get_lead_registry().pending()
+                    removed = not os.path.exists(unsent)
+                    delivered = bot.drain_sheet_replication(10)
+                    bot.close_lead_registry(keep_unsent=True)
+            finally:
+                server.shutdown()
+                server.server_close()
+            records = server.script.store.records()
+            left = os.path.exists(unsent)
+    print(f"First drain: {drained}, saved: {saved}, restored: {restored}, rows: {len(records)}")
+    assert not drained and saved, "Unsent leads are written to UNSENT_LEADS_PATH"
+    assert restored == 5 and removed, "The next start takes them back into the outbox"
+    assert delivered and len(records) == 5, "Every lead reaches the sheet"
+    assert not left, "Nothing is saved when the outbox is empty"
+    print("[PASS] Unsent leads survive restart\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING SHUTDOWN DRAIN")
+    print("=" * 60 + "\n")
+
+    try:
+        test_drain_retries_backed_off_leads()
+        test_drain_gives_up_on_failing_sheet()
+        test_unsent_leads_survive_restart()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
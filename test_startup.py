@@ -0,0 +1,93 @@
+"""Tests for lazy imports, precompiled artifacts and the startup benchmark."""
+
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from artifacts import load_artifact
+from bench_startup import measure_first_reply
+
+HEAVY_MODULES = ("requests", "numpy", "gpt_service", "city_gazetteer", "funnel_events", "scoring_pool")
+
+
+def test_import_skips_heavy_modules():
+    """`import bot` does not load requests, NumPy or the listings service"""
+    code = f"import sys, bot; print([name for name in {HEAVY_MODULES!r} if name in sys.modules])"
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    print(f"Heavy modules loaded by import: {output}")
+    assert output == "[]", "Heavy modules should be imported on first use"
+    print("[PASS] Import skips heavy modules\n")
+
+
+def test_artifact_cache():
+    """Artifacts are built once, reloaded from disk and rebuilt when a source changes"""
+    with tempfile.TemporaryDirectory() as root:
+        source = os.path.join(root, "catalog.json")
+        with open(source, "w", encoding="utf-8") as handle:
+            handle.write('{"Haval": 1}')
+        build = mock.Mock(side_effect=lambda: {"built": build.call_count})
+        directory = os.path.join(root, "compiled")
+
+        first = load_artifact("catalog", [source], build, directory)
+        second = load_artifact("catalog", [source], build, directory)
+        print(f"First: {first}, second: {second}, builds: {build.call_count}")
+        assert build.call_count == 1 and second == first, "Second load should come from the pickle"
+
+        with open(source, "w", encoding="utf-8") as handle:
+            handle.write('{"Haval": 2}')
+        assert load_artifact("catalog", [source], build, directory) == {"built": 2}, "Changed source should rebuild"
+        assert len(os.listdir(directory)) == 1, "Stale artifacts should be removed"
+
+        with mock.patch("logging.warning"):
+            blocked = os.path.join(source, "not-a-directory")
+            assert load_artifact("catalog", [source], build, blocked) == {"built": 3}, "Unwritable cache still builds"
+    print("[PASS] Artifact cache\n")
+
+
+def test_warm_up_loads_subsystems():
+    """warm_up() preloads the lazy subsystems; the event log stays off without a directory"""
+    with mock.patch.object(bot, "car_search_service", None), mock.patch.object(bot, "FUNNEL_EVENTS_DIR", ""):
+        bot.warm_up()
+        assert bot.car_search_service is not None, "Listings service should be created"
+        assert bot.get_funnel_log() is None, "Event log is disabled without FUNNEL_EVENTS_DIR"
+    for name in ("requests", "numpy", "city_gazetteer"):
+        assert name in sys.modules, f"{name} should be imported by warm-up"
+    print("[PASS] Warm-up loads subsystems\n")
+
+
+def test_first_reply_measured():
+    """A fresh bot process answers a queued /start and the delay is measured"""
+    elapsed = measure_first_reply()
+    print(f"Time to first reply: {elapsed:.0f} ms")
+    assert 0 < elapsed < 60000, "First reply should be measured"
+    print("[PASS] First reply measured\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING STARTUP")
+    print("=" * 60 + "\n")
+
+    try:
+        test_import_skips_heavy_modules()
+        test_artifact_cache()
+        test_warm_up_loads_subsystems()
+        test_first_reply_measured()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,186 @@
+"""Tests for hosting several tenant bots in one process"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BOT_ID, StubTelegramRequest, UpdateFactory, funnel_script
+from gas_standin import AppsScriptServer, AppsScriptStandIn
+from tenants import SharedRequest, Tenant, load_tenants
+
+
+class TenantRequest(StubTelegramRequest):
+    """Stub Bot API shared by all bots: keeps sent keyboards per token and counts shutdowns."""
+
+    def __init__(self):
+        super().__init__()
+        self.keyboards = {}
+        self.shutdowns = 0
+
+    async def shutdown(self) -> None:
+        self.shutdowns += 1
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        token = url.split("/bot", 1)[-1].split("/", 1)[0]
+        markup = request_data.parameters.get("reply_markup") if request_data else None
+        if isinstance(markup, dict) and "keyboard" in markup:
+            rows = [[button["text"] for button in row] for row in markup["keyboard"]]
+            self.keyboards.setdefault(token, []).append(rows)
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+async def _start(tenants, request):
+    applications = [bot.build_application(tenant.token, request=request, tenant=tenant) for tenant in tenants]
+    for tenant, application in zip(tenants, applications):
+        await application.initialize()
+        await bot.start_tenant_services(tenant)
+    return applications
+
+
+async def _drive(applications, users: int) -> None:
+    async def drive(application) -> None:
+        factory = UpdateFactory(application.bot)
+        for number in range(1, users + 1):
+            for _, update in funnel_script(factory, number):
+                await application.process_update(update)
+
+    # Updates of the bots interleave on one event loop
+    await asyncio.gather(*(drive(application) for application in applications))
+
+
+async def _stop(tenants, applications) -> None:
+    for tenant, application in zip(tenants, applications):
+        await application.shutdown()
+        await bot.stop_tenant_services(tenant)
+
+
+async def _host(tenants, users: int) -> TenantRequest:
+    inner = TenantRequest()
+    applications = await _start(tenants, SharedRequest(inner))
+    await _drive(applications, users)
+    await _stop(tenants, applications)
+    return inner
+
+
+async def _running_size(tenants) -> int:
+    """Traced memory while the bots are up and have served one user each."""
+    applications = await _start(tenants, SharedRequest(TenantRequest()))
+    await _drive(applications, 1)
+    size = tracemalloc.get_traced_memory()[0]
+    await _stop(tenants, applications)
+    return size
+
+
+def test_load_tenants():
+    """Tokens come from the config or the environment; shared tokens or registries are rejected"""
+    config = {
+        "tenants": [
+            {"name": "msk", "token_env": "MSK_TOKEN", "leads_db_path": "data/msk.sqlite3"},
+            {"name": "kzn", "token": "2:KZN", "cities": [["Казань", "Самара"]], "greeting": "Казань!"},
+        ]
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tenants.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False)
+        msk, kzn = load_tenants(path, environ={"MSK_TOKEN": "1:MSK"})
+
+        config["tenants"][1]["leads_db_path"] = "data/msk.sqlite3"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(config, f)
+        try:
+            load_tenants(path, environ={"MSK_TOKEN": "1:MSK"})
+            shared_registry = False
+        except ValueError as exc:
+            shared_registry = "leads_db_path" in str(exc)
+        try:
+            load_tenants(path, environ={})
+            missing_token = False
+        except ValueError as exc:
+            missing_token = "msk" in str(exc)
+    print(f"Loaded: {msk.name} {msk.token}, {kzn.name} hubs {kzn.city_hubs}")
+    assert msk.token == "1:MSK" and kzn.token == "2:KZN", "Tokens from token_env and token"
+    assert msk.cities is None and kzn.city_hubs == ("Казань", "Самара"), "Omitted catalogs fall back to bot.py"
+    assert shared_registry and missing_token, "Invalid configs are rejected"
+    print("[PASS] Load tenants\n")
+
+
+def test_tenants_share_process():
+    """Each bot keeps its own catalogs and sheet while sharing the pool and replication workers"""
+    servers = [AppsScriptServer(script=AppsScriptStandIn()) for _ in range(2)]
+    for server in servers:
+        server.start()
+    msk = Tenant("msk", f"{BOT_ID}:MSK", sheet_sync_url=servers[0].url)
+    kzn = Tenant(
+        "kzn",
+        f"{BOT_ID}:KZN",
+        sheet_sync_url=servers[1].url,
+        car_brands=[["Haval", "Geely"]],
+        cities=[["Казань", "Самара"]],
+        greeting="Добро пожаловать в бота автоподбора Казани!",
+    )
+    users = 6
+    bot.close_lead_registry()
+    try:
+        request = asyncio.run(_host([msk, kzn], users))
+        replicated = bot.sheet_replicator.wait_idle(10)
+        records = [server.script.records() for server in servers]
+    finally:
+        bot.close_lead_registry()
+        bot.hosted_tenants.clear()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+    print(f"Sheet rows: msk {len(records[0])}, kzn {len(records[1])}")
+    print(f"kzn hubs: {sorted({record['city_hub'] for record in records[1]})}")
+    assert replicated, "One replicator drains both registries"
+    assert [len(rows) for rows in records] == [users, users], "Every bot's leads reach only its own sheet"
+    assert {record["city_hub"] for record in records[0]} == {"Москва"}, "Default hubs for msk"
+    assert {record["city_hub"] for record in records[1]} <= set(kzn.city_hubs), "kzn maps towns to its own hubs"
+    assert request.keyboards[kzn.token][1] == kzn.car_brands, "kzn offers its own brands"
+    assert request.keyboards[msk.token][1] == bot.CAR_BRANDS, "msk offers the default brands"
+    assert request.shutdowns == 1, "The shared pool is closed once, by the last bot"
+    print("[PASS] Tenants share the process\n")
+
+
+def test_tenant_overhead():
+    """An extra hosted bot costs a few megabytes at most"""
+    bot.close_lead_registry()
+    asyncio.run(_host([Tenant("warm", f"{BOT_ID}:WARM")], 1))  # imports, catalogs, gazetteer
+    tracemalloc.start()
+    try:
+        one = asyncio.run(_running_size([Tenant("one", f"{BOT_ID}:ONE")]))
+        six = asyncio.run(_running_size([Tenant(f"t{number}", f"{BOT_ID}:T{number}") for number in range(6)]))
+        overhead = (six - one) / 5
+    finally:
+        tracemalloc.stop()
+        bot.close_lead_registry()
+        bot.hosted_tenants.clear()
+    print(f"Memory per extra tenant: {overhead / 1024:.0f} KiB")
+    assert overhead < 4 * 1024 * 1024, "Per-tenant overhead should stay within a few megabytes"
+    print("[PASS] Tenant overhead\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING MULTI-TENANT HOSTING")
+    print("=" * 60 + "\n")
+
+    try:
+        test_load_tenants()
+        test_tenants_share_process()
+        test_tenant_overhead()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
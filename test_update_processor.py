@@ -0,0 +1,156 @@
+"""Tests for concurrent update processing kept in order per user"""
+
+import asyncio
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bot
+from bench_handlers import BENCH_TOKEN, StubTelegramRequest, UpdateFactory, funnel_script
+from update_processor import PerUserUpdateProcessor
+
+MANAGER_PROMPT = "Передать контакт менеджеру"
+
+
+class RecordingRequest(StubTelegramRequest):
+    """Stub Bot API logging (time, chat id, text) of every sent message."""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith("/sendMessage"):
+            parameters = request_data.parameters
+            self.sent.append((time.perf_counter(), int(parameters["chat_id"]), parameters.get("text", "")))
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+async def _interleave():
+    application = bot.build_application(BENCH_TOKEN, request=StubTelegramRequest())
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    processor = PerUserUpdateProcessor(8)
+    log = []
+
+    async def handle(user_id: int, number: int, seconds: float) -> None:
+        log.append(("start", user_id, number))
+        await asyncio.sleep(seconds)
+        log.append(("end", user_id, number))
+
+    # User 1 sends a slow update and a fast one; user 2 one update in between
+    jobs = [(1, 0, 0.05), (2, 0, 0.0), (1, 1, 0.0)]
+    await asyncio.gather(
+        *(
+            processor.process_update(factory.message(user_id, True, "x"), handle(user_id, number, seconds))
+            for user_id, number, seconds in jobs
+        )
+    )
+    await application.shutdown()
+    return log, len(processor)
+
+
+def test_per_user_order():
+    """Different users overlap; one user's updates run one after another in delivery order"""
+    log, tracked = asyncio.run(_interleave())
+    print(f"Log: {log}")
+    assert log.index(("end", 2, 0)) < log.index(("end", 1, 0)), "User 2 does not wait for user 1"
+    assert log.index(("end", 1, 0)) < log.index(("start", 1, 1)), "User 1's second update waits for the first"
+    assert tracked == 0, "Queues of finished users are dropped"
+    print("[PASS] Per-user order\n")
+
+
+async def _flood(slots: int, flood: int):
+    application = bot.build_application(BENCH_TOKEN, request=StubTelegramRequest())
+    await application.initialize()
+    factory = UpdateFactory(application.bot)
+    processor = PerUserUpdateProcessor(slots)
+    finished = {}
+
+    async def handle(user_id: int, number: int) -> None:
+        # User 1's first update is the slow search step
+        await asyncio.sleep(0.3 if (user_id, number) == (1, 0) else 0.001)
+        finished[(user_id, number)] = time.perf_counter()
+
+    def deliver(user_id: int, number: int) -> asyncio.Task:
+        # As Application._update_fetcher does: a task per update
+        update = factory.message(user_id, True, "x")
+        return asyncio.get_running_loop().create_task(processor.process_update(update, handle(user_id, number)))
+
+    started = time.perf_counter()
+    tasks = [deliver(1, number) for number in range(flood)]
+    await asyncio.sleep(0.01)
+    tasks.append(deliver(2, 0))
+    await asyncio.gather(*tasks)
+    await application.shutdown()
+    order = [number for user_id, number in sorted(finished, key=finished.get) if user_id == 1]
+    return finished[(2, 0)] - started, finished[(1, flood - 1)] - started, order
+
+
+def test_flooding_user_takes_one_slot():
+    """Updates queued behind one user's slow update leave the other slots to other users"""
+    other_seconds, flood_seconds, order = asyncio.run(_flood(slots=4, flood=20))
+    print(f"Other user done after {other_seconds * 1000:.0f} ms, flood done after {flood_seconds * 1000:.0f} ms")
+    assert order == list(range(20)), "The flooding user's updates keep their order"
+    assert other_seconds < 0.1 and flood_seconds > 0.3, "The other user does not wait for the flood"
+    print("[PASS] Flooding user takes one slot\n")
+
+
+async def _slow_selection():
+    request = RecordingRequest()
+    application = bot.build_application(BENCH_TOKEN, request=request)
+    await application.initialize()
+    await application.start()
+    factory = UpdateFactory(application.bot)
+    # The first user goes through the whole form up to the selection step in one burst
+    slow = [update for _, update in funnel_script(factory, 1)[:7]]
+    slow_user = slow[0].effective_chat.id
+    for update in slow:
+        await application.update_queue.put(update)
+    await asyncio.sleep(0.05)
+    other = factory.message(42, True, "/start")
+    queued_at = time.perf_counter()
+    await application.update_queue.put(other)
+
+    deadline = time.monotonic() + 5
+    while not any(chat == slow_user and MANAGER_PROMPT in text for _, chat, text in request.sent):
+        assert time.monotonic() < deadline, "Timed out waiting for the selection step"
+        await asyncio.sleep(0.01)
+    await application.stop()
+    await application.shutdown()
+    other_reply = next(moment for moment, chat, _ in request.sent if chat == other.effective_chat.id)
+    slow_done = next(moment for moment, chat, text in request.sent if chat == slow_user and MANAGER_PROMPT in text)
+    return other_reply - queued_at, slow_done - queued_at
+
+
+def test_slow_selection_does_not_delay_others():
+    """A user in the selection step (progress bar, search) does not hold up other users' replies"""
+    with mock.patch.object(bot, "SHEET_SYNC_URL", ""), mock.patch.object(bot, "AI_PROGRESS_STEP_SECONDS", 0.1):
+        bot.close_lead_registry()
+        other_seconds, slow_seconds = asyncio.run(_slow_selection())
+        bot.close_lead_registry()
+    print(f"Other user's reply after {other_seconds * 1000:.0f} ms, selection done after {slow_seconds * 1000:.0f} ms")
+    assert slow_seconds > 0.4, "The selection step takes its time"
+    assert other_seconds < 0.1, "Another user's /start is answered meanwhile"
+    print("[PASS] Slow selection does not delay others\n")
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("TESTING UPDATE PROCESSOR")
+    print("=" * 60 + "\n")
+
+    try:
+        test_per_user_order()
+        test_flooding_user_takes_one_slot()
+        test_slow_selection_does_not_delay_others()
+
+        print("=" * 60)
+        print("ALL TESTS PASSED!")
+        print("=" * 60)
+    except AssertionError as e:
+        print(f"\n[FAIL] TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,83 @@
+"""
+Update processor - concurrent updates, in order per user
+
+By default an Application handles one update at a time: a user waiting for
+the listing search and the AI progress bar of the selection step delays
+every other user's reply until it finishes, even when the search itself
+runs in the scoring pool.
+
+PerUserUpdateProcessor lets updates of different users run concurrently
+(up to `max_concurrent_updates`) while the updates of one user in one chat
+still run one after another, in the order Telegram delivered them. The
+ConversationHandler keys its state by chat and user, so a user's next
+answer is never handled before the previous one moved the conversation on.
+
+The Application takes one of the `max_concurrent_updates` slots before it
+hands an update over, so a user's later updates must not wait holding one:
+a user tapping away during the search would fill every slot and stall all
+other chats. Instead they are queued behind the user's running update and
+give their slot back at once; the running one works through the queue, so
+each user occupies at most one slot.
+"""
+
+import logging
+from collections import deque
+from typing import Any, Coroutine, Deque, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """(chat id, user id) whose updates must stay in order; None for updates without a user or chat."""
+    if not isinstance(update, Update):
+        return None
+    chat, user = update.effective_chat, update.effective_user
+    if chat is None and user is None:
+        return None
+    return (chat.id if chat else None, user.id if user else None)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Concurrent update processing, serialized per (chat, user)."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # key -> updates that arrived while one of the key's updates was running; dropped when it is done
+        self._queues: Dict[Hashable, Deque[Coroutine[Any, Any, Any]]] = {}
+
+    async def do_process_update(self, update: object, coroutine: Coroutine[Any, Any, Any]) -> None:
+        key = update_key(update)
+        if key is None:
+            await coroutine
+            return
+        queue = self._queues.get(key)
+        if queue is not None:
+            # Run by the key's running update after the ones before it; waiting takes no slot
+            queue.append(coroutine)
+            return
+        queue = self._queues[key] = deque()
+        try:
+            while True:
+                try:
+                    await coroutine
+                except Exception:
+                    # Application.process_update reports handler errors itself; the queue goes on
+                    logging.exception("Update of %s failed", key)
+                if not queue:
+                    break
+                coroutine = queue.popleft()
+        finally:
+            del self._queues[key]
+            for waiting in queue:
+                # Cancelled during shutdown: the queued updates are not processed
+                waiting.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return len(self._queues)